@@ -0,0 +1,23 @@
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Action plugin of the firewall_rules module, which runs the module on the controller during an
+offline session of the host, see the offline_session module.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from ansible_collections.puzzle.opnsense.plugins.plugin_utils.offline_session import (
+    OfflineActionBase,
+)
+
+
+class ActionModule(OfflineActionBase):
+    """
+    Runs the firewall_rules module on the host or in its offline session.
+    """
+
+    MODULE_NAME = "firewall_rules"
@@ -0,0 +1,253 @@
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Action plugin of the ha_apply module.
+
+The prepare phase runs the given modules on the node with OPNSENSE_DEFER_APPLY set, so
+that they only change config.xml. Since every host of a play runs its action in its own
+worker, the prepare phases of all nodes run in parallel. The apply phase is scheduled by
+the policy: in parallel on all nodes or staggered, where every node waits for a marker
+written on the controller by the previous node in the list before applying. The markers
+of a run are removed once every node of the play recorded its status.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Optional
+
+from ansible.errors import AnsibleAction, AnsibleActionFail
+from ansible.plugins.action import ActionBase
+
+DEFER_APPLY_ENV: str = "OPNSENSE_DEFER_APPLY"
+APPLY_MODULE: str = "puzzle.opnsense.ha_apply"
+COLLECTION_PREFIX: str = "puzzle.opnsense."
+
+
+def marker_dir(run_id: str) -> str:
+    """
+    Returns the controller-side directory of the marker files of a run.
+    """
+
+    return os.path.join(tempfile.gettempdir(), f"ansible-opnsense-ha-apply-{run_id}")
+
+
+def marker_path(run_id: str, node: str) -> str:
+    """
+    Returns the path of the controller-side marker file of a node.
+    """
+
+    return os.path.join(marker_dir(run_id), f"{node}.json")
+
+
+def write_marker(run_id: str, node: str, status: str) -> None:
+    """
+    Records the apply status (done or failed) of a node on the controller.
+    """
+
+    path: str = marker_path(run_id, node)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path: str = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as marker_file:
+        json.dump({"status": status, "time": time.time()}, marker_file)
+    os.replace(tmp_path, path)
+
+
+def remove_markers(run_id: str, nodes: List[str]) -> bool:
+    """
+    Removes the marker files of a run once all given nodes recorded their apply status.
+
+    A node only writes its marker after it finished waiting for its predecessor, so no
+    node waits for a marker anymore once all of them are written.
+
+    Returns:
+        bool: True if all nodes finished and the markers were removed.
+    """
+
+    if not all(os.path.exists(marker_path(run_id, node)) for node in nodes):
+        return False
+
+    # the last nodes may finish at the same time and both remove the markers
+    shutil.rmtree(marker_dir(run_id), ignore_errors=True)
+    return True
+
+
+def finish_node(run_id: str, node: str, nodes: List[str], status: str) -> None:
+    """
+    Records the apply status of a node and removes the markers of the run if it was the
+    last of the nodes to finish.
+    """
+
+    write_marker(run_id, node, status)
+    remove_markers(run_id, nodes + [node])
+
+
+def wait_for_node(run_id: str, node: str, timeout: float, interval: float = 0.5) -> str:
+    """
+    Waits until the given node recorded its apply status.
+
+    Returns:
+        str: The status of the node.
+
+    Raises:
+        AnsibleActionFail: If the node did not finish within the timeout.
+    """
+
+    path: str = marker_path(run_id, node)
+    deadline: float = time.monotonic() + timeout
+
+    while True:
+        try:
+            with open(path, "r", encoding="utf-8") as marker_file:
+                return json.load(marker_file)["status"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if time.monotonic() >= deadline:
+            raise AnsibleActionFail(
+                f"Timeout after {timeout}s waiting for node {node} to apply its changes"
+            )
+        time.sleep(interval)
+
+
+def previous_node(nodes: List[str], node: str) -> Optional[str]:
+    """
+    Returns the node which has to finish its apply before the given node may apply.
+    """
+
+    if node not in nodes:
+        return None
+
+    index: int = nodes.index(node)
+    return nodes[index - 1] if index > 0 else None
+
+
+class ActionModule(ActionBase):
+    """
+    Runs the prepare phase with deferred apply and schedules the apply phase.
+    """
+
+    TRANSFERS_FILES = False
+    _VALID_ARGS = frozenset(
+        ("tasks", "nodes", "policy", "settle_delay", "stagger_timeout")
+    )
+
+    def _execute_deferred(self, module_name: str, module_args: dict, task_vars: dict):
+        original_environment = self._task.environment
+        self._task.environment = list(original_environment or []) + [
+            {DEFER_APPLY_ENV: "1"}
+        ]
+        try:
+            return self._execute_module(
+                module_name=module_name, module_args=module_args, task_vars=task_vars
+            )
+        finally:
+            self._task.environment = original_environment
+
+    def run(self, tmp=None, task_vars=None):
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        task_vars = task_vars or {}
+        args: dict = self._task.args
+        policy: str = args.get("policy", "staggered")
+        if policy not in ("parallel", "staggered"):
+            result.update(
+                failed=True,
+                msg=f"Unsupported policy '{policy}', use one of parallel or staggered",
+            )
+            return result
+
+        node: str = task_vars["inventory_hostname"]
+        play_hosts: List[str] = list(task_vars.get("ansible_play_hosts") or [node])
+        # nodes which are not (or no longer) part of the play never write a marker
+        nodes: List[str] = [
+            name for name in args.get("nodes") or [node] if name in play_hosts
+        ]
+        # the task uuid is shared by all hosts running this task
+        run_id: str = self._task._uuid  # pylint: disable=protected-access
+
+        timings: dict = {}
+        result["changed"] = False
+
+        try:
+            start: float = time.perf_counter()
+            prepare_results: List[dict] = []
+            for task in args.get("tasks") or []:
+                module_name: str = task["module"]
+                if "." not in module_name:
+                    module_name = COLLECTION_PREFIX + module_name
+
+                module_result: dict = self._execute_deferred(
+                    module_name, task.get("args") or {}, task_vars
+                )
+                module_result["module"] = module_name
+                prepare_results.append(module_result)
+                result["changed"] = result["changed"] or module_result.get(
+                    "changed", False
+                )
+
+                if module_result.get("failed"):
+                    raise AnsibleActionFail(
+                        f"Prepare phase failed in {module_name}: "
+                        f"{module_result.get('msg', '')}",
+                        result={"prepare_results": prepare_results},
+                    )
+
+            if args.get("tasks"):
+                result["prepare_results"] = prepare_results
+            timings["prepare"] = round(time.perf_counter() - start, 3)
+
+            start = time.perf_counter()
+            predecessor: Optional[str] = (
+                previous_node(nodes, node) if policy == "staggered" else None
+            )
+            if predecessor is not None:
+                status: str = wait_for_node(
+                    run_id, predecessor, float(args.get("stagger_timeout", 900))
+                )
+                if status != "done":
+                    raise AnsibleActionFail(
+                        f"Node {predecessor} failed to apply its changes, "
+                        "not applying on this node to keep one node passing traffic"
+                    )
+                time.sleep(int(args.get("settle_delay", 0)))
+            timings["wait"] = round(time.perf_counter() - start, 3)
+
+            start = time.perf_counter()
+            apply_result: dict = self._execute_module(
+                module_name=APPLY_MODULE, module_args={}, task_vars=task_vars
+            )
+            timings["apply"] = round(time.perf_counter() - start, 3)
+
+            if apply_result.get("failed"):
+                raise AnsibleActionFail(
+                    apply_result.get("msg", "Apply of the OPNsense settings failed"),
+                    result={"details": apply_result.get("details")},
+                )
+        except AnsibleAction as action_error:
+            finish_node(run_id, node, nodes, "failed")
+            result.update(action_error.result)
+            result["timings"] = timings
+            return result
+        except Exception:
+            finish_node(run_id, node, nodes, "failed")
+            raise
+
+        finish_node(run_id, node, nodes, "done")
+
+        result["changed"] = result["changed"] or apply_result.get("changed", False)
+        result["opnsense_configure_output"] = apply_result.get(
+            "opnsense_configure_output", []
+        )
+        result["timings"] = timings
+
+        return result
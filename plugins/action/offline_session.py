@@ -0,0 +1,140 @@
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Action plugin of the offline_session module.
+
+Starting a session fetches config.xml, the OPNsense version and the introspection of the
+host with a single module run and stores them on the controller. Flushing transfers the
+edited config once and applies the configure functions recorded by the offline module
+runs on the host.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import base64
+from typing import Dict, Optional
+
+from ansible.errors import AnsibleActionFail
+from ansible.plugins.action import ActionBase
+
+from ansible_collections.puzzle.opnsense.plugins.plugin_utils.offline_session import (
+    CONFIG_FILE,
+    OfflineSession,
+    OfflineSessionError,
+)
+
+SESSION_MODULE: str = "puzzle.opnsense.offline_session"
+
+
+class ActionModule(ActionBase):
+    """
+    Starts, flushes or discards the offline session of the host.
+    """
+
+    TRANSFERS_FILES = True
+    _VALID_ARGS = frozenset(("state",))
+
+    def _start(self, session: OfflineSession, task_vars: dict) -> dict:
+        fetch_result: dict = self._execute_module(
+            module_name=SESSION_MODULE,
+            module_args={"state": "started"},
+            task_vars=task_vars,
+        )
+        if fetch_result.get("failed"):
+            raise AnsibleActionFail(
+                f"Could not fetch the config: {fetch_result.get('msg', '')}",
+                result=fetch_result,
+            )
+
+        session.start(
+            content=base64.b64decode(fetch_result["content"]),
+            digest=fetch_result["digest"],
+            opnsense_version=fetch_result["opnsense_version"],
+            introspection=fetch_result.get("introspection"),
+        )
+
+        return {
+            "changed": False,
+            "digest": fetch_result["digest"],
+            "opnsense_version": fetch_result["opnsense_version"],
+            "warnings": fetch_result.get("warnings", []),
+        }
+
+    def _flush(self, session: OfflineSession, state: dict, task_vars: dict) -> dict:
+        pending: Dict[str, list] = session.load_pending()
+        module_args: dict = {
+            "state": "flushed",
+            "base_digest": state["digest"],
+            "php_requirements": pending["php_requirements"],
+            "configure_functions": pending["functions"],
+        }
+
+        tmp_path: Optional[str] = None
+        if session.config_digest() != state["digest"]:
+            tmp_path = self._make_tmp_path()
+            shell = self._connection._shell  # pylint: disable=protected-access
+            module_args["src"] = shell.join_path(tmp_path, CONFIG_FILE)
+            self._transfer_file(session.path(CONFIG_FILE), module_args["src"])
+            self._fixup_perms2((tmp_path, module_args["src"]))
+
+        try:
+            flush_result: dict = self._execute_module(
+                module_name=SESSION_MODULE,
+                module_args=module_args,
+                task_vars=task_vars,
+            )
+        finally:
+            if tmp_path is not None:
+                self._remove_tmp_path(tmp_path)
+
+        if flush_result.get("failed"):
+            # keep the session to retry the flush or to discard it
+            raise AnsibleActionFail(
+                flush_result.get("msg", "Flush of the offline session failed"),
+                result=flush_result,
+            )
+
+        if not self._play_context.check_mode:
+            session.discard()
+
+        return flush_result
+
+    def run(self, tmp=None, task_vars=None):
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        task_vars = task_vars or {}
+        session_state: str = self._task.args.get("state", "started")
+        if session_state not in ("started", "flushed", "discarded"):
+            result.update(
+                failed=True,
+                msg=f"Unsupported state '{session_state}', "
+                "use one of started, flushed or discarded",
+            )
+            return result
+
+        session = OfflineSession(task_vars.get("inventory_hostname", ""))
+
+        try:
+            if session_state == "started":
+                result.update(self._start(session, task_vars))
+            elif session_state == "flushed":
+                state: Optional[dict] = session.load_state()
+                if state is None:
+                    raise AnsibleActionFail(
+                        "There is no offline session to flush, "
+                        "start it with state=started first"
+                    )
+                result.update(self._flush(session, state, task_vars))
+            else:
+                result["changed"] = session.active
+                session.discard()
+        except AnsibleActionFail as action_error:
+            result.update(action_error.result)
+        except OfflineSessionError as session_error:
+            result.update(failed=True, msg=str(session_error))
+
+        return result
@@ -0,0 +1,157 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Utilities to defer the configure functions of modules and apply them at once.
+
+Applying a configuration change (e.g. filter_configure) usually takes much longer than
+changing config.xml. If the environment variable OPNSENSE_DEFER_APPLY is set, modules only
+record their configure functions in a pending file instead of running them. All pending
+functions are later applied at once, every function only once, e.g. by the ha_apply
+module, which allows to schedule the slow apply phase of the nodes of a HA pair.
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    file_utils,
+    opnsense_utils,
+    timing_utils,
+)
+
+DEFER_APPLY_ENV: str = "OPNSENSE_DEFER_APPLY"
+PENDING_APPLY_FILE_ENV: str = "OPNSENSE_PENDING_APPLY_FILE"
+PENDING_APPLY_FILE: str = "/var/run/ansible_opnsense_pending_apply.json"
+
+
+def apply_deferred() -> bool:
+    """
+    Returns True if configure functions should be deferred instead of applied.
+    """
+
+    return os.environ.get(DEFER_APPLY_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+def pending_apply_file(path: Optional[str] = None) -> str:
+    """
+    Returns the path of the pending file: the given path, OPNSENSE_PENDING_APPLY_FILE if
+    set or PENDING_APPLY_FILE.
+    """
+
+    return path or os.environ.get(PENDING_APPLY_FILE_ENV) or PENDING_APPLY_FILE
+
+
+def load_pending(path: Optional[str] = None) -> Dict[str, list]:
+    """
+    Loads the pending configure functions and their PHP requirements.
+
+    Returns:
+        Dict[str, list]: The php_requirements and the functions (name and params).
+    """
+
+    try:
+        with open(pending_apply_file(path), "r", encoding="utf-8") as pending_file:
+            pending: dict = json.load(pending_file)
+    except (OSError, ValueError):
+        pending = {}
+
+    return {
+        "php_requirements": list(pending.get("php_requirements", [])),
+        "functions": list(pending.get("functions", [])),
+    }
+
+
+def _save_pending(pending: Dict[str, list], path: str) -> None:
+    file_utils.atomic_write(path, json.dumps(pending, indent=2).encode("utf-8"))
+
+
+def defer_functions(
+    php_requirements: List[str],
+    configure_functions: List[dict],
+    path: Optional[str] = None,
+) -> List[dict]:
+    """
+    Records configure functions to be applied later.
+
+    Functions already pending with the same parameters are recorded only once, the PHP
+    requirements of all deferred functions are combined.
+
+    Args:
+        php_requirements (List[str]): PHP files required by the functions.
+        configure_functions (List[dict]): The functions, each with a name and
+                                          configure_params.
+        path (Optional[str]): Path of the pending file, see pending_apply_file.
+
+    Returns:
+        List[dict]: The output of the deferred functions, in the format of
+        OPNsenseModuleConfig.apply_settings.
+    """
+
+    pending: Dict[str, list] = load_pending(path)
+
+    for requirement in php_requirements:
+        if requirement not in pending["php_requirements"]:
+            pending["php_requirements"].append(requirement)
+
+    cmd_output: List[dict] = []
+    for function in configure_functions:
+        entry: dict = {
+            "name": function["name"],
+            "configure_params": list(function["configure_params"] or []),
+        }
+        if entry not in pending["functions"]:
+            pending["functions"].append(entry)
+        cmd_output.append(
+            {
+                "function": entry["name"],
+                "params": entry["configure_params"],
+                "deferred": True,
+                "rc": 0,
+            }
+        )
+
+    _save_pending(pending, pending_apply_file(path))
+
+    return cmd_output
+
+
+def apply_pending(path: Optional[str] = None) -> List[dict]:
+    """
+    Runs all pending configure functions once and clears the pending file.
+
+    If a function fails, the remaining functions are still run, but the pending file is
+    kept so that the functions can be applied again.
+
+    Args:
+        path (Optional[str]): Path of the pending file, see pending_apply_file.
+
+    Returns:
+        List[dict]: The output of every function, in the format of
+        OPNsenseModuleConfig.apply_settings.
+    """
+
+    path = pending_apply_file(path)
+    pending: Dict[str, list] = load_pending(path)
+
+    cmd_output: List[dict] = []
+    for function in pending["functions"]:
+        with timing_utils.phase(f"apply:{function['name']}"):
+            result_dict: dict = opnsense_utils.run_function(
+                php_requirements=pending["php_requirements"],
+                configure_function=function["name"],
+                configure_params=function["configure_params"],
+            )
+        cmd_output.append(
+            {
+                "function": function["name"],
+                "params": function["configure_params"],
+                **result_dict,
+            }
+        )
+
+    if all(output["rc"] == 0 for output in cmd_output) and os.path.exists(path):
+        os.unlink(path)
+
+    return cmd_output
@@ -11,18 +11,28 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
-from typing import List, Optional, Dict
-from xml.etree import ElementTree
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Mapping, Optional, Dict, Tuple
 from xml.etree.ElementTree import Element
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    apply_utils,
+    file_utils,
+    lock_utils,
     version_utils,
     opnsense_utils,
     module_index,
+    snapshot_utils,
+    timing_utils,
     xml_utils,
 )
 
 
+# redirects all config access to another file, e.g. a config fetched for offline editing
+CONFIG_PATH_ENV: str = "OPNSENSE_CONFIG_PATH"
+
+
 class OPNSenseConfigUsageError(Exception):
     """
     Exception raised for errors related to improper usage of the OPNSense module.
@@ -63,6 +73,70 @@ class UnsupportedModuleSettingError(Exception):
     """
 
 
+@dataclass
+class ConfigBaseline:
+    """
+    The content of the config file as loaded or last written, which changed and diff
+    compare against.
+
+    Attributes:
+        data (bytes): The content of the config file.
+        tree (Optional[Element]): data parsed, once it is needed.
+        xml (Optional[bytes]): The serialized baseline, once it is needed.
+        document (Optional[SectionedXML]): The sections of tree, if only some of them are
+                                           parsed.
+    """
+
+    data: bytes = b""
+    tree: Optional[Element] = None
+    xml: Optional[bytes] = None
+    document: Optional[xml_utils.SectionedXML] = None
+
+
+@dataclass
+class SettingIndex:
+    """
+    The settings of the config contexts of an OPNsenseModuleConfig.
+
+    Attributes:
+        xpaths (Dict[str, str]): The XPath of every setting.
+        parents (Dict[str, Tuple[str, str]]): The XPath of the parent and the tag of every
+                                              setting.
+        elements (Dict[str, Optional[Element]]): The element of every setting in the
+                                                 in-memory config, None if it is not
+                                                 present.
+    """
+
+    xpaths: Dict[str, str] = field(default_factory=dict)
+    parents: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+    elements: Dict[str, Optional[Element]] = field(default_factory=dict)
+
+
+@dataclass
+class ConfigState:
+    """
+    The state of an OPNsenseModuleConfig besides the in-memory config.
+
+    Attributes:
+        lock (ConfigLock): The lock on the config file, held from the load until the
+                           config is saved or the context is exited. Exclusive, shared in
+                           check mode.
+        digest (Optional[str]): SHA-256 digest of the config file as last read or written.
+        document (Optional[SectionedXML]): The sections of the config file, if only some of
+                                           them are parsed.
+        baseline (ConfigBaseline): The baseline of changed and diff.
+        index (SettingIndex): The settings of the config contexts.
+        approximations (List[str]): The checks approximated in check mode.
+    """
+
+    lock: lock_utils.ConfigLock
+    digest: Optional[str] = None
+    document: Optional[xml_utils.SectionedXML] = None
+    baseline: ConfigBaseline = field(default_factory=ConfigBaseline)
+    index: SettingIndex = field(default_factory=SettingIndex)
+    approximations: List[str] = field(default_factory=list)
+
+
 class OPNsenseModuleConfig:
     """
     A class to handle OPNsense module configuration.
@@ -71,23 +145,28 @@ class OPNsenseModuleConfig:
     to OPNsense modules. It also includes functionality to apply settings and manage
     PHP requirements and configure functions based on the OPNsense version and module name.
 
+    If sectioned is set, e.g. by SectionedModuleConfig, only the top-level sections of the
+    config file which the settings of the config contexts address are parsed.
+
     Attributes:
         opnsense_version (str): The OPNsense version.
+        sectioned (bool): Whether only the addressed sections of the config file are parsed.
         _config_xml_tree (Element): The XML tree of the configuration file.
         _config_path (str): The file path of the configuration.
         _config_maps (List[str]): The mappings of settings and their XPath in the XML tree.
-        _config_contexts (dict): List of required config_contexts
         _module_name (str): The name of the module.
         _check_mode (bool): If the module is run in check_mode or not
+        _state (ConfigState): The lock, the baseline and the setting index of the config.
     """
 
     opnsense_version: str
+    sectioned: bool = False
     _config_xml_tree: Element
     _config_path: str
     _module_name: str
-    _config_maps: Dict[str, dict] = {}
-    _config_contexts: List[str]
+    _config_maps: Dict[str, dict]
     _check_mode: bool
+    _state: ConfigState
 
     def __init__(
         self,
@@ -99,18 +178,40 @@ class OPNsenseModuleConfig:
         """
         Initializes the OPNsenseModuleConfig class.
 
+        The config file is locked before it is loaded, see save and __exit__ for the
+        release.
+
         Args:
             module_name (str): The name of the module.
             check_mode (bool): Check mode
             config_context_names (List[str]): Names of required config contexts.
             path (str, optional): The path to the config.xml file. Defaults to "/conf/config.xml".
+                                  Overridden by OPNSENSE_CONFIG_PATH if it is set.
+
+        Raises:
+            ConfigLockTimeoutError: If the config file is locked by another process for longer
+                                    than the lock timeout.
         """
         self._module_name = module_name
-        self._config_contexts = config_context_names
+        path = os.environ.get(CONFIG_PATH_ENV) or path
         self._config_path = path
-        self._config_xml_tree = self._load_config()
-        self.opnsense_version = version_utils.get_opnsense_version()
         self._check_mode = check_mode
+        self._state = ConfigState(
+            lock=lock_utils.ConfigLock(path, exclusive=not check_mode)
+        )
+        self._state.lock.acquire()
+        try:
+            self._load_config_maps(config_context_names)
+        except BaseException:
+            self._state.lock.release()
+            raise
+
+    def _load_config_maps(self, config_context_names: List[str]) -> None:
+        """
+        Loads the config maps of the contexts for the OPNsense version and the config file.
+        """
+        with timing_utils.phase("opnsense_version"):
+            self.opnsense_version = version_utils.get_opnsense_version()
         try:
             version_map: dict = module_index.VERSION_MAP[self.opnsense_version]
         except KeyError as ke:
@@ -119,6 +220,8 @@ class OPNsenseModuleConfig:
                 "by puzzle.opnsense collection.\n"
                 f"Supported versions are {list(module_index.VERSION_MAP.keys())}"
             ) from ke
+        # the config maps of every instance, sets remove the contexts they do not apply
+        self._config_maps = {}
         for config_context_name in config_context_names:
             if config_context_name not in version_map:
                 raise UnsupportedVersionForModule(
@@ -129,6 +232,84 @@ class OPNsenseModuleConfig:
 
             self._config_maps[config_context_name] = version_map[config_context_name]
 
+        self._index_settings()
+        self._config_xml_tree = self._load_config()
+        self._index_elements()
+
+    def _index_settings(self) -> None:
+        """
+        Merges the settings of the config contexts into a single setting to XPath map and
+        precomputes the parent XPath of every setting.
+
+        Raises:
+            ModuleMisconfigurationError: If two config contexts map a setting to different
+                                         XPaths.
+        """
+        index: SettingIndex = self._state.index
+        for config_map in self._config_maps.values():
+            for setting_name, xpath in config_map.items():
+                if setting_name in ["php_requirements", "configure_functions"]:
+                    continue
+
+                if index.xpaths.setdefault(setting_name, xpath) != xpath:
+                    raise ModuleMisconfigurationError(
+                        f"Setting '{setting_name}' of module '{self._module_name}' is "
+                        f"mapped to '{index.xpaths[setting_name]}' and '{xpath}' by "
+                        "its config contexts for OPNsense version "
+                        f"'{self.opnsense_version}'."
+                    )
+
+                parent_xpath, _, tag = xpath.rpartition("/")
+                index.parents[setting_name] = (parent_xpath, tag)
+
+    def _index_elements(self, xpath: Optional[str] = None) -> None:
+        """
+        Resolves the elements of the settings in the config, of all settings or only of
+        the settings at or below the given XPath.
+        """
+        index: SettingIndex = self._state.index
+        if xpath is None:
+            index.elements = {}
+        for setting_name, setting_xpath in index.xpaths.items():
+            if (
+                xpath is None
+                or setting_xpath == xpath
+                or setting_xpath.startswith(f"{xpath}/")
+            ):
+                index.elements[setting_name] = self._config_xml_tree.find(setting_xpath)
+
+    def _setting_xpaths(self) -> List[str]:
+        """
+        Returns the XPaths of all settings of the config maps.
+        """
+
+        return [
+            xpath
+            for cfg_map in self._config_maps.values()
+            for setting_name, xpath in cfg_map.items()
+            if setting_name not in ["php_requirements", "configure_functions"]
+        ]
+
+    def _parse_config(
+        self, data: bytes
+    ) -> Tuple[Element, Optional[xml_utils.SectionedXML]]:
+        """
+        Parses the config, only the addressed sections if the config is sectioned.
+
+        Returns:
+            Tuple[Element, Optional[SectionedXML]]: The root element and the sections, None
+                                                    if the whole config was parsed.
+        """
+
+        if self.sectioned:
+            document: Optional[xml_utils.SectionedXML] = xml_utils.SectionedXML.parse(
+                data, self._setting_xpaths()
+            )
+            if document is not None:
+                return document.root, document
+
+        return xml_utils.parse_xml(data), None
+
     def _load_config(self) -> Element:
         """
         Loads the config.xml file and returns its root element.
@@ -136,7 +317,86 @@ class OPNsenseModuleConfig:
         Returns:
             Element: The root element of the config.xml file.
         """
-        return ElementTree.parse(self._config_path).getroot()
+        with timing_utils.phase("parse"):
+            with open(self._config_path, "rb") as config_file:
+                data: bytes = config_file.read()
+            self._state.digest = file_utils.digest(data)
+            self._set_baseline(data)
+            root, self._state.document = self._parse_config(data)
+            return root
+
+    def _set_baseline(self, data: bytes, serialized: bool = False) -> None:
+        """
+        Sets the content of the config file which changed and diff compare against.
+
+        Args:
+            data (bytes): The content of the config file.
+            serialized (bool): True if data was serialized from the in-memory config, so
+                               it can be compared without parsing it.
+        """
+
+        self._state.baseline = ConfigBaseline(data, xml=data if serialized else None)
+
+    def _baseline_config(self) -> Element:
+        """
+        Returns the root element of the baseline config, parsed from memory once.
+        """
+
+        baseline: ConfigBaseline = self._state.baseline
+        if baseline.tree is None:
+            with timing_utils.phase("parse"):
+                baseline.tree, baseline.document = self._parse_config(baseline.data)
+
+        return baseline.tree
+
+    @staticmethod
+    def _serialize(root: Element, document: Optional[xml_utils.SectionedXML]) -> bytes:
+        with timing_utils.phase("serialize"):
+            if document is not None:
+                return document.serialize()
+            return xml_utils.serialize_xml(root, xml_declaration=True)
+
+    def _serialize_config(self) -> bytes:
+        return self._serialize(self._config_xml_tree, self._state.document)
+
+    def _write_config(self) -> bool:
+        """
+        Writes the in-memory config to the config file.
+
+        The config is serialized once and only written if it differs from the content of the
+        file, compared by digest. The file is replaced atomically under the exclusive lock,
+        see file_utils.atomic_write, and the lock moves to the new file. The serialized
+        config becomes the baseline of changed and diff, so the file does not have to be
+        parsed again.
+
+        Returns:
+            bool: True if the file was written, False if it already had the same content.
+        """
+
+        data: bytes = self._serialize_config()
+        self._set_baseline(data, serialized=True)
+
+        data_digest: str = file_utils.digest(data)
+        if data_digest == self._state.digest:
+            return False
+
+        # check mode instances only hold a shared lock, saved instances no lock at all
+        config_lock: lock_utils.ConfigLock = self._state.lock
+        write_lock: lock_utils.ConfigLock = (
+            config_lock
+            if config_lock.exclusive and config_lock.acquired
+            else lock_utils.ConfigLock(self._config_path).acquire()
+        )
+        try:
+            with timing_utils.phase("write"):
+                file_utils.atomic_write(self._config_path, data)
+            write_lock.relock()
+        finally:
+            if write_lock is not config_lock:
+                write_lock.release()
+        self._state.digest = data_digest
+
+        return True
 
     def __enter__(self) -> "OPNsenseModuleConfig":
         """
@@ -152,6 +412,7 @@ class OPNsenseModuleConfig:
         Exits the context manager for OPNsenseModuleConfig.
 
         Checks if the configuration has changed and not been saved, raising a RuntimeError if so.
+        The lock on the config file is released in any case.
 
         Args:
             exc_type: The exception type.
@@ -161,32 +422,99 @@ class OPNsenseModuleConfig:
         Raises:
             RuntimeError: If there are unsaved changes in the configuration.
         """
-        if exc_type:
-            raise exc_type(exc_val).with_traceback(exc_tb)
-        if self.changed and not self._check_mode:
-            raise RuntimeError("Config has changed. Cannot exit without saving.")
+        try:
+            if exc_type:
+                raise exc_type(exc_val).with_traceback(exc_tb)
+            if self.changed and not self._check_mode:
+                raise RuntimeError("Config has changed. Cannot exit without saving.")
+        finally:
+            self._state.lock.release()
 
     def save(self, override_changed: bool = False) -> bool:
         """
         Saves the config to the file if changes have been made.
 
+        The lock on the config file is released once the config is written, before
+        apply_settings runs configure functions which lock and write the config file
+        themselves.
+
         Returns:
         - bool: True if changes were saved, False if no changes were detected.
         """
 
         if not self.changed and not override_changed:
             return False
-        tree: ElementTree.ElementTree = ElementTree.ElementTree(self._config_xml_tree)
-        tree.write(self._config_path, encoding="utf-8", xml_declaration=True)
-        self._config_xml_tree = self._load_config()
+        self._write_config()
+        # the configure functions of apply_settings lock the config file themselves
+        self._state.lock.release()
         return True
 
     @property
     def changed(self) -> bool:
-        """Checks if changes have been made to the config."""
-        return (
-            ElementTree.tostring(self._load_config()).decode()
-            != ElementTree.tostring(self._config_xml_tree).decode()
+        """
+        Checks if changes have been made to the config.
+
+        The in-memory config is compared to the baseline as loaded or last written, the
+        config file is not read again.
+        """
+        baseline: ConfigBaseline = self._state.baseline
+        if baseline.xml is None:
+            baseline.xml = self._serialize(self._baseline_config(), baseline.document)
+        return self._serialize_config() != baseline.xml
+
+    @property
+    def check_mode(self) -> bool:
+        """True if the config is only checked and never saved."""
+        return self._check_mode
+
+    @property
+    def approximations(self) -> List[str]:
+        """
+        The checks which were approximated in check mode instead of running an expensive
+        probe on the instance, e.g. a password verification which would require PHP.
+        """
+        return list(self._state.approximations)
+
+    def _approximate(self, check: str) -> None:
+        """Records a check approximated in check mode."""
+        if check not in self._state.approximations:
+            self._state.approximations.append(check)
+
+    @property
+    def config_digest(self) -> Optional[str]:
+        """SHA-256 digest of the config file as last read or written."""
+        return self._state.digest
+
+    def _snapshot(self, name: str, convert: Callable[[], Any]) -> Any:
+        """
+        Returns the objects converted from the loaded config file, from a snapshot if
+        OPNSENSE_SNAPSHOTS is set and the config file was converted before.
+
+        Call it while loading only, before the config is modified. No snapshot is stored
+        in check mode.
+
+        Args:
+            name (str): The name of the objects, e.g. "rules".
+            convert (Callable[[], Any]): Converts the objects from the config, e.g.
+                                         FirewallRuleSet._load_rules. The objects must
+                                         be picklable.
+
+        Returns:
+            Any: The converted objects.
+        """
+
+        return snapshot_utils.SnapshotCache(
+            self._config_path, read_only=self._check_mode
+        ).snapshot(
+            name=f"{self._module_name}/{self.opnsense_version}/{name}",
+            config_digest=self._state.digest,
+            module_names=[
+                type(self).__module__,
+                __name__,
+                module_index.__name__,
+                xml_utils.__name__,
+            ],
+            convert=convert,
         )
 
     def get(self, setting_name: str) -> Element:
@@ -199,23 +527,15 @@ class OPNsenseModuleConfig:
         Returns:
         - Element: The retrieved setting element.
         """
-        for cfg_map in self._config_maps.values():
-            if setting_name in cfg_map:
-                return self._config_xml_tree.find(cfg_map[setting_name])
-
-        supported_settings: List[str] = []
-        for cfg_map in self._config_maps.values():
-            supported_settings.extend(cfg_map.keys())
-
-        if "php_requirements" in supported_settings:
-            supported_settings.remove("php_requirements")
-        if "configure_functions" in supported_settings:
-            supported_settings.remove("configure_functions")
+        try:
+            return self._state.index.elements[setting_name]
+        except KeyError:
+            pass
 
         raise UnsupportedModuleSettingError(
             f"Setting '{setting_name}' is not supported in module '{self._module_name}' "
             f"for OPNsense version '{self.opnsense_version}'."
-            f"Supported settings are {supported_settings}"
+            f"Supported settings are {list(self._state.index.xpaths)}"
         )
 
     def _get_php_requirements(self) -> list:
@@ -245,7 +565,7 @@ class OPNsenseModuleConfig:
                 )
 
             # ensure php_requirements are defined as a list
-            if not isinstance(php_requirements, list):
+            if not isinstance(php_requirements, (list, tuple)):
                 raise ModuleMisconfigurationError(
                     f"PHP requirements (php_requirements) for the module '{self._module_name}' are "
                     "not provided as a list in the VERSION_MAP using OPNsense version"
@@ -300,7 +620,7 @@ class OPNsenseModuleConfig:
                 )
 
             # ensure configure_functions are defined as a list
-            if not isinstance(configure_functions, dict):
+            if not isinstance(configure_functions, Mapping):
                 raise ModuleMisconfigurationError(
                     "Configure functions (configure_functions) for the module "
                     f"'{self._module_name}' are "
@@ -340,6 +660,8 @@ class OPNsenseModuleConfig:
         Note:
         - The function relies on properly defined PHP requirements and configure functions for
           each module, as per the version-specific configuration.
+        - If the environment variable OPNSENSE_DEFER_APPLY is set, the configure functions are
+          only recorded as pending (see apply_utils) and applied later, e.g. by ha_apply.
         """
 
         # get module specific php_requirements
@@ -348,17 +670,28 @@ class OPNsenseModuleConfig:
         # get module specific configure_functions
         configure_functions: dict = self._get_configure_functions()
 
+        # configure functions lock and write the config file themselves, e.g. if the config
+        # was not saved because it did not change
+        self._state.lock.release()
+
+        if apply_utils.apply_deferred() and not self._check_mode:
+            return apply_utils.defer_functions(
+                php_requirements=php_requirements,
+                configure_functions=list(configure_functions.values()),
+            )
+
         cmd_output: list = []
 
         # run configure functions with all required php dependencies and store their output.
         for value in configure_functions.values():
             meta_dict = {"function": value["name"], "params": value["configure_params"]}
             if not self._check_mode:
-                result_dict = opnsense_utils.run_function(
-                    php_requirements=php_requirements,
-                    configure_function=value["name"],
-                    configure_params=value["configure_params"],
-                )
+                with timing_utils.phase(f"apply:{value['name']}"):
+                    result_dict = opnsense_utils.run_function(
+                        php_requirements=php_requirements,
+                        configure_function=value["name"],
+                        configure_params=value["configure_params"],
+                    )
             else:
                 result_dict = {
                     "check_mode": "Ansible running in check mode, does not execute configure functions",  # pylint: disable=line-too-long
@@ -395,37 +728,30 @@ class OPNsenseModuleConfig:
         - This function directly modifies the configuration and should be used with caution.
         """
 
-        # get xpath from key_mapping
-        xpath: Optional[str] = None
-        for cfg_map in self._config_maps.values():
-            if setting in cfg_map:
-                xpath = cfg_map.get(setting)
-
-        if xpath is None:
+        index: SettingIndex = self._state.index
+        if setting not in index.xpaths:
             raise ModuleMisconfigurationError(
                 f"Could not access given setting {setting}"
             )
-        # create a copy of the _config_dict
-        _setting: Element = self._config_xml_tree.find(xpath)
+        _setting: Optional[Element] = index.elements[setting]
 
         # there are conditions where a config option is not present in
         # the XML unless it's configured. In that case _settings will be
         # None at this point. If it is, we will have to create the new
         # element first to be able to set it's .text value.
         if _setting is None:
+            parent_xpath, tag = index.parents[setting]
+
             # get parent of new element
-            _setting_parent: Element = self._config_xml_tree.find(
-                "/".join(xpath.split("/")[:-1])
+            _setting_parent: Element = (
+                self._config_xml_tree.find(parent_xpath)
+                if parent_xpath
+                else self._config_xml_tree
             )
 
-            # create new empty element
-            element: Element = xml_utils.dict_to_etree(xpath.split("/")[-1], {})
-
-            # append the new element to it's parent
-            _setting_parent.extend(element)
-
-            # rediscover the element
-            _setting: Element = self._config_xml_tree.find(xpath)
+            # create the new empty element and index it
+            _setting = xml_utils.sub_element(_setting_parent, tag)
+            self._index_elements(index.xpaths[setting])
 
         # If the element is present we will verify it's .text value
         elif _setting.text is None or _setting.text.strip() == "":
@@ -437,11 +763,39 @@ class OPNsenseModuleConfig:
 
         _setting.text = value
 
+    def remove(self, setting: str) -> None:
+        """
+        Removes the element of a setting from the config, if it is present.
+
+        Parameters:
+        - setting (str): The setting to remove.
+
+        Raises:
+        - ModuleMisconfigurationError: If the setting is not supported by the module.
+        """
+        index: SettingIndex = self._state.index
+        if setting not in index.xpaths:
+            raise ModuleMisconfigurationError(
+                f"Could not access given setting {setting}"
+            )
+        _setting: Optional[Element] = index.elements[setting]
+        if _setting is None:
+            return
+
+        parent_xpath: str = index.parents[setting][0]
+        _setting_parent: Element = (
+            self._config_xml_tree.find(parent_xpath)
+            if parent_xpath
+            else self._config_xml_tree
+        )
+        _setting_parent.remove(_setting)
+        self._index_elements(index.xpaths[setting])
+
     @property
     def diff(self) -> [Dict[dict, dict]]:
         """
-        Compares the in-memory configuration with the configuration on the file path
-        and returns a dictionary of differences.
+        Compares the in-memory configuration with the configuration as loaded or last
+        written and returns a dictionary of differences.
 
         Returns:
         - Dict[dict, dict]: A dictionary containing the before and
@@ -450,8 +804,7 @@ class OPNsenseModuleConfig:
         Example:
         - diff might return {'before': {"foo": "bar"}, 'after': {"foo": "baz"}}.
         """
-        file_config_tree = ElementTree.parse(self._config_path)
-        file_config = file_config_tree.getroot()
+        file_config: Element = self._baseline_config()
 
         # Create a dictionary to store the differences
         config_diff_before = {}
@@ -484,3 +837,14 @@ class OPNsenseModuleConfig:
                     config_diff_after.update({xpath: in_memory_element.text})
 
         return {"before": config_diff_before, "after": config_diff_after}
+
+
+class SectionedModuleConfig(OPNsenseModuleConfig):
+    """
+    An OPNsenseModuleConfig which only parses the top-level sections of the config file
+    which the settings of its config contexts address, see xml_utils.SectionedXML.
+
+    For modules which only use the config maps, other elements are missing in the tree.
+    """
+
+    sectioned: bool = True
@@ -2,7 +2,19 @@
 #  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 """Reusable Enum utilities"""
 from enum import Enum
-from typing import List
+from functools import lru_cache
+from typing import Dict, List
+
+
+@lru_cache(maxsize=None)
+def _lookup_table(enum_class: type) -> Dict[str, "ListEnum"]:
+    # names and values of the members, built on first use; the first member with a
+    # matching name or value wins, like in a linear search of the members
+    table: Dict[str, "ListEnum"] = {}
+    for _key, _value in enum_class.__members__.items():
+        table.setdefault(_key, _value)
+        table.setdefault(_value.value, _value)
+    return table
 
 
 class ListEnum(Enum):
@@ -33,7 +45,8 @@ class ListEnum(Enum):
         -------
         Enum value
         """
-        for _key, _value in cls.__members__.items():
-            if value in (_key, _value.value):
-                return _value
+        try:
+            return _lookup_table(cls)[value]
+        except (KeyError, TypeError):
+            pass
         raise ValueError(f"'{cls.__name__}' enum not found for '{value}'")
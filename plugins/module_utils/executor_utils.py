@@ -0,0 +1,307 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Executors of the commands the collection runs on OPNsense, PHP and opnsense-version.
+
+opnsense_utils and version_utils run their commands through the executor returned by
+get_executor. The environment variable OPNSENSE_EXECUTOR selects it:
+
+- subprocess (default): Runs every command in a new process.
+- pooled: Like subprocess, but starts the PHP interpreter for the next PHP command
+  ahead of time, so that its start-up overlaps with the work between the commands.
+- record: Like subprocess, and appends every command and its result to the fixtures
+  file OPNSENSE_EXECUTOR_FIXTURES, as JSON lines.
+- replay: Returns the results recorded in OPNSENSE_EXECUTOR_FIXTURES instead of running
+  the commands, e.g. to replay a run of a firewall on any machine.
+
+The recorded commands contain the parameters of the module run, e.g. passwords to hash,
+the fixtures file is readable by its owner only.
+"""
+
+import abc
+import atexit
+import collections
+import json
+import os
+import subprocess
+from typing import Deque, Dict, List, Optional, Tuple
+
+EXECUTOR_ENV: str = "OPNSENSE_EXECUTOR"
+EXECUTOR_FIXTURES_ENV: str = "OPNSENSE_EXECUTOR_FIXTURES"
+
+# PHP reads the script from stdin if it is started without one
+PHP_COMMAND_PREFIX: List[str] = ["php", "-r"]
+PHP_WORKER_ARGS: List[str] = ["php"]
+
+
+class ExecutorUsageError(Exception):
+    """
+    Exception raised for an unknown executor or a command which was not recorded.
+    """
+
+
+class Executor(abc.ABC):
+    """
+    Runs commands like subprocess, the base of all executors.
+    """
+
+    @abc.abstractmethod
+    def run(self, args: List[str]) -> subprocess.CompletedProcess:
+        """
+        Runs a command and captures its output, like subprocess.run without check.
+
+        Args:
+            args (List[str]): The command and its arguments.
+
+        Returns:
+            subprocess.CompletedProcess: The return code and the output of the command,
+            as bytes.
+        """
+
+    def check_output(self, args: List[str]) -> str:
+        """
+        Runs a command and returns its output, like subprocess.check_output.
+
+        Args:
+            args (List[str]): The command and its arguments.
+
+        Returns:
+            str: The decoded output of the command.
+
+        Raises:
+            subprocess.CalledProcessError: If the command failed.
+        """
+
+        result: subprocess.CompletedProcess = self.run(args)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(
+                result.returncode, args, result.stdout, result.stderr
+            )
+        return result.stdout.decode("utf-8")
+
+    def close(self) -> None:
+        """Releases the resources of the executor, e.g. started processes."""
+
+
+class SubprocessExecutor(Executor):
+    """
+    Runs every command in a new process.
+    """
+
+    def run(self, args: List[str]) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,  # do not raise exception if program fails
+        )
+
+    def check_output(self, args: List[str]) -> str:
+        return subprocess.check_output(args=args, encoding="utf-8")
+
+
+class PooledExecutor(SubprocessExecutor):
+    """
+    Runs PHP commands in PHP interpreters started ahead of time.
+
+    Every PHP command still runs in a fresh interpreter, like php -r. The interpreter
+    is started without a script and waits for it on stdin, the next one is started as
+    soon as the previous one is taken. Other commands run like in SubprocessExecutor.
+
+    Attributes:
+        size (int): The number of interpreters started ahead of time.
+    """
+
+    def __init__(self, size: int = 1):
+        self.size = size
+        self._workers: Deque[subprocess.Popen] = collections.deque()
+
+    def _start_workers(self) -> None:
+        while len(self._workers) < self.size:
+            self._workers.append(
+                subprocess.Popen(  # pylint: disable=consider-using-with
+                    PHP_WORKER_ARGS,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            )
+
+    def run(self, args: List[str]) -> subprocess.CompletedProcess:
+        if len(args) != 3 or args[:2] != PHP_COMMAND_PREFIX:
+            return super().run(args)
+
+        self._start_workers()
+        worker: subprocess.Popen = self._workers.popleft()
+        # the next interpreter starts while this one runs the command
+        self._start_workers()
+
+        stdout, stderr = worker.communicate(f"<?php {args[2]}".encode("utf-8"))
+        return subprocess.CompletedProcess(args, worker.returncode, stdout, stderr)
+
+    def close(self) -> None:
+        while self._workers:
+            worker: subprocess.Popen = self._workers.popleft()
+            worker.kill()
+            worker.communicate()
+
+
+class RecordingExecutor(Executor):
+    """
+    Runs commands with another executor and records every command and its result.
+
+    Attributes:
+        path (str): The fixtures file, the results are appended as JSON lines.
+        executor (Executor): The executor running the commands.
+    """
+
+    def __init__(self, path: str, executor: Optional[Executor] = None):
+        self.path = path
+        self.executor = executor or SubprocessExecutor()
+
+    def run(self, args: List[str]) -> subprocess.CompletedProcess:
+        result: subprocess.CompletedProcess = self.executor.run(args)
+
+        fixture: dict = {
+            "args": list(args),
+            "rc": result.returncode,
+            # surrogateescape keeps output which is not valid UTF-8
+            "stdout": result.stdout.decode("utf-8", "surrogateescape"),
+            "stderr": result.stderr.decode("utf-8", "surrogateescape"),
+        }
+        fixtures_descriptor: int = os.open(
+            self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+        )
+        with os.fdopen(fixtures_descriptor, "a", encoding="utf-8") as fixtures_file:
+            fixtures_file.write(json.dumps(fixture) + "\n")
+
+        return result
+
+    def close(self) -> None:
+        self.executor.close()
+
+
+class ReplayingExecutor(Executor):
+    """
+    Returns the recorded results of commands instead of running them.
+
+    A command recorded several times returns its results in the recorded order, the last
+    one once all of them were returned.
+
+    Attributes:
+        path (str): The fixtures file written by RecordingExecutor.
+        fallback (Optional[Executor]): Runs the commands which were not recorded, if it
+                                       is set.
+    """
+
+    def __init__(self, path: str, fallback: Optional[Executor] = None):
+        self.path = path
+        self.fallback = fallback
+        self._results: Dict[Tuple[str, ...], Deque[subprocess.CompletedProcess]] = {}
+
+        with open(path, "r", encoding="utf-8") as fixtures_file:
+            for line in fixtures_file:
+                if not line.strip():
+                    continue
+                fixture: dict = json.loads(line)
+                self._results.setdefault(
+                    tuple(fixture["args"]), collections.deque()
+                ).append(
+                    subprocess.CompletedProcess(
+                        fixture["args"],
+                        fixture["rc"],
+                        fixture["stdout"].encode("utf-8", "surrogateescape"),
+                        fixture["stderr"].encode("utf-8", "surrogateescape"),
+                    )
+                )
+
+    def run(self, args: List[str]) -> subprocess.CompletedProcess:
+        results: Optional[Deque[subprocess.CompletedProcess]] = self._results.get(
+            tuple(args)
+        )
+        if not results:
+            if self.fallback is not None:
+                return self.fallback.run(args)
+            raise ExecutorUsageError(
+                f"The command {args!r} was not recorded in {self.path}."
+            )
+
+        return results.popleft() if len(results) > 1 else results[0]
+
+
+# the executor set by set_executor
+_executor: Optional[Executor] = None
+# the executor selected by OPNSENSE_EXECUTOR, with the environment it was selected by
+_selected_executor: Optional[Tuple[Tuple[str, str], Executor]] = None
+
+
+def set_executor(executor: Optional[Executor]) -> Optional[Executor]:
+    """
+    Sets the executor of all commands, instead of the one selected by OPNSENSE_EXECUTOR.
+
+    Args:
+        executor (Optional[Executor]): The executor, None to select it by
+                                       OPNSENSE_EXECUTOR again.
+
+    Returns:
+        Optional[Executor]: The previously set executor, e.g. to restore it.
+    """
+
+    global _executor  # pylint: disable=global-statement
+
+    previous: Optional[Executor] = _executor
+    _executor = executor
+    return previous
+
+
+def get_executor() -> Executor:
+    """
+    Returns the executor of all commands, see set_executor and OPNSENSE_EXECUTOR.
+
+    Raises:
+        ExecutorUsageError: If OPNSENSE_EXECUTOR is unknown, or the fixtures file is
+                            not set for record or replay.
+    """
+
+    global _selected_executor  # pylint: disable=global-statement
+
+    if _executor is not None:
+        return _executor
+
+    environment: Tuple[str, str] = (
+        os.environ.get(EXECUTOR_ENV, "").strip().lower() or "subprocess",
+        os.environ.get(EXECUTOR_FIXTURES_ENV, ""),
+    )
+    if _selected_executor is not None and _selected_executor[0] == environment:
+        return _selected_executor[1]
+
+    name, fixtures = environment
+    if name in ("record", "replay") and not fixtures:
+        raise ExecutorUsageError(
+            f"{EXECUTOR_ENV}={name} requires the fixtures file {EXECUTOR_FIXTURES_ENV}."
+        )
+
+    if name == "subprocess":
+        executor: Executor = SubprocessExecutor()
+    elif name == "pooled":
+        executor = PooledExecutor()
+    elif name == "record":
+        executor = RecordingExecutor(fixtures)
+    elif name == "replay":
+        executor = ReplayingExecutor(fixtures)
+    else:
+        raise ExecutorUsageError(
+            f"Unknown executor {EXECUTOR_ENV}={name}, "
+            "supported are subprocess, pooled, record and replay."
+        )
+
+    _close_selected_executor()
+    _selected_executor = (environment, executor)
+    return executor
+
+
+@atexit.register
+def _close_selected_executor() -> None:
+    if _selected_executor is not None:
+        _selected_executor[1].close()
@@ -0,0 +1,98 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Utilities to write files on the firewall atomically.
+"""
+
+import hashlib
+import os
+import stat
+import tempfile
+from typing import Optional
+
+# mode of newly created files, like config.xml
+DEFAULT_FILE_MODE: int = 0o644
+
+
+def digest(data: bytes) -> str:
+    """
+    Returns the SHA-256 hex digest of the given content.
+    """
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def _fsync_directory(directory: str) -> None:
+    try:
+        directory_descriptor: int = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(directory_descriptor)
+    except OSError:
+        # not every platform and file system supports syncing directories
+        pass
+    finally:
+        os.close(directory_descriptor)
+
+
+def atomic_write(path: str, data: bytes, mode: Optional[int] = None) -> None:
+    """
+    Writes a file atomically.
+
+    The content is written to a temporary file in the same directory, flushed to disk and
+    then renamed over the file, so that the file contains either the old or the new
+    content, even if the process or the system crashes while writing.
+
+    Args:
+        path (str): The file to write.
+        data (bytes): The new content of the file.
+        mode (Optional[int]): The permissions of the file. Defaults to the permissions of
+                              the existing file, DEFAULT_FILE_MODE for a new file.
+
+    Raises:
+        OSError: If the file could not be written, the file is left untouched.
+    """
+
+    directory: str = os.path.dirname(path) or "."
+
+    try:
+        current_stat: Optional[os.stat_result] = os.stat(path)
+    except FileNotFoundError:
+        current_stat = None
+
+    if mode is None:
+        mode = (
+            stat.S_IMODE(current_stat.st_mode)
+            if current_stat is not None
+            else DEFAULT_FILE_MODE
+        )
+
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}."
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+            os.chmod(tmp_path, mode)
+            if current_stat is not None:
+                try:
+                    os.chown(tmp_path, current_stat.st_uid, current_stat.st_gid)
+                except PermissionError:
+                    # only root may change the owner, keep the owner of the writing user
+                    pass
+
+            os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    _fsync_directory(directory)
@@ -0,0 +1,241 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Persistent fingerprints of the desired state of module runs, to skip unchanged runs.
+
+If the environment variable OPNSENSE_FINGERPRINTS is set, a module run which found
+nothing to change records a fingerprint of its parameters, keyed by the module and the
+identity of the managed object, together with the digest of config.xml it verified. A
+later run with the same parameters against a config.xml with the same digest is known
+to change nothing and returns before config.xml is even parsed. Any change of config.xml,
+by Ansible, the GUI or by hand, changes its digest and invalidates all fingerprints.
+The fingerprints are also bound to the code of the module, the module_utils of the
+collection and the OPNsense version, an update of either invalidates them as well.
+
+The parameters are hashed with a random key kept in the store, so that the store does
+not reveal e.g. plain passwords. The store is kept next to config.xml, readable by root
+only.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Dict, NamedTuple, Optional
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    config_utils,
+    executor_utils,
+    file_utils,
+    snapshot_utils,
+    timing_utils,
+    version_utils,
+)
+
+FINGERPRINTS_ENV: str = "OPNSENSE_FINGERPRINTS"
+FINGERPRINT_FILE_NAME: str = ".ansible_fingerprints.json"
+DEFAULT_CONFIG_PATH: str = "/conf/config.xml"
+
+# changing the format of the fingerprints invalidates all stored fingerprints
+FINGERPRINT_FORMAT: int = 2
+
+
+def fingerprints_enabled() -> bool:
+    """
+    Returns True if fingerprints should be used to skip unchanged runs.
+    """
+
+    return os.environ.get(FINGERPRINTS_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+class Fingerprint(NamedTuple):
+    """
+    The desired state of a module run.
+
+    Attributes:
+        module_name (str): The name of the module.
+        key (str): The module and the identity of the managed object.
+        params (str): The JSON serialized parameters of the run.
+    """
+
+    module_name: str
+    key: str
+    params: str
+
+
+class FingerprintStore:
+    """
+    The fingerprints of the unchanged module runs against a config file.
+
+    Attributes:
+        config_path (str): The config file, OPNSENSE_CONFIG_PATH or /conf/config.xml by
+                           default.
+        path (str): The store file, next to the config file by default.
+    """
+
+    def __init__(self, config_path: Optional[str] = None, path: Optional[str] = None):
+        self.config_path = (
+            config_path
+            or os.environ.get(config_utils.CONFIG_PATH_ENV)
+            or DEFAULT_CONFIG_PATH
+        )
+        self.path = path or os.path.join(
+            os.path.dirname(self.config_path), FINGERPRINT_FILE_NAME
+        )
+        self._environments: Dict[str, str] = {}
+
+    @staticmethod
+    def fingerprint(module_name: str, identity: dict, params: dict) -> Fingerprint:
+        """
+        Returns the fingerprint of a module run.
+
+        Args:
+            module_name (str): The name of the module.
+            identity (dict): The parameters identifying the managed object, e.g. its name.
+                             Runs with the same identity replace each others fingerprint.
+            params (dict): All parameters of the run.
+
+        Returns:
+            Fingerprint: The fingerprint of the run.
+        """
+
+        return Fingerprint(
+            module_name=module_name,
+            key=f"{module_name}:{json.dumps(identity, sort_keys=True, default=str)}",
+            params=json.dumps(params, sort_keys=True, default=str),
+        )
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as store_file:
+                store: dict = json.load(store_file)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(store, dict) or store.get("format") != FINGERPRINT_FORMAT:
+            return {}
+
+        return store
+
+    def _get_environment(self, module_name: str) -> Optional[str]:
+        """
+        Returns the code of the module and the module_utils of the collection and the
+        OPNsense version the runs of the module are fingerprinted with, None if either
+        is not known.
+        """
+
+        if module_name not in self._environments:
+            code: Optional[str] = snapshot_utils.collection_code_digest(module_name)
+            try:
+                version: str = version_utils.get_opnsense_version()
+            except (
+                OSError,
+                executor_utils.ExecutorUsageError,
+                version_utils.OPNSenseVersionUsageError,
+            ):
+                return None
+            if code is None:
+                return None
+            self._environments[module_name] = f"{code}\0{version}"
+
+        return self._environments[module_name]
+
+    def _hash(self, store: dict, fingerprint: Fingerprint) -> Optional[str]:
+        environment: Optional[str] = self._get_environment(fingerprint.module_name)
+        if environment is None:
+            return None
+
+        return hmac.new(
+            bytes.fromhex(store["key"]),
+            f"{environment}\0{fingerprint.params}".encode("utf-8"),
+            hashlib.sha256,
+        ).hexdigest()
+
+    def _config_file_digest(self) -> Optional[str]:
+        try:
+            with open(self.config_path, "rb") as config_file:
+                return file_utils.digest(config_file.read())
+        except OSError:
+            return None
+
+    def matches(self, fingerprint: Fingerprint) -> bool:
+        """
+        Returns True if the same run found nothing to change in the current config file.
+
+        Always False if fingerprints are not enabled.
+        """
+
+        if not fingerprints_enabled():
+            return False
+
+        with timing_utils.phase("fingerprint"):
+            store: dict = self._load()
+            entry: Optional[dict] = store.get("entries", {}).get(fingerprint.key)
+            if entry is None:
+                return False
+
+            params_hash: Optional[str] = self._hash(store, fingerprint)
+            if params_hash is None or not hmac.compare_digest(
+                entry.get("params", ""), params_hash
+            ):
+                return False
+
+            return entry.get("config_digest") == self._config_file_digest()
+
+    def record(self, fingerprint: Fingerprint, config_digest: Optional[str]) -> None:
+        """
+        Records a run which found nothing to change in the config file with the given
+        digest. Nothing is recorded if fingerprints are not enabled.
+
+        The fingerprints are only an optimization, a store which can not be written is
+        ignored.
+
+        Args:
+            fingerprint (Fingerprint): The fingerprint of the run.
+            config_digest (Optional[str]): The digest of the verified config file.
+        """
+
+        if not fingerprints_enabled() or config_digest is None:
+            return
+
+        with timing_utils.phase("fingerprint"):
+            store: dict = self._load()
+            if not store:
+                store = {
+                    "format": FINGERPRINT_FORMAT,
+                    "key": secrets.token_hex(32),
+                    "entries": {},
+                }
+
+            params_hash: Optional[str] = self._hash(store, fingerprint)
+            if params_hash is None:
+                return
+
+            entries: Dict[str, dict] = store.setdefault("entries", {})
+            entries[fingerprint.key] = {
+                "params": params_hash,
+                "config_digest": config_digest,
+                "time": time.time(),
+            }
+
+            try:
+                file_utils.atomic_write(
+                    self.path,
+                    json.dumps(store, sort_keys=True).encode("utf-8"),
+                    mode=0o600,
+                )
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """
+        Removes all fingerprints.
+        """
+
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,448 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Utilities to pre-materialize the pf table files of urltable and geoip aliases.
+
+OPNsense loads the content of urltable and geoip aliases from table files located in
+/var/db/aliastables. If such a file is missing or outdated, the alias is refreshed by
+downloading and parsing its source again. The AliasTableCache in this module loads the
+table content from a local file or a (local stand-in) HTTP source, normalizes and
+collapses the entries and writes the table file OPNsense expects. The ETag and mtime of
+every source are remembered, so that unchanged sources are skipped. A written table file
+is loaded into the pf table of the alias right away, see AliasTableCache.load_table.
+"""
+
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import tempfile
+import urllib.parse
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    executor_utils,
+    timing_utils,
+)
+
+ALIAS_TABLE_DIR: str = "/var/db/aliastables"
+GEOIP_DIR: str = "/usr/local/share/GeoIP/alias"
+TABLE_STATE_FILE: str = ".ansible_table_state.json"
+
+# alias names as accepted by OPNsense, they are used in the paths of the table files
+ALIAS_NAME_PATTERN: re.Pattern = re.compile(r"^[a-zA-Z0-9_]{1,32}$")
+
+
+class OPNsenseAliasTableSourceError(Exception):
+    """
+    Exception raised when the content of an alias table source can not be loaded.
+    """
+
+
+class OPNsenseAliasTableNameError(Exception):
+    """
+    Exception raised when an alias name is not valid for a table file.
+    """
+
+
+@dataclass
+class TableSourceResult:
+    """
+    Result of loading an alias table source.
+
+    Attributes:
+        content (Optional[bytes]): Raw content of the source, None if not modified.
+        etag (Optional[str]): ETag returned by an HTTP source.
+        mtime (Optional[float]): Modification time of a file source.
+        not_modified (bool): True if the source is unchanged since the last load.
+    """
+
+    content: Optional[bytes] = None
+    etag: Optional[str] = None
+    mtime: Optional[float] = None
+    not_modified: bool = False
+
+
+def normalize_table_entries(lines: Iterable[str]) -> List[str]:
+    """
+    Normalizes the lines of an alias table source to pf table entries.
+
+    Comments (starting with '#', ';' or '//') and anything after the first whitespace of a
+    line are dropped, invalid entries are skipped. The remaining networks are collapsed per
+    address family and returned sorted, IPv4 entries first. Host networks are rendered as
+    plain addresses.
+
+    Args:
+        lines (Iterable[str]): The lines of the source.
+
+    Returns:
+        List[str]: The normalized table entries.
+    """
+
+    networks: Dict[int, list] = {4: [], 6: []}
+
+    for line in lines:
+        entry = line.strip()
+        if not entry or entry.startswith(("#", ";", "//")):
+            continue
+
+        entry = entry.split()[0]
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        networks[network.version].append(network)
+
+    entries: List[str] = []
+    for version in (4, 6):
+        for network in ipaddress.collapse_addresses(networks[version]):
+            if network.num_addresses == 1:
+                entries.append(str(network.network_address))
+            else:
+                entries.append(str(network))
+
+    return entries
+
+
+def _last_modified(header: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(header).timestamp() if header else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _load_http_source(
+    source: str, etag: Optional[str], mtime: Optional[float], timeout: int
+) -> TableSourceResult:
+    """
+    Loads an HTTP source, conditionally if the ETag or mtime of the last load is given.
+
+    The mtime of the result is the Last-Modified header of the response.
+    """
+
+    # imported on demand, the HTTP client is slow to import and rarely needed
+    # pylint: disable=import-outside-toplevel
+    from urllib.error import HTTPError, URLError
+    from urllib.request import Request, urlopen
+
+    request = Request(source)
+    if etag:
+        request.add_header("If-None-Match", etag)
+    if mtime:
+        request.add_header("If-Modified-Since", formatdate(mtime, usegmt=True))
+
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return TableSourceResult(
+                content=response.read(),
+                etag=response.headers.get("ETag"),
+                mtime=_last_modified(response.headers.get("Last-Modified")),
+            )
+    except HTTPError as http_error:
+        if http_error.code == 304:
+            return TableSourceResult(etag=etag, mtime=mtime, not_modified=True)
+        raise OPNsenseAliasTableSourceError(
+            f"Could not load alias table source {source}: {http_error}"
+        ) from http_error
+    except URLError as url_error:
+        raise OPNsenseAliasTableSourceError(
+            f"Could not load alias table source {source}: {url_error}"
+        ) from url_error
+
+
+def load_table_source(
+    source: str,
+    etag: Optional[str] = None,
+    mtime: Optional[float] = None,
+    timeout: int = 30,
+) -> TableSourceResult:
+    """
+    Loads the content of an alias table source.
+
+    Sources may be local paths, file:// URLs or http(s):// URLs. File sources are skipped
+    if their mtime matches the given mtime, HTTP sources are requested conditionally with
+    the given ETag and mtime (If-None-Match / If-Modified-Since). The mtime of an HTTP
+    source is its Last-Modified header.
+
+    Args:
+        source (str): Path or URL of the source.
+        etag (Optional[str]): ETag of the last successful load.
+        mtime (Optional[float]): Modification time of the last successful load.
+        timeout (int): Timeout in seconds for HTTP sources.
+
+    Returns:
+        TableSourceResult: The loaded source.
+
+    Raises:
+        OPNsenseAliasTableSourceError: If the source can not be loaded.
+    """
+
+    parsed_source = urllib.parse.urlparse(source)
+
+    if parsed_source.scheme in ("http", "https"):
+        return _load_http_source(source, etag, mtime, timeout)
+
+    path: str = parsed_source.path if parsed_source.scheme == "file" else source
+
+    try:
+        source_mtime: float = os.stat(path).st_mtime
+        if mtime is not None and source_mtime == mtime:
+            return TableSourceResult(mtime=mtime, not_modified=True)
+
+        with open(path, "rb") as source_file:
+            return TableSourceResult(content=source_file.read(), mtime=source_mtime)
+    except OSError as os_error:
+        raise OPNsenseAliasTableSourceError(
+            f"Could not load alias table source {source}: {os_error}"
+        ) from os_error
+
+
+class AliasTableCache:
+    """
+    Writes the pf table files of urltable and geoip aliases from local sources.
+
+    The state of every materialized alias (source, ETag, mtime and content digest) is kept
+    in a JSON file next to the table files, so that unchanged sources are neither loaded
+    nor written again. In check mode, the sources are loaded and compared, but neither the
+    table files nor the state are written.
+
+    Attributes:
+        table_dir (str): Directory containing the alias table files.
+        geoip_dir (str): Directory containing the per country GeoIP files.
+        check_mode (bool): Whether the table files are only compared, not written.
+    """
+
+    def __init__(
+        self,
+        table_dir: str = ALIAS_TABLE_DIR,
+        geoip_dir: str = GEOIP_DIR,
+        check_mode: bool = False,
+    ):
+        self.table_dir = table_dir
+        self.geoip_dir = geoip_dir
+        self.check_mode = check_mode
+        self._state_path = os.path.join(table_dir, TABLE_STATE_FILE)
+        self._state: Dict[str, dict] = self._load_state()
+
+    def _load_state(self) -> Dict[str, dict]:
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        if self.check_mode:
+            return
+
+        self._write_atomic(
+            self._state_path,
+            json.dumps(self._state, indent=2, sort_keys=True).encode("utf-8"),
+        )
+
+    def table_path(self, alias_name: str) -> str:
+        """
+        Returns the path of the table file of the given alias.
+
+        Raises:
+            OPNsenseAliasTableNameError: If the name is not a valid alias name.
+        """
+
+        if not ALIAS_NAME_PATTERN.match(alias_name):
+            raise OPNsenseAliasTableNameError(
+                f"Invalid alias name {alias_name!r} for a table file, alias names may "
+                "only contain up to 32 letters, digits and underscores"
+            )
+        return os.path.join(self.table_dir, f"{alias_name}.txt")
+
+    def load_table(self, alias_name: str) -> dict:
+        """
+        Loads the table file of an alias into its pf table, replacing its entries.
+
+        OPNsense only loads table files when the filter is reloaded or the aliases are
+        refreshed, the configure functions of firewall_alias do neither.
+
+        Args:
+            alias_name (str): Name of the alias.
+
+        Returns:
+            dict: The command, its return code and output.
+        """
+
+        args: List[str] = [
+            "pfctl",
+            "-t",
+            alias_name,
+            "-T",
+            "replace",
+            "-f",
+            self.table_path(alias_name),
+        ]
+        with timing_utils.phase("apply:pfctl"):
+            result = executor_utils.get_executor().run(args)
+
+        return {
+            "command": " ".join(args),
+            "rc": result.returncode,
+            "stdout": result.stdout.decode("utf-8", "replace"),
+            "stderr": result.stderr.decode("utf-8", "replace"),
+        }
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        os.makedirs(self.table_dir, exist_ok=True)
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=self.table_dir, prefix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def _write_table(self, alias_name: str, entries: List[str]) -> bool:
+        """
+        Writes the table file of an alias if its content differs from the last write.
+
+        Returns:
+            bool: True if the table file was written, or would be in check mode, False
+            otherwise.
+        """
+
+        data: bytes = "".join(f"{entry}\n" for entry in entries).encode("utf-8")
+        digest: str = hashlib.sha256(data).hexdigest()
+
+        alias_state: dict = self._state.get(alias_name, {})
+        if alias_state.get("digest") == digest and os.path.isfile(
+            self.table_path(alias_name)
+        ):
+            return False
+        if self.check_mode:
+            return True
+
+        self._write_atomic(self.table_path(alias_name), data)
+        alias_state["digest"] = digest
+        self._state[alias_name] = alias_state
+        return True
+
+    def materialize_urltable(self, alias_name: str, source: str) -> dict:
+        """
+        Materializes the table file of an urltable alias.
+
+        Args:
+            alias_name (str): Name of the alias.
+            source (str): Path or URL to load the table content from.
+
+        Returns:
+            dict: The materialization result of the alias.
+
+        Raises:
+            OPNsenseAliasTableNameError: If the name is not a valid alias name.
+            OPNsenseAliasTableSourceError: If the source can not be loaded.
+        """
+
+        table_path: str = self.table_path(alias_name)
+        alias_state: dict = self._state.get(alias_name, {})
+        if alias_state.get("source") != source:
+            alias_state = {"digest": alias_state.get("digest")}
+
+        source_result: TableSourceResult = load_table_source(
+            source, etag=alias_state.get("etag"), mtime=alias_state.get("mtime")
+        )
+
+        result: dict = {"name": alias_name, "source": source, "changed": False}
+
+        if source_result.not_modified and os.path.isfile(table_path):
+            result["skipped"] = "source not modified"
+            result["entries"] = alias_state.get("entries")
+            return result
+
+        if source_result.content is None:
+            source_result = load_table_source(source)
+
+        entries: List[str] = normalize_table_entries(
+            source_result.content.decode("utf-8", errors="replace").splitlines()
+        )
+
+        alias_state.update(
+            source=source,
+            etag=source_result.etag,
+            mtime=source_result.mtime,
+            entries=len(entries),
+        )
+        self._state[alias_name] = alias_state
+
+        result["changed"] = self._write_table(alias_name, entries)
+        result["entries"] = len(entries)
+        self._save_state()
+
+        return result
+
+    def materialize_geoip(
+        self, alias_name: str, countries: List[str], protocols: List[str]
+    ) -> dict:
+        """
+        Materializes the table file of a geoip alias from the per country files in geoip_dir.
+
+        Args:
+            alias_name (str): Name of the alias.
+            countries (List[str]): Country codes of the alias.
+            protocols (List[str]): Address families of the alias (IPv4 and/or IPv6).
+
+        Returns:
+            dict: The materialization result of the alias.
+
+        Raises:
+            OPNsenseAliasTableNameError: If the name is not a valid alias name.
+            OPNsenseAliasTableSourceError: If there is no GeoIP data for the countries.
+        """
+
+        table_path: str = self.table_path(alias_name)
+        protocols = protocols or ["IPv4", "IPv6"]
+        source_paths: List[str] = sorted(
+            os.path.join(self.geoip_dir, f"{country}-{protocol}")
+            for country in countries
+            for protocol in protocols
+        )
+        source_paths = [path for path in source_paths if os.path.isfile(path)]
+
+        result: dict = {"name": alias_name, "source": self.geoip_dir, "changed": False}
+
+        if not source_paths:
+            raise OPNsenseAliasTableSourceError(
+                f"No GeoIP data found in {self.geoip_dir} for alias {alias_name}, "
+                "make sure a GeoIP source is configured and has been downloaded"
+            )
+
+        source_key: str = ",".join(source_paths)
+        source_mtime: float = max(os.stat(path).st_mtime for path in source_paths)
+
+        alias_state: dict = self._state.get(alias_name, {})
+        if (
+            alias_state.get("source") == source_key
+            and alias_state.get("mtime") == source_mtime
+            and os.path.isfile(table_path)
+        ):
+            result["skipped"] = "source not modified"
+            result["entries"] = alias_state.get("entries")
+            return result
+
+        lines: List[str] = []
+        for path in source_paths:
+            with open(path, "r", encoding="utf-8", errors="replace") as geoip_file:
+                lines.extend(geoip_file.read().splitlines())
+
+        entries: List[str] = normalize_table_entries(lines)
+
+        alias_state.update(source=source_key, mtime=source_mtime, entries=len(entries))
+        self._state[alias_name] = alias_state
+
+        result["changed"] = self._write_table(alias_name, entries)
+        result["entries"] = len(entries)
+        self._save_state()
+
+        return result
@@ -10,18 +10,12 @@ import re
 import ipaddress
 from typing import List, Optional, Union, Dict
 
-from xml.etree.ElementTree import Element, ElementTree
+from xml.etree.ElementTree import Element
 from ansible_collections.puzzle.opnsense.plugins.module_utils import xml_utils
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
-    OPNsenseModuleConfig,
+    SectionedModuleConfig,
     UnsupportedModuleSettingError,
 )
-from ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils import (
-    Group,
-)
-from ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils import (
-    InterfacesSet,
-)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.enum_utils import ListEnum
 
 
@@ -298,7 +292,7 @@ class FirewallAlias:
         return element
 
 
-class FirewallAliasSet(OPNsenseModuleConfig):
+class FirewallAliasSet(SectionedModuleConfig):
     """
     FirewallAliasSet manages a collection of firewall aliases.
 
@@ -308,7 +302,7 @@ class FirewallAliasSet(OPNsenseModuleConfig):
 
     _aliases: List[FirewallAlias]
 
-    def __init__(self, path: str = "/conf/config.xml"):
+    def __init__(self, path: str = "/conf/config.xml", check_mode: bool = False):
         super().__init__(
             module_name="firewall_alias",
             config_context_names=[
@@ -317,9 +311,9 @@ class FirewallAliasSet(OPNsenseModuleConfig):
                 "interfaces_assignments",
             ],
             path=path,
+            check_mode=check_mode,
         )
-        self._aliases = self._load_aliases()
-        self._config_xml_tree = self._load_config()
+        self._aliases = self._snapshot("aliases", self._load_aliases)
         self.group_list = []
 
         try:
@@ -475,6 +469,12 @@ class FirewallAliasSet(OPNsenseModuleConfig):
             bool: True if valid, False otherwise.
         """
 
+        # imported on demand, most aliases do not reference groups
+        # pylint: disable=import-outside-toplevel
+        from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+            system_access_users_utils,
+        )
+
         # load groups
         element_tree_opnvpn_groups: Element = self.get("system")
 
@@ -482,9 +482,9 @@ class FirewallAliasSet(OPNsenseModuleConfig):
 
         for group in element_tree_opnvpn_groups:
             if group.tag == "group":
-                self.group_list.append(Group.from_xml(group))
+                self.group_list.append(system_access_users_utils.Group.from_xml(group))
 
-        existing_group: Optional[Group] = next(
+        existing_group: Optional[system_access_users_utils.Group] = next(
             (g for g in self.group_list if g.name == type_opnvpngroup_alias),
             None,
         )
@@ -522,7 +522,15 @@ class FirewallAliasSet(OPNsenseModuleConfig):
             bool: True if valid, False otherwise.
         """
 
-        with InterfacesSet(path=self._config_path) as if_set:
+        # imported on demand, most aliases do not reference interfaces
+        # pylint: disable=import-outside-toplevel
+        from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+            interfaces_assignments_utils,
+        )
+
+        with interfaces_assignments_utils.InterfacesSet(
+            path=self._config_path
+        ) as if_set:
             interface = if_set.find(descr=interface_name)
 
             if interface is None:
@@ -732,8 +740,8 @@ class FirewallAliasSet(OPNsenseModuleConfig):
         # since "system_access_users" and "interfaces_assignments" are no
         # longer needed and to avoid the configure_functions in
         # the save() method, they can be popped
-        self._config_maps.pop("system_access_users")
-        self._config_maps.pop("interfaces_assignments")
+        self._config_maps.pop("system_access_users", None)
+        self._config_maps.pop("interfaces_assignments", None)
 
         if not self.changed:
             return False
@@ -752,14 +760,6 @@ class FirewallAliasSet(OPNsenseModuleConfig):
         filter_element.extend([alias.to_etree() for alias in self._aliases])
 
         # Write the updated XML tree to the file
-        tree: ElementTree = ElementTree(self._config_xml_tree)
-
-        # raise ValueError([(test.tag, test.text) for test in list(filter_element)[0]])
-
-        tree.write(self._config_path, encoding="utf-8", xml_declaration=True)
-
-        # Reload the configuration to reflect the updated changes
-
-        self._config_xml_tree = self._load_config()
+        self._write_config()
 
         return True
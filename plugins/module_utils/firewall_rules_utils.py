@@ -10,7 +10,7 @@ from xml.etree.ElementTree import Element
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import xml_utils
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
-    OPNsenseModuleConfig,
+    SectionedModuleConfig,
 )
 from ansible_collections.puzzle.opnsense.plugins.module_utils.enum_utils import ListEnum
 
@@ -514,7 +514,7 @@ class FirewallRule:
         return FirewallRule(**rule_dict)
 
 
-class FirewallRuleSet(OPNsenseModuleConfig):
+class FirewallRuleSet(SectionedModuleConfig):
     """
     Manages a set of firewall rules in an OPNsense configuration.
 
@@ -537,13 +537,14 @@ class FirewallRuleSet(OPNsenseModuleConfig):
 
     _rules: List[FirewallRule]
 
-    def __init__(self, path: str = "/conf/config.xml"):
+    def __init__(self, path: str = "/conf/config.xml", check_mode: bool = False):
         super().__init__(
             module_name="firewall_rules",
             config_context_names=["firewall_rules"],
             path=path,
+            check_mode=check_mode,
         )
-        self._rules = self._load_rules()
+        self._rules = self._snapshot("rules", self._load_rules)
 
     def _load_rules(self) -> List[FirewallRule]:
         # /opnsense/filter Element containing a list of <rule>
@@ -0,0 +1,433 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Utilities to hash user passwords and API key secrets in batches.
+
+Hashing a single secret by starting a PHP process is dominated by the PHP startup time,
+while the bcrypt work itself is CPU bound. The SecretHasher in this module therefore
+hashes lists of secrets at once: in-process if the required Python libraries are
+available, otherwise in as few PHP invocations as possible. Large batches are split into
+chunks which are processed concurrently by threads, one per CPU core of the firewall and
+at most MAX_WORKERS: PHP chunks run in their own processes and bcrypt releases the GIL
+while hashing. The crypt module holds the GIL, so SHA-512 crypt secrets hashed in-process
+are processed in a single chunk, they take milliseconds compared to bcrypt.
+"""
+
+import base64
+import hmac
+import importlib
+import json
+import math
+import os
+import re
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    opnsense_utils,
+    timing_utils,
+)
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+
+@lru_cache(maxsize=None)
+def _crypt():
+    """
+    Returns the crypt module, None if it is not available.
+
+    crypt is only imported when an API key secret is first hashed or verified.
+    """
+
+    try:
+        with warnings.catch_warnings():
+            # the crypt module is deprecated since Python 3.11 and removed in 3.13, PHP
+            # hashes the secrets if it is missing
+            warnings.simplefilter("ignore", DeprecationWarning)
+            return importlib.import_module("crypt")
+    except ImportError:
+        return None
+
+
+# PHP statement used to hash the API key secret $value, as done by the OPNsense GUI
+SECRET_HASH_EXPRESSION: str = "crypt($value, '$6$')"
+
+# default cost of PHP password_hash with PASSWORD_BCRYPT
+DEFAULT_BCRYPT_COST: int = 10
+
+BCRYPT_PREFIXES: Tuple[str, ...] = ("$2y$", "$2b$", "$2a$")
+
+# upper bound of the chunks processed concurrently, e.g. of PHP processes started at once
+MAX_WORKERS: int = 8
+
+
+class ChunkFunction(NamedTuple):
+    """
+    A function processing a chunk of values into a list of results.
+
+    Attributes:
+        method (str): How the values are processed, native or php, recorded in the stats.
+        function (Callable[[list], list]): The function processing a chunk.
+        concurrent (bool): Whether chunks are processed concurrently. Functions which
+                           hold the GIL, like crypt, are not concurrent.
+    """
+
+    method: str
+    function: Callable[[list], list]
+    concurrent: bool = True
+
+
+class OPNsensePasswordHashReturnError(Exception):
+    """
+    Exception raised when the batched hashing or verification of passwords fails
+    """
+
+
+def run_php_batch(
+    php_requirements: List[str], command: str, values: list, name: str = "batch"
+) -> list:
+    """
+    Runs a PHP command over a list of values in a single PHP invocation.
+
+    The values are passed base64 encoded as the JSON array $values, the command must
+    assign the JSON serializable results to the array $results.
+
+    Args:
+        php_requirements (List[str]): PHP files to require before executing the command.
+        command (str): The PHP statements processing $values into $results.
+        values (list): The JSON serializable values to process.
+        name (str): The name the invocation is recorded by in the timings.
+
+    Returns:
+        list: The decoded $results array.
+
+    Raises:
+        OPNsensePasswordHashReturnError: If the PHP invocation fails or returns an
+        unexpected number of results.
+    """
+
+    encoded_values: str = base64.b64encode(json.dumps(values).encode("utf-8")).decode(
+        "ascii"
+    )
+
+    batch_result = opnsense_utils.run_command(
+        php_requirements=php_requirements,
+        command=(
+            f"$values = json_decode(base64_decode('{encoded_values}'), true); "
+            f"$results = []; {command} echo json_encode($results);"
+        ),
+        name=name,
+    )
+
+    if batch_result.get("stderr") or batch_result.get("rc"):
+        raise OPNsensePasswordHashReturnError(
+            f"error encounterd while processing password batch {batch_result.get('stderr')}"
+        )
+
+    try:
+        results: list = json.loads(batch_result.get("stdout"))
+    except ValueError as value_error:
+        raise OPNsensePasswordHashReturnError(
+            f"invalid output of password batch: {batch_result.get('stdout')}"
+        ) from value_error
+
+    if not isinstance(results, list) or len(results) != len(values):
+        raise OPNsensePasswordHashReturnError(
+            f"password batch returned {len(results)} results for {len(values)} values"
+        )
+
+    return results
+
+
+class SecretHasher:
+    """
+    Hashes and verifies batches of passwords and API key secrets.
+
+    Passwords are hashed with bcrypt, API key secrets with SHA-512 crypt ('$6$'), just like
+    OPNsense does. Depending on the backend, the hashes are computed in-process or by PHP:
+
+        - auto: in-process if the bcrypt or crypt Python module is available, PHP otherwise
+        - native: in-process only, fails if the Python module is missing
+        - php: PHP only
+
+    Every processed chunk is recorded in stats with its operation, method, size and duration.
+
+    Attributes:
+        backend (str): The hashing backend, one of auto, native or php.
+        workers (int): Number of chunks processed concurrently, one per CPU core by
+                       default and at most MAX_WORKERS.
+        stats (List[dict]): Timing statistics of the processed chunks.
+    """
+
+    BACKENDS = ("auto", "native", "php")
+
+    def __init__(self, backend: str = "auto", workers: Optional[int] = None):
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                f"Unsupported hashing backend '{backend}', use one of {self.BACKENDS}"
+            )
+
+        self.backend = backend
+        self.workers = max(1, min(workers or os.cpu_count() or 1, MAX_WORKERS))
+        self.stats: List[dict] = []
+
+    def _use_native(self, module) -> bool:
+        if self.backend == "php":
+            return False
+
+        if module is None:
+            if self.backend == "native":
+                raise OPNsensePasswordHashReturnError(
+                    "in-process hashing requested, but the required Python module is missing"
+                )
+            return False
+
+        return True
+
+    def verifies_natively(self, hashes: List[str]) -> bool:
+        """
+        Returns True if all the given hashes can be verified in-process, without PHP.
+        """
+
+        if self.backend == "php":
+            return False
+
+        return all(
+            isinstance(hashed, str)
+            and (
+                (bcrypt is not None and hashed.startswith(BCRYPT_PREFIXES))
+                or (hashed.startswith("$6$") and _crypt() is not None)
+            )
+            for hashed in hashes
+        )
+
+    def _process(
+        self, operation: str, chunk_function: ChunkFunction, values: list
+    ) -> list:
+        """
+        Processes the values in chunks, one chunk per worker, and records the timing of
+        every chunk.
+
+        The values of functions which are not concurrent are processed in a single chunk,
+        threads would only add overhead.
+        """
+
+        if not values:
+            return []
+
+        chunk_size: int = math.ceil(
+            len(values) / (self.workers if chunk_function.concurrent else 1)
+        )
+        chunks: List[list] = [
+            values[index : index + chunk_size]
+            for index in range(0, len(values), chunk_size)
+        ]
+
+        def process_chunk(chunk: list) -> Tuple[list, float]:
+            start: float = time.perf_counter()
+            return chunk_function.function(chunk), time.perf_counter() - start
+
+        with timing_utils.phase(operation):
+            if len(chunks) == 1:
+                chunk_results = [process_chunk(chunks[0])]
+            else:
+                # PHP chunks run in their own processes and bcrypt releases the GIL, so
+                # threads are enough to use all cores
+                with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                    chunk_results = list(executor.map(process_chunk, chunks))
+
+        results: list = []
+        for batch, (chunk, (chunk_result, duration)) in enumerate(
+            zip(chunks, chunk_results)
+        ):
+            self.stats.append(
+                {
+                    "operation": operation,
+                    "method": chunk_function.method,
+                    "batch": batch,
+                    "size": len(chunk),
+                    "duration": round(duration, 6),
+                }
+            )
+            results.extend(chunk_result)
+
+        return results
+
+    def hash_passwords(
+        self,
+        passwords: List[str],
+        php_requirements: List[str],
+        hash_expression: str,
+    ) -> List[str]:
+        """
+        Hashes a list of plain passwords.
+
+        Args:
+            passwords (List[str]): The plain passwords to hash.
+            php_requirements (List[str]): PHP files required by hash_expression.
+            hash_expression (str): PHP expression hashing the password $value,
+                                   e.g. "password_hash($value,PASSWORD_BCRYPT)".
+
+        Returns:
+            List[str]: The hashed passwords, in the order of the given passwords.
+
+        Raises:
+            OPNsensePasswordHashReturnError: If the passwords could not be hashed.
+        """
+
+        if "PASSWORD_BCRYPT" in hash_expression and self._use_native(bcrypt):
+            cost_match = re.search(r"'cost'\s*=>\s*(\d+)", hash_expression)
+            cost: int = int(cost_match.group(1)) if cost_match else DEFAULT_BCRYPT_COST
+
+            def native_hash(chunk: List[str]) -> List[str]:
+                # $2b$ and $2y$ hashes are identical, PHP creates the latter
+                return [
+                    "$2y$"
+                    + bcrypt.hashpw(
+                        password.encode("utf-8"), bcrypt.gensalt(rounds=cost)
+                    ).decode("ascii")[4:]
+                    for password in chunk
+                ]
+
+            return self._process(
+                "password_hash", ChunkFunction("native", native_hash), passwords
+            )
+
+        def php_hash(chunk: List[str]) -> List[str]:
+            return run_php_batch(
+                php_requirements=php_requirements,
+                command=f"foreach ($values as $value) {{ $results[] = {hash_expression}; }}",
+                values=chunk,
+                name="password_hash",
+            )
+
+        return self._process("password_hash", ChunkFunction("php", php_hash), passwords)
+
+    def verify_passwords(self, pairs: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Verifies a list of (hashed password, plain password) pairs.
+
+        bcrypt password hashes and SHA-512 crypt API key secrets are verified in-process if
+        the required Python module is available, see verifies_natively.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The existing hashes and the plain passwords to
+            verify against them.
+
+        Returns:
+            List[bool]: True for every pair whose plain password matches the hash.
+
+        Raises:
+            OPNsensePasswordHashReturnError: If the passwords could not be verified.
+        """
+
+        if self.verifies_natively([hashed for hashed, _plain in pairs]):
+
+            def native_verify(chunk: List[list]) -> List[bool]:
+                return [
+                    (
+                        hmac.compare_digest(_crypt().crypt(plain, hashed), hashed)
+                        if hashed.startswith("$6$")
+                        else bcrypt.checkpw(
+                            plain.encode("utf-8"), ("$2b$" + hashed[4:]).encode("ascii")
+                        )
+                    )
+                    for hashed, plain in chunk
+                ]
+
+            return self._process(
+                "password_verify",
+                ChunkFunction(
+                    "native",
+                    native_verify,
+                    # only bcrypt releases the GIL
+                    concurrent=any(
+                        not hashed.startswith("$6$") for hashed, _plain in pairs
+                    ),
+                ),
+                [list(p) for p in pairs],
+            )
+
+        if self.backend == "native":
+            raise OPNsensePasswordHashReturnError(
+                "in-process verification requested, but the required Python module is missing"
+            )
+
+        def php_verify(chunk: List[list]) -> List[bool]:
+            return run_php_batch(
+                php_requirements=[],
+                command=(
+                    "foreach ($values as $value) "
+                    "{ $results[] = password_verify($value[1], $value[0]); }"
+                ),
+                values=chunk,
+                name="password_verify",
+            )
+
+        return self._process(
+            "password_verify",
+            ChunkFunction("php", php_verify),
+            [list(pair) for pair in pairs],
+        )
+
+    def hash_secrets(self, secrets: List[str]) -> List[str]:
+        """
+        Hashes a list of API key secrets with SHA-512 crypt.
+
+        Args:
+            secrets (List[str]): The plain secrets to hash.
+
+        Returns:
+            List[str]: The hashed secrets, in the order of the given secrets.
+
+        Raises:
+            OPNsensePasswordHashReturnError: If the secrets could not be hashed.
+        """
+
+        if self._use_native(_crypt()):
+
+            def native_hash(chunk: List[str]) -> List[str]:
+                return [_crypt().crypt(secret, "$6$") for secret in chunk]
+
+            # crypt holds the GIL
+            hashed_secrets: List[str] = self._process(
+                "secret_hash",
+                ChunkFunction("native", native_hash, concurrent=False),
+                secrets,
+            )
+        else:
+
+            def php_hash(chunk: List[str]) -> List[str]:
+                return run_php_batch(
+                    php_requirements=[],
+                    command=(
+                        "foreach ($values as $value) "
+                        f"{{ $results[] = {SECRET_HASH_EXPRESSION}; }}"
+                    ),
+                    values=chunk,
+                    name="secret_hash",
+                )
+
+            hashed_secrets = self._process(
+                "secret_hash", ChunkFunction("php", php_hash), secrets
+            )
+
+        for hashed_secret in hashed_secrets:
+            if not (
+                isinstance(hashed_secret, str)
+                and hashed_secret.startswith("$6$")
+                and len(hashed_secret) >= 90
+            ):
+                raise OPNsensePasswordHashReturnError(
+                    "validation of the secret failed! "
+                    "Secret must start with $6$ and have a min length of 90"
+                )
+
+        return hashed_secrets
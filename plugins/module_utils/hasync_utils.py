@@ -0,0 +1,428 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Utilities to synchronize the configuration of an OPNsense HA pair.
+
+OPNsense synchronizes the configuration of a HA pair by pushing whole config sections
+to the peer over XMLRPC (opnsense.restore_config_section). The peer, the credentials and
+the sections to synchronize are configured in the hasync settings managed by the
+system_high_availability_settings module. The HASyncClient in this module pushes only the
+sections whose content changed since the last successful push, detected by a digest of
+every section subtree, and reuses a single keep-alive connection for all sections.
+"""
+
+import hashlib
+import json
+import ssl
+import time
+import urllib.parse
+import xmlrpc.client
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    file_utils,
+    xml_utils,
+)
+
+HASYNC_STATE_FILE: str = "/conf/.ansible_hasync_state.json"
+
+# hasync elements starting with 'synchronize' which do not enable a service
+HASYNC_NON_SERVICE_ELEMENTS: Tuple[str, ...] = ("synchronizetoip",)
+
+# the key of the attributes of an element in the PHP config array
+ATTRIBUTES_KEY: str = "@attributes"
+
+RECONFIGURE_METHOD: str = "opnsense.filter_configure"
+
+
+class OPNsenseHASyncError(Exception):
+    """
+    Exception raised when the configuration can not be synchronized to the HA peer.
+    """
+
+
+def section_path(section: str) -> str:
+    """
+    Converts an OPNsense sync section name (e.g. OPNsense.Firewall.Alias) to its path
+    in config.xml (e.g. OPNsense/Firewall/Alias).
+    """
+
+    return section.strip().replace(".", "/")
+
+
+def section_digest(element: Optional[Element]) -> Optional[str]:
+    """
+    Returns the SHA-256 digest of the canonical XML of a config section.
+
+    Args:
+        element (Optional[Element]): The root element of the section.
+
+    Returns:
+        Optional[str]: The hex digest, None if the section does not exist.
+    """
+
+    if element is None:
+        return None
+
+    canonical_xml: str = ElementTree.canonicalize(
+        xml_utils.serialize_xml(element).decode("utf-8"), strip_text=True
+    )
+    return hashlib.sha256(canonical_xml.encode("utf-8")).hexdigest()
+
+
+def element_to_xmlrpc(element: Element):
+    """
+    Converts a config element to the structure of the PHP config array, as expected
+    by opnsense.restore_config_section.
+
+    Elements without children are converted to their text (empty string if unset),
+    children with the same tag are combined to a list. The attributes of an element, e.g.
+    the uuid of the items of MVC models, are stored under the key @attributes, like
+    OPNsense's Config::toArray does, so that the peer restores them. An element with
+    text keeps its text only, the PHP config array has no place for both.
+    """
+
+    children: List[Element] = list(element)
+    if not children and (element.text or not element.attrib):
+        return element.text or ""
+
+    result: dict = {}
+    if element.attrib:
+        result[ATTRIBUTES_KEY] = dict(element.attrib)
+    for child in children:
+        value = element_to_xmlrpc(child)
+        if child.tag in result:
+            if not isinstance(result[child.tag], list):
+                result[child.tag] = [result[child.tag]]
+            result[child.tag].append(value)
+        else:
+            result[child.tag] = value
+
+    return result
+
+
+def get_sync_services(hasync: Element) -> List[str]:
+    """
+    Returns the ids of the services enabled for synchronization in the hasync settings.
+
+    Since OPNsense 24.7 the services are stored comma separated in hasync/syncitems,
+    older versions store an element synchronize<service id> per enabled service.
+    """
+
+    syncitems: Optional[Element] = hasync.find("syncitems")
+    if syncitems is not None:
+        return [item for item in (syncitems.text or "").split(",") if item]
+
+    return [
+        child.tag[len("synchronize") :]
+        for child in hasync
+        if child.tag.startswith("synchronize")
+        and child.tag not in HASYNC_NON_SERVICE_ELEMENTS
+        and child.text == "on"
+    ]
+
+
+def peer_url(synchronize_to: str) -> str:
+    """
+    Returns the XMLRPC URL of the HA peer from the hasync/synchronizetoip setting,
+    which is either an IP address or an URL.
+    """
+
+    if "://" not in synchronize_to:
+        synchronize_to = f"https://{synchronize_to}"
+
+    parsed_url = urllib.parse.urlsplit(synchronize_to)
+    path: str = parsed_url.path if parsed_url.path not in ("", "/") else "/xmlrpc.php"
+
+    return urllib.parse.urlunsplit((parsed_url.scheme, parsed_url.netloc, path, "", ""))
+
+
+class HASyncState:
+    """
+    Stores the digests of the sections last pushed to every HA peer in a JSON file.
+
+    Attributes:
+        path (str): Path of the JSON state file.
+    """
+
+    def __init__(self, path: str = HASYNC_STATE_FILE):
+        self.path = path
+        self._state: Dict[str, Dict[str, str]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def digests(self, peer: str) -> Dict[str, str]:
+        """Returns the section digests last pushed to the given peer."""
+        return dict(self._state.get(peer, {}))
+
+    def update(self, peer: str, digests: Dict[str, str]) -> None:
+        """Records the digests of sections successfully pushed to the given peer."""
+        self._state.setdefault(peer, {}).update(digests)
+
+    def save(self) -> None:
+        """Writes the state file atomically."""
+        file_utils.atomic_write(
+            self.path,
+            json.dumps(self._state, indent=2, sort_keys=True).encode("utf-8"),
+            mode=0o600,
+        )
+
+
+class _MeteredTransportMixin:
+    """
+    Records the size of every XMLRPC request body sent over the (reused) connection.
+    """
+
+    last_request_bytes: int = 0
+    connections: int = 0
+    timeout: Optional[float] = None
+
+    def make_connection(self, host):
+        """Returns the connection to the host, counting the newly opened ones."""
+        if self._connection[1] is None or self._connection[0] != host:
+            self.connections += 1
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+    def send_content(self, connection, request_body):
+        """Sends the request body, recording its size."""
+        self.last_request_bytes = len(request_body)
+        return super().send_content(connection, request_body)
+
+
+class _MeteredTransport(_MeteredTransportMixin, xmlrpc.client.Transport):
+    pass
+
+
+class _MeteredSafeTransport(_MeteredTransportMixin, xmlrpc.client.SafeTransport):
+    pass
+
+
+class HASyncClient:
+    """
+    Pushes config sections to the XMLRPC endpoint of an OPNsense HA peer.
+
+    All requests share one keep-alive connection. Every pushed section is reported with
+    its size in bytes and the duration of the request. The requests are authenticated
+    with auth, the username and the password of the peer, if it is given.
+
+    Attributes:
+        url (str): The XMLRPC URL of the peer.
+        timeout (int): Timeout of a single request in seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        auth: Optional[Tuple[Optional[str], Optional[str]]] = None,
+        timeout: int = 30,
+        validate_certs: bool = True,
+    ):
+        self.url = url
+        self.timeout = timeout
+
+        parsed_url = urllib.parse.urlsplit(url)
+        netloc: str = parsed_url.netloc
+        username, password = auth or (None, None)
+        if username:
+            credentials: str = urllib.parse.quote(username, safe="")
+            if password:
+                credentials += ":" + urllib.parse.quote(password, safe="")
+            netloc = f"{credentials}@{netloc}"
+
+        if parsed_url.scheme == "https":
+            context: ssl.SSLContext = ssl.create_default_context()
+            if not validate_certs:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._transport = _MeteredSafeTransport(context=context)
+        else:
+            self._transport = _MeteredTransport()
+        self._transport.timeout = timeout
+
+        self._proxy = xmlrpc.client.ServerProxy(
+            urllib.parse.urlunsplit(
+                (parsed_url.scheme, netloc, parsed_url.path, "", "")
+            ),
+            transport=self._transport,
+        )
+
+    @property
+    def connections(self) -> int:
+        """Number of connections opened to the peer."""
+        return self._transport.connections
+
+    def _call(self, method: str, *params) -> Tuple[object, int, float]:
+        start: float = time.perf_counter()
+        try:
+            response = getattr(self._proxy, method)(*params)
+        except (xmlrpc.client.Error, OSError) as error:
+            raise OPNsenseHASyncError(
+                f"XMLRPC call {method} to {self.url} failed: {error}"
+            ) from error
+
+        return (
+            response,
+            self._transport.last_request_bytes,
+            time.perf_counter() - start,
+        )
+
+    def push_section(self, section: str, element: Element) -> dict:
+        """
+        Pushes a single config section to the peer.
+
+        Args:
+            section (str): The section name, e.g. aliases or OPNsense.Firewall.Alias.
+            element (Element): The root element of the section.
+
+        Returns:
+            dict: The section with the number of bytes sent and the duration.
+
+        Raises:
+            OPNsenseHASyncError: If the peer rejects the section or is not reachable.
+        """
+
+        _response, sent_bytes, duration = self._call(
+            "opnsense.restore_config_section",
+            {section: element_to_xmlrpc(element)},
+        )
+
+        return {
+            "section": section,
+            "bytes": sent_bytes,
+            "duration": round(duration, 6),
+        }
+
+    def reconfigure(self, method: str = RECONFIGURE_METHOD) -> dict:
+        """
+        Calls a method without parameters on the peer, e.g. to apply the pushed sections.
+        """
+
+        _response, sent_bytes, duration = self._call(method)
+
+        return {"method": method, "bytes": sent_bytes, "duration": round(duration, 6)}
+
+    def close(self) -> None:
+        """Closes the connection to the peer."""
+        self._transport.close()
+
+    def __enter__(self) -> "HASyncClient":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def plan_sync(
+    config: Element, sections: List[str], digests: Dict[str, str]
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Determines which sections changed since the last push.
+
+    Args:
+        config (Element): The root element of config.xml.
+        sections (List[str]): The sections to synchronize.
+        digests (Dict[str, str]): The digests of the sections last pushed.
+
+    Returns:
+        Tuple[Dict[str, str], List[str]]: The digests of the changed sections and the
+        unchanged sections. Sections which do not exist in the config are ignored.
+    """
+
+    changed: Dict[str, str] = {}
+    unchanged: List[str] = []
+
+    for section in dict.fromkeys(sections):
+        digest: Optional[str] = section_digest(config.find(section_path(section)))
+        if digest is None:
+            continue
+        if digests.get(section) == digest:
+            unchanged.append(section)
+        else:
+            changed[section] = digest
+
+    return changed, unchanged
+
+
+class SyncOptions(NamedTuple):
+    """
+    The options of a synchronization.
+
+    Attributes:
+        force (bool): Push all sections, regardless of their digest.
+        check_mode (bool): Only determine the changed sections.
+        reconfigure (Optional[str]): The method called on the peer to apply the pushed
+                                     sections, None to not apply them.
+    """
+
+    force: bool = False
+    check_mode: bool = False
+    reconfigure: Optional[str] = RECONFIGURE_METHOD
+
+
+def synchronize(
+    config: Element,
+    sections: List[str],
+    client: HASyncClient,
+    state: HASyncState,
+    options: SyncOptions = SyncOptions(),
+) -> dict:
+    """
+    Pushes the changed sections of the configuration to the HA peer and applies them.
+
+    The digests of the pushed sections are only recorded in the state once all sections
+    were pushed and applied on the peer, so that a failed push or reconfigure is retried
+    by the next run.
+
+    Args:
+        config (Element): The root element of config.xml.
+        sections (List[str]): The sections to synchronize.
+        client (HASyncClient): The client connected to the peer.
+        state (HASyncState): The digests of the sections last pushed.
+        options (SyncOptions): The options of the synchronization.
+
+    Returns:
+        dict: The synchronized (with bytes and duration) and the unchanged sections, and
+        the reconfigure call if sections were pushed and applied.
+
+    Raises:
+        OPNsenseHASyncError: If a section can not be pushed or applied.
+    """
+
+    changed, unchanged = plan_sync(
+        config, sections, {} if options.force else state.digests(client.url)
+    )
+
+    result: dict = {
+        "synchronized_sections": [],
+        "unchanged_sections": unchanged,
+    }
+
+    if options.check_mode:
+        result["synchronized_sections"] = [{"section": section} for section in changed]
+        return result
+
+    for section in changed:
+        result["synchronized_sections"].append(
+            client.push_section(section, config.find(section_path(section)))
+        )
+
+    if not changed:
+        return result
+
+    if options.reconfigure is not None:
+        result["reconfigure_output"] = client.reconfigure(options.reconfigure)
+
+    state.update(client.url, changed)
+    state.save()
+
+    return result
@@ -5,15 +5,20 @@
 interfaces_assignments_utils module_utils: Module_utils to configure OPNsense interface settings
 """
 
+import os
+import re
+import socket
 from dataclasses import dataclass, asdict, field
-from typing import List, Optional, Dict, Any
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple
 
 
-from xml.etree.ElementTree import Element, ElementTree, SubElement
+from xml.etree.ElementTree import Element
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import (
-    xml_utils,
+    introspection_utils,
     opnsense_utils,
+    xml_utils,
 )
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
     OPNsenseModuleConfig,
@@ -38,6 +43,110 @@ class OPNSenseGetInterfacesError(Exception):
     """
 
 
+# kernel interfaces which can't be assigned, unless configured as virtual device
+IGNORED_KERNEL_INTERFACES: re.Pattern = re.compile(
+    r"^(lo|enc|pflog|pfsync|plip|ipfw|usbus)\d+$"
+)
+
+# virtual devices defined in config.xml as (xpath of the definitions, device name element)
+VIRTUAL_DEVICE_ELEMENTS: List[Tuple[str, str]] = [
+    ("vlans/vlan", "vlanif"),
+    ("laggs/lagg", "laggif"),
+    ("bridges/bridged", "bridgeif"),
+    ("gifs/gif", "gifif"),
+    ("gres/gre", "greif"),
+    ("ppps/ppp", "if"),
+    ("wireless/clone", "cloneif"),
+]
+
+# virtual devices defined in config.xml as (xpath of the definitions, id element, name prefix)
+VIRTUAL_DEVICE_IDS: List[Tuple[str, str, str]] = [
+    ("openvpn/openvpn-server", "vpnid", "ovpns"),
+    ("openvpn/openvpn-client", "vpnid", "ovpnc"),
+    ("OPNsense/Interfaces/vxlans/vxlan", "deviceId", "vxlan"),
+    ("OPNsense/Interfaces/loopbacks/loopback", "deviceId", "lo"),
+    ("OPNsense/wireguard/server/servers/server", "instance", "wg"),
+    ("OPNsense/Swanctl/VTIs/VTI", "reqid", "ipsec"),
+]
+
+DEVICE_ENUMERATION_MODES: Tuple[str, ...] = ("native", "php", "verify")
+
+
+@lru_cache(maxsize=None)
+def get_kernel_interfaces() -> Tuple[str, ...]:
+    """
+    Returns the assignable network interfaces known to the kernel.
+
+    The list is read once per run using if_nameindex(3), loopback, pflog, pfsync and other
+    system interfaces are skipped.
+    """
+
+    try:
+        kernel_interfaces = socket.if_nameindex()
+    except (AttributeError, OSError):
+        return ()
+
+    return tuple(
+        name
+        for _index, name in kernel_interfaces
+        if not IGNORED_KERNEL_INTERFACES.match(name)
+    )
+
+
+def get_configured_virtual_devices(config: Element) -> List[str]:
+    """
+    Returns the names of the virtual devices (vlans, laggs, bridges, tunnels, ...) defined
+    in the given configuration, in the way OPNsense's plugins_devices() names them.
+
+    Args:
+        config (Element): The root element of config.xml.
+
+    Returns:
+        List[str]: The names of the configured virtual devices.
+    """
+
+    devices: List[str] = []
+
+    for xpath, name_element in VIRTUAL_DEVICE_ELEMENTS:
+        for definition in config.findall(xpath):
+            name: Optional[str] = definition.findtext(name_element)
+            if name:
+                devices.append(name.strip())
+
+    for xpath, id_element, prefix in VIRTUAL_DEVICE_IDS:
+        for definition in config.findall(xpath):
+            device_id: Optional[str] = definition.findtext(id_element)
+            if device_id and device_id.strip():
+                devices.append(f"{prefix}{device_id.strip()}")
+
+    for instance in config.findall("OPNsense/OpenVPN/Instances/Instance"):
+        vpnid: Optional[str] = instance.findtext("vpnid")
+        if vpnid:
+            role: str = "ovpns" if instance.findtext("role") == "server" else "ovpnc"
+            devices.append(f"{role}{vpnid.strip()}")
+
+    return devices
+
+
+def enumerate_devices_native(config: Element) -> List[str]:
+    """
+    Enumerates the assignable devices without PHP, from the kernel interface list and the
+    virtual devices defined in the given configuration.
+
+    Args:
+        config (Element): The root element of config.xml.
+
+    Returns:
+        List[str]: The unique device names, kernel interfaces first.
+    """
+
+    return list(
+        dict.fromkeys(
+            list(get_kernel_interfaces()) + get_configured_virtual_devices(config)
+        )
+    )
+
+
 @dataclass
 class InterfaceAssignment:
     """
@@ -122,11 +231,15 @@ class InterfaceAssignment:
         exceptions = ["dhcphostname", "mtu", "subnet", "gateway", "media", "mediaopt"]
 
         # Create the main element
-        main_element = Element(interface_assignment_dict["identifier"])
+        main_element = xml_utils.new_element(interface_assignment_dict["identifier"])
 
         # Special handling for 'device' and 'descr'
-        SubElement(main_element, "if").text = interface_assignment_dict.get("device")
-        SubElement(main_element, "descr").text = interface_assignment_dict.get("descr")
+        xml_utils.sub_element(main_element, "if").text = interface_assignment_dict.get(
+            "device"
+        )
+        xml_utils.sub_element(main_element, "descr").text = (
+            interface_assignment_dict.get("descr")
+        )
 
         # handle special cases
         if getattr(self, "alias-subnet", None):
@@ -182,10 +295,10 @@ class InterfaceAssignment:
                 ]
                 and value is None
             ):
-                sub_element = SubElement(main_element, key)
+                sub_element = xml_utils.sub_element(main_element, key)
             if value is None and key not in exceptions:
                 continue
-            sub_element = SubElement(main_element, key)
+            sub_element = xml_utils.sub_element(main_element, key)
             if value is True:
                 sub_element.text = "1"
             elif value is not None:
@@ -239,6 +352,8 @@ class InterfacesSet(OPNsenseModuleConfig):
         changed() -> bool: Checks if current assignments differ from the loaded ones.
         update(InterfaceAssignment: InterfaceAssignment): Updates an assignment,
         errors if not found.
+        reconcile(interface_assignments: List[InterfaceAssignment]): Applies a list of
+        assignments in a single pass, errors on conflicts before modifying anything.
         find(**kwargs) -> Optional[InterfaceAssignment]: Finds an assignment matching
         specified attributes.
         save() -> bool: Saves changes to the config file if there are modifications.
@@ -246,14 +361,30 @@ class InterfacesSet(OPNsenseModuleConfig):
 
     _interfaces_assignments: List[InterfaceAssignment]
 
-    def __init__(self, path: str = "/conf/config.xml"):
+    def __init__(
+        self,
+        path: str = "/conf/config.xml",
+        device_enumeration: str = "php",
+        check_mode: bool = False,
+    ):
+        # validated before the config file is locked
+        if device_enumeration not in DEVICE_ENUMERATION_MODES:
+            raise ValueError(
+                f"Unsupported device enumeration '{device_enumeration}', "
+                f"use one of {DEVICE_ENUMERATION_MODES}"
+            )
+
         super().__init__(
             module_name="interfaces_assignments",
             config_context_names=["interfaces_assignments"],
             path=path,
+            check_mode=check_mode,
         )
 
-        self._config_xml_tree = self._load_config()
+        self._device_enumeration = device_enumeration
+        self._devices: Optional[List[str]] = None
+        self.device_enumeration_mismatch: Optional[Dict[str, List[str]]] = None
+
         self._interfaces_assignments = self._load_interfaces()
 
     def _load_interfaces(self) -> List["InterfaceAssignment"]:
@@ -286,16 +417,21 @@ class InterfacesSet(OPNsenseModuleConfig):
 
         return bool(str(self._interfaces_assignments) != str(self._load_interfaces()))
 
-    def get_interfaces(self) -> List[InterfaceAssignment]:
+    def get_interfaces(self) -> List[str]:
         """
-        Retrieves a list of interface assignments from an OPNSense device via a PHP function.
+        Retrieves the list of devices which can be assigned on the OPNsense device.
 
-        The function queries the device using specified PHP requirements and config functions.
-        It processes the stdout, extracts interface data, and handles errors.
+        Depending on the device enumeration mode of the set, the devices are enumerated
+        natively (kernel interfaces and virtual devices from the configuration), with PHP
+        or with both (verify). In verify mode the PHP result is used and the differences
+        to the native enumeration are stored in device_enumeration_mismatch. The result is
+        cached for the lifetime of the set. Offline, the kernel interfaces of the instance
+        are not available and the devices of the fetched introspection are used. In check
+        mode, the devices are enumerated natively unless an introspection file is given,
+        which is recorded in the approximations.
 
         Returns:
-            list[InterfaceAssignment]: A list of interface assignments parsed
-                                       from the PHP function's output.
+            list[str]: A list of the assignable device names.
 
         Raises:
             OPNSenseGetInterfacesError: If an error occurs during the retrieval
@@ -303,41 +439,71 @@ class InterfacesSet(OPNsenseModuleConfig):
                                         or if no interfaces are found.
         """
 
-        # load requirements
-        php_requirements = self._config_maps["interfaces_assignments"][
-            "php_requirements"
-        ]
-        php_command = """
-                    /* get physical network interfaces */
-                    foreach (get_interface_list() as $key => $item) {
-                        echo $key.',';
-                    }
-                    /* get virtual network interfaces */
-                    foreach (plugins_devices() as $item){
-                        foreach ($item["names"] as $key => $if ) {
-                            echo $key.',';
-                        }
-                    }
-                    """
-
-        # run php function
-        result = opnsense_utils.run_command(
-            php_requirements=php_requirements,
-            command=php_command,
+        if self._devices is not None:
+            return list(self._devices)
+
+        device_enumeration: str = (
+            "php" if opnsense_utils.offline() else self._device_enumeration
         )
+        if (
+            self._check_mode
+            and device_enumeration != "native"
+            and not opnsense_utils.offline()
+            and not os.environ.get(introspection_utils.INTROSPECTION_FILE_ENV)
+        ):
+            self._approximate(
+                "assignable devices enumerated natively instead of with PHP"
+            )
+            device_enumeration = "native"
+
+        if device_enumeration == "native":
+            devices: List[str] = enumerate_devices_native(self._config_xml_tree)
+
+            if len(devices) < 1:
+                raise OPNSenseGetInterfacesError(
+                    "error encounterd while getting interfaces, less than one interface available"
+                )
+        else:
+            devices = self._get_interfaces_php()
+
+            if device_enumeration == "verify":
+                native_devices: List[str] = enumerate_devices_native(
+                    self._config_xml_tree
+                )
+                self.device_enumeration_mismatch = {
+                    "missing_in_native": sorted(set(devices) - set(native_devices)),
+                    "missing_in_php": sorted(set(native_devices) - set(devices)),
+                }
+
+        self._devices = devices
 
-        # check for stderr
-        if result.get("stderr"):
+        return list(devices)
+
+    def _get_interfaces_php(self) -> List[str]:
+        """
+        Retrieves the list of assignable devices from an OPNSense device via PHP.
+
+        The devices (get_interface_list() and plugins_devices()) are taken from the
+        memoized introspection of the instance, which is shared with other modules
+        of the same run.
+
+        Returns:
+            list[str]: A list of device names returned by the PHP functions.
+
+        Raises:
+            OPNSenseGetInterfacesError: If an error occurs during the retrieval
+                                        or parsing process,
+                                        or if no interfaces are found.
+        """
+
+        try:
+            interface_list: List[str] = introspection_utils.get_introspection()[
+                "devices"
+            ]
+        except introspection_utils.OPNsenseIntrospectionError as error:
             raise OPNSenseGetInterfacesError(
                 "error encounterd while getting interfaces"
-            )
-
-        # parse list
-        interface_list: list[str] = [
-            item.strip()
-            for item in result.get("stdout").split(",")
-            if item.strip() and item.strip() != "None"
-        ]
+            ) from error
 
         # check parsed list length
         if len(interface_list) < 1:
@@ -345,7 +511,7 @@ class InterfacesSet(OPNsenseModuleConfig):
                 "error encounterd while getting interfaces, less than one interface available"
             )
 
-        return interface_list
+        return list(interface_list)
 
     def update(self, interface_assignment: InterfaceAssignment) -> None:
         """
@@ -422,6 +588,95 @@ class InterfacesSet(OPNsenseModuleConfig):
                 "This device is already assigned, please unassign this device first"
             )
 
+    def reconcile(self, interface_assignments: List[InterfaceAssignment]) -> None:
+        """
+        Applies a list of desired interface assignments in a single pass.
+
+        The devices are enumerated once and the whole desired assignment table is
+        validated up front using device to identifier and identifier to device maps,
+        before any assignment is modified. Devices may be moved between identifiers
+        (including swaps of two devices), as long as no device ends up assigned to more
+        than one identifier. Identifiers which are not part of the list are left unchanged.
+
+        Args:
+            interface_assignments (List[InterfaceAssignment]): The desired assignments.
+
+        Raises:
+            OPNSenseDeviceNotFoundError: If a device of the list is not found.
+            OPNSenseDeviceAlreadyAssignedError: If the list contains an identifier or
+                                                device more than once, or if a device
+                                                would be assigned to multiple identifiers.
+        """
+
+        desired_by_identifier: Dict[str, InterfaceAssignment] = {}
+        desired_by_device: Dict[str, str] = {}
+
+        for interface_assignment in interface_assignments:
+            if interface_assignment.identifier in desired_by_identifier:
+                raise OPNSenseDeviceAlreadyAssignedError(
+                    f"Identifier {interface_assignment.identifier} is listed more than once"
+                )
+            if interface_assignment.device in desired_by_device:
+                raise OPNSenseDeviceAlreadyAssignedError(
+                    f"Device {interface_assignment.device} is assigned to "
+                    f"{desired_by_device[interface_assignment.device]} and "
+                    f"{interface_assignment.identifier}"
+                )
+            desired_by_identifier[interface_assignment.identifier] = (
+                interface_assignment
+            )
+            desired_by_device[interface_assignment.device] = (
+                interface_assignment.identifier
+            )
+
+        device_interfaces_set: set = set(self.get_interfaces())
+        missing_devices: List[str] = [
+            device
+            for device in desired_by_device
+            if device not in device_interfaces_set
+        ]
+        if missing_devices:
+            raise OPNSenseDeviceNotFoundError(
+                f"Device was not found on OPNsense Instance: {', '.join(missing_devices)}"
+            )
+
+        current_by_identifier: Dict[str, InterfaceAssignment] = {
+            assignment.identifier: assignment
+            for assignment in self._interfaces_assignments
+        }
+
+        # devices kept by identifiers which are not part of the desired list
+        for assignment in self._interfaces_assignments:
+            if assignment.identifier in desired_by_identifier:
+                continue
+            owner: Optional[str] = desired_by_device.get(assignment.device)
+            if owner is not None:
+                raise OPNSenseDeviceAlreadyAssignedError(
+                    f"Device {assignment.device} is already assigned to "
+                    f"{assignment.identifier}, please unassign this device first"
+                )
+
+        for identifier, interface_assignment in desired_by_identifier.items():
+            interface_to_update: Optional[InterfaceAssignment] = (
+                current_by_identifier.get(identifier)
+            )
+
+            if interface_to_update is None:
+                self._interfaces_assignments.append(
+                    InterfaceAssignment(
+                        identifier=interface_assignment.identifier,
+                        device=interface_assignment.device,
+                        descr=interface_assignment.descr,
+                    )
+                )
+                continue
+
+            # Merge extra_attrs
+            interface_assignment.extra_attrs.update(interface_to_update.extra_attrs)
+
+            # Update the existing interface
+            interface_to_update.__dict__.update(interface_assignment.__dict__)
+
     def find(self, **kwargs) -> Optional[InterfaceAssignment]:
         """
         Searches for an interface assignment that matches given criteria.
@@ -486,7 +741,6 @@ class InterfacesSet(OPNsenseModuleConfig):
         )
 
         # Write the updated XML tree to the file
-        tree = ElementTree(self._config_xml_tree)
-        tree.write(self._config_path, encoding="utf-8", xml_declaration=True)
+        self._write_config()
 
         return True
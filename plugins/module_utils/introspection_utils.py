@@ -0,0 +1,154 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Utilities to introspect the runtime state of an OPNsense instance through PHP.
+
+Several modules need information which is only available through the OPNsense PHP
+functions, e.g. the configured interfaces, the services which can be synchronized by
+the HA XMLRPC sync or the assignable network devices. Starting PHP and loading the
+OPNsense includes takes much longer than the functions themselves, therefore all of
+these datasets are collected with a single PHP invocation, returned as JSON and
+memoized for the rest of the module run. If OPNSENSE_INTROSPECTION_FILE is set, the
+introspection output is read from that file instead, e.g. when editing a fetched config
+offline.
+"""
+
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import opnsense_utils
+
+INTROSPECTION_FILE_ENV: str = "OPNSENSE_INTROSPECTION_FILE"
+
+INTROSPECTION_PHP_REQUIREMENTS: List[str] = [
+    "/usr/local/etc/inc/config.inc",
+    "/usr/local/etc/inc/util.inc",
+    "/usr/local/etc/inc/interfaces.inc",
+    "/usr/local/etc/inc/plugins.inc",
+]
+
+# https://github.com/opnsense/core/blob/7d212f3e5d9eb2456acf2165987dd850cd78c710/src/etc/inc/util.inc#L822
+# https://github.com/opnsense/core/blob/66c684b2c66d26000129bfb161c6cbafe4175dc8/src/etc/inc/plugins.inc#L355
+INTROSPECTION_PHP_COMMAND: str = """
+    /* get physical and virtual network devices */
+    $devices = array_keys(get_interface_list());
+    foreach (plugins_devices() as $item) {
+        foreach (array_keys($item['names']) as $name) {
+            $devices[] = $name;
+        }
+    }
+    /* get services which can be synchronized */
+    $xmlrpc_sync = [];
+    $xmlrpc_sync_sections = [];
+    foreach (plugins_xmlrpc_sync() as $key => $item) {
+        $xmlrpc_sync[$key] = $item['description'];
+        $xmlrpc_sync_sections[$key] = explode(',', $item['section']);
+    }
+    echo json_encode([
+        'interfaces' => get_configured_interface_with_descr(),
+        'xmlrpc_sync' => $xmlrpc_sync,
+        'xmlrpc_sync_sections' => $xmlrpc_sync_sections,
+        'devices' => $devices,
+    ]);
+"""
+
+
+class OPNsenseIntrospectionError(Exception):
+    """
+    Exception raised when the runtime state of the OPNsense instance can not be retrieved.
+    """
+
+
+@lru_cache(maxsize=None)
+def _run_introspection() -> str:
+    introspection_file: str = os.environ.get(INTROSPECTION_FILE_ENV, "")
+    if introspection_file:
+        try:
+            with open(introspection_file, "r", encoding="utf-8") as snapshot:
+                return snapshot.read()
+        except OSError as os_error:
+            raise OPNsenseIntrospectionError(
+                f"error reading the introspection from {introspection_file}: {os_error}"
+            ) from os_error
+
+    result: dict = opnsense_utils.run_command(
+        php_requirements=INTROSPECTION_PHP_REQUIREMENTS,
+        command=INTROSPECTION_PHP_COMMAND,
+        name="introspection",
+    )
+
+    if result.get("stderr"):
+        raise OPNsenseIntrospectionError(
+            f"error encountered during introspection: {result.get('stderr')}"
+        )
+
+    return result.get("stdout") or ""
+
+
+def get_introspection() -> Dict[str, object]:
+    """
+    Returns the runtime state of the OPNsense instance.
+
+    The PHP introspection is run once per module run, subsequent calls return the
+    memoized result. Use reset_introspection() to force a new introspection, e.g. after
+    devices have been created.
+
+    Returns:
+        Dict[str, object]: A dict with the keys
+            - interfaces (Dict[str, str]): configured interfaces with their description,
+              as returned by get_configured_interface_with_descr()
+            - xmlrpc_sync (Dict[str, str]): services which can be synchronized with their
+              description, as returned by plugins_xmlrpc_sync()
+            - xmlrpc_sync_sections (Dict[str, List[str]]): the config sections of every
+              service which can be synchronized, e.g. OPNsense.Firewall.Alias
+            - devices (List[str]): assignable physical and virtual network devices
+
+    Raises:
+        OPNsenseIntrospectionError: If PHP fails or returns unexpected output.
+    """
+
+    stdout: str = _run_introspection()
+
+    try:
+        introspection = json.loads(stdout)
+    except ValueError as value_error:
+        raise OPNsenseIntrospectionError(
+            f"invalid output of introspection: {stdout}"
+        ) from value_error
+
+    if not isinstance(introspection, dict):
+        raise OPNsenseIntrospectionError(f"invalid output of introspection: {stdout}")
+
+    # PHP encodes empty associative arrays as lists
+    return {
+        "interfaces": {
+            str(key): str(value)
+            for key, value in (introspection.get("interfaces") or {}).items()
+        },
+        "xmlrpc_sync": {
+            str(key): str(value)
+            for key, value in (introspection.get("xmlrpc_sync") or {}).items()
+        },
+        "xmlrpc_sync_sections": {
+            str(key): [str(section).strip() for section in sections or [] if section]
+            for key, sections in (
+                introspection.get("xmlrpc_sync_sections") or {}
+            ).items()
+        },
+        "devices": [
+            str(device)
+            for device in introspection.get("devices") or []
+            if device is not None and str(device).strip()
+        ],
+    }
+
+
+def reset_introspection() -> None:
+    """
+    Discards the memoized introspection result.
+    """
+
+    _run_introspection.cache_clear()
@@ -0,0 +1,294 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Cooperative locking of the OPNsense config file.
+
+OPNsense serializes changes to /conf/config.xml by an flock on the config file itself,
+exclusive for a read-modify-write cycle. The ConfigLock in this module takes the same
+lock, so that concurrent Ansible runs and changes done in the GUI do not interleave.
+
+Locks are reentrant within a process: flock locks belong to an open file, so a process
+locking the same file through a second file descriptor would wait for itself. All
+ConfigLocks of a path therefore share one file descriptor, which is locked exclusively
+as long as any of them is exclusive and shared otherwise.
+
+Modules release their lock once the config is saved, before they run configure
+functions: those lock the config file themselves, e.g. in write_config, and would wait
+for the module forever. A lock which is no longer referenced is released as well.
+
+The collection replaces the config file atomically, see file_utils.atomic_write, so that
+a crash while writing never leaves a partial config file. The lock of the process then
+moves to the new file, see ConfigLock.relock. A process which waited for the lock of the
+replaced file holds the lock of a file which is no longer the config file, the lock is
+therefore only considered acquired once the locked file is still the file at the path,
+otherwise it is acquired again on the new file.
+"""
+
+import fcntl
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+
+CONFIG_LOCK_TIMEOUT_ENV: str = "OPNSENSE_CONFIG_LOCK_TIMEOUT"
+DEFAULT_LOCK_TIMEOUT: float = 60.0
+LOCK_POLL_INTERVAL: float = 0.05
+
+
+class ConfigLockTimeoutError(Exception):
+    """
+    Exception raised when the config file could not be locked within the timeout.
+    """
+
+
+def lock_timeout() -> float:
+    """
+    Returns the lock timeout in seconds, from OPNSENSE_CONFIG_LOCK_TIMEOUT if set.
+    """
+
+    try:
+        return float(os.environ.get(CONFIG_LOCK_TIMEOUT_ENV, DEFAULT_LOCK_TIMEOUT))
+    except ValueError:
+        return DEFAULT_LOCK_TIMEOUT
+
+
+@dataclass
+class _HeldLock:
+    """
+    The file descriptor of a locked path and the number of shared and exclusive holders
+    in this process.
+    """
+
+    file_descriptor: int
+    shared: int = 0
+    exclusive: int = 0
+    stale_file_descriptors: List[int] = field(default_factory=list)
+
+    @property
+    def operation(self) -> int:
+        """The flock operation of the current holders."""
+        return fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+
+
+_held_locks: Dict[str, _HeldLock] = {}
+
+
+def _is_current_file(file_descriptor: int, path: str) -> bool:
+    try:
+        path_stat: os.stat_result = os.stat(path)
+    except FileNotFoundError:
+        return False
+
+    file_stat: os.stat_result = os.fstat(file_descriptor)
+    return (file_stat.st_dev, file_stat.st_ino) == (path_stat.st_dev, path_stat.st_ino)
+
+
+def _flock(file_descriptor: int, operation: int, deadline: float) -> Optional[int]:
+    """
+    Locks the file descriptor, polling until the deadline.
+
+    Returns:
+        Optional[int]: The number of failed attempts, None if the deadline passed.
+    """
+
+    attempts: int = 0
+    while True:
+        try:
+            fcntl.flock(file_descriptor, operation | fcntl.LOCK_NB)
+            return attempts
+        except BlockingIOError:
+            attempts += 1
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(LOCK_POLL_INTERVAL)
+
+
+class ConfigLock:
+    """
+    A shared or exclusive, reentrant flock on a config file.
+
+    Attributes:
+        path (str): The locked file.
+        exclusive (bool): Exclusive lock for read-modify-write, shared lock for reading.
+        timeout (float): Seconds to wait for the lock at most.
+        wait (float): Seconds waited for the lock, 0 if it was already held by the process.
+        contended (bool): True if the lock was held by another process when requested.
+    """
+
+    def __init__(
+        self, path: str, exclusive: bool = True, timeout: Optional[float] = None
+    ):
+        self.path = os.path.realpath(path)
+        self.exclusive = exclusive
+        self.timeout = lock_timeout() if timeout is None else timeout
+        self.wait: float = 0.0
+        self.contended: bool = False
+        self._acquired: bool = False
+
+    @property
+    def acquired(self) -> bool:
+        """True if the lock is held."""
+        return self._acquired
+
+    def _record(self, operation: int, attempts: int, start: float) -> None:
+        self.wait = time.monotonic() - start
+        self.contended = attempts > 0
+        timing_utils.record(
+            "config_locks",
+            {
+                "path": self.path,
+                "mode": "exclusive" if operation == fcntl.LOCK_EX else "shared",
+                "wait": round(self.wait, 6),
+                "attempts": attempts + 1,
+            },
+        )
+
+    def _lock_new_file(
+        self, operation: int, start: float, deadline: float
+    ) -> _HeldLock:
+        failed_attempts: int = 0
+        while True:
+            file_descriptor: int = os.open(self.path, os.O_RDONLY)
+            attempts: Optional[int] = _flock(file_descriptor, operation, deadline)
+
+            if attempts is not None and _is_current_file(file_descriptor, self.path):
+                self._record(operation, failed_attempts + attempts, start)
+                return _HeldLock(file_descriptor)
+
+            os.close(file_descriptor)
+            if attempts is None:
+                raise ConfigLockTimeoutError(
+                    f"Could not lock {self.path} within {self.timeout} seconds, "
+                    "it is locked by another process"
+                )
+            # the config file was replaced while waiting, lock the new file
+            failed_attempts += attempts + 1
+
+    def acquire(self) -> "ConfigLock":
+        """
+        Acquires the lock, upgrading the lock of the process if needed.
+
+        Raises:
+            ConfigLockTimeoutError: If the lock could not be acquired within the timeout.
+        """
+
+        if self._acquired:
+            return self
+
+        start: float = time.monotonic()
+        deadline: float = start + self.timeout
+
+        with timing_utils.phase("config_lock_wait"):
+            held: Optional[_HeldLock] = _held_locks.get(self.path)
+            if held is None:
+                held = self._lock_new_file(
+                    fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH, start, deadline
+                )
+                _held_locks[self.path] = held
+            elif self.exclusive and not held.exclusive:
+                # upgrade the shared lock of the process
+                attempts: Optional[int] = _flock(
+                    held.file_descriptor, fcntl.LOCK_EX, deadline
+                )
+                if attempts is None:
+                    # a failed upgrade may have released the shared lock
+                    _flock(
+                        held.file_descriptor,
+                        fcntl.LOCK_SH,
+                        time.monotonic() + self.timeout,
+                    )
+                    raise ConfigLockTimeoutError(
+                        f"Could not upgrade the lock of {self.path} within "
+                        f"{self.timeout} seconds, it is locked by another process"
+                    )
+
+                if _is_current_file(held.file_descriptor, self.path):
+                    self._record(fcntl.LOCK_EX, attempts, start)
+                else:
+                    # flock upgrades are not atomic, the file may have been replaced
+                    held.stale_file_descriptors.append(held.file_descriptor)
+                    held.file_descriptor = self._lock_new_file(
+                        fcntl.LOCK_EX, start, deadline
+                    ).file_descriptor
+            else:
+                self.wait = 0.0
+
+        if self.exclusive:
+            held.exclusive += 1
+        else:
+            held.shared += 1
+        self._acquired = True
+
+        return self
+
+    def relock(self) -> None:
+        """
+        Moves the lock of the process to the file at the path, after the locked file was
+        replaced, e.g. by file_utils.atomic_write. The replaced file is unlocked.
+
+        Raises:
+            ConfigLockTimeoutError: If the new file could not be locked within the timeout.
+        """
+
+        if not self._acquired:
+            return
+
+        held: _HeldLock = _held_locks[self.path]
+        if _is_current_file(held.file_descriptor, self.path):
+            return
+
+        start: float = time.monotonic()
+        with timing_utils.phase("config_lock_wait"):
+            file_descriptor: int = self._lock_new_file(
+                held.operation, start, start + self.timeout
+            ).file_descriptor
+
+        for stale_file_descriptor in held.stale_file_descriptors + [
+            held.file_descriptor
+        ]:
+            os.close(stale_file_descriptor)
+        held.stale_file_descriptors = []
+        held.file_descriptor = file_descriptor
+
+    def release(self) -> None:
+        """
+        Releases the lock. The file is unlocked once no lock of the process holds it.
+        """
+
+        if not self._acquired:
+            return
+        self._acquired = False
+
+        held: _HeldLock = _held_locks[self.path]
+        if self.exclusive:
+            held.exclusive -= 1
+        else:
+            held.shared -= 1
+
+        if held.exclusive or held.shared:
+            if not held.exclusive:
+                # downgrade to the shared lock of the remaining holders
+                fcntl.flock(held.file_descriptor, fcntl.LOCK_SH)
+            return
+
+        del _held_locks[self.path]
+        for file_descriptor in held.stale_file_descriptors + [held.file_descriptor]:
+            os.close(file_descriptor)
+
+    def __enter__(self) -> "ConfigLock":
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __del__(self):
+        # e.g. the lock of a set which was not used as a context manager
+        if getattr(self, "_acquired", False):
+            try:
+                self.release()
+            except (KeyError, OSError, TypeError):
+                # the module globals may already be gone at interpreter shutdown
+                pass
@@ -24,778 +24,385 @@ For example, the 'system_settings_general' module for "OPNsense 22.7 (amd64/Open
 - Configure functions: A dictionary mapping function names to their details. Each function
   detail includes the function name and any parameters required to execute the function.
 
+VERSION_MAP is resolved from SERIES, in which every OPNsense series after the first inherits
+the configurations of the previous series and only declares what changed:
+- A module configuration declared by a series replaces the settings, PHP requirements and
+  configure functions it names in the inherited configuration, a value of None removes them.
+- A module configuration of None removes the module from the series.
+
+A new series is added by declaring its differences to the previous series in SERIES.
+VERSION_MAP is only resolved when it is first accessed.
+
 This map is essential for dynamically configuring modules based on the OPNsense version and
 provides a centralized definition for various configurations across different OPNsense versions.
 """
+
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+CONFIG_MAP_META_KEYS: List[str] = ["php_requirements", "configure_functions"]
+
+
+class Series(NamedTuple):
+    """
+    The declaration of the module configurations of an OPNsense series.
+
+    Attributes:
+        inherits (Optional[str]): The series whose module configurations are inherited.
+        contexts (dict): The module configurations, or their changes to the inherited ones.
+    """
+
+    inherits: Optional[str]
+    contexts: dict
+
+
 # pylint: disable=duplicate-code; Since this is rewritten in some tests.
-VERSION_MAP = {
-    "22.7": {
-        "system_settings_general": {
-            "hostname": "system/hostname",
-            "domain": "system/domain",
-            "timezone": "system/timezone",
-            # Add other mappings here.
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "system_timezone_configure": {
-                    "name": "system_timezone_configure",
-                    "configure_params": ["true"],
-                },
-                "system_trust_configure": {
-                    "name": "system_trust_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hostname_configure": {
-                    "name": "system_hostname_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hosts_generate": {
-                    "name": "system_hosts_generate",
-                    "configure_params": ["true"],
-                },
-                "system_resolvconf_generate": {
-                    "name": "system_resolvconf_generate",
-                    "configure_params": ["true"],
-                },
-                "plugins_configure_dns": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dns'", "true"],
-                },
-                "plugins_configure_dhcp": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dhcp'", "true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": ["true"],
-                },
-            },
-        },
-        "system_settings_logging": {
-            "preserve_logs": "syslog/preservelogs",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_settings_logging": {
-                    "name": "system_syslog_start",
-                    "configure_params": ["true"],
-                },
-            },
-        },
-        "system_access_users": {
-            "users": "system/user",
-            "uid": "system/nextuid",
-            "gid": "system/nextgid",
-            "system": "system",
-            "maximumtableentries": "system/maximumtableentries",
-            "php_requirements": [
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {},
-        },
-        "password": {
-            "php_requirements": [
-                "/usr/local/etc/inc/auth.inc",
-            ],
-            "configure_functions": {
-                "password": {
-                    "name": "echo password_hash",
-                    "configure_params": [
-                        "'password'",
-                        "PASSWORD_BCRYPT",
-                        "[ 'cost' => 11 ]",
-                    ],
-                },
-            },
-        },
-        "firewall_rules": {
-            "rules": "filter",
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "system_cron_configure": {
-                    "name": "system_cron_configure",
-                    "configure_params": ["true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
-            },
-        },
-        "interfaces_assignments": {
-            "interfaces": "interfaces",
-            # Add other mappings here.
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/rrd.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
-            },
-        },
-        "system_high_availability_settings": {
-            # Add other mappings here
-            "hasync": "hasync",
-            "synchronize_states": "hasync/pfsyncenabled",
-            "synchronize_interface": "hasync/pfsyncinterface",
-            "synchronize_peer_ip": "hasync/pfsyncpeerip",
-            "synchronize_config_to_ip": "hasync/synchronizetoip",
-            "remote_system_username": "hasync/username",
-            "remote_system_password": "hasync/password",
-            "disable_preempt": "hasync/disablepreempt",
-            "disconnect_dialup_interfaces": "hasync/disconnectppps",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/plugins.inc",
-            ],
-            "configure_functions": {},
-        },
-        "firewall_alias": {
-            "alias": "OPNsense/Firewall/Alias/aliases",
-            "geoip": "OPNsense/Firewall/Alias/geoip",
-            "php_requirements": [],
-            "configure_functions": {},
-        },
-    },
-    "23.1": {
-        "system_settings_general": {
-            "hostname": "system/hostname",
-            "domain": "system/domain",
-            "timezone": "system/timezone",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "system_timezone_configure": {
-                    "name": "system_timezone_configure",
-                    "configure_params": ["true"],
-                },
-                "system_trust_configure": {
-                    "name": "system_trust_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hostname_configure": {
-                    "name": "system_hostname_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hosts_generate": {
-                    "name": "system_hosts_generate",
-                    "configure_params": ["true"],
-                },
-                "system_resolvconf_generate": {
-                    "name": "system_resolvconf_generate",
-                    "configure_params": ["true"],
-                },
-                "plugins_configure_dns": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dns'", "true"],
-                },
-                "plugins_configure_dhcp": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dhcp'", "true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": ["true"],
-                },
-            },
-        },
-        "system_settings_logging": {
-            "preserve_logs": "syslog/preservelogs",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_settings_logging": {
-                    "name": "system_syslog_start",
-                    "configure_params": ["true"],
+SERIES: Dict[str, Series] = {
+    "22.7": Series(
+        inherits=None,
+        contexts={
+            "system_settings_general": {
+                "hostname": "system/hostname",
+                "domain": "system/domain",
+                "timezone": "system/timezone",
+                # Add other mappings here.
+                "php_requirements": [
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/filter.inc",
+                    "/usr/local/etc/inc/system.inc",
+                    "/usr/local/etc/inc/interfaces.inc",
+                ],
+                "configure_functions": {
+                    "system_timezone_configure": {
+                        "name": "system_timezone_configure",
+                        "configure_params": ["true"],
+                    },
+                    "system_trust_configure": {
+                        "name": "system_trust_configure",
+                        "configure_params": ["true"],
+                    },
+                    "system_hostname_configure": {
+                        "name": "system_hostname_configure",
+                        "configure_params": ["true"],
+                    },
+                    "system_hosts_generate": {
+                        "name": "system_hosts_generate",
+                        "configure_params": ["true"],
+                    },
+                    "system_resolvconf_generate": {
+                        "name": "system_resolvconf_generate",
+                        "configure_params": ["true"],
+                    },
+                    "plugins_configure_dns": {
+                        "name": "plugins_configure",
+                        "configure_params": ["'dns'", "true"],
+                    },
+                    "plugins_configure_dhcp": {
+                        "name": "plugins_configure",
+                        "configure_params": ["'dhcp'", "true"],
+                    },
+                    "filter_configure": {
+                        "name": "filter_configure",
+                        "configure_params": ["true"],
+                    },
                 },
             },
-        },
-        "system_access_users": {
-            "users": "system/user",
-            "uid": "system/nextuid",
-            "gid": "system/nextgid",
-            "system": "system",
-            "maximumtableentries": "system/maximumtableentries",
-            "php_requirements": [
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {},
-        },
-        "password": {
-            "php_requirements": [
-                "/usr/local/etc/inc/auth.inc",
-            ],
-            "configure_functions": {
-                "password": {
-                    "name": "echo password_hash",
-                    "configure_params": [
-                        "'password'",
-                        "PASSWORD_BCRYPT",
-                        "[ 'cost' => 11 ]",
-                    ],
+            "system_settings_logging": {
+                "preserve_logs": "syslog/preservelogs",
+                # Add other mappings here
+                "php_requirements": [
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/system.inc",
+                ],
+                "configure_functions": {
+                    "system_settings_logging": {
+                        "name": "system_syslog_start",
+                        "configure_params": ["true"],
+                    },
                 },
             },
-        },
-        "firewall_rules": {
-            "rules": "filter",
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",  # required for the service_log utility
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_cron_configure": {
-                    "name": "system_cron_configure",
-                    "configure_params": ["true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
-            },
-        },
-        "interfaces_assignments": {
-            "interfaces": "interfaces",
-            # Add other mappings here.
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/rrd.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
-            },
-        },
-        "system_high_availability_settings": {
-            # Add other mappings here
-            "hasync": "hasync",
-            "synchronize_states": "hasync/pfsyncenabled",
-            "synchronize_interface": "hasync/pfsyncinterface",
-            "synchronize_peer_ip": "hasync/pfsyncpeerip",
-            "synchronize_config_to_ip": "hasync/synchronizetoip",
-            "remote_system_username": "hasync/username",
-            "remote_system_password": "hasync/password",
-            "disable_preempt": "hasync/disablepreempt",
-            "disconnect_dialup_interfaces": "hasync/disconnectppps",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/plugins.inc",
-            ],
-            "configure_functions": {},
-        },
-        "firewall_alias": {
-            "alias": "OPNsense/Firewall/Alias/aliases",
-            "geoip": "OPNsense/Firewall/Alias/geoip",
-            "php_requirements": [],
-            "configure_functions": {},
-        },
-    },
-    "23.7": {
-        "system_settings_general": {
-            "hostname": "system/hostname",
-            "domain": "system/domain",
-            "timezone": "system/timezone",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "system_timezone_configure": {
-                    "name": "system_timezone_configure",
-                    "configure_params": ["true"],
-                },
-                "system_trust_configure": {
-                    "name": "system_trust_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hostname_configure": {
-                    "name": "system_hostname_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hosts_generate": {
-                    "name": "system_hosts_generate",
-                    "configure_params": ["true"],
-                },
-                "system_resolvconf_generate": {
-                    "name": "system_resolvconf_generate",
-                    "configure_params": ["true"],
-                },
-                "plugins_configure_dns": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dns'", "true"],
-                },
-                "plugins_configure_dhcp": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dhcp'", "true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": ["true"],
-                },
-            },
-        },
-        "system_settings_logging": {
-            "preserve_logs": "syslog/preservelogs",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_settings_logging": {
-                    "name": "system_syslog_start",
-                    "configure_params": ["true"],
-                }
-            },
-        },
-        "system_access_users": {
-            "users": "system/user",
-            "uid": "system/nextuid",
-            "gid": "system/nextgid",
-            "system": "system",
-            "maximumtableentries": "system/maximumtableentries",
-            "php_requirements": [
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {},
-        },
-        "password": {
-            "php_requirements": [
-                "/usr/local/etc/inc/auth.inc",
-            ],
-            "configure_functions": {
-                "password": {
-                    "name": "echo password_hash",
-                    "configure_params": [
-                        "'password'",
-                        "PASSWORD_BCRYPT",
-                        "[ 'cost' => 11 ]",
-                    ],
-                },
+            "system_access_users": {
+                "users": "system/user",
+                "uid": "system/nextuid",
+                "gid": "system/nextgid",
+                "system": "system",
+                "maximumtableentries": "system/maximumtableentries",
+                "php_requirements": [
+                    "/usr/local/etc/inc/system.inc",
+                ],
+                "configure_functions": {},
             },
-        },
-        "firewall_rules": {
-            "rules": "filter",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_cron_configure": {
-                    "name": "system_cron_configure",
-                    "configure_params": ["true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
+            "password": {
+                "php_requirements": [
+                    "/usr/local/etc/inc/auth.inc",
+                ],
+                "configure_functions": {
+                    "password": {
+                        "name": "echo password_hash",
+                        "configure_params": [
+                            "'password'",
+                            "PASSWORD_BCRYPT",
+                            "[ 'cost' => 11 ]",
+                        ],
+                    },
                 },
             },
-        },
-        "interfaces_assignments": {
-            "interfaces": "interfaces",
-            # Add other mappings here.
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/rrd.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
+            "firewall_rules": {
+                "rules": "filter",
+                "php_requirements": [
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/filter.inc",
+                    "/usr/local/etc/inc/system.inc",
+                    "/usr/local/etc/inc/interfaces.inc",
+                ],
+                "configure_functions": {
+                    "system_cron_configure": {
+                        "name": "system_cron_configure",
+                        "configure_params": ["true"],
+                    },
+                    "filter_configure": {
+                        "name": "filter_configure",
+                        "configure_params": [],
+                    },
                 },
             },
-        },
-        "system_high_availability_settings": {
-            # Add other mappings here
-            "hasync": "hasync",
-            "synchronize_states": "hasync/pfsyncenabled",
-            "synchronize_interface": "hasync/pfsyncinterface",
-            "synchronize_peer_ip": "hasync/pfsyncpeerip",
-            "synchronize_config_to_ip": "hasync/synchronizetoip",
-            "remote_system_username": "hasync/username",
-            "remote_system_password": "hasync/password",
-            "disable_preempt": "hasync/disablepreempt",
-            "disconnect_dialup_interfaces": "hasync/disconnectppps",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/plugins.inc",
-            ],
-            "configure_functions": {},
-        },
-        "firewall_alias": {
-            "alias": "OPNsense/Firewall/Alias/aliases",
-            "geoip": "OPNsense/Firewall/Alias/geoip",
-            "php_requirements": [],
-            "configure_functions": {},
-        },
-    },
-    "24.1": {
-        "system_settings_general": {
-            "hostname": "system/hostname",
-            "domain": "system/domain",
-            "timezone": "system/timezone",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "system_timezone_configure": {
-                    "name": "system_timezone_configure",
-                    "configure_params": ["true"],
-                },
-                "system_trust_configure": {
-                    "name": "system_trust_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hostname_configure": {
-                    "name": "system_hostname_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hosts_generate": {
-                    "name": "system_hosts_generate",
-                    "configure_params": ["true"],
-                },
-                "system_resolvconf_generate": {
-                    "name": "system_resolvconf_generate",
-                    "configure_params": ["true"],
-                },
-                "plugins_configure_dns": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dns'", "true"],
-                },
-                "plugins_configure_dhcp": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dhcp'", "true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": ["true"],
+            "interfaces_assignments": {
+                "interfaces": "interfaces",
+                # Add other mappings here.
+                "php_requirements": [
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/filter.inc",
+                    "/usr/local/etc/inc/system.inc",
+                    "/usr/local/etc/inc/rrd.inc",
+                    "/usr/local/etc/inc/interfaces.inc",
+                ],
+                "configure_functions": {
+                    "filter_configure": {
+                        "name": "filter_configure",
+                        "configure_params": [],
+                    },
                 },
             },
-        },
-        "system_settings_logging": {
-            "preserve_logs": "syslog/preservelogs",
-            "max_log_file_size_mb": "syslog/maxfilesize",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_settings_logging": {
-                    "name": "system_syslog_start",
-                    "configure_params": ["true"],
-                }
+            "system_high_availability_settings": {
+                # Add other mappings here
+                "hasync": "hasync",
+                "synchronize_states": "hasync/pfsyncenabled",
+                "synchronize_interface": "hasync/pfsyncinterface",
+                "synchronize_peer_ip": "hasync/pfsyncpeerip",
+                "synchronize_config_to_ip": "hasync/synchronizetoip",
+                "remote_system_username": "hasync/username",
+                "remote_system_password": "hasync/password",
+                "disable_preempt": "hasync/disablepreempt",
+                "disconnect_dialup_interfaces": "hasync/disconnectppps",
+                "php_requirements": [
+                    "/usr/local/etc/inc/interfaces.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/plugins.inc",
+                ],
+                "configure_functions": {},
             },
-        },
-        "system_access_users": {
-            "users": "system/user",
-            "uid": "system/nextuid",
-            "gid": "system/nextgid",
-            "system": "system",
-            "maximumtableentries": "system/maximumtableentries",
-            "php_requirements": [
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {},
-        },
-        "password": {
-            "php_requirements": [
-                "/usr/local/etc/inc/auth.inc",
-            ],
-            "configure_functions": {
-                "password": {
-                    "name": "echo password_hash",
-                    "configure_params": [
-                        "'password'",
-                        "PASSWORD_BCRYPT",
-                        "[ 'cost' => 11 ]",
-                    ],
-                },
+            "firewall_alias": {
+                "alias": "OPNsense/Firewall/Alias/aliases",
+                "geoip": "OPNsense/Firewall/Alias/geoip",
+                "php_requirements": [],
+                "configure_functions": {},
             },
         },
-        "firewall_rules": {
-            "rules": "filter",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/filter.inc",
-            ],
-            "configure_functions": {
-                "system_cron_configure": {
-                    "name": "system_cron_configure",
-                    "configure_params": ["true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
+    ),
+    "23.1": Series(
+        inherits="22.7",
+        contexts={
+            "firewall_rules": {
+                "php_requirements": [
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",  # required for the service_log utility
+                    "/usr/local/etc/inc/interfaces.inc",
+                    "/usr/local/etc/inc/filter.inc",
+                    "/usr/local/etc/inc/system.inc",
+                ],
             },
         },
-        "interfaces_assignments": {
-            "interfaces": "interfaces",
-            # Add other mappings here.
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/rrd.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
+    ),
+    "23.7": Series(
+        inherits="23.1",
+        contexts={
+            "firewall_rules": {
+                "php_requirements": [
+                    "/usr/local/etc/inc/interfaces.inc",
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/filter.inc",
+                    "/usr/local/etc/inc/system.inc",
+                ],
             },
         },
-        "system_high_availability_settings": {
-            # Add other mappings here
-            "hasync": "hasync",
-            "synchronize_states": "hasync/pfsyncenabled",
-            "synchronize_interface": "hasync/pfsyncinterface",
-            "synchronize_peer_ip": "hasync/pfsyncpeerip",
-            "synchronize_config_to_ip": "hasync/synchronizetoip",
-            "remote_system_username": "hasync/username",
-            "remote_system_password": "hasync/password",
-            "disable_preempt": "hasync/disablepreempt",
-            "disconnect_dialup_interfaces": "hasync/disconnectppps",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/plugins.inc",
-            ],
-            "configure_functions": {},
-        },
-        "firewall_alias": {
-            "alias": "OPNsense/Firewall/Alias/aliases",
-            "geoip": "OPNsense/Firewall/Alias/geoip",
-            "php_requirements": [],
-            "configure_functions": {},
-        },
-    },
-    "24.7": {
-        "system_settings_general": {
-            "hostname": "system/hostname",
-            "domain": "system/domain",
-            "timezone": "system/timezone",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "system_timezone_configure": {
-                    "name": "system_timezone_configure",
-                    "configure_params": ["true"],
-                },
-                "system_trust_configure": {
-                    "name": "system_trust_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hostname_configure": {
-                    "name": "system_hostname_configure",
-                    "configure_params": ["true"],
-                },
-                "system_hosts_generate": {
-                    "name": "system_hosts_generate",
-                    "configure_params": ["true"],
-                },
-                "system_resolvconf_generate": {
-                    "name": "system_resolvconf_generate",
-                    "configure_params": ["true"],
-                },
-                "plugins_configure_dns": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dns'", "true"],
-                },
-                "plugins_configure_dhcp": {
-                    "name": "plugins_configure",
-                    "configure_params": ["'dhcp'", "true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": ["true"],
-                },
-            },
-        },
-        "system_settings_logging": {
-            "preserve_logs": ".//Syslog/general/maxpreserve",
-            "max_log_file_size_mb": ".//Syslog/general/maxfilesize",
-            # Add other mappings here
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {
-                "system_settings_logging": {
-                    "name": "system_syslog_start",
-                    "configure_params": ["true"],
-                }
+    ),
+    "24.1": Series(
+        inherits="23.7",
+        contexts={
+            "system_settings_logging": {
+                "max_log_file_size_mb": "syslog/maxfilesize",
             },
-        },
-        "system_access_users": {
-            "users": "system/user",
-            "uid": "system/nextuid",
-            "gid": "system/nextgid",
-            "system": "system",
-            "maximumtableentries": "system/maximumtableentries",
-            "php_requirements": [
-                "/usr/local/etc/inc/system.inc",
-            ],
-            "configure_functions": {},
-        },
-        "password": {
-            "php_requirements": [
-                "/usr/local/etc/inc/auth.inc",
-            ],
-            "configure_functions": {
-                "password": {
-                    "name": "echo password_hash",
-                    "configure_params": [
-                        "'password'",
-                        "PASSWORD_BCRYPT",
-                        "[ 'cost' => 11 ]",
-                    ],
-                },
+            "firewall_rules": {
+                "php_requirements": [
+                    "/usr/local/etc/inc/interfaces.inc",
+                    "/usr/local/etc/inc/config.inc",
+                    "/usr/local/etc/inc/util.inc",
+                    "/usr/local/etc/inc/system.inc",
+                    "/usr/local/etc/inc/filter.inc",
+                ],
             },
         },
-        "firewall_rules": {
-            "rules": "filter",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/filter.inc",
-            ],
-            "configure_functions": {
-                "system_cron_configure": {
-                    "name": "system_cron_configure",
-                    "configure_params": ["true"],
-                },
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
+    ),
+    "24.7": Series(
+        inherits="24.1",
+        contexts={
+            "system_settings_logging": {
+                # the syslog settings moved to the Syslog model
+                "preserve_logs": ".//Syslog/general/maxpreserve",
+                "max_log_file_size_mb": ".//Syslog/general/maxfilesize",
             },
-        },
-        "interfaces_assignments": {
-            "interfaces": "interfaces",
-            # Add other mappings here.
-            "php_requirements": [
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/filter.inc",
-                "/usr/local/etc/inc/system.inc",
-                "/usr/local/etc/inc/rrd.inc",
-                "/usr/local/etc/inc/interfaces.inc",
-            ],
-            "configure_functions": {
-                "filter_configure": {
-                    "name": "filter_configure",
-                    "configure_params": [],
-                },
+            "system_high_availability_settings": {
+                "sync_compatibility": "hasync/pfsyncversion",
+                "sync_services": "hasync/syncitems",
             },
         },
-        "system_high_availability_settings": {
-            # Add other mappings here
-            "hasync": "hasync",
-            "synchronize_states": "hasync/pfsyncenabled",
-            "synchronize_interface": "hasync/pfsyncinterface",
-            "synchronize_peer_ip": "hasync/pfsyncpeerip",
-            "synchronize_config_to_ip": "hasync/synchronizetoip",
-            "remote_system_username": "hasync/username",
-            "sync_compatibility": "hasync/pfsyncversion",
-            "remote_system_password": "hasync/password",
-            "disable_preempt": "hasync/disablepreempt",
-            "disconnect_dialup_interfaces": "hasync/disconnectppps",
-            "sync_services": "hasync/syncitems",
-            "php_requirements": [
-                "/usr/local/etc/inc/interfaces.inc",
-                "/usr/local/etc/inc/util.inc",
-                "/usr/local/etc/inc/config.inc",
-                "/usr/local/etc/inc/plugins.inc",
-            ],
-            "configure_functions": {},
-        },
-        "firewall_alias": {
-            "alias": "OPNsense/Firewall/Alias/aliases",
-            "geoip": "OPNsense/Firewall/Alias/geoip",
-            "php_requirements": [],
-            "configure_functions": {},
-        },
-    },
+    ),
 }
+
+
+def _freeze(value: Any) -> Any:
+    # dicts and lists are frozen recursively, e.g. the configure functions and their params
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def resolve_version_map(series: Dict[str, Series]) -> Dict[str, Mapping[str, Mapping]]:
+    """
+    Resolves the declarations of the OPNsense series into flattened module configurations
+    per series.
+
+    Every series is resolved once, in the order of the declarations, and serves as the
+    base of the series inheriting from it. The resolved series and module configurations
+    are read-only, including their values: dicts are resolved to read-only mappings and
+    lists to tuples.
+
+    Args:
+        series (Dict[str, Series]): The declarations of the series, every series declared
+                                    after the series it inherits from.
+
+    Returns:
+        Dict[str, Mapping[str, Mapping]]: The module configurations per series.
+
+    Raises:
+        ValueError: If a series inherits from a series which is not declared before it.
+    """
+
+    version_map: Dict[str, Mapping[str, Mapping]] = {}
+    for version, declaration in series.items():
+        contexts: Dict[str, Mapping] = {}
+        if declaration.inherits is not None:
+            if declaration.inherits not in version_map:
+                raise ValueError(
+                    f"OPNsense series '{version}' inherits from '{declaration.inherits}', "
+                    "which is not declared before it"
+                )
+            contexts.update(version_map[declaration.inherits])
+
+        for context_name, changes in declaration.contexts.items():
+            if changes is None:
+                contexts.pop(context_name, None)
+                continue
+
+            config_map: dict = dict(contexts.get(context_name, {}))
+            for key, value in changes.items():
+                if value is None:
+                    config_map.pop(key, None)
+                else:
+                    config_map[key] = _freeze(value)
+            contexts[context_name] = MappingProxyType(config_map)
+
+        version_map[version] = MappingProxyType(contexts)
+
+    return version_map
+
+
+def validate_version_map(version_map: Mapping[str, Mapping[str, Mapping]]) -> List[str]:
+    """
+    Validates the settings, PHP requirements and configure functions of all module
+    configurations of a version map.
+
+    Args:
+        version_map (Mapping[str, Mapping[str, Mapping]]): The module configurations per
+                                                         series.
+
+    Returns:
+        List[str]: The problems found, empty if the version map is valid.
+    """
+
+    problems: List[str] = []
+    for version, contexts in version_map.items():
+        for context_name, config_map in contexts.items():
+            where: str = f"{version}/{context_name}"
+
+            for setting_name, xpath in config_map.items():
+                if setting_name not in CONFIG_MAP_META_KEYS and (
+                    not isinstance(xpath, str) or not xpath
+                ):
+                    problems.append(f"{where}: setting '{setting_name}' has no XPath")
+
+            php_requirements = config_map.get("php_requirements")
+            if not isinstance(php_requirements, (list, tuple)):
+                problems.append(f"{where}: php_requirements is not a list")
+            else:
+                problems.extend(
+                    f"{where}: PHP requirement {requirement!r} is not an absolute path"
+                    for requirement in php_requirements
+                    if not isinstance(requirement, str)
+                    or not requirement.startswith("/")
+                )
+
+            configure_functions = config_map.get("configure_functions")
+            if not isinstance(configure_functions, Mapping):
+                problems.append(f"{where}: configure_functions is not a dict")
+                continue
+
+            for function_key, function in configure_functions.items():
+                if not isinstance(function, Mapping) or not isinstance(
+                    function.get("name"), str
+                ):
+                    problems.append(
+                        f"{where}: configure function '{function_key}' has no name"
+                    )
+                elif not isinstance(
+                    function.get("configure_params"), (list, tuple)
+                ) or not all(
+                    isinstance(param, str) for param in function["configure_params"]
+                ):
+                    problems.append(
+                        f"{where}: configure_params of configure function "
+                        f"'{function_key}' are not a list of strings"
+                    )
+
+    return problems
+
+
+@lru_cache(maxsize=None)
+def _version_map() -> Dict[str, Mapping[str, Mapping]]:
+    return resolve_version_map(SERIES)
+
+
+def __getattr__(name: str):
+    # VERSION_MAP is resolved on first access, always to the same dict
+    if name == "VERSION_MAP":
+        return _version_map()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -7,26 +7,54 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
+import os
 from typing import List
-import subprocess
 
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    executor_utils,
+    timing_utils,
+)
 
-def _run_php_command(php_cmd: str) -> dict:
+# set when modules run on a fetched config away from the instance, where PHP is unavailable
+OFFLINE_ENV: str = "OPNSENSE_OFFLINE"
+
+
+def offline() -> bool:
+    """
+    Returns True if modules run offline, on a config fetched from the instance.
+    """
+
+    return os.environ.get(OFFLINE_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+def _run_php_command(php_cmd: str, name: str) -> dict:
     """
     Helper method to execute a PHP command and capture the output.
 
     Args:
         php_cmd (str): The complete PHP command to execute.
+        name (str): The name the invocation is recorded by in the timings, the command
+                    is not recorded since it may contain secrets.
 
     Returns:
         dict: A dictionary containing stdout, stderr, and return code details.
+        Offline, PHP is not run and a failed result is returned.
+
+    The command is run by the executor selected by OPNSENSE_EXECUTOR, see executor_utils.
     """
-    cmd_result = subprocess.run(
-        ["php", "-r", php_cmd],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        check=False,  # do not raise exception if program fails
-    )
+    if offline():
+        stderr: str = "PHP is not available in an offline session"
+        return {
+            "stdout": "",
+            "stdout_lines": [],
+            "stderr": stderr,
+            "stderr_lines": [stderr],
+            "rc": 1,
+        }
+
+    with timing_utils.php_invocation(name) as invocation:
+        cmd_result = executor_utils.get_executor().run(["php", "-r", php_cmd])
+        invocation["rc"] = cmd_result.returncode
 
     return {
         "stdout": cmd_result.stdout.decode().strip(),
@@ -62,16 +90,20 @@ def run_function(
     # assemble php command
     php_cmd = f"{requirements_string} {configure_function}({params_string});"
 
-    return _run_php_command(php_cmd)
+    return _run_php_command(php_cmd, configure_function)
 
 
-def run_command(php_requirements: List[str], command: str) -> dict:
+def run_command(
+    php_requirements: List[str], command: str, name: str = "command"
+) -> dict:
     """
     Executes a PHP command with specified requirements, capturing the output.
 
     Args:
         php_requirements (List[str]): PHP files to require before executing the command.
         command (str): The PHP command to execute.
+        name (str): The name the invocation is recorded by in the timings, e.g. the PHP
+                    function it runs.
 
     Returns:
         dict: A dictionary containing stdout, stderr, and return code details.
@@ -80,4 +112,4 @@ def run_command(php_requirements: List[str], command: str) -> dict:
     requirements_string = " ".join([f"require '{req}';" for req in php_requirements])
     php_cmd = f"{requirements_string} {command}"
 
-    return _run_php_command(php_cmd)
+    return _run_php_command(php_cmd, name)
@@ -0,0 +1,325 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Snapshots of the objects converted from config.xml, to skip the conversion on later runs.
+
+If the environment variable OPNSENSE_SNAPSHOTS is set, the sets of this collection (e.g.
+FirewallRuleSet) store the objects they converted from config.xml in a snapshot, keyed by
+the set, the digest of config.xml and the code of the collection converting it. A later
+run against a config.xml with the same digest loads the objects from the snapshot instead
+of converting the XML again. Any change of config.xml or of the code invalidates the
+snapshots.
+
+The snapshots are pickled. Since loading a pickle can run arbitrary code, they are only
+read from a directory owned by the current user which nobody else can write to, and every
+snapshot is authenticated with a random key kept in that directory. The directory keeps
+the most recently used snapshots only.
+"""
+
+import hashlib
+import hmac
+import importlib
+import importlib.util
+import os
+import pkgutil
+import secrets
+import stat
+import sys
+from typing import Any, Callable, List, Optional, Tuple
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    file_utils,
+    timing_utils,
+)
+
+SNAPSHOTS_ENV: str = "OPNSENSE_SNAPSHOTS"
+SNAPSHOT_DIR_NAME: str = ".ansible_snapshots"
+SNAPSHOT_KEY_FILE: str = ".key"
+SNAPSHOT_SUFFIX: str = ".pickle"
+
+# the number of snapshots kept, the least recently used ones are removed
+MAX_SNAPSHOTS: int = 8
+
+# changing the format of the snapshots invalidates all stored snapshots
+SNAPSHOT_FORMAT: int = 1
+
+
+def snapshots_enabled() -> bool:
+    """
+    Returns True if snapshots should be used to skip the conversion of config.xml.
+    """
+
+    return os.environ.get(SNAPSHOTS_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+COLLECTION_PACKAGE: str = "ansible_collections.puzzle.opnsense.plugins."
+
+
+def _source_digest(loaders: List[Tuple[str, Any]]) -> Optional[str]:
+    code_hash = hashlib.sha256()
+    for module_name, loader in loaders:
+        try:
+            source: Optional[str] = loader.get_source(module_name)
+        except (AttributeError, ImportError, OSError):
+            return None
+        if source is None:
+            return None
+        code_hash.update(f"{module_name}\0{source}\0".encode("utf-8"))
+
+    return code_hash.hexdigest()
+
+
+def code_digest(module_names: List[str]) -> Optional[str]:
+    """
+    Returns the digest of the source code of the given, imported modules.
+
+    The modules of this collection are not installed as a package on the firewall, so
+    the code converting the snapshotted objects identifies the version of the collection.
+
+    Returns:
+        Optional[str]: The digest, None if the source of a module is not available.
+    """
+
+    return _source_digest(
+        [
+            (module_name, getattr(sys.modules.get(module_name), "__loader__", None))
+            for module_name in module_names
+        ]
+    )
+
+
+def _find_loader(module_name: str) -> Any:
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+
+    return getattr(spec, "loader", None)
+
+
+def collection_code_digest(module_name: str) -> Optional[str]:
+    """
+    Returns the digest of the source code of the given module of this collection and of
+    all module_utils shipped with it.
+
+    The modules are listed explicitly and looked up without importing them, so the
+    digest does not depend on which module_utils happen to be imported (some are only
+    imported lazily) when it is computed.
+
+    Args:
+        module_name (str): The name of the module, e.g. firewall_rules.
+
+    Returns:
+        Optional[str]: The digest, None if the source of a module is not available.
+    """
+
+    # this module is part of module_utils, so the package is always imported
+    module_utils = importlib.import_module(f"{COLLECTION_PACKAGE}module_utils")
+
+    # the packages, e.g. module_utils, contain no code
+    module_names: List[str] = [f"{COLLECTION_PACKAGE}modules.{module_name}"] + sorted(
+        f"{module_utils.__name__}.{module_info.name}"
+        for module_info in pkgutil.iter_modules(module_utils.__path__)
+        if not module_info.ispkg
+    )
+
+    return _source_digest(
+        [(module_name, _find_loader(module_name)) for module_name in module_names]
+    )
+
+
+class SnapshotCache:
+    """
+    The snapshots of the objects converted from a config file.
+
+    Attributes:
+        path (str): The snapshot directory, next to the config file by default.
+        max_snapshots (int): The number of snapshots kept.
+        read_only (bool): Whether snapshots are only loaded and never stored, e.g. in
+                          check mode.
+    """
+
+    def __init__(
+        self,
+        config_path: str,
+        path: Optional[str] = None,
+        max_snapshots: int = MAX_SNAPSHOTS,
+        read_only: bool = False,
+    ):
+        self.path = path or os.path.join(
+            os.path.dirname(config_path), SNAPSHOT_DIR_NAME
+        )
+        self.max_snapshots = max_snapshots
+        self.read_only = read_only
+
+    def _protected(self) -> bool:
+        """
+        Returns True if the directory is owned by the current user and nobody else can
+        write to it.
+        """
+
+        try:
+            directory_stat: os.stat_result = os.lstat(self.path)
+        except OSError:
+            return False
+
+        return (
+            stat.S_ISDIR(directory_stat.st_mode)
+            and directory_stat.st_uid == os.geteuid()
+            and not directory_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+        )
+
+    def _key(self, create: bool) -> Optional[bytes]:
+        key_path: str = os.path.join(self.path, SNAPSHOT_KEY_FILE)
+        try:
+            with open(key_path, "rb") as key_file:
+                return key_file.read()
+        except FileNotFoundError:
+            if not create:
+                return None
+
+        key: bytes = secrets.token_bytes(32)
+        try:
+            key_descriptor: int = os.open(
+                key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+            )
+        except FileExistsError:
+            # created by a concurrent run
+            return self._key(create=False)
+
+        with os.fdopen(key_descriptor, "wb") as key_file:
+            key_file.write(key)
+        return key
+
+    def _snapshot_path(self, name: str, config_digest: str, code: str) -> str:
+        snapshot_id: str = hashlib.sha256(
+            f"{SNAPSHOT_FORMAT}\0{name}\0{config_digest}\0{code}".encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.path, snapshot_id + SNAPSHOT_SUFFIX)
+
+    def load(self, name: str, config_digest: str, code: str) -> Optional[Any]:
+        """
+        Returns the snapshotted objects, None if there is no valid snapshot.
+
+        Args:
+            name (str): The name of the snapshot, e.g. the set and its objects.
+            config_digest (str): The digest of the config file the objects were converted
+                                 from.
+            code (str): The digest of the code converting the objects, see code_digest.
+        """
+
+        if not self._protected():
+            return None
+
+        key: Optional[bytes] = self._key(create=False)
+        snapshot_path: str = self._snapshot_path(name, config_digest, code)
+        try:
+            with open(snapshot_path, "rb") as snapshot_file:
+                data: bytes = snapshot_file.read()
+        except OSError:
+            return None
+
+        signature, payload = data[:32], data[32:]
+        if key is None or not hmac.compare_digest(
+            signature, hmac.new(key, payload, hashlib.sha256).digest()
+        ):
+            return None
+
+        import pickle  # pylint: disable=import-outside-toplevel
+
+        try:
+            objects: Any = pickle.loads(payload)
+        except Exception:  # pylint: disable=broad-except
+            # e.g. a snapshot of classes which were changed without changing the code
+            # digest, the snapshots are only an optimization
+            return None
+
+        try:
+            # the modification time orders the snapshots by their last use
+            os.utime(snapshot_path)
+        except OSError:
+            pass
+
+        return objects
+
+    def store(self, name: str, config_digest: str, code: str, objects: Any) -> None:
+        """
+        Stores a snapshot of the objects and removes the least recently used snapshots.
+
+        The snapshots are only an optimization, a directory which can not be written or
+        is not protected is ignored.
+        """
+
+        import pickle  # pylint: disable=import-outside-toplevel
+
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            if not self._protected():
+                return
+
+            key: Optional[bytes] = self._key(create=True)
+            payload: bytes = pickle.dumps(objects, protocol=pickle.HIGHEST_PROTOCOL)
+            file_utils.atomic_write(
+                self._snapshot_path(name, config_digest, code),
+                hmac.new(key, payload, hashlib.sha256).digest() + payload,
+                mode=0o600,
+            )
+            self._evict()
+        except (OSError, pickle.PicklingError):
+            pass
+
+    def _evict(self) -> None:
+        snapshots: List[os.DirEntry] = [
+            entry
+            for entry in os.scandir(self.path)
+            if entry.name.endswith(SNAPSHOT_SUFFIX)
+        ]
+        if len(snapshots) <= self.max_snapshots:
+            return
+
+        snapshots.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        for entry in snapshots[self.max_snapshots :]:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def snapshot(
+        self,
+        name: str,
+        config_digest: Optional[str],
+        module_names: List[str],
+        convert: Callable[[], Any],
+    ) -> Any:
+        """
+        Returns the converted objects, from a snapshot if there is one. A snapshot of
+        converted objects is stored unless the cache is read only.
+
+        Args:
+            name (str): The name of the snapshot, e.g. the set and its objects.
+            config_digest (Optional[str]): The digest of the config file.
+            module_names (List[str]): The modules whose code converts the objects.
+            convert (Callable[[], Any]): Converts the objects from the config.
+
+        Returns:
+            Any: The objects returned by convert, or loaded from an equal snapshot.
+        """
+
+        code: Optional[str] = (
+            code_digest(module_names) if snapshots_enabled() and config_digest else None
+        )
+        if code is None:
+            return convert()
+
+        with timing_utils.phase("snapshot"):
+            objects: Optional[Any] = self.load(name, config_digest, code)
+        if objects is not None:
+            return objects
+
+        objects = convert()
+        if not self.read_only:
+            with timing_utils.phase("snapshot"):
+                self.store(name, config_digest, code, objects)
+
+        return objects
@@ -27,13 +27,15 @@ Licensed under the GNU General Public License v3.0+
 """
 
 
-from dataclasses import dataclass, asdict
-from typing import List, Optional, Dict
+from bisect import bisect_left, insort
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Iterable, List, Optional, Dict, Set, Tuple
 import base64
+import copy
 import os
 import binascii
 
-from xml.etree.ElementTree import Element, ElementTree
+from xml.etree.ElementTree import Element
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import (
     xml_utils,
@@ -41,8 +43,16 @@ from ansible_collections.puzzle.opnsense.plugins.module_utils import (
 )
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
-    OPNsenseModuleConfig,
+    SectionedModuleConfig,
 )
+from ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils import (
+    SecretHasher,
+)
+
+# written instead of the hashes in check mode, where hashing is only needed to detect
+# a change but the hashes themselves are never saved
+CHECK_MODE_PASSWORD_HASH: str = "$2y$10$" + "*" * 53
+CHECK_MODE_SECRET_HASH: str = "$6$$" + "*" * 86
 
 
 class OPNsenseCryptReturnError(Exception):
@@ -69,6 +79,16 @@ class OPNsenseNotValidBase64APIKeyError(Exception):
     """
 
 
+def _is_password_hash(value: Optional[str]) -> bool:
+    """Returns True if the given value is a bcrypt hash as created by password_hash."""
+
+    return (
+        isinstance(value, str)
+        and value.startswith(("$2y$", "$2b$", "$2a$"))
+        and len(value) == 60
+    )
+
+
 def hash_verify(existing_hashed_string: str, plain_string: Optional[str]) -> bool:
     """
     Verifies if a plain string matches an existing hashed string.
@@ -94,6 +114,7 @@ def hash_verify(existing_hashed_string: str, plain_string: Optional[str]) -> boo
     hash_matches = opnsense_utils.run_command(
         php_requirements=[],
         command=f"var_dump(password_verify('{escaped_string}','{existing_hashed_string}'));",
+        name="password_verify",
     )
 
     if hash_matches.get("stderr"):
@@ -105,13 +126,19 @@ def hash_verify(existing_hashed_string: str, plain_string: Optional[str]) -> boo
     return hash_matches.get("stdout") == "bool(true)"
 
 
-def apikeys_verify(existing_apikeys: List[Dict], apikeys: Optional[List[Dict]]) -> bool:
+def apikeys_verify(
+    existing_apikeys: List[Dict],
+    apikeys: Optional[List[Dict]],
+    verify: Optional[Callable[[str, Optional[str]], bool]] = None,
+) -> bool:
     """
     Verifies if a list of API keys matches existing API keys.
 
     Args:
         existing_apikeys (List[Dict]): List of existing API keys with 'key' and hashed 'secret'.
         apikeys (List[Dict]): List of new API keys with 'key' and plain 'secret'.
+        verify (Optional[Callable[[str, Optional[str]], bool]]): Verifies a plain secret
+            against a hash, hash_verify by default.
 
     Returns:
         bool: True if all new API keys match the existing ones, otherwise False.
@@ -136,7 +163,13 @@ def apikeys_verify(existing_apikeys: List[Dict], apikeys: Optional[List[Dict]])
             # Key does not exist
             return False
 
-        if not hash_verify(existing_keys_and_secrets[key], plain_secret):
+        if plain_secret.startswith("$6$"):
+            # already hashed, the hashes are compared directly
+            if plain_secret != existing_keys_and_secrets[key]:
+                return False
+            continue
+
+        if not (verify or hash_verify)(existing_keys_and_secrets[key], plain_secret):
             # Secret does not match
             return False
 
@@ -145,7 +178,7 @@ def apikeys_verify(existing_apikeys: List[Dict], apikeys: Optional[List[Dict]])
 
 
 @dataclass
-class Group:
+class Group:  # pylint: disable=too-many-instance-attributes
     """
     Represents a Group entity with various attributes.
 
@@ -176,6 +209,15 @@ class Group:
     gid: Optional[str] = None
     member: Optional[List[str]] = None
 
+    # the set of member uids and the member list and its length it was built from
+    _members: Optional[Set[str]] = field(
+        default=None, init=False, compare=False, repr=False
+    )
+    _indexed_member: Optional[List[str]] = field(
+        default=None, init=False, compare=False, repr=False
+    )
+    _indexed_length: int = field(default=0, init=False, compare=False, repr=False)
+
     @staticmethod
     def from_xml(element: Element) -> "Group":
         """Creates a Group instance from an XML Element."""
@@ -190,12 +232,39 @@ class Group:
     def to_etree(self) -> Element:
         """Converts the Group instance to an XML Element."""
 
-        group_dict: dict = asdict(self)
+        group_dict: dict = {
+            key: value for key, value in asdict(self).items() if not key.startswith("_")
+        }
 
         element: Element = xml_utils.dict_to_etree("group", group_dict)[0]
 
         return element
 
+    def _member_index(self) -> Set[str]:
+        """
+        Returns a set of the member uids, which is rebuilt whenever the member list was
+        replaced or changed its length outside of add_user and remove_user.
+        """
+
+        index: Optional[Set[str]] = self._members
+        if (
+            index is None
+            or self._indexed_member is not self.member
+            or (
+                isinstance(self.member, list)
+                and len(self.member) != self._indexed_length
+            )
+        ):
+            if isinstance(self.member, list):
+                index = set(self.member)
+                self._indexed_length = len(self.member)
+            else:
+                index = {self.member} if self.member else set()
+            self._members = index
+            self._indexed_member = self.member
+
+        return index
+
     def check_if_user_in_group(self, user: "User") -> bool:
         """
         Checks if a user is already in the group.
@@ -207,10 +276,7 @@ class Group:
             bool: True if the user is in the group, False otherwise.
         """
 
-        if self.member and user.uid in self.member:
-            return True
-
-        return False
+        return user.uid in self._member_index()
 
     def add_user(self, user: "User") -> None:
         """
@@ -225,7 +291,13 @@ class Group:
         if not isinstance(self.member, list):
             self.member = [self.member] if self.member else []
 
+        members: Set[str] = self._member_index()
+        if user.uid in members:
+            return
+
         self.member.append(user.uid)
+        members.add(user.uid)
+        self._indexed_length = len(self.member)
 
     def remove_user(self, user: "User") -> None:
         """
@@ -243,9 +315,13 @@ class Group:
             # If self.member is None or empty, this will set it to an empty list.
             self.member = [self.member] if self.member else []
 
+        members: Set[str] = self._member_index()
+
         # Check if the user's UID is in the member list, then remove it.
-        if user.uid in self.member:
+        if user.uid in members:
             self.member.remove(user.uid)
+            members.discard(user.uid)
+            self._indexed_length = len(self.member)
 
 
 class User:
@@ -338,6 +414,11 @@ class User:
 
         if self.__dict__.get("password") and other.__dict__.get("password"):
             if not self.__dict__["password"] == other.__dict__["password"]:
+                # two different hashes can not be verified against each other
+                if _is_password_hash(self.__dict__["password"]) and _is_password_hash(
+                    other.__dict__["password"]
+                ):
+                    return False
                 if not hash_verify(
                     existing_hashed_string=self.__dict__["password"],
                     plain_string=other.__dict__["password"],
@@ -566,7 +647,167 @@ class User:
         return cls(**user_dict)
 
 
-class UserSet(OPNsenseModuleConfig):
+class IdAllocator:
+    """
+    Allocates user or group ids, like OPNsense does with system/nextuid and system/nextgid.
+
+    The ids in use are kept in a sorted list, so that allocating, reserving and releasing ids
+    does not require scanning all users or groups. Two policies are supported:
+
+        - monotonic: ids are handed out from the next id counter upwards, like OPNsense does
+        - reuse: ids freed by deleted users or groups (gaps between minimum and the counter)
+                 are handed out first, then the counter is continued
+
+    Attributes:
+        policy (str): The allocation policy, monotonic or reuse.
+        minimum (int): The lowest id which may be allocated.
+        next_id (int): The value of the next id counter after all allocations.
+        dirty (bool): True if ids were allocated since the allocator was created.
+    """
+
+    POLICIES = ("monotonic", "reuse")
+
+    def __init__(
+        self,
+        used_ids: Iterable,
+        next_id: Optional[int] = None,
+        policy: str = "monotonic",
+        minimum: int = 2000,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(
+                f"Unsupported id allocation policy '{policy}', use one of {self.POLICIES}"
+            )
+
+        self.policy = policy
+        self.minimum = minimum
+        self._used: List[int] = sorted(
+            {int(used_id) for used_id in used_ids if str(used_id).isdigit()}
+        )
+
+        if next_id is None:
+            next_id = self._used[-1] + 1 if self._used else minimum
+        self.next_id = max(next_id, minimum)
+        self._gap_cursor = minimum
+        self.dirty = False
+
+    def is_used(self, id_value: int) -> bool:
+        """Returns True if the given id is in use."""
+
+        index: int = bisect_left(self._used, id_value)
+        return index < len(self._used) and self._used[index] == id_value
+
+    def reserve(self, id_value) -> None:
+        """Marks an explicitly assigned id as used."""
+
+        if str(id_value).isdigit() and not self.is_used(int(id_value)):
+            insort(self._used, int(id_value))
+
+    def release(self, id_value) -> None:
+        """
+        Marks the id of a deleted user or group as free. Ids below minimum are never
+        handed out again.
+        """
+
+        if not str(id_value).isdigit():
+            return
+
+        index: int = bisect_left(self._used, int(id_value))
+        if index < len(self._used) and self._used[index] == int(id_value):
+            del self._used[index]
+            self._gap_cursor = max(self.minimum, min(self._gap_cursor, int(id_value)))
+
+    def _next_free(self, candidate: int) -> int:
+        """Returns the first free id which is greater than or equal to candidate."""
+
+        index: int = bisect_left(self._used, candidate)
+        while index < len(self._used) and self._used[index] == candidate:
+            candidate += 1
+            index += 1
+        return candidate
+
+    def allocate(self, count: int = 1) -> List[int]:
+        """
+        Allocates a number of ids in one call.
+
+        Args:
+            count (int): The number of ids to allocate.
+
+        Returns:
+            List[int]: The allocated ids in ascending order.
+        """
+
+        allocated: List[int] = []
+
+        while len(allocated) < count:
+            if self.policy == "reuse" and self._gap_cursor < self.next_id:
+                candidate: int = self._next_free(self._gap_cursor)
+                if candidate < self.next_id:
+                    self._gap_cursor = candidate + 1
+                    allocated.append(candidate)
+                    insort(self._used, candidate)
+                    continue
+                self._gap_cursor = self.next_id
+
+            candidate = self._next_free(self.next_id)
+            self.next_id = candidate + 1
+            allocated.append(candidate)
+            insort(self._used, candidate)
+
+        self.dirty = self.dirty or bool(allocated)
+
+        return allocated
+
+
+@dataclass
+class IdAllocators:
+    """
+    The id allocators of a UserSet, created on first use.
+
+    Attributes:
+        policy (str): The allocation policy, monotonic or reuse.
+        uid (Optional[IdAllocator]): The allocator of user ids, None until it is used.
+        gid (Optional[IdAllocator]): The allocator of group ids, None until it is used.
+    """
+
+    policy: str
+    uid: Optional[IdAllocator] = None
+    gid: Optional[IdAllocator] = None
+
+
+@dataclass
+class GroupIndex:
+    """
+    The indexes of the groups of a UserSet.
+
+    Attributes:
+        by_name (Dict[str, Group]): The groups by name, the first group of a name wins.
+        by_uid (Dict[str, Set[str]]): The names of the groups of every member uid.
+    """
+
+    by_name: Dict[str, Group] = field(default_factory=dict)
+    by_uid: Dict[str, Set[str]] = field(default_factory=dict)
+
+
+@dataclass
+class UserSetBaseline:
+    """
+    The persisted state of the users and groups of a UserSet.
+
+    Attributes:
+        user_names (List[str]): The names of the persisted users, in their order.
+        users (Dict[str, User]): Copies of the modified users, taken before they were
+                                 first modified.
+        groups (Dict[str, Group]): Copies of the modified groups, taken before they were
+                                   first modified.
+    """
+
+    user_names: List[str]
+    users: Dict[str, User] = field(default_factory=dict)
+    groups: Dict[str, Group] = field(default_factory=dict)
+
+
+class UserSet(SectionedModuleConfig):
     """
     Represents a collection of user and group configurations within the OPNsense system,
     facilitating the management of users and groups through direct manipulation of the system's
@@ -595,6 +836,8 @@ class UserSet(OPNsenseModuleConfig):
         _load_users(self): Loads users from the system configuration into the _users list.
         _load_groups(self): Loads groups from the system configuration into the _groups list.
         add_or_update(self, user: User): Adds a new user or updates an existing one in the system.
+        reconcile(self, users: List[User], ...): Adds, updates and removes a list of users at
+                                                 once, hashing all passwords in one batch.
         delete(self, user: User): Removes a specified user from the system's configuration.
         find(self, **kwargs): Searches for and returns a user matching specified criteria.
         save(self): Saves changes made to users or groups back to the system's configuration file.
@@ -609,16 +852,186 @@ class UserSet(OPNsenseModuleConfig):
     """
 
     _users: List[User]
-
-    def __init__(self, path: str = "/conf/config.xml"):
+    _groups: List[Group]
+    _ids: IdAllocators
+    _group_index: GroupIndex
+    _baseline: UserSetBaseline
+
+    def __init__(
+        self,
+        path: str = "/conf/config.xml",
+        id_policy: str = "monotonic",
+        check_mode: bool = False,
+    ):
         super().__init__(
             module_name="system_access_users",
             config_context_names=["system_access_users", "password"],
             path=path,
+            check_mode=check_mode,
         )
-        self._users = self._load_users()
-        self._groups = self._load_groups()
-        self._config_xml_tree = self._load_config()
+        self._ids = IdAllocators(policy=id_policy)
+        self._users, self._groups = self._snapshot(
+            "users", lambda: (self._load_users(), self._load_groups())
+        )
+        self._hasher = SecretHasher()
+        self._password_hash_definition: Optional[Tuple[List[str], str]] = None
+        self._index_groups()
+        self._reset_baseline()
+
+    def _index_groups(self) -> None:
+        """
+        Builds the name to group and the uid to group names indexes of the loaded groups.
+        """
+
+        self._group_index = GroupIndex()
+        for group in self._groups:
+            # like a linear search, the first group with a given name wins
+            self._group_index.by_name.setdefault(group.name, group)
+            for uid in group._member_index():  # pylint: disable=protected-access
+                self._group_index.by_uid.setdefault(uid, set()).add(group.name)
+
+    def _reset_baseline(self) -> None:
+        """
+        Marks the current users and groups as the persisted state.
+
+        Users and groups are snapshotted lazily the first time they are modified, so that
+        changed only needs to compare the modified ones instead of re-parsing all users
+        and groups from the configuration.
+        """
+
+        self._baseline = UserSetBaseline(user_names=[user.name for user in self._users])
+
+    def _get_next_id(self, setting: str) -> Optional[int]:
+        next_id_element: Optional[Element] = self.get(setting)
+        if next_id_element is None or not (next_id_element.text or "").isdigit():
+            return None
+        return int(next_id_element.text)
+
+    def _member_uids(self) -> Set[str]:
+        """Returns the uids referenced by the members of any group."""
+
+        return {
+            uid
+            for group in self._groups
+            for uid in group._member_index()  # pylint: disable=protected-access
+        }
+
+    @property
+    def uid_allocator(self) -> IdAllocator:
+        """
+        The allocator of user ids, created from the configured users on first use.
+
+        The uids referenced by group members are in use as well, even if no user has them,
+        so that a new user never inherits the group memberships of a former user.
+        """
+
+        if self._ids.uid is None:
+            self._ids.uid = IdAllocator(
+                used_ids=[getattr(user, "uid", None) for user in self._users]
+                + list(self._member_uids()),
+                next_id=self._get_next_id("uid"),
+                policy=self._ids.policy,
+            )
+        return self._ids.uid
+
+    @property
+    def gid_allocator(self) -> IdAllocator:
+        """The allocator of group ids, created from the configured groups on first use."""
+
+        if self._ids.gid is None:
+            self._ids.gid = IdAllocator(
+                used_ids=[group.gid for group in self._groups],
+                next_id=self._get_next_id("gid"),
+                policy=self._ids.policy,
+            )
+        return self._ids.gid
+
+    def allocate_uids(self, count: int = 1) -> List[str]:
+        """Allocates a number of user ids at once, see IdAllocator.allocate."""
+
+        return [str(uid) for uid in self.uid_allocator.allocate(count)]
+
+    def allocate_gids(self, count: int = 1) -> List[str]:
+        """Allocates a number of group ids at once, see IdAllocator.allocate."""
+
+        return [str(gid) for gid in self.gid_allocator.allocate(count)]
+
+    def _pending_ids(self) -> Dict[str, str]:
+        """
+        Returns the next id counters of the used allocators which were not written yet,
+        by their setting.
+        """
+
+        return {
+            setting: str(allocator.next_id)
+            for allocator, setting in (
+                (self._ids.uid, "uid"),
+                (self._ids.gid, "gid"),
+            )
+            if allocator is not None and allocator.dirty
+        }
+
+    def _commit_ids(self) -> None:
+        """
+        Writes the next id counters of the used allocators to system/nextuid and
+        system/nextgid. The counters are written once, instead of after every allocation.
+        """
+
+        for setting, next_id in self._pending_ids().items():
+            self.set(value=next_id, setting=setting)
+
+    @property
+    def diff(self) -> Dict[str, dict]:
+        """
+        Returns the diff of the configuration, including the pending id counters, without
+        writing them to the configuration.
+        """
+
+        config_diff: Dict[str, dict] = super().diff
+        for setting, next_id in self._pending_ids().items():
+            config_diff["after"][self._state.index.xpaths[setting]] = next_id
+        return config_diff
+
+    def _track_user(self, user: User) -> None:
+        if user.name not in self._baseline.users:
+            self._baseline.users[user.name] = copy.deepcopy(user)
+
+    def _track_group(self, group: Group) -> None:
+        if group.name not in self._baseline.groups:
+            self._baseline.groups[group.name] = copy.deepcopy(group)
+
+    def _add_group_member(self, group: Group, user: User) -> None:
+        if group.check_if_user_in_group(user):
+            return
+
+        self._track_group(group)
+        group.add_user(user)
+        self._group_index.by_uid.setdefault(user.uid, set()).add(group.name)
+
+    def _remove_group_member(self, group: Group, user: User) -> None:
+        if not group.check_if_user_in_group(user):
+            return
+
+        self._track_group(group)
+        group.remove_user(user)
+        self._group_index.by_uid.get(user.uid, set()).discard(group.name)
+
+    def _release_user(self, user: User) -> None:
+        """
+        Removes a deleted user from the members of every group and, if uids are allocated,
+        frees its uid once no group references it anymore.
+        """
+
+        uid: Optional[str] = getattr(user, "uid", None)
+        for group_name in list(self._group_index.by_uid.get(uid, ())):
+            self._remove_group_member(self._group_index.by_name[group_name], user)
+
+        if self._group_index.by_uid.get(uid):
+            return
+        self._group_index.by_uid.pop(uid, None)
+
+        if self._ids.uid is not None or self._ids.policy == "reuse":
+            self.uid_allocator.release(uid)
 
     def _load_users(self) -> List[User]:
         """
@@ -702,83 +1115,92 @@ class UserSet(OPNsenseModuleConfig):
                 persisted yet; False otherwise.
 
         The method works by comparing the current in-memory representations of users and groups
-        against the versions loaded from the system's configuration files. A difference in these
-        lists indicates that changes have been made in the session that have not been saved, thus
-        prompting the need for a save operation to update the system configuration accordingly.
+        against snapshots taken before they were first modified in this session. Only added,
+        removed and modified users and groups are compared, the configuration is not re-parsed.
 
         Note:
             This property should be consulted before performing a save operation to avoid
             unnecessary writes to the system configuration when no changes have been made.
         """
-        return self._load_users() != self._users or self._load_groups() != self._groups
+        if [user.name for user in self._users] != self._baseline.user_names:
+            return True
 
-    def set_user_password(self, user: User) -> None:
-        """
-        Sets the user's password using specified PHP and configuration functions.
-        """
+        if self._baseline.users:
+            current_users: Dict[str, User] = {user.name: user for user in self._users}
+            for name, baseline_user in self._baseline.users.items():
+                if baseline_user != current_users[name]:
+                    return True
 
-        # load requirements
-        php_requirements = self._config_maps["password"]["php_requirements"]
+        for name, baseline_group in self._baseline.groups.items():
+            if baseline_group != self._group_index.by_name[name]:
+                return True
 
-        # load requirements
-        configure_function_dict = self._config_maps["password"]["configure_functions"]
-        configure_function_key = "password"
-        configure_function = configure_function_dict[configure_function_key]["name"]
-        configure_params = configure_function_dict[configure_function_key][
-            "configure_params"
-        ]
+        return False
 
-        # sanitize and escape password
-        escaped_password = user.password.replace("\\", "\\\\").replace("'", "\\'")
+    @property
+    def hashing_stats(self) -> List[dict]:
+        """
+        Returns the timing statistics of all password and secret hashing batches processed
+        by this instance.
+        """
 
-        # format parameters
-        formatted_params = [
-            (
-                param.replace("'password'", f"'{escaped_password}'")
-                if "password" in param
-                else param
-            )
-            for param in configure_params
-        ]
+        return self._hasher.stats
 
-        # set user password
-        user.password = opnsense_utils.run_function(
-            php_requirements=php_requirements,
-            configure_function=configure_function,
-            configure_params=formatted_params,
-        ).get("stdout")
+    def set_user_password(self, user: User) -> None:
+        """
+        Sets the user's password using specified PHP and configuration functions.
+        """
+
+        user.password = self.hash_passwords([user.password])[0]
 
         # since "password" is no longer needed and to avoid the configure_functions in
         # the save() method, it can be popped
-        self._config_maps.pop("password")
+        self._config_maps.pop("password", None)
 
-    @staticmethod
-    def set_api_keys_secret(user: User) -> None:
+    def set_api_keys_secret(self, *users: User) -> None:
         """
-        Sets the API keys for a user, hashing the 'secret' key if not already hashed.
+        Sets the API keys for users, hashing the 'secret' key if not already hashed.
 
         Args:
-            user (User): The user object containing API keys to be processed.
+            *users (User): The user objects containing API keys to be processed.
 
         Returns:
             None
 
-        The function iterates over the user's API keys and hashes the 'secret' key using
-        User.generate_hashed_secret if the key name is 'secret' and the value does not already start
-        with "$6$". Other keys and values are left unchanged.
+        All secrets of the given users which do not already start with "$6$" are hashed in
+        one batch by the SecretHasher. Other keys and values are left unchanged.
         """
 
-        user.apikeys = [
-            {
-                key_name: (
-                    User.generate_hashed_secret(secret_value)
-                    if key_name == "secret" and not secret_value.startswith("$6$")
-                    else secret_value
-                )
-                for key_name, secret_value in api_key_dict.items()
-            }
+        plain_secrets: List[str] = [
+            api_key_dict["secret"]
+            for user in users
             for api_key_dict in user.apikeys
+            if api_key_dict.get("secret")
+            and not api_key_dict["secret"].startswith("$6$")
         ]
+        hashed_secrets: Dict[str, str] = dict(
+            zip(
+                plain_secrets,
+                (
+                    [CHECK_MODE_SECRET_HASH] * len(plain_secrets)
+                    if self._check_mode
+                    else self._hasher.hash_secrets(plain_secrets)
+                ),
+            )
+        )
+
+        for user in users:
+            user.apikeys = [
+                {
+                    key_name: (
+                        hashed_secrets.get(secret_value, secret_value)
+                        if key_name == "secret"
+                        else secret_value
+                    )
+                    for key_name, secret_value in api_key_dict.items()
+                }
+                for api_key_dict in user.apikeys
+            ]
 
     def _update_user_groups(self, user: User, existing_user: Optional[User] = None):
         """
@@ -809,14 +1231,16 @@ class UserSet(OPNsenseModuleConfig):
         if (
             hasattr(existing_user, "groupname") and existing_user.groupname
         ) and not hasattr(user, "groupname"):
-            for existing_group in self._groups:
-                if existing_group.check_if_user_in_group(target_user):
-                    existing_group.remove_user(target_user)
+            for group_name in list(self._group_index.by_uid.get(target_user.uid, ())):
+                self._remove_group_member(
+                    self._group_index.by_name[group_name], target_user
+                )
 
-                    if target_user.__dict__.get("groupname"):
-                        target_user.groupname.remove(existing_group.name)
-                        if not target_user.groupname:
-                            target_user.groupname = []
+                if target_user.__dict__.get("groupname"):
+                    if group_name in target_user.groupname:
+                        target_user.groupname.remove(group_name)
+                    if not target_user.groupname:
+                        target_user.groupname = []
 
             return  # Exit the method after removing the user from all groups.
 
@@ -826,21 +1250,16 @@ class UserSet(OPNsenseModuleConfig):
         )
 
         for group_name in group_names:
-            group_found = False
-            for index, existing_group in enumerate(self._groups):
-                if existing_group.name == group_name:
-                    group_found = True
-                    if not existing_group.check_if_user_in_group(target_user):
-                        existing_group.add_user(target_user)
-                        self._groups[index] = existing_group
-                    break  # Stop searching once the group is found
-
-            if not group_found:
+            existing_group: Optional[Group] = self._group_index.by_name.get(group_name)
+
+            if existing_group is None:
                 # Group was not found, raise an exception
                 raise OPNsenseGroupNotFoundError(
                     f"Group '{group_name}' not found on Instance"
                 )
 
+            self._add_group_member(existing_group, target_user)
+
     def add_or_update(self, user: User) -> None:
         """
         Adds a new user to the system or updates an existing user's information, ensuring that group
@@ -872,20 +1291,44 @@ class UserSet(OPNsenseModuleConfig):
         existing_user: Optional[User] = next(
             (u for u in self._users if u.name == user.name), None
         )
-        next_uid: Element = self.get("uid")
 
         if existing_user:
-            if not hash_verify(
-                existing_hashed_string=existing_user.password,
-                plain_string=user.password,
+            if not self._secret_matches(
+                existing_user.password,
+                user.password,
+                f"password of user '{user.name}'",
             ):
                 self.set_user_password(user)
             else:
                 user.__dict__.pop("password")
+        else:
+            self.set_user_password(user)
+
+        self._merge_user(user, existing_user)
+
+    def _merge_user(self, user: User, existing_user: Optional[User] = None) -> None:
+        """
+        Merges a user, whose password has already been handled, into the managed users.
+
+        Existing users are updated in place, new users are assigned the next free uid and
+        appended. In both cases the API key secrets are hashed if needed and the group
+        memberships are updated.
+
+        Parameters:
+            user (User): The user to merge.
+            existing_user (Optional[User]): The currently configured user with the same name.
+        """
+
+        if existing_user:
+            self._track_user(existing_user)
 
             if hasattr(user, "apikeys"):
                 if not apikeys_verify(
-                    existing_apikeys=existing_user.apikeys, apikeys=user.apikeys
+                    existing_apikeys=existing_user.apikeys,
+                    apikeys=user.apikeys,
+                    verify=lambda hashed, plain: self._secret_matches(
+                        hashed, plain, f"API key secrets of user '{user.name}'"
+                    ),
                 ):
                     self.set_api_keys_secret(user)
 
@@ -897,13 +1340,11 @@ class UserSet(OPNsenseModuleConfig):
 
             return
 
-        self.set_user_password(user)
-
         # Assign UID if not set
         if not hasattr(user, "uid"):
-            user.uid = next_uid.text
-            # Increase the next_uid
-            self.set(value=str(int(next_uid.text) + 1), setting="uid")
+            user.uid = self.allocate_uids()[0]
+        elif self._ids.uid is not None:
+            self._ids.uid.reserve(user.uid)
 
         if hasattr(user, "groupname"):
             # Update groups for the new user
@@ -912,6 +1353,240 @@ class UserSet(OPNsenseModuleConfig):
         # Add the new user
         self._users.append(user)
 
+    def _password_hash_command(self) -> Tuple[List[str], str]:
+        """
+        Returns the PHP requirements and the expression hashing the password $value, as
+        defined by the password configure function of the current OPNsense version.
+        """
+
+        if self._password_hash_definition is None:
+            php_requirements = self._config_maps["password"]["php_requirements"]
+            password_function = self._config_maps["password"]["configure_functions"][
+                "password"
+            ]
+
+            # "echo password_hash" is called as an expression
+            function_name: str = password_function["name"].split()[-1]
+            params: str = ",".join(
+                "$value" if param == "'password'" else param
+                for param in password_function["configure_params"]
+            )
+
+            self._password_hash_definition = (
+                php_requirements,
+                f"{function_name}({params})",
+            )
+
+        return self._password_hash_definition
+
+    def _secret_matches(
+        self, hashed: Optional[str], plain: Optional[str], check: str
+    ) -> bool:
+        """
+        Verifies a plain password or API key secret against its hash, like hash_verify.
+
+        In check mode, the secret is verified in-process if possible. If that would
+        require PHP, the secret is assumed to be unchanged and the check is recorded in
+        the approximations. In an offline session, the secret is verified by the
+        SecretHasher, which fails with OPNsensePasswordHashReturnError if that would
+        require PHP.
+        """
+
+        if not self._check_mode and not opnsense_utils.offline():
+            return hash_verify(hashed, plain)
+
+        if plain is None or not hashed:
+            return False
+
+        if not self._check_mode:
+            return self._hasher.verify_passwords([(hashed, plain)])[0]
+
+        if not self._hasher.verifies_natively([hashed]):
+            self._approximate(f"{check} not verified, assumed unchanged")
+            return True
+
+        return self._hasher.verify_passwords([(hashed, plain)])[0]
+
+    def hash_passwords(self, passwords: List[str]) -> List[str]:
+        """
+        Hashes a list of plain passwords in one batch.
+
+        In check mode the passwords are not hashed, placeholders are returned instead.
+
+        Args:
+            passwords (List[str]): The plain passwords to hash.
+
+        Returns:
+            List[str]: The hashed passwords, in the order of the given passwords.
+
+        Raises:
+            OPNsensePasswordHashReturnError: If the passwords could not be hashed.
+        """
+
+        if not passwords:
+            return []
+
+        if self._check_mode:
+            return [CHECK_MODE_PASSWORD_HASH] * len(passwords)
+
+        php_requirements, hash_expression = self._password_hash_command()
+
+        return self._hasher.hash_passwords(
+            passwords,
+            php_requirements=php_requirements,
+            hash_expression=hash_expression,
+        )
+
+    def verify_passwords(self, pairs: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Verifies a list of (hashed password, plain password) pairs in one batch.
+
+        Args:
+            pairs (List[Tuple[str, str]]): The existing hashes and the plain passwords to
+            verify against them.
+
+        Returns:
+            List[bool]: True for every pair whose plain password matches the hash.
+
+        Raises:
+            OPNsensePasswordHashReturnError: If the passwords could not be verified.
+        """
+
+        if not pairs:
+            return []
+
+        return self._hasher.verify_passwords(pairs)
+
+    def _hash_changed_passwords(
+        self, users: List[User], existing_users: Dict[str, User]
+    ) -> None:
+        """
+        Verifies the passwords of the existing users in one batch and hashes the new or
+        changed passwords in another. Unchanged passwords are dropped from the users.
+        """
+
+        verify_users: List[User] = [
+            user
+            for user in users
+            if user.__dict__.get("password")
+            and user.name in existing_users
+            and existing_users[user.name].__dict__.get("password")
+        ]
+        pairs: List[Tuple[str, str]] = [
+            (existing_users[user.name].password, user.password) for user in verify_users
+        ]
+        if self._check_mode and not self._hasher.verifies_natively(
+            [hashed for hashed, _plain in pairs]
+        ):
+            for user in verify_users:
+                self._approximate(
+                    f"password of user '{user.name}' not verified, assumed unchanged"
+                )
+            matches: List[bool] = [True] * len(pairs)
+        else:
+            matches = self.verify_passwords(pairs)
+        for user, match in zip(verify_users, matches):
+            if match:
+                user.__dict__.pop("password")
+
+        hash_users: List[User] = [
+            user for user in users if user.__dict__.get("password") is not None
+        ]
+        hashed_passwords: List[str] = self.hash_passwords(
+            [user.password for user in hash_users]
+        )
+        for user, hashed_password in zip(hash_users, hashed_passwords):
+            user.password = hashed_password
+
+    def _remove_users(
+        self, users: List[User], absent_users: List[User], purge: bool
+    ) -> List[str]:
+        """
+        Removes the absent users and, if purge is set, every user with scope 'user' which
+        is not in users.
+
+        Returns:
+            List[str]: The names of the removed users.
+        """
+
+        removed_names = {user.name for user in absent_users}
+        if purge:
+            desired_names = {user.name for user in users}
+            removed_names.update(
+                user.name
+                for user in self._users
+                if user.name not in desired_names
+                and str(getattr(user, "scope", "user")).lower() == "user"
+            )
+
+        removed_users: List[User] = [
+            user for user in self._users if user.name in removed_names
+        ]
+        for user in removed_users:
+            self._release_user(user)
+        if removed_users:
+            self._users = [
+                user for user in self._users if user.name not in removed_names
+            ]
+
+        return [user.name for user in removed_users]
+
+    def reconcile(
+        self,
+        users: List[User],
+        absent_users: Optional[List[User]] = None,
+        purge: bool = False,
+    ) -> List[str]:
+        """
+        Reconciles the managed users with a list of desired users in one pass.
+
+        All passwords of existing users are verified in one batch, all new or changed
+        passwords and all API key secrets are hashed in further batches, instead of
+        starting PHP for every user. The users are then merged like in add_or_update.
+
+        Parameters:
+            users (List[User]): The users which should be present.
+            absent_users (Optional[List[User]]): The users which should be removed.
+            purge (bool): If True, every user with scope 'user' which is not listed in
+                          users is removed.
+
+        Returns:
+            List[str]: The names of the removed users.
+        """
+
+        existing_users: Dict[str, User] = {user.name: user for user in self._users}
+
+        self._hash_changed_passwords(users, existing_users)
+
+        # the passwords are already set, there is nothing to apply for them
+        self._config_maps.pop("password", None)
+
+        # remove users first, so that the reuse policy can hand out their uids again
+        removed_users: List[str] = self._remove_users(users, absent_users or [], purge)
+
+        # allocate the uids of all new users at once
+        new_users: List[User] = []
+        for user in users:
+            if user.name in existing_users:
+                continue
+            if hasattr(user, "uid"):
+                self.uid_allocator.reserve(user.uid)
+            else:
+                new_users.append(user)
+
+        for user, uid in zip(new_users, self.allocate_uids(len(new_users))):
+            user.uid = uid
+
+        # hash the API key secrets of all users in one batch
+        self.set_api_keys_secret(
+            *[user for user in users if user.__dict__.get("apikeys")]
+        )
+
+        for user in users:
+            self._merge_user(user, existing_users.get(user.name))
+
+        return removed_users
+
     def delete(self, user: User) -> None:
         """
         Removes a specified user from the internal list of managed users.
@@ -934,6 +1609,10 @@ class UserSet(OPNsenseModuleConfig):
             None: This method does not return a value but updates the internal list of users.
         """
 
+        for deleted_user in self._users:
+            if deleted_user.name == user.name:
+                self._release_user(deleted_user)
+
         self._users = [r for r in self._users if r.name != user.name]
 
     def find(self, **kwargs) -> Optional[User]:
@@ -993,6 +1672,8 @@ class UserSet(OPNsenseModuleConfig):
         if not self.changed:
             return False
 
+        self._commit_ids()
+
         # Assuming self._config_maps["system_access_users"]["system"]
         # gives you the path to the 'system' element
         filter_element: Element = self._config_xml_tree.find(
@@ -1013,11 +1694,7 @@ class UserSet(OPNsenseModuleConfig):
         filter_element.extend([user.to_etree() for user in self._users])
 
         # Write the updated XML tree to the file
-        tree: ElementTree = ElementTree(self._config_xml_tree)
-
-        tree.write(self._config_path, encoding="utf-8", xml_declaration=True)
-
-        # Reload the configuration to reflect the updated changes
-        self._config_xml_tree = self._load_config()
+        self._write_config()
+        self._reset_baseline()
 
         return True
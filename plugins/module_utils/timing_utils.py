@@ -0,0 +1,215 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Opt-in profiling of the phases of a module run.
+
+If the environment variable OPNSENSE_TIMINGS is set, the wall time, the CPU time and the
+number of calls of every phase (e.g. parsing config.xml, getting the OPNsense version,
+hashing passwords, writing config.xml or running configure functions) are recorded, as
+well as every single PHP invocation. PHP invocations are recorded by the name of the
+PHP function or phase they run, never by their command, which may contain secrets.
+Modules instrumented with instrument() return the recorded timings in the timings key of
+their result. If OPNSENSE_TIMINGS_FILE is set as well, the timings are appended to that
+file as a JSON line, so they can be trended.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+TIMINGS_ENV: str = "OPNSENSE_TIMINGS"
+TIMINGS_FILE_ENV: str = "OPNSENSE_TIMINGS_FILE"
+
+# guards the recorded timings, phases are also recorded from worker threads
+_lock: threading.Lock = threading.Lock()
+_phases: Dict[str, Dict[str, float]] = {}
+_php_invocations: List[dict] = []
+_records: Dict[str, List[dict]] = {}
+
+
+def timings_enabled() -> bool:
+    """
+    Returns True if the timings should be recorded.
+    """
+
+    return os.environ.get(TIMINGS_ENV, "").lower() not in ("", "0", "false", "no")
+
+
+def _children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _add_phase(name: str, wall: float, cpu: float) -> None:
+    with _lock:
+        totals: Dict[str, float] = _phases.setdefault(
+            name, {"wall": 0.0, "cpu": 0.0, "calls": 0}
+        )
+        totals["wall"] += wall
+        totals["cpu"] += cpu
+        totals["calls"] += 1
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Records the wall and CPU time of the enclosed block as the given phase.
+
+    The CPU time includes the time of child processes (e.g. PHP) finished within the
+    block. Phases with the same name are accumulated, nested phases are recorded in
+    addition to the enclosing phase.
+    """
+
+    if not timings_enabled():
+        yield
+        return
+
+    wall_start: float = time.perf_counter()
+    cpu_start: float = time.process_time() + _children_cpu_time()
+    try:
+        yield
+    finally:
+        _add_phase(
+            name,
+            time.perf_counter() - wall_start,
+            time.process_time() + _children_cpu_time() - cpu_start,
+        )
+
+
+@contextlib.contextmanager
+def php_invocation(name: str) -> Iterator[dict]:
+    """
+    Records a single PHP invocation and accumulates it in the php phase.
+
+    Args:
+        name (str): The PHP function or phase the invocation runs, e.g. filter_configure.
+                    The command itself is not recorded, it may contain secrets.
+
+    Yields:
+        dict: The record of the invocation, the caller may add the return code as rc.
+    """
+
+    invocation: dict = {"name": name}
+    if not timings_enabled():
+        yield invocation
+        return
+
+    wall_start: float = time.perf_counter()
+    cpu_start: float = _children_cpu_time()
+    try:
+        yield invocation
+    finally:
+        invocation["wall"] = round(time.perf_counter() - wall_start, 6)
+        invocation["cpu"] = round(_children_cpu_time() - cpu_start, 6)
+        _add_phase("php", invocation["wall"], invocation["cpu"])
+        with _lock:
+            _php_invocations.append(invocation)
+
+
+def record(kind: str, entry: dict) -> None:
+    """
+    Records an event of the given kind, e.g. the wait for a lock, returned in get_timings.
+    """
+
+    if timings_enabled():
+        with _lock:
+            _records.setdefault(kind, []).append(dict(entry))
+
+
+def get_timings() -> dict:
+    """
+    Returns the timings recorded so far.
+
+    Returns:
+        dict: The phases with their wall and CPU time in seconds and their number of calls,
+        every PHP invocation with its name, wall and CPU time and the recorded events by
+        kind.
+    """
+
+    with _lock:
+        return {
+            "phases": {
+                name: {
+                    "wall": round(values["wall"], 6),
+                    "cpu": round(values["cpu"], 6),
+                    "calls": values["calls"],
+                }
+                for name, values in _phases.items()
+            },
+            "php_invocations": [dict(invocation) for invocation in _php_invocations],
+            **{
+                kind: [dict(entry) for entry in entries]
+                for kind, entries in _records.items()
+            },
+        }
+
+
+def reset_timings() -> None:
+    """
+    Discards all recorded timings.
+    """
+
+    with _lock:
+        _phases.clear()
+        _php_invocations.clear()
+        _records.clear()
+
+
+def write_timings(module_name: str, timings: dict, path: Optional[str] = None) -> None:
+    """
+    Appends the timings of a module run as a JSON line to the timings file.
+
+    Args:
+        module_name (str): The name of the module.
+        timings (dict): The timings as returned by get_timings.
+        path (Optional[str]): The file to append to, OPNSENSE_TIMINGS_FILE by default.
+    """
+
+    path = path or os.environ.get(TIMINGS_FILE_ENV)
+    if not path:
+        return
+
+    line: str = json.dumps(
+        {"module": module_name, "time": time.time(), **timings}, sort_keys=True
+    )
+    with open(path, "a", encoding="utf-8") as timings_file:
+        timings_file.write(line + "\n")
+
+
+def instrument(module, module_name: str) -> None:
+    """
+    Adds the recorded timings to the result of an AnsibleModule.
+
+    If timings are enabled, exit_json and fail_json of the given module return the timings
+    of the run in the timings key and append them to the timings file.
+
+    Args:
+        module (AnsibleModule): The module to instrument.
+        module_name (str): The name of the module, as recorded in the timings file.
+    """
+
+    if not timings_enabled():
+        return
+
+    start: float = time.perf_counter()
+
+    def with_timings(exit_function):
+        def wrapper(*args, **kwargs):
+            timings: dict = get_timings()
+            timings["total"] = round(time.perf_counter() - start, 6)
+            try:
+                write_timings(module_name, timings)
+            except OSError as os_error:
+                module.warn(f"Could not write the timings: {os_error}")
+            kwargs.setdefault("timings", timings)
+            return exit_function(*args, **kwargs)
+
+        return wrapper
+
+    module.exit_json = with_timings(module.exit_json)
+    module.fail_json = with_timings(module.fail_json)
@@ -8,8 +8,14 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import json
+import os
 import subprocess
 
+from ansible_collections.puzzle.opnsense.plugins.module_utils import executor_utils
+
+# overrides the version of the instance, e.g. when editing a fetched config offline
+OPNSENSE_VERSION_ENV = "OPNSENSE_VERSION"
+
 
 class OPNSenseVersionUsageError(Exception):
     """
@@ -19,12 +25,20 @@ class OPNSenseVersionUsageError(Exception):
 
 def get_opnsense_version() -> str:
     """
-    Returns output of command opensense-version
+    Returns output of command opensense-version, or OPNSENSE_VERSION if it is set
+
+    The command is run by the executor selected by OPNSENSE_EXECUTOR, see executor_utils.
     """
+    version_override = os.environ.get(OPNSENSE_VERSION_ENV)
+    if version_override:
+        return version_override
+
     try:
-        version_string = subprocess.check_output(
-            args=["opnsense-version", "-O"], encoding="utf-8"
-        ).strip()
+        version_string = (
+            executor_utils.get_executor()
+            .check_output(["opnsense-version", "-O"])
+            .strip()
+        )
 
     except subprocess.CalledProcessError as exc:
         raise OPNSenseVersionUsageError(
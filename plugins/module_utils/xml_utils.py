@@ -1,147 +1,531 @@
 # Copyright: (c) 2023, Fabio Bertagna <bertagna@puzzle.ch>, Puzzle ITC
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
-"""Utilities for XML operations."""
+"""
+Utilities for XML operations.
+
+config.xml is parsed and serialized by lxml if it is installed, which is considerably
+faster on large configurations, and by the ElementTree module of the standard library
+otherwise. The backend can be chosen with the environment variable OPNSENSE_XML_BACKEND
+(auto, lxml or etree). Both backends provide the same element API (find, findall, iter,
+attrib, text, ...), but their elements can not be mixed in a tree. Elements added to
+a parsed config must therefore be created with new_element, sub_element or
+dict_to_etree, which use the backend of the parsed config.
+"""
 
 from __future__ import absolute_import, division, print_function
 
-from typing import Union, Optional, List
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Union, Optional, List, Tuple
+from xml.etree import ElementTree
 from xml.etree.ElementTree import Element
 
 __metaclass__ = type
 
+XML_BACKEND_ENV: str = "OPNSENSE_XML_BACKEND"
+XML_BACKENDS: tuple = ("lxml", "etree")
+
+# the declaration written by ElementTree, kept for lxml to produce the same header
+XML_DECLARATION: bytes = b"<?xml version='1.0' encoding='utf-8'?>\n"
+
 
 ###############################
-# --- Dict to ElementTree --- #
+# ----- Backend handling ----- #
 ###############################
 
 
-def dict_to_etree(
-    tag: str, data: Optional[Union[int, str, list, dict]]
-) -> Optional[List[Element]]:
+@lru_cache(maxsize=None)
+def _lxml_etree():
     """
-    Converts a Python dictionary to an ElementTree.Element structure.
+    Returns the etree module of lxml, None if lxml is not installed.
 
-    :param tag: The root element tag.
-    :param data: The root element children structure data.
-    :return: The generated list of ElementTree.Element.
+    lxml is only imported when it is first needed, e.g. not by module runs which return
+    before config.xml is parsed.
     """
 
-    return_value = None
+    try:
+        from lxml import etree  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return etree
 
-    if isinstance(data, (int, str, type(None))):
-        return_value = [_create_element(tag, data)]
 
-    elif isinstance(data, dict):
-        return_value = [_create_element_from_dict(tag, data)]
+def lxml_available() -> bool:
+    """
+    Returns True if lxml is installed, imports it if needed.
+    """
 
-    elif isinstance(data, list):
-        flattened_data = _flatten_list(data)
-        return_value = _process_list(tag, flattened_data)
+    return _lxml_etree() is not None
 
-    if return_value is not None:
-        return return_value
 
-    raise ValueError(
-        f"You provided an unsupported data type {type(data)}."
-        "Only values of type int, str, dict or list are supported."
+@lru_cache(maxsize=None)
+def _lxml_element_class():
+    etree = _lxml_etree()
+
+    # pylint: disable=too-few-public-methods
+    class _LxmlElement(etree.ElementBase):
+        """
+        lxml element accepting any text value like an ElementTree element, e.g.
+        integers, which are converted to strings.
+        """
+
+        def __setattr__(self, name: str, value) -> None:
+            if name == "text" and not isinstance(value, (str, bytes, type(None))):
+                value = str(value)
+            super().__setattr__(name, value)
+
+    return _LxmlElement
+
+
+def _new_lxml_parser():
+    # like ElementTree: drop comments and processing instructions, do not expand
+    # external entities, and support large configurations
+    etree = _lxml_etree()
+    parser = etree.XMLParser(
+        remove_comments=True,
+        remove_pis=True,
+        resolve_entities=False,
+        huge_tree=True,
     )
+    parser.set_element_class_lookup(
+        etree.ElementDefaultClassLookup(element=_lxml_element_class())
+    )
+    return parser
+
 
+@lru_cache(maxsize=None)
+def _lxml_element_factory():
+    return _new_lxml_parser()
 
-def _create_element(tag: str, data: Optional[Union[int, str]]) -> Element:
+
+def xml_backend() -> str:
+    """
+    Returns the XML backend to use, lxml or etree.
+
+    OPNSENSE_XML_BACKEND selects the backend, by default (auto) lxml is used if it is
+    installed. If lxml is requested but not installed, etree is used.
     """
-    Creates an ElementTree.Element with the given tag and optional text content.
+
+    requested: str = os.environ.get(XML_BACKEND_ENV, "auto").strip().lower()
+    if requested == "etree" or _lxml_etree() is None:
+        return "etree"
+    return "lxml"
+
+
+def new_element(tag: str, attrib: Optional[dict] = None) -> Element:
+    """
+    Creates an element of the XML backend.
 
     :param tag: The element tag.
-    :param data: The optional text content of the element.
-    :return: The created ElementTree.Element.
+    :param attrib: The optional attributes of the element.
+    :return: The created element.
     """
-    new_element: Element = Element(tag)
-    new_element.text = data
-    return new_element
 
+    return _element_factory()(tag, attrib or {})
 
-def _create_element_from_dict(tag: str, data: dict) -> Element:
+
+def _element_factory() -> Callable[..., Element]:
+    """
+    Returns the function creating an element of the XML backend, called with the tag and
+    the optional attributes.
     """
-    Creates an ElementTree.Element from a dictionary by recursively converting its key-value pairs.
 
-    :param tag: The tag for the new element.
-    :param data: The dictionary containing key-value pairs.
-    :return: The created ElementTree.Element.
+    if xml_backend() == "lxml":
+        return _lxml_element_factory().makeelement
+    return Element
+
+
+def sub_element(parent: Element, tag: str, attrib: Optional[dict] = None) -> Element:
     """
-    new_element: Element = Element(tag)
-    for key, val in data.items():
-        child_elements: List[Element] = dict_to_etree(key, val)
+    Creates an element of the backend of the parent and appends it to the parent.
 
-        new_element.extend(child_elements)
+    :param parent: The parent element.
+    :param tag: The element tag.
+    :param attrib: The optional attributes of the element.
+    :return: The created element.
+    """
 
-    return new_element
+    element: Element = parent.makeelement(tag, attrib or {})
+    parent.append(element)
+    return element
 
 
-def _flatten_list(data: list) -> list:
+def parse_xml(data: bytes) -> Element:
     """
-    Flattens a nested list.
+    Parses an XML document with the XML backend.
 
-    :param data: The list to flatten.
-    :return: The flattened list.
+    :param data: The XML document.
+    :return: The root element of the document.
     """
-    flattened_list = []
-    for item in data:
-        if isinstance(item, list):
-            flattened_list.extend(_flatten_list(item))
-        else:
-            flattened_list.append(item)
-    return flattened_list
 
+    if xml_backend() == "lxml":
+        return _lxml_etree().fromstring(data, _new_lxml_parser())
+    return ElementTree.fromstring(data)
 
-def _process_list(tag: str, data: list) -> List[Element]:
+
+def serialize_xml(element: Element, xml_declaration: bool = False) -> bytes:
     """
-    Processes a list by iterating over its elements and converting them to ElementTree.Element.
+    Serializes an element as UTF-8, with either backend.
 
-    :param tag: The tag for the new elements.
-    :param data: The list of elements to process.
-    :return: The list of generated ElementTree.Element.
+    :param element: The element to serialize, created by either backend.
+    :param xml_declaration: Whether the XML declaration is written.
+    :return: The serialized element.
     """
-    new_elements: List[Element] = []
-    root: Optional[Element] = None
 
-    if len(data) == 0:
-        return [Element(tag)]
+    if not isinstance(element, Element) and _lxml_etree() is not None:
+        data: bytes = _lxml_etree().tostring(element, encoding="utf-8")
+        return XML_DECLARATION + data if xml_declaration else data
+
+    return ElementTree.tostring(
+        element, encoding="utf-8", xml_declaration=xml_declaration
+    )
+
+
+###############################
+# ---- Sectioned parsing ----- #
+###############################
+
+
+@lru_cache(maxsize=None)
+def _section_patterns() -> dict:
+    # compiled on first use, most module runs never split a document
+    return {
+        "prolog": re.compile(rb"\s*(<\?xml\s[^>]*\?>)?\s*"),
+        "encoding": re.compile(rb"encoding\s*=\s*[\"']([^\"']+)[\"']"),
+        "start_tag": re.compile(
+            rb"<([^\s/>!?]+)((?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*(/?)>"
+        ),
+        "whitespace": re.compile(rb"\s*"),
+        "section_xpath": re.compile(r"(\.//|\./)?([A-Za-z_][\w.-]*)(?=$|/|\[)"),
+    }
 
-    for data_item in data:
-        if isinstance(data_item, (int, str, type(None), list)):
-            new_items: List[Element] = dict_to_etree(tag, data_item)
 
-            new_elements.extend(new_items)
+def _section_selector(xpath: str) -> Optional[Tuple[bool, str]]:
+    """
+    Returns whether the XPath searches descendants and the first tag of the XPath, None if
+    the XPath can not be attributed to top-level sections.
+    """
 
-        elif isinstance(data_item, dict):
-            root = _process_dict_list(tag, data_item, root)
+    match = _section_patterns()["section_xpath"].match(xpath)
+    if match is None:
+        return None
+    return match.group(1) == ".//", match.group(2)
 
-    if root is not None:
-        new_elements.append(root)
 
-    return new_elements
+@lru_cache(maxsize=None)
+def _tag_re(tag: bytes) -> "re.Pattern":
+    # the start and end tags of elements with the tag
+    return re.compile(rb"<(/?)" + re.escape(tag) + rb"(?=[\s/>])")
 
 
-def _process_dict_list(
-    tag: str, input_dict: dict, root: Optional[Element]
-) -> Optional[Element]:
+def _section_end(data: bytes, tag: bytes, start: int) -> int:
     """
-    Processes a dictionary within a list, converting its key-value pairs to ElementTree.Element.
+    Returns the end offset of the element with the tag whose start tag ends at start.
+    """
+
+    start_tag_re: re.Pattern = _section_patterns()["start_tag"]
+    depth: int = 1
+    for match in _tag_re(tag).finditer(data, start):
+        offset: int = match.start()
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                return data.index(b">", offset) + 1
+            continue
+
+        start_tag = start_tag_re.match(data, offset)
+        if start_tag is None:
+            raise ValueError(f"malformed start tag at offset {offset}")
+        if not start_tag.group(3):
+            depth += 1
+
+    raise ValueError(f"unclosed element {tag!r}")
 
-    :param tag: The tag for the new elements.
-    :param input_dict: The dictionary containing key-value pairs.
-    :param root: The root element to append child elements.
-    :return: The updated root element.
+
+def _root_spans(data: bytes) -> Optional[Tuple[int, "re.Match", int]]:
+    """
+    Returns the end of the prolog, the start tag of the root element and the start of its
+    end tag, None if the document can not be split into sections.
     """
-    if root is None:
-        root = Element(tag)
 
-    for key, val in input_dict.items():
-        child_elements: List[Element] = dict_to_etree(key, val)
-        root.extend(child_elements)
+    patterns: dict = _section_patterns()
+    prolog = patterns["prolog"].match(data)
+    if prolog.group(1):
+        encoding = patterns["encoding"].search(prolog.group(1))
+        if encoding and encoding.group(1).lower() not in (b"utf-8", b"utf8"):
+            return None
+
+    # comments, CDATA sections, DOCTYPEs and processing instructions could hide or
+    # fake tags from the byte scan
+    if b"<!" in data or b"<?" in data[prolog.end() :]:
+        return None
+
+    root_tag = patterns["start_tag"].match(data, prolog.end())
+    if root_tag is None or root_tag.group(3) or b"xmlns" in root_tag.group(2):
+        return None
 
-    return root
+    closing = re.compile(rb"</" + re.escape(root_tag.group(1)) + rb"\s*>\s*\Z")
+    root_end = closing.search(data, root_tag.end())
+    if root_end is None:
+        return None
+
+    return prolog.end(), root_tag, root_end.start()
+
+
+def _selected_sections(
+    data: bytes, start: int, end: int, selectors: List[Tuple[bool, str]]
+) -> Optional[List[Tuple[int, int]]]:
+    """
+    Returns the start and end offset of every child element of the root element between
+    start and end which a selector can match, None if the root element has text content
+    or a child is malformed.
+    """
+
+    patterns: dict = _section_patterns()
+    sections: List[Tuple[int, int]] = []
+    position: int = start
+    try:
+        while True:
+            section_start: int = patterns["whitespace"].match(data, position).end()
+            if section_start >= end:
+                return sections
+
+            section_tag = patterns["start_tag"].match(data, section_start)
+            if section_tag is None:
+                # text content of the root element
+                return None
+
+            section_end: int = (
+                section_tag.end()
+                if section_tag.group(3)
+                else _section_end(data, section_tag.group(1), section_tag.end())
+            )
+            name: str = section_tag.group(1).decode("utf-8")
+            if any(
+                name == tag
+                or (
+                    descendant
+                    and _tag_re(tag.encode("utf-8")).search(
+                        data, section_start, section_end
+                    )
+                )
+                for descendant, tag in selectors
+            ):
+                sections.append((section_start, section_end))
+            position = section_end
+    except ValueError:
+        return None
+
+
+class SectionedXML:
+    """
+    An XML document of which only the top-level sections addressed by a set of XPaths
+    are parsed.
+
+    The document is split into its top-level sections by a byte scan, without parsing
+    it. Only the sections an XPath can match are parsed into the root element, all
+    other sections are kept as raw bytes and written back unchanged by serialize, so
+    the parse time and memory scale with the addressed sections instead of the
+    document. Changes to the parsed sections and sections appended to the root are
+    serialized, changes of the root element itself are not.
+
+    Attributes:
+        root (Element): The root element, with the parsed sections as children.
+    """
+
+    def __init__(self, data: bytes, root: Element, layout: list, suffix: int):
+        self.root = root
+        self._data = data
+        self._layout = layout
+        self._suffix = suffix
+        self._sections = [part for part in layout if not isinstance(part, tuple)]
+
+    @classmethod
+    def parse(cls, data: bytes, xpaths: List[str]) -> Optional["SectionedXML"]:
+        """
+        Parses the sections of an XML document which the XPaths, relative to the root
+        element, can match.
+
+        :param data: The XML document.
+        :param xpaths: The XPaths which will be used on the root element.
+        :return: The sectioned document, None if the document or an XPath can not be
+                 split into sections, e.g. because of comments, a DOCTYPE or an absolute
+                 XPath. The whole document has to be parsed then.
+        """
+
+        selectors: List[Optional[Tuple[bool, str]]] = [
+            _section_selector(xpath) for xpath in xpaths
+        ]
+        if None in selectors:
+            return None
+
+        spans: Optional[Tuple[int, "re.Match", int]] = _root_spans(data)
+        if spans is None:
+            return None
+        prolog_end, root_tag, root_end = spans
+
+        sections: Optional[List[Tuple[int, int]]] = _selected_sections(
+            data, root_tag.end(), root_end, selectors
+        )
+        if sections is None:
+            return None
+
+        # the raw byte spans and the parsed sections, in document order
+        layout: list = []
+        root: Element = parse_xml(
+            data[prolog_end : root_tag.end()] + b"</" + root_tag.group(1) + b">"
+        )
+        raw_start: int = 0
+        for section_start, section_end in sections:
+            layout.append((raw_start, section_start))
+            section: Element = parse_xml(data[section_start:section_end])
+            root.append(section)
+            layout.append(section)
+            raw_start = section_end
+
+        layout.append((raw_start, root_end))
+
+        return cls(data, root, layout, root_end)
+
+    def serialize(self) -> bytes:
+        """
+        Serializes the document, with the parsed sections serialized from the root and
+        the other sections as they were parsed.
+
+        :return: The serialized document.
+        """
+
+        view = memoryview(self._data)
+        children: set = {id(child) for child in self.root}
+        sections: set = {id(section) for section in self._sections}
+
+        parts: list = []
+        for part in self._layout:
+            if isinstance(part, tuple):
+                parts.append(view[part[0] : part[1]])
+            elif id(part) in children:
+                parts.append(serialize_xml(part))
+
+        # sections appended to the root
+        parts.extend(
+            serialize_xml(child) for child in self.root if id(child) not in sections
+        )
+        parts.append(view[self._suffix :])
+
+        return b"".join(parts)
+
+
+###############################
+# --- Dict to ElementTree --- #
+###############################
+
+
+def dict_to_etree(
+    tag: str, data: Optional[Union[int, str, list, dict]]
+) -> Optional[List[Element]]:
+    """
+    Converts a Python dictionary to an ElementTree.Element structure.
+
+    A value is converted to an element with the value as text, a dict to an element with
+    an element for every item and a list, nested lists flattened, to an element for every
+    value followed by a single element with the items of all of its dicts. The structure
+    is converted iteratively, so that its depth is not limited by the recursion limit.
+
+    :param tag: The root element tag.
+    :param data: The root element children structure data.
+    :return: The generated list of ElementTree.Element.
+    """
+
+    # the elements whose children are not converted yet, with the dicts of the children
+    pending: List[Tuple[Element, List[dict]]] = []
+    make_element: Callable[..., Element] = _element_factory()
+    elements: List[Element] = _new_elements(tag, data, pending, make_element)
+
+    while pending:
+        element, children = pending.pop()
+        for child_data in children:
+            for key, val in child_data.items():
+                element.extend(_new_elements(key, val, pending, make_element))
+
+    return elements
+
+
+def _new_elements(
+    tag: str,
+    data: Optional[Union[int, str, list, dict]],
+    pending: list,
+    make_element: Callable[..., Element],
+) -> List[Element]:
+    """
+    Creates the elements of a value of dict_to_etree, without their children.
+
+    :param tag: The element tag.
+    :param data: The value to convert.
+    :param pending: The elements whose children are still to be converted, the created
+                    elements of dicts are added to it.
+    :param make_element: Creates an element of the XML backend, see _element_factory.
+    :return: The created ElementTree.Element.
+    """
+
+    if isinstance(data, (int, str, type(None))):
+        element: Element = make_element(tag)
+        element.text = data
+        return [element]
+
+    if isinstance(data, dict):
+        element = make_element(tag)
+        pending.append((element, [data]))
+        return [element]
+
+    if isinstance(data, list):
+        flattened_data: list = _flatten_list(data)
+        if not flattened_data:
+            return [make_element(tag)]
+
+        elements: List[Element] = []
+        dicts: List[dict] = []
+        for item in flattened_data:
+            if isinstance(item, (int, str, type(None))):
+                element = make_element(tag)
+                element.text = item
+                elements.append(element)
+            elif isinstance(item, dict):
+                dicts.append(item)
+
+        # the items of all dicts of the list are merged into a single element
+        if dicts:
+            element = make_element(tag)
+            pending.append((element, dicts))
+            elements.append(element)
+
+        return elements
+
+    raise ValueError(
+        f"You provided an unsupported data type {type(data)}."
+        "Only values of type int, str, dict or list are supported."
+    )
+
+
+def _flatten_list(data: list) -> list:
+    """
+    Flattens a nested list.
+
+    :param data: The list to flatten.
+    :return: The flattened list.
+    """
+    flattened_list = []
+    iterators = [iter(data)]
+    while iterators:
+        for item in iterators[-1]:
+            if isinstance(item, list):
+                iterators.append(iter(item))
+                break
+            flattened_list.append(item)
+        else:
+            iterators.pop()
+    return flattened_list
 
 
 ###############################
@@ -153,6 +537,12 @@ def etree_to_dict(input_etree: Element) -> dict:
     """
     Converts an ElementTree.Element structure to a Python dictionary.
 
+    An element without children is converted to its text, an element with a single child
+    to a dict of the child, an element whose children all have the same tag to a list of
+    dicts of every child and any other element to a dict of its children, with the
+    values of repeated tags collected in a list. The tree is converted iteratively, so
+    that its depth is not limited by the recursion limit.
+
     :param input_etree: The input ElementTree.Element.
     :return: dict: The result dict.
     """
@@ -160,31 +550,62 @@ def etree_to_dict(input_etree: Element) -> dict:
     input_children: List[Element] = list(input_etree)
 
     # input element has no children, so it is a 'primitive' element
-    if len(input_children) == 0:
+    if not input_children:
         return {input_etree.tag: input_etree.text}  # Return the text directly
 
-    children_results = [etree_to_dict(child) for child in input_children]
+    # the elements being converted, with their children and the values of the
+    # children converted so far
+    stack: List[Tuple[Element, List[Element], list]] = [
+        (input_etree, input_children, [])
+    ]
+    while True:
+        element, children, values = stack[-1]
+        if len(values) < len(children):
+            child: Element = children[len(values)]
+            grandchildren: List[Element] = list(child)
+            if grandchildren:
+                stack.append((child, grandchildren, []))
+            else:
+                values.append(child.text)
+            continue
+
+        stack.pop()
+        value: Union[dict, list] = _children_value(children, values)
+        if not stack:
+            return {element.tag: value}
+        stack[-1][2].append(value)
+
+
+def _children_value(children: List[Element], values: list) -> Union[dict, list]:
+    """
+    Returns the value of an element in etree_to_dict from the values of its children.
+
+    :param children: The children of the element.
+    :param values: The values of the children.
+    :return: The value of the element.
+    """
 
     # If there's only one child node, return it as a dictionary
-    if len(input_children) == 1:
-        return {input_etree.tag: children_results[0]}
+    if len(children) == 1:
+        return {children[0].tag: values[0]}
+
+    tags: list = [child.tag for child in children]
 
     # If all child tags are the same, wrap them in a list
-    if len(set(child.tag for child in input_children)) == 1:
-        return {input_etree.tag: children_results}
-
-    result = {}
-    for child_data in children_results:
-        for key, value in child_data.items():
-            if key in result:
-                if isinstance(result[key], list):
-                    result[key].append(value)
-                else:
-                    result[key] = [result[key], value]
+    if tags.count(tags[0]) == len(tags):
+        return [{tag: value} for tag, value in zip(tags, values)]
+
+    result: dict = {}
+    for key, value in zip(tags, values):
+        if key in result:
+            if isinstance(result[key], list):
+                result[key].append(value)
             else:
-                result[key] = value
+                result[key] = [result[key], value]
+        else:
+            result[key] = value
 
-    return {input_etree.tag: result}
+    return result
 
 
 def elements_equal(e1, e2) -> bool:
@@ -127,6 +127,33 @@ options:
     type: str
     default: present
     choices: [present, absent]
+  materialize_table:
+    description:
+      - If set to True, the pf table file of an urltable or geoip alias is
+        written to /var/db/aliastables by the module, so OPNsense does not
+        need to download and parse the alias content on the next refresh.
+      - The table file is only written if the content of the source has
+        changed since the last run.
+      - The table file is written before config.xml is changed, the run fails
+        without changing config.xml if the source can not be loaded.
+      - A written table file is loaded into the pf table of the alias with
+        pfctl, once config.xml is saved.
+      - In check mode, the source is loaded and compared with the table file,
+        which is not written.
+    type: bool
+    required: false
+    default: false
+    version_added: "1.6.0"
+  table_source:
+    description:
+      - Local path, file:// URL or http(s):// URL of a local mirror to load
+        the content of an urltable alias from.
+      - Required if O(materialize_table=true) and O(type=urltable).
+      - GeoIP aliases are always materialized from the GeoIP files already
+        downloaded to /usr/local/share/GeoIP/alias.
+    type: str
+    required: false
+    version_added: "1.6.0"
 '''
 
 EXAMPLES = r'''
@@ -167,6 +194,15 @@ EXAMPLES = r'''
         - CH
         - DE
 
+- name: Create a URLTable Alias and pre-materialize its table from a local mirror
+  puzzle.opnsense.firewall_alias:
+    name: TestAliasTypeURLTableMirror
+    type: urltable
+    content:
+      - https://www.spamhaus.org/drop/drop.txt
+    materialize_table: true
+    table_source: /var/cache/mirror/drop.txt
+
 - name: Create an MAC Alias with the content FF:FF:FF:FF:FF
   puzzle.opnsense.firewall_alias:
     name: TestAliasTypeMAC
@@ -198,20 +234,107 @@ opnsense_configure_output:
     description: A List of the executed OPNsense configure function along with their respective stdout, stderr and rc
     returned: always
     type: list
+table_materialization:
+    description:
+      - Result of the table file materialization of the alias, containing the
+        alias name, the source, the number of entries and whether the table
+        file changed.
+      - If the table file changed, C(load) holds the pfctl command loading it
+        into the pf table of the alias, with its rc, stdout and stderr.
+    returned: when O(materialize_table=true)
+    type: dict
+fingerprint_match:
+    description:
+      - Set if the run was skipped, because the same run found nothing to change before
+        and config.xml did not change since.
+      - Only used if the environment variable C(OPNSENSE_FINGERPRINTS) is set.
+    returned: when the run was skipped
+    type: bool
+    sample: true
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 0.248
+      phases:
+        parse:
+          wall: 0.009
+          cpu: 0.008
+          calls: 1
+        write:
+          wall: 0.003
+          cpu: 0.002
+          calls: 1
+        "apply:pfctl":
+          wall: 0.211
+          cpu: 0.034
+          calls: 1
+      php_invocations: []
 '''
 # fmt: on
-from typing import Optional
+from typing import Any, Optional
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    Fingerprint,
+    FingerprintStore,
+)
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_alias_utils import (
     FirewallAlias,
     FirewallAliasSet,
+    FirewallAliasType,
 )
 
 ANSIBLE_MANAGED: str = "[ ANSIBLE ]"
 
 
+def materialize_table(module: AnsibleModule, alias: FirewallAlias, result: dict) -> Any:
+    """
+    Materializes the table file of an urltable or geoip alias, in check mode only
+    compares it, and stores the outcome in result. Fails the module if the table can not
+    be materialized.
+
+    Returns:
+        AliasTableCache: The table cache, to load the table into pf once the config is
+        saved.
+    """
+
+    # imported on demand, only materialized tables need the table cache
+    # pylint: disable=import-outside-toplevel
+    from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+        firewall_alias_table_utils,
+    )
+
+    table_cache: firewall_alias_table_utils.AliasTableCache = (
+        firewall_alias_table_utils.AliasTableCache(check_mode=module.check_mode)
+    )
+    try:
+        if alias.type == FirewallAliasType.URLTABLES:
+            result["table_materialization"] = table_cache.materialize_urltable(
+                alias.name, module.params["table_source"]
+            )
+        else:
+            result["table_materialization"] = table_cache.materialize_geoip(
+                alias.name,
+                module.params["content"] or [],
+                [protocol for protocol in module.params["protocol"] or [] if protocol],
+            )
+    except (
+        firewall_alias_table_utils.OPNsenseAliasTableNameError,
+        firewall_alias_table_utils.OPNsenseAliasTableSourceError,
+    ) as table_error:
+        module.fail_json(msg=str(table_error))
+
+    return table_cache
+
+
 def main():
     """Main module execution entry point."""
 
@@ -254,12 +377,26 @@ def main():
             "default": "present",
             "choices": ["present", "absent"],
         },
+        "materialize_table": {"type": "bool", "required": False, "default": False},
+        "table_source": {"type": "str", "required": False},
     }
 
     module: AnsibleModule = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True,
     )
+    timing_utils.instrument(module, "firewall_alias")
+
+    # validated before anything is modified
+    if module.params["materialize_table"]:
+        if module.params["type"] not in ("urltable", "geoip"):
+            module.fail_json(
+                msg="materialize_table is only supported for urltable and geoip aliases"
+            )
+        if module.params["type"] == "urltable" and not module.params["table_source"]:
+            module.fail_json(
+                msg="table_source is required to materialize the table of an urltable alias"
+            )
 
     # https://docs.ansible.com/ansible/latest/reference_appendices/common_return_values.html
     # https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html#return-block
@@ -285,7 +422,24 @@ def main():
 
     ansible_alias_state: str = module.params.get("state")
 
-    with FirewallAliasSet() as alias_set:
+    # materialized tables depend on their sources, not only on config.xml
+    fingerprints: FingerprintStore = FingerprintStore()
+    fingerprint: Optional[Fingerprint] = None
+    if not module.params["materialize_table"]:
+        fingerprint = fingerprints.fingerprint(
+            "firewall_alias", {"name": ansible_alias.name}, module.params
+        )
+        if fingerprints.matches(fingerprint):
+            result["fingerprint_match"] = True
+            module.exit_json(**result)
+
+    # the table is materialized before config.xml is modified, so that an unavailable
+    # source fails the run without changes
+    table_cache: Any = None
+    if module.params["materialize_table"] and ansible_alias_state == "present":
+        table_cache = materialize_table(module, ansible_alias, result)
+
+    with FirewallAliasSet(check_mode=module.check_mode) as alias_set:
 
         if ansible_alias_state == "present":
             alias_set.add_or_update(ansible_alias)
@@ -297,6 +451,10 @@ def main():
         if alias_set.changed:
             result["diff"] = alias_set.diff
             result["changed"] = True
+        elif fingerprint is not None and not module.check_mode:
+            fingerprints.record(fingerprint, alias_set.config_digest)
+
+        if result["changed"] and not module.check_mode:
             alias_set.save()
             result["opnsense_configure_output"] = alias_set.apply_settings()
             for cmd_result in result["opnsense_configure_output"]:
@@ -306,6 +464,19 @@ def main():
                         details=cmd_result,
                     )
 
+    if table_cache is not None and result["table_materialization"]["changed"]:
+        result["changed"] = True
+        if not module.check_mode:
+            # the configure functions of firewall_alias do not load table files
+            result["table_materialization"]["load"] = table_cache.load_table(
+                ansible_alias.name
+            )
+            if result["table_materialization"]["load"]["rc"] != 0:
+                module.fail_json(
+                    msg="Loading the materialized table into pf failed",
+                    details=result["table_materialization"]["load"],
+                )
+
     # Return results
     module.exit_json(**result)
 
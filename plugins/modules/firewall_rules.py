@@ -322,11 +322,64 @@ opnsense_configure_output:
         stderr_lines: []
         stdout: ""
         stdout_lines: []
+fingerprint_match:
+    description:
+      - Set if the run was skipped, because the same run found nothing to change before
+        and config.xml did not change since.
+      - Only used if the environment variable C(OPNSENSE_FINGERPRINTS) is set.
+    returned: when the run was skipped
+    type: bool
+    sample: true
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 1.402
+      phases:
+        parse:
+          wall: 0.012
+          cpu: 0.011
+          calls: 1
+        write:
+          wall: 0.004
+          cpu: 0.003
+          calls: 1
+        "apply:system_cron_configure":
+          wall: 0.161
+          cpu: 0.122
+          calls: 1
+        "apply:filter_configure":
+          wall: 1.204
+          cpu: 0.913
+          calls: 1
+        php:
+          wall: 1.365
+          cpu: 1.035
+          calls: 2
+      php_invocations:
+        - name: system_cron_configure
+          rc: 0
+          wall: 0.161
+          cpu: 0.122
+        - name: filter_configure
+          rc: 0
+          wall: 1.204
+          cpu: 0.913
 '''
 # fmt: on
 from typing import Optional
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    Fingerprint,
+    FingerprintStore,
+)
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_rules_utils import (
     FirewallRuleSet,
@@ -397,6 +450,7 @@ def main():
         argument_spec=module_args,
         supports_check_mode=True,
     )
+    timing_utils.instrument(module, "firewall_rules")
 
     # https://docs.ansible.com/ansible/latest/reference_appendices/common_return_values.html
     # https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html#return-block
@@ -420,7 +474,19 @@ def main():
 
     ansible_rule_state: str = module.params.get("state")
 
-    with FirewallRuleSet() as rule_set:
+    # rules are matched on all their fields, not just on interface and description,
+    # so only the state does not identify the managed rule
+    fingerprints: FingerprintStore = FingerprintStore()
+    fingerprint: Fingerprint = fingerprints.fingerprint(
+        "firewall_rules",
+        {key: value for key, value in module.params.items() if key != "state"},
+        module.params,
+    )
+    if fingerprints.matches(fingerprint):
+        result["fingerprint_match"] = True
+        module.exit_json(**result)
+
+    with FirewallRuleSet(check_mode=module.check_mode) as rule_set:
         if ansible_rule_state == "present":
             rule_set.add_or_update(ansible_rule)
         else:
@@ -431,6 +497,10 @@ def main():
         if rule_set.changed:
             result["diff"] = rule_set.diff
             result["changed"] = True
+        elif not module.check_mode:
+            fingerprints.record(fingerprint, rule_set.config_digest)
+
+        if result["changed"] and not module.check_mode:
             rule_set.save()
             result["opnsense_configure_output"] = rule_set.apply_settings()
             for cmd_result in result["opnsense_configure_output"]:
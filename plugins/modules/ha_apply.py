@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""ha_apply module: Prepare and apply configuration changes on the nodes of a HA pair"""
+
+__metaclass__ = type
+
+# https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html
+# fmt: off
+
+DOCUMENTATION = r'''
+---
+author:
+  - Puzzle ITC (@puzzle)
+module: ha_apply
+version_added: "1.6.0"
+short_description: Prepare and apply configuration changes on the nodes of a HA pair
+description:
+  - Runs modules of this collection on every node with deferred apply, so that they only
+    change config.xml, and then applies all pending configure functions at once.
+  - The prepare phase of all nodes runs in parallel. The apply phase either runs in
+    parallel on all nodes or staggered, node by node in the order of O(nodes), so that
+    one node keeps passing traffic while the other one reloads.
+  - Without O(tasks), the configure functions deferred by earlier tasks (with the
+    environment variable C(OPNSENSE_DEFER_APPLY) set) are applied.
+  - The orchestration is done by the action plugin of the same name, the module applies
+    the pending configure functions on the node.
+options:
+  tasks:
+    description:
+      - Modules to run with deferred apply in the prepare phase.
+    type: list
+    elements: dict
+    required: false
+    suboptions:
+      module:
+        description:
+          - Name of the module, e.g. V(firewall_alias) or V(puzzle.opnsense.firewall_alias).
+        type: str
+        required: true
+      args:
+        description:
+          - The parameters of the module.
+        type: dict
+        required: false
+        default: {}
+  nodes:
+    description:
+      - Inventory hostnames of the nodes taking part, in the order of the staggered apply.
+      - Defaults to the current host only.
+      - Nodes which are not part of the play (C(ansible_play_hosts)), e.g. because they are
+        unreachable, are skipped and not waited for.
+    type: list
+    elements: str
+    required: false
+  policy:
+    description:
+      - V(parallel) applies the changes on all nodes at the same time.
+      - V(staggered) applies the changes on a node only after the previous node in O(nodes)
+        finished its apply.
+    type: str
+    default: staggered
+    choices: [parallel, staggered]
+  settle_delay:
+    description:
+      - Seconds to wait after the previous node finished its apply, e.g. to let CARP settle.
+      - Only used with O(policy=staggered).
+    type: int
+    default: 0
+  stagger_timeout:
+    description:
+      - Seconds to wait at most for the previous node to finish its apply.
+    type: int
+    default: 900
+'''
+
+EXAMPLES = r'''
+---
+- name: Configure both HA nodes, reloading the secondary first
+  puzzle.opnsense.ha_apply:
+    nodes:
+      - fw-secondary
+      - fw-primary
+    policy: staggered
+    settle_delay: 10
+    tasks:
+      - module: firewall_alias
+        args:
+          name: TestAlias
+          type: host
+          content: 10.0.0.1
+      - module: firewall_rules
+        args:
+          interface: lan
+          description: Block SSH on LAN
+          destination:
+            port: 22
+          action: block
+
+- name: Apply the changes of earlier deferred tasks on all nodes at once
+  puzzle.opnsense.ha_apply:
+    policy: parallel
+'''
+
+RETURN = '''
+prepare_results:
+    description: The results of the modules run in the prepare phase.
+    returned: when O(tasks) is set
+    type: list
+    elements: dict
+pending_functions:
+    description: The configure functions pending on the node before the apply.
+    returned: always
+    type: list
+    elements: dict
+    sample:
+      - name: filter_configure
+        configure_params: []
+opnsense_configure_output:
+    description: A list of the executed OPNsense configure function along with their respective stdout, stderr and rc
+    returned: always
+    type: list
+    sample:
+      - function: filter_configure
+        params: []
+        rc: 0
+        stderr: ''
+        stderr_lines: []
+        stdout: ''
+        stdout_lines: []
+timings:
+    description: Duration of the phases in seconds.
+    returned: always
+    type: dict
+    sample:
+      prepare: 1.24
+      wait: 31.5
+      apply: 28.1
+'''
+# fmt: on
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    apply_utils,
+    timing_utils,
+)
+
+
+def main():
+    """
+    Main function of the ha_apply module
+    """
+
+    module = AnsibleModule(
+        argument_spec={},
+        supports_check_mode=True,
+    )
+    timing_utils.instrument(module, "ha_apply")
+
+    result = {
+        "changed": False,
+        "invocation": module.params,
+    }
+
+    pending = apply_utils.load_pending()
+    result["pending_functions"] = pending["functions"]
+
+    if pending["functions"]:
+        result["changed"] = True
+
+    if pending["functions"] and not module.check_mode:
+        result["opnsense_configure_output"] = apply_utils.apply_pending()
+
+        for cmd_result in result["opnsense_configure_output"]:
+            if cmd_result["rc"] != 0:
+                module.fail_json(
+                    msg="Apply of the OPNsense settings failed",
+                    details=cmd_result,
+                )
+
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
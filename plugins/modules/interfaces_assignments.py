@@ -24,19 +24,59 @@ options:
   identifier:
     description:
       - "Technical identifier of the interface, used by hasync for example"
+      - Required unless O(assignments) is set.
     type: str
-    required: true
+    required: false
   device:
     description:
       - Physical Device Name eg. vtnet0, ipsec1000 etc,.
+      - Required if O(identifier) is set.
     type: str
-    required: true
+    required: false
   description:
     description:
       - Interface name shown in the GUI. Identifier in capital letters if not provided.
       - Input will be trimmed, as no whitespaces are allowed.
     type: str
     required: false
+  assignments:
+    description:
+      - A list of interface assignments to apply at once, mutually exclusive with O(identifier).
+      - The devices are enumerated once, conflicts of the whole list are detected before
+        anything is changed and the configuration is written and applied once.
+      - Devices may be moved between the listed identifiers, e.g. to swap the devices of two interfaces.
+      - Identifiers which are not listed are left unchanged.
+    type: list
+    elements: dict
+    required: false
+    version_added: "1.6.0"
+    suboptions:
+      identifier:
+        description:
+          - Technical identifier of the interface.
+        type: str
+        required: true
+      device:
+        description:
+          - Physical Device Name eg. vtnet0, ipsec1000 etc,.
+        type: str
+        required: true
+      description:
+        description:
+          - Interface name shown in the GUI.
+        type: str
+        required: false
+  device_enumeration:
+    description:
+      - How the assignable devices are enumerated.
+      - C(native) reads the kernel interfaces and the virtual devices defined in the configuration without starting PHP.
+      - C(php) uses the OPNsense PHP functions get_interface_list and plugins_devices.
+      - C(verify) uses the PHP result and additionally reports the differences to the native enumeration in C(device_enumeration_mismatch).
+    type: str
+    required: false
+    default: php
+    choices: [native, php, verify]
+    version_added: "1.6.0"
 '''
 
 EXAMPLES = r'''
@@ -50,9 +90,27 @@ EXAMPLES = r'''
     identifier: "lan"
     device: "vtnet1"
     description: "lan_interface"
+
+- name: Assign all interfaces at once, swapping the devices of lan and opt1
+  puzzle.opnsense.interfaces_assignments:
+    assignments:
+      - identifier: "lan"
+        device: "vtnet2"
+        description: "lan_interface"
+      - identifier: "opt1"
+        device: "vtnet1"
+        description: "dmz_interface"
 '''
 
 RETURN = '''
+device_enumeration_mismatch:
+    description: Devices found by only one of the enumeration methods, returned if device_enumeration is verify.
+    returned: when device_enumeration is verify
+    type: dict
+    sample:
+      missing_in_native: []
+      missing_in_php:
+        - vlan0.100
 opnsense_configure_output:
     description: A list of the executed OPNsense configure function along with their respective stdout, stderr and rc
     returned: always
@@ -76,37 +134,111 @@ opnsense_configure_output:
         stdout: Generating RRD graphs...done.
         stdout_lines:
           - Generating RRD graphs...done.
+check_mode_approximations:
+    description:
+      - The checks which were approximated in check mode instead of running an expensive probe
+        on the firewall, e.g. a password which could only be verified with PHP and is assumed
+        to be unchanged.
+    returned: in check mode, if checks were approximated
+    type: list
+    elements: str
+    sample:
+      - password of user 'admin' not verified, assumed unchanged
+fingerprint_match:
+    description:
+      - Set if the run was skipped, because the same run found nothing to change before
+        and config.xml did not change since.
+      - Only used if the environment variable C(OPNSENSE_FINGERPRINTS) is set.
+    returned: when the run was skipped
+    type: bool
+    sample: true
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 1.377
+      phases:
+        parse:
+          wall: 0.011
+          cpu: 0.010
+          calls: 1
+        php:
+          wall: 0.152
+          cpu: 0.118
+          calls: 1
+        "apply:filter_configure":
+          wall: 1.187
+          cpu: 0.902
+          calls: 1
+      php_invocations:
+        - name: introspection
+          rc: 0
+          wall: 0.152
+          cpu: 0.118
 '''
 # fmt: on
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    Fingerprint,
+    FingerprintStore,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils import (
     InterfacesSet,
     InterfaceAssignment,
     OPNSenseDeviceNotFoundError,
     OPNSenseDeviceAlreadyAssignedError,
     OPNSenseGetInterfacesError,
+    get_kernel_interfaces,
 )
 
 
+ASSIGNMENT_ARGS: dict = {
+    "identifier": {"type": "str", "required": False},
+    "device": {"type": "str", "required": False},
+    "description": {"type": "str", "required": False},
+}
+
+
 def main():
     """
     Main function of the interfaces_assignments module
     """
 
     module_args = {
-        "identifier": {"type": "str", "required": True},
-        "device": {"type": "str", "required": True},
-        "description": {"type": "str", "required": False},
+        **ASSIGNMENT_ARGS,
+        "assignments": {
+            "type": "list",
+            "required": False,
+            "elements": "dict",
+            "options": {
+                **ASSIGNMENT_ARGS,
+                "identifier": {"type": "str", "required": True},
+                "device": {"type": "str", "required": True},
+            },
+        },
+        "device_enumeration": {
+            "type": "str",
+            "required": False,
+            "default": "php",
+            "choices": ["native", "php", "verify"],
+        },
     }
 
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True,
-        required_one_of=[
-            ["identifier", "device", "description"],
-        ],
+        mutually_exclusive=[("identifier", "assignments")],
+        required_one_of=[("identifier", "assignments")],
+        required_together=[("identifier", "device")],
     )
+    timing_utils.instrument(module, "interfaces_assignments")
 
     # https://docs.ansible.com/ansible/latest/reference_appendices/common_return_values.html
     # https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html#return-block
@@ -116,12 +248,39 @@ def main():
         "diff": None,
     }
 
-    interface_assignment = InterfaceAssignment.from_ansible_module_params(module.params)
+    # a list of assignments is reconciled as a whole, the assignable devices depend on
+    # the interfaces of the kernel besides config.xml
+    fingerprints: FingerprintStore = FingerprintStore()
+    fingerprint: Fingerprint = fingerprints.fingerprint(
+        "interfaces_assignments",
+        (
+            {"identifier": module.params["identifier"]}
+            if module.params["assignments"] is None
+            else {}
+        ),
+        {**module.params, "kernel_interfaces": get_kernel_interfaces()},
+    )
+    if fingerprints.matches(fingerprint):
+        result["fingerprint_match"] = True
+        module.exit_json(**result)
 
-    with InterfacesSet() as interfaces_set:
+    with InterfacesSet(
+        device_enumeration=module.params["device_enumeration"],
+        check_mode=module.check_mode,
+    ) as interfaces_set:
 
         try:
-            interfaces_set.update(interface_assignment)
+            if module.params["assignments"] is not None:
+                interfaces_set.reconcile(
+                    [
+                        InterfaceAssignment.from_ansible_module_params(params)
+                        for params in module.params["assignments"]
+                    ]
+                )
+            else:
+                interfaces_set.update(
+                    InterfaceAssignment.from_ansible_module_params(module.params)
+                )
 
         except (
             OPNSenseDeviceNotFoundError
@@ -136,11 +295,21 @@ def main():
         except OPNSenseGetInterfacesError as opnsense_get_interfaces_error_message:
             module.fail_json(msg=str(opnsense_get_interfaces_error_message))
 
+        if interfaces_set.device_enumeration_mismatch is not None:
+            result["device_enumeration_mismatch"] = (
+                interfaces_set.device_enumeration_mismatch
+            )
+
+        if interfaces_set.approximations:
+            result["check_mode_approximations"] = interfaces_set.approximations
+
         if interfaces_set.changed:
             result["diff"] = interfaces_set.diff
             result["changed"] = True
+        elif not module.check_mode:
+            fingerprints.record(fingerprint, interfaces_set.config_digest)
 
-        if interfaces_set.changed and not module.check_mode:
+        if result["changed"] and not module.check_mode:
             interfaces_set.save()
             result["opnsense_configure_output"] = interfaces_set.apply_settings()
 
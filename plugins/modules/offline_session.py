@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""offline_session module: Edit the OPNsense config offline on the controller"""
+
+# pylint: disable=duplicate-code
+__metaclass__ = type
+
+# https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html
+# fmt: off
+
+DOCUMENTATION = r'''
+---
+author:
+  - Puzzle ITC (@puzzle)
+module: offline_session
+version_added: "1.6.0"
+short_description: Edit the OPNsense config offline on the controller
+description:
+  - Every task of this collection usually transfers its module to the firewall, parses
+    /conf/config.xml there, writes it and applies the changes. In large plays the transport
+    dominates the run time.
+  - V(started) fetches config.xml once, together with the OPNsense version and the runtime
+    state needed by the modules (e.g. the assignable network devices), and stores it on the
+    controller. Until the session is flushed, the modules M(puzzle.opnsense.firewall_rules),
+    M(puzzle.opnsense.firewall_alias), M(puzzle.opnsense.system_access_users) and
+    M(puzzle.opnsense.interfaces_assignments) run on the controller against that copy
+    and only record the configure functions to apply.
+  - V(flushed) pushes the edited config.xml in a single transfer and applies all recorded
+    configure functions once, every function only once. The push fails without changing
+    anything if config.xml was changed on the firewall since the session started.
+  - V(discarded) drops the session and all offline changes.
+  - Passwords and API key secrets are hashed on the controller, which requires the
+    C(bcrypt) Python package (and C(crypt) for API key secrets) there. Operations which
+    need PHP on the firewall, e.g. O(puzzle.opnsense.firewall_alias#module:materialize_table),
+    are not supported in a session.
+  - A session belongs to the run of ansible-playbook which started it, sessions left
+    behind by an earlier run are ignored.
+  - The sessions are kept in C(OPNSENSE_OFFLINE_SESSION_DIR) on the controller, a
+    directory of the current user in the temporary directory by default. It must be owned
+    by the user running ansible-playbook and nobody else may write to it.
+  - The session is orchestrated by the action plugin of the same name, the module reads
+    and writes config.xml on the firewall.
+options:
+  state:
+    description:
+      - V(started) fetches config.xml and starts the session of the host.
+      - V(flushed) pushes the edited config, applies the changes and ends the session.
+      - V(discarded) ends the session without pushing its changes.
+    type: str
+    default: started
+    choices: [started, flushed, discarded]
+  src:
+    description:
+      - Internal, the transferred config to push, set by the action plugin.
+    type: path
+    required: false
+  base_digest:
+    description:
+      - Internal, the SHA-256 digest of config.xml when the session started, set by the
+        action plugin.
+    type: str
+    required: false
+  php_requirements:
+    description:
+      - Internal, the PHP files required by O(configure_functions), set by the action
+        plugin.
+    type: list
+    elements: str
+    required: false
+    default: []
+  configure_functions:
+    description:
+      - Internal, the configure functions recorded in the session, set by the action
+        plugin.
+    type: list
+    elements: dict
+    required: false
+    default: []
+'''
+
+EXAMPLES = r'''
+---
+- name: Fetch config.xml once
+  puzzle.opnsense.offline_session:
+    state: started
+
+- name: Edited on the controller
+  puzzle.opnsense.firewall_alias:
+    name: "host_{{ item }}"
+    type: host
+    content: "10.0.0.{{ item }}"
+  loop: "{{ range(1, 200) | list }}"
+
+- name: Push config.xml and apply the changes once
+  puzzle.opnsense.offline_session:
+    state: flushed
+'''
+
+RETURN = '''
+opnsense_version:
+    description: The OPNsense version of the firewall.
+    returned: when O(state=started)
+    type: str
+    sample: "24.7"
+digest:
+    description: The SHA-256 digest of config.xml on the firewall after the task.
+    returned: always
+    type: str
+pushed:
+    description: Whether the edited config.xml was written on the firewall.
+    returned: when O(state=flushed)
+    type: bool
+opnsense_configure_output:
+    description: A list of the executed OPNsense configure function along with their respective stdout, stderr and rc
+    returned: when O(state=flushed)
+    type: list
+    sample:
+      - function: filter_configure
+        params: []
+        rc: 0
+        stderr: ''
+        stderr_lines: []
+        stdout: ''
+        stdout_lines: []
+timings:
+    description: The wall and CPU time of the phases of the module run, if the environment variable OPNSENSE_TIMINGS is set.
+    returned: when enabled
+    type: dict
+'''
+# fmt: on
+
+import base64
+import os
+from typing import Optional
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    apply_utils,
+    config_utils,
+    file_utils,
+    introspection_utils,
+    lock_utils,
+    timing_utils,
+    version_utils,
+)
+
+CONFIG_PATH: str = "/conf/config.xml"
+
+
+def config_path() -> str:
+    """
+    Returns the path of config.xml, overridden by OPNSENSE_CONFIG_PATH if it is set.
+    """
+
+    return os.environ.get(config_utils.CONFIG_PATH_ENV) or CONFIG_PATH
+
+
+def fetch(module: AnsibleModule, result: dict) -> None:
+    """
+    Returns config.xml with the OPNsense version and the introspection of the firewall.
+    """
+
+    path: str = config_path()
+    with lock_utils.ConfigLock(path, exclusive=False):
+        with open(path, "rb") as config_file:
+            data: bytes = config_file.read()
+
+    result["content"] = base64.b64encode(data).decode("ascii")
+    result["digest"] = file_utils.digest(data)
+    result["opnsense_version"] = version_utils.get_opnsense_version()
+
+    try:
+        result["introspection"] = introspection_utils.get_introspection()
+    except introspection_utils.OPNsenseIntrospectionError as introspection_error:
+        result["introspection"] = None
+        module.warn(
+            "Could not introspect the firewall, modules depending on its runtime state "
+            f"will fail in the session: {introspection_error}"
+        )
+
+
+def push(module: AnsibleModule, result: dict) -> None:
+    """
+    Writes the edited config.xml, unless it was changed on the firewall in the meantime,
+    and applies the configure functions of the session.
+    """
+
+    path: str = config_path()
+    with lock_utils.ConfigLock(path, exclusive=not module.check_mode) as config_lock:
+        with open(path, "rb") as config_file:
+            current_digest: str = file_utils.digest(config_file.read())
+
+        if (
+            module.params["base_digest"]
+            and current_digest != module.params["base_digest"]
+        ):
+            module.fail_json(
+                msg=f"{path} was changed on the firewall since the offline session "
+                "started, start a new session to edit the current config",
+                digest=current_digest,
+            )
+
+        data: Optional[bytes] = None
+        if module.params["src"]:
+            with open(module.params["src"], "rb") as src_file:
+                data = src_file.read()
+
+        result["digest"] = current_digest
+        result["pushed"] = (
+            data is not None and file_utils.digest(data) != current_digest
+        )
+        if result["pushed"] and not module.check_mode:
+            with timing_utils.phase("write"):
+                file_utils.atomic_write(path, data)
+                config_lock.relock()
+            result["digest"] = file_utils.digest(data)
+
+    result["changed"] = result["pushed"] or bool(module.params["configure_functions"])
+    if module.check_mode or not module.params["configure_functions"]:
+        return
+
+    result["opnsense_configure_output"] = apply_utils.defer_functions(
+        module.params["php_requirements"], module.params["configure_functions"]
+    )
+    if apply_utils.apply_deferred():
+        return
+
+    result["opnsense_configure_output"] = apply_utils.apply_pending()
+    for cmd_result in result["opnsense_configure_output"]:
+        if cmd_result["rc"] != 0:
+            module.fail_json(
+                msg="Apply of the OPNsense settings failed",
+                details=cmd_result,
+            )
+
+
+def main():
+    """
+    Main function of the offline_session module
+    """
+
+    module = AnsibleModule(
+        argument_spec={
+            "state": {
+                "type": "str",
+                "default": "started",
+                "choices": ["started", "flushed", "discarded"],
+            },
+            "src": {"type": "path", "required": False},
+            "base_digest": {"type": "str", "required": False, "no_log": False},
+            "php_requirements": {
+                "type": "list",
+                "elements": "str",
+                "required": False,
+                "default": [],
+            },
+            "configure_functions": {
+                "type": "list",
+                "elements": "dict",
+                "required": False,
+                "default": [],
+            },
+        },
+        supports_check_mode=True,
+    )
+    timing_utils.instrument(module, "offline_session")
+
+    result = {"changed": False}
+
+    if module.params["state"] == "started":
+        fetch(module, result)
+    elif module.params["state"] == "flushed":
+        push(module, result)
+
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,12 +26,14 @@ options:
     username:
         description:
             - The username of the OPNsense user.
-        required: true
+            - Required unless O(users) is set.
+        required: false
         type: str
     password:
         description:
             - The password of the OPNsense user.
-        required: true
+            - Required if O(username) is set.
+        required: false
         type: str
     disabled:
         description:
@@ -110,6 +112,127 @@ options:
             - absent
         default: present
         type: str
+    users:
+        description:
+            - A list of OPNsense users to manage at once, mutually exclusive with O(username).
+            - All users are reconciled in a single pass, the passwords of all
+              users are verified and hashed in one batch and the configuration
+              is written once.
+        required: false
+        type: list
+        elements: dict
+        version_added: "1.6.0"
+        suboptions:
+            username:
+                description:
+                    - The username of the OPNsense user.
+                required: true
+                type: str
+            password:
+                description:
+                    - The password of the OPNsense user.
+                    - Required if O(users[].state=present).
+                required: false
+                type: str
+            disabled:
+                description:
+                    - Indicates whether the user account should be disabled.
+                required: false
+                default: false
+                type: bool
+            full_name:
+                description:
+                    - The full name of the OPNsense user.
+                required: false
+                type: str
+            email:
+                description:
+                    - The email address of the OPNsense user.
+                required: false
+                type: str
+            comment:
+                description:
+                    - Additional comments or notes for the OPNsense user.
+                required: false
+                type: str
+            landing_page:
+                description:
+                    - The landing page for the OPNsense user.
+                required: false
+                type: str
+            shell:
+                description:
+                    - The shell for the OPNsense user.
+                required: false
+                type: str
+            expires:
+                description:
+                    - "Leave blank if the account shouldn't expire, otherwise enter the expiration date in the following format: mm/dd/yyyy"
+                required: false
+                type: str
+            groups:
+                description:
+                    - A list of groups the OPNsense user belongs to.
+                required: false
+                type: list
+                elements: str
+            apikeys:
+                description:
+                    - A list of apikeys for an OPNsense User. Generates new apikey if "" is provided.
+                required: false
+                type: list
+                elements: dict
+            otp_seed:
+                description:
+                    - The otp_seed of a OPNsense user.
+                required: false
+                type: str
+            authorizedkeys:
+                description:
+                    - The authorizedkeys of a OPNsense user.
+                required: false
+                type: str
+            scope:
+                description:
+                    - The scope of the OPNsense user.
+                required: false
+                type: str
+            uid:
+                description:
+                    - The UID of the OPNsense user.
+                required: false
+                type: str
+            state:
+                description:
+                    - The desired state of the OPNsense user.
+                required: false
+                choices:
+                    - present
+                    - absent
+                default: present
+                type: str
+    purge:
+        description:
+            - If set to true, all users with scope C(user) which are not part of
+              O(users) are removed.
+            - Only used together with O(users).
+        required: false
+        default: false
+        type: bool
+        version_added: "1.6.0"
+    id_allocation:
+        description:
+            - How the UIDs of new users without O(uid) are allocated.
+            - V(monotonic) continues the C(system/nextuid) counter like OPNsense does.
+            - V(reuse) first reuses the UIDs of deleted users which are lower than
+              the counter.
+        required: false
+        default: monotonic
+        choices:
+            - monotonic
+            - reuse
+        type: str
+        version_added: "1.6.0"
 '''
 
 EXAMPLES = r'''
@@ -129,6 +252,20 @@ EXAMPLES = r'''
     username: johndoe
     state: absent
   register: result
+
+- name: Reconcile all OPNsense users at once and remove unmanaged ones
+  puzzle.opnsense.system_access_users:
+    users:
+      - username: johndoe
+        password: secret
+        groups:
+          - admins
+      - username: janedoe
+        password: secret
+      - username: olduser
+        state: absent
+    purge: true
+  register: result
 '''
 
 RETURN = '''
@@ -144,62 +281,229 @@ opnsense_configure_output:
         stderr_lines: []
         stdout: ""
         stdout_lines: []
+generated_apikeys:
+    description:
+      - The API keys of the user, including the generated ones.
+      - In list mode a dict with the username as key and only the API keys generated for
+        the user, those given with an empty key, as value.
+    returned: when API keys are set, in list mode when API keys were generated
+    type: raw
+hashing_stats:
+    description:
+      - Timing statistics of the password and API key secret hashing batches,
+        one entry per processed batch with its operation, method (native or
+        php), size and duration in seconds.
+    returned: when passwords or secrets were hashed or verified in batches
+    type: list
+    elements: dict
+    sample:
+      - operation: password_hash
+        method: php
+        batch: 0
+        size: 25
+        duration: 3.81
+removed_users:
+    description: The names of the users removed by a list mode run.
+    returned: when O(users) is set
+    type: list
+    elements: str
+check_mode_approximations:
+    description:
+      - The checks which were approximated in check mode instead of running an expensive probe
+        on the firewall, e.g. a password which could only be verified with PHP and is assumed
+        to be unchanged.
+    returned: in check mode, if checks were approximated
+    type: list
+    elements: str
+    sample:
+      - password of user 'admin' not verified, assumed unchanged
+fingerprint_match:
+    description:
+      - Set if the run was skipped, because the same run found nothing to change before
+        and config.xml did not change since.
+      - Only used if the environment variable C(OPNSENSE_FINGERPRINTS) is set.
+    returned: when the run was skipped
+    type: bool
+    sample: true
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 0.683
+      phases:
+        parse:
+          wall: 0.015
+          cpu: 0.014
+          calls: 1
+        password_hash:
+          wall: 0.421
+          cpu: 0.402
+          calls: 1
+        password_verify:
+          wall: 0.198
+          cpu: 0.187
+          calls: 1
+        write:
+          wall: 0.004
+          cpu: 0.003
+          calls: 1
+      php_invocations: []
 '''
 # fmt: on
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    Fingerprint,
+    FingerprintStore,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils import (
+    OPNsensePasswordHashReturnError,
+)
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils import (
     User,
     UserSet,
     OPNsenseGroupNotFoundError,
+    OPNsenseHashVerifyReturnError,
     OPNsenseNotValidBase64APIKeyError,
 )
 
 
 ANSIBLE_MANAGED: str = "[ ANSIBLE ]"
 
+USER_ARGS: dict = {
+    "username": {"type": "str", "required": False},
+    "password": {"type": "str", "required": False, "no_log": True},
+    "disabled": {"type": "bool", "default": False},
+    "full_name": {"type": "str", "required": False},
+    "email": {"type": "str", "required": False},
+    "comment": {"type": "str", "required": False},
+    "landing_page": {"type": "str", "required": False},
+    "shell": {"type": "str", "required": False},
+    "expires": {"type": "str", "required": False},
+    "otp_seed": {"type": "str", "required": False},
+    "authorizedkeys": {"type": "str", "required": False, "no_log": True},
+    "groups": {"type": "list", "required": False, "elements": "str"},
+    "apikeys": {
+        "type": "list",
+        "required": False,
+        "elements": "dict",
+        "no_log": True,
+    },
+    "scope": {"type": "str", "required": False},
+    "uid": {"type": "str", "required": False},
+    "state": {
+        "type": "str",
+        "default": "present",
+        "choices": ["present", "absent"],
+    },
+}
+
+
+def user_from_params(params: dict) -> User:
+    """
+    Creates a User from the parameters of a single user, making its full_name ansible-managed.
+    """
+
+    # make description ansible-managed
+    description: Optional[str] = params["full_name"]
+
+    if description and ANSIBLE_MANAGED not in description:
+        description = f"{ANSIBLE_MANAGED} - {description}"
+    else:
+        description = ANSIBLE_MANAGED
+
+    # since description matches the full_name in GUI
+    params["full_name"] = description
+
+    return User.from_ansible_module_params(params)
+
+
+def generated_apikeys(params: dict, user: User) -> List[dict]:
+    """
+    Returns the API keys generated for a user, those given with an empty key in its params.
+
+    The API keys given with a key are not returned, their secrets are known to the caller.
+    """
+
+    return [
+        dict(apikey)
+        for apikey_params, apikey in zip(
+            params.get("apikeys") or [], getattr(user, "apikeys", None) or []
+        )
+        if not apikey_params.get("key")
+    ]
+
+
+def reconcile_users(
+    user_set: UserSet, params: dict
+) -> Tuple[List[str], Dict[str, list]]:
+    """
+    Reconciles the users of the set with the list of users in the module parameters.
+
+    Returns:
+        Tuple[List[str], Dict[str, list]]: The names of the removed users and the generated
+        API keys by username, copied before their secrets are hashed.
+    """
+
+    present_users: List[User] = []
+    absent_users: List[User] = []
+    user_apikeys: Dict[str, list] = {}
+    for user_params in params["users"]:
+        if user_params["state"] == "present":
+            user: User = user_from_params(user_params)
+            present_users.append(user)
+            apikeys: List[dict] = generated_apikeys(user_params, user)
+            if apikeys:
+                user_apikeys[user_params["username"]] = apikeys
+        else:
+            absent_users.append(User(name=user_params["username"]))
+
+    removed_users: List[str] = user_set.reconcile(
+        present_users, absent_users=absent_users, purge=params["purge"]
+    )
+    return removed_users, user_apikeys
+
 
 def main():
     """
     Main function of the system_access_users module
     """
     module_args = {
-        "username": {
-            "type": "str",
-            "required": True,
-        },
-        "password": {"type": "str", "required": True, "no_log": True},
-        "disabled": {"type": "bool", "default": False},
-        "full_name": {"type": "str", "required": False},
-        "email": {"type": "str", "required": False},
-        "comment": {"type": "str", "required": False},
-        "landing_page": {"type": "str", "required": False},
-        "shell": {"type": "str", "required": False},
-        "expires": {"type": "str", "required": False},
-        "otp_seed": {"type": "str", "required": False},
-        "authorizedkeys": {"type": "str", "required": False, "no_log": True},
-        "groups": {"type": "list", "required": False, "elements": "str"},
-        "apikeys": {
+        **USER_ARGS,
+        "users": {
             "type": "list",
             "required": False,
             "elements": "dict",
-            "no_log": False,
+            "options": {
+                **USER_ARGS,
+                "username": {"type": "str", "required": True},
+            },
+            "required_if": [("state", "present", ("password",))],
         },
-        "scope": {"type": "str", "required": False},
-        "uid": {"type": "str", "required": False},
-        "state": {
+        "purge": {"type": "bool", "default": False},
+        "id_allocation": {
             "type": "str",
-            "default": "present",
-            "choices": ["present", "absent"],
+            "default": "monotonic",
+            "choices": ["monotonic", "reuse"],
         },
     }
 
     module: AnsibleModule = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True,
+        mutually_exclusive=[("username", "users")],
+        required_one_of=[("username", "users")],
+        required_by={"username": "password"},
     )
+    timing_utils.instrument(module, "system_access_users")
 
     # https://docs.ansible.com/ansible/latest/reference_appendices/common_return_values.html
     # https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html#return-block
@@ -208,38 +512,60 @@ def main():
         "invocation": module.params,
         "diff": None,
     }
-    # make description ansible-managed
-    description: Optional[str] = module.params["full_name"]
 
-    if description and ANSIBLE_MANAGED not in description:
-        description = f"{ANSIBLE_MANAGED} - {description}"
-    else:
-        description = ANSIBLE_MANAGED
-
-    # since description matches the full_name in GUI
-    module.params["full_name"] = description
+    # a list of users is reconciled as a whole
+    fingerprints: FingerprintStore = FingerprintStore()
+    fingerprint: Fingerprint = fingerprints.fingerprint(
+        "system_access_users",
+        (
+            {"username": module.params["username"]}
+            if module.params["users"] is None
+            else {}
+        ),
+        module.params,
+    )
+    if fingerprints.matches(fingerprint):
+        result["fingerprint_match"] = True
+        module.exit_json(**result)
 
     try:
-        ansible_user: User = User.from_ansible_module_params(module.params)
+        with UserSet(
+            id_policy=module.params["id_allocation"], check_mode=module.check_mode
+        ) as user_set:
+            if module.params["users"] is not None:
+                result["removed_users"], user_apikeys = reconcile_users(
+                    user_set, module.params
+                )
+            else:
+                ansible_user: User = user_from_params(module.params)
+
+                ansible_user_state: str = module.params.get("state")
 
-        ansible_user_state: str = module.params.get("state")
+                if ansible_user_state == "present":
+                    user_set.add_or_update(ansible_user)
+                elif ansible_user_state == "absent":
+                    user_set.delete(ansible_user)
 
-        with UserSet() as user_set:
-            if ansible_user_state == "present":
-                user_set.add_or_update(ansible_user)
-            elif ansible_user_state == "absent":
-                user_set.delete(ansible_user)
+                user_apikeys = getattr(ansible_user, "apikeys", None)
+
+            if user_set.hashing_stats:
+                result["hashing_stats"] = user_set.hashing_stats
 
             if user_set.changed:
                 result["diff"] = user_set.diff
                 result["changed"] = True
+            elif not module.check_mode:
+                fingerprints.record(fingerprint, user_set.config_digest)
+
+            if user_set.approximations:
+                result["check_mode_approximations"] = user_set.approximations
 
-            if user_set.changed and not module.check_mode:
+            if result["changed"] and not module.check_mode:
                 user_set.save()
                 result["opnsense_configure_output"] = user_set.apply_settings()
 
-                if hasattr(ansible_user, "apikeys"):
-                    result["generated_apikeys"] = ansible_user.apikeys
+                if user_apikeys:
+                    result["generated_apikeys"] = user_apikeys
 
                 for cmd_result in result["opnsense_configure_output"]:
                     if cmd_result["rc"] != 0:
@@ -255,6 +581,10 @@ def main():
         OPNsenseNotValidBase64APIKeyError
     ) as opnsense_not_valid_base64_apikey_error_message:
         module.fail_json(msg=str(opnsense_not_valid_base64_apikey_error_message))
+    except OPNsensePasswordHashReturnError as opnsense_password_hash_error_message:
+        module.fail_json(msg=str(opnsense_password_hash_error_message))
+    except OPNsenseHashVerifyReturnError as opnsense_hash_verify_error_message:
+        module.fail_json(msg=str(opnsense_hash_verify_error_message))
 
 
 if __name__ == "__main__":
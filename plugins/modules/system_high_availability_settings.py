@@ -107,13 +107,43 @@ opnsense_configure_output:
         stderr_lines: []
         stdout: ""
         stdout_lines: []
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 0.203
+      phases:
+        opnsense_version:
+          wall: 0.002
+          cpu: 0.001
+          calls: 1
+        parse:
+          wall: 0.010
+          cpu: 0.009
+          calls: 1
+        php:
+          wall: 0.163
+          cpu: 0.124
+          calls: 1
+        write:
+          wall: 0.003
+          cpu: 0.002
+          calls: 1
+      php_invocations:
+        - name: introspection
+          rc: 0
+          wall: 0.163
+          cpu: 0.124
 '''
 # pylint: enable=duplicate-code
 # fmt: on
 from typing import Optional, List, Dict
 import ipaddress
-from xml.etree import ElementTree
-from xml.etree.ElementTree import Element
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
     OPNsenseModuleConfig,
@@ -126,8 +156,10 @@ from ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignm
 )
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import (
-    opnsense_utils,
+    introspection_utils,
+    timing_utils,
     version_utils,
+    xml_utils,
 )
 
 
@@ -165,12 +197,7 @@ def check_hasync_node(config: OPNsenseModuleConfig) -> None:
         config (OPNsenseModuleConfig): The configuration for the opnsense firewall
     """
     if config.get("hasync") is None:
-        ElementTree.SubElement(
-            config._config_xml_tree,  # pylint: disable=W0212
-            config._config_maps[  # pylint: disable=W0212
-                "system_high_availability_settings"
-            ]["hasync"],
-        )
+        config.set(value=None, setting="hasync")
         # default settings when nothing is selected
         synchronize_interface(config, "lan")
         config.set(value=None, setting="synchronize_config_to_ip")
@@ -190,7 +217,7 @@ def disable_preempt(config: OPNsenseModuleConfig, setting: bool) -> None:
         if setting and config.get("disable_preempt") is None:
             config.set(value="on", setting="disable_preempt")
         elif not setting and config.get("disable_preempt") is not None:
-            config.get("hasync").remove(config.get("disable_preempt"))
+            config.remove("disable_preempt")
     else:
         config.set(str(int(setting)), "disable_preempt")
 
@@ -208,7 +235,7 @@ def disconnect_dialup_interfaces(config: OPNsenseModuleConfig, setting: bool) ->
         if setting and config.get("disconnect_dialup_interfaces") is None:
             config.set(value="on", setting="disconnect_dialup_interfaces")
         elif not setting and config.get("disconnect_dialup_interfaces") is not None:
-            config.get("hasync").remove(config.get("disconnect_dialup_interfaces"))
+            config.remove("disconnect_dialup_interfaces")
     else:
         config.set(str(int(setting)), "disconnect_dialup_interfaces")
 
@@ -225,46 +252,23 @@ def synchronize_states(config: OPNsenseModuleConfig, setting: bool) -> None:
         if setting and config.get("synchronize_states") is None:
             config.set(value="on", setting="synchronize_states")
         elif not setting and config.get("synchronize_states") is not None:
-            config.get("hasync").remove(config.get("synchronize_states"))
+            config.remove("synchronize_states")
     else:
         config.set(str(int(setting)), "synchronize_states")
 
 
 def get_configured_interface_with_descr() -> Dict[str, str]:
     """
-    Get all interfaces that are allowed to be used for synchronize_interface
-    Args:
-        config (OPNsenseModuleConfig): The configuration for the opnsense firewall
+    Get all interfaces that are allowed to be used for synchronize_interface.
+    The interfaces are taken from the memoized introspection of the instance.
     """
     # https://github.com/opnsense/core/blob/7d212f3e5d9eb2456acf2165987dd850cd78c710/src/etc/inc/util.inc#L822
-    # load requirements
-    php_requirements = [
-        "/usr/local/etc/inc/interfaces.inc",
-        "/usr/local/etc/inc/util.inc",
-        "/usr/local/etc/inc/config.inc",
-    ]
-    php_command = """
-                foreach (get_configured_interface_with_descr() as $key => $item) {
-                    echo $key.':'.$item.',';
-                }
-                """
-
-    # run php function
-    result = opnsense_utils.run_command(
-        php_requirements=php_requirements,
-        command=php_command,
-    )
-
-    # check for stderr
-    if result.get("stderr"):
-        raise OPNSenseGetInterfacesError("error encountered while getting interfaces")
-
-    # parse list
-    interfaces = dict(
-        (item.strip().split(":"))
-        for item in result.get("stdout").split(",")
-        if item.strip() and item.strip() != "None"
-    )
+    try:
+        interfaces = introspection_utils.get_introspection()["interfaces"]
+    except introspection_utils.OPNsenseIntrospectionError as error:
+        raise OPNSenseGetInterfacesError(
+            "error encountered while getting interfaces"
+        ) from error
 
     # check parsed list length
     if len(interfaces) < 1:
@@ -311,7 +315,7 @@ def synchronize_peer_ip(config: OPNsenseModuleConfig, peer_ip: str) -> None:
                 )
             config.set(value=peer_ip, setting="synchronize_peer_ip")
         elif not peer_ip and config.get("synchronize_peer_ip") is not None:
-            config.get("hasync").remove(config.get("synchronize_peer_ip"))
+            config.remove("synchronize_peer_ip")
     else:
         if peer_ip and not validate_ip(peer_ip):
             raise ValueError("Setting synchronize_peer_ip has to be a valid IP address")
@@ -341,29 +345,16 @@ def remote_system_synchronization(
 
 def plugins_xmlrpc_sync() -> Dict[str, str]:
     """
-    Get all services on the firewall which can even be synced
+    Get all services on the firewall which can even be synced.
+    The services are taken from the memoized introspection of the instance.
     """
     # https://github.com/opnsense/core/blob/66c684b2c66d26000129bfb161c6cbafe4175dc8/src/etc/inc/plugins.inc#L355
-    php_requirements = ["/usr/local/etc/inc/plugins.inc"]
-    php_command = """
-                foreach (plugins_xmlrpc_sync() as $key => $item) {
-                    echo $key.','.$item['description'].'\n';
-                }
-                """
-
-    # run php function
-    result = opnsense_utils.run_command(
-        php_requirements=php_requirements,
-        command=php_command,
-    )
-
-    # check for stderr
-    if result.get("stderr"):
-        raise OPNSenseGetInterfacesError("error encountered while getting services")
-    allowed_services = dict(
-        service.split(",") for service in result.get("stdout_lines")
-    )
-    return allowed_services
+    try:
+        return introspection_utils.get_introspection()["xmlrpc_sync"]
+    except introspection_utils.OPNsenseIntrospectionError as error:
+        raise OPNSenseGetInterfacesError(
+            "error encountered while getting services"
+        ) from error
 
 
 def services_to_synchronize(
@@ -431,7 +422,7 @@ def services_to_synchronize(
             # If a service shouldn't get synced, the element is removed from the config entirely.
             service_xml_element_name = f"synchronize{service_id}"
             if config.get("hasync").find(service_xml_element_name) is None:
-                xml_elem = Element(service_xml_element_name)
+                xml_elem = xml_utils.new_element(service_xml_element_name)
                 xml_elem.text = "on"
                 config.get("hasync").append(xml_elem)
 
@@ -518,6 +509,7 @@ def main():
             ],
         ],
     )
+    timing_utils.instrument(module, "system_high_availability_settings")
     result = {
         "changed": False,
         "invocation": module.params,
@@ -597,7 +589,7 @@ def main():
             result["diff"] = config.diff
             result["changed"] = True
 
-        if config.changed and not module.check_mode:
+        if result["changed"] and not module.check_mode:
             config.save()
             result["opnsense_configure_output"] = config.apply_settings()
             for cmd_result in result["opnsense_configure_output"]:
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""system_high_availability_sync module: Synchronize the configuration to the HA peer"""
+
+# pylint: disable=duplicate-code
+__metaclass__ = type
+
+# https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html
+# fmt: off
+
+DOCUMENTATION = r'''
+---
+author:
+  - Puzzle ITC (@puzzle)
+module: system_high_availability_sync
+version_added: "1.6.0"
+short_description: Synchronize the configuration to the HA peer
+description:
+  - Pushes the configuration sections selected in the high availability settings to the
+    HA peer over XMLRPC, like the OPNsense "Synchronize config" action does.
+  - Only sections whose content changed since the last successful push are sent, all
+    sections are sent over a single keep-alive connection.
+  - The pushed sections are only recorded once all of them were pushed and the peer was
+    reconfigured, a failed run pushes them again.
+  - The peer, the credentials and the services are taken from the hasync settings, see
+    the M(puzzle.opnsense.system_high_availability_settings) module.
+options:
+  sections:
+    description:
+      - Config sections to synchronize, e.g. V(aliases) or V(OPNsense.Firewall.Alias).
+      - Defaults to the sections of the services enabled in the high availability settings.
+    type: list
+    elements: str
+    required: false
+  force:
+    description:
+      - Push all sections, even if they did not change since the last push.
+    type: bool
+    default: false
+  reconfigure_peer:
+    description:
+      - Reload the filter on the peer after sections have been pushed.
+    type: bool
+    default: true
+  timeout:
+    description:
+      - Timeout of a single XMLRPC request in seconds.
+    type: int
+    default: 30
+  validate_certs:
+    description:
+      - Validate the TLS certificate of the peer.
+    type: bool
+    default: true
+  state_file:
+    description:
+      - File in which the digests of the last pushed sections are stored.
+    type: path
+    default: /conf/.ansible_hasync_state.json
+'''
+
+EXAMPLES = r'''
+---
+- name: Synchronize the changed sections to the HA peer
+  puzzle.opnsense.system_high_availability_sync:
+
+- name: Synchronize the aliases, regardless of the last push
+  puzzle.opnsense.system_high_availability_sync:
+    sections:
+      - OPNsense.Firewall.Alias
+    force: true
+    validate_certs: false
+'''
+
+RETURN = '''
+peer:
+    description: The XMLRPC URL of the HA peer.
+    returned: always
+    type: str
+    sample: https://192.168.1.3/xmlrpc.php
+synchronized_sections:
+    description: The sections pushed to the peer with the bytes sent and the duration in seconds.
+    returned: always
+    type: list
+    elements: dict
+    sample:
+      - section: OPNsense.Firewall.Alias
+        bytes: 5321
+        duration: 0.041
+unchanged_sections:
+    description: The sections which did not change since the last push.
+    returned: always
+    type: list
+    elements: str
+    sample:
+      - aliases
+reconfigure_output:
+    description: The call of the reconfigure method on the peer with the bytes sent and the duration in seconds.
+    returned: when sections were synchronized and O(reconfigure_peer=true)
+    type: dict
+    sample:
+      method: opnsense.filter_configure
+      bytes: 128
+      duration: 2.513
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 0.871
+      phases:
+        opnsense_version:
+          wall: 0.002
+          cpu: 0.001
+          calls: 1
+        parse:
+          wall: 0.011
+          cpu: 0.010
+          calls: 1
+      php_invocations: []
+'''
+# fmt: on
+
+from typing import List
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
+    OPNsenseModuleConfig,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    hasync_utils,
+    introspection_utils,
+    timing_utils,
+)
+
+
+def sections_of_services(services: List[str]) -> List[str]:
+    """
+    Returns the config sections of the given services to synchronize.
+    """
+
+    all_sections = introspection_utils.get_introspection()["xmlrpc_sync_sections"]
+
+    sections: List[str] = []
+    for service in services:
+        if service not in all_sections:
+            raise ValueError(
+                f"Service {service} could not be found in your OPNsense installation."
+            )
+        sections.extend(all_sections[service])
+
+    return sections
+
+
+def main():
+    """
+    Main function of the system_high_availability_sync module
+    """
+
+    module_args = {
+        "sections": {"type": "list", "required": False, "elements": "str"},
+        "force": {"type": "bool", "default": False},
+        "reconfigure_peer": {"type": "bool", "default": True},
+        "timeout": {"type": "int", "default": 30},
+        "validate_certs": {"type": "bool", "default": True},
+        "state_file": {"type": "path", "default": hasync_utils.HASYNC_STATE_FILE},
+    }
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True,
+    )
+    timing_utils.instrument(module, "system_high_availability_sync")
+
+    result = {
+        "changed": False,
+        "invocation": module.params,
+    }
+
+    with OPNsenseModuleConfig(
+        module_name="system_high_availability_sync",
+        config_context_names=["system_high_availability_settings"],
+        check_mode=True,
+    ) as config:
+        hasync = config.get("hasync")
+        synchronize_to = config.get("synchronize_config_to_ip")
+
+        if hasync is None or synchronize_to is None or not synchronize_to.text:
+            module.fail_json(
+                msg="No HA peer configured, set synchronize_config_to_ip "
+                "with the system_high_availability_settings module"
+            )
+
+        try:
+            sections: List[str] = module.params["sections"] or sections_of_services(
+                hasync_utils.get_sync_services(hasync)
+            )
+        except (ValueError, introspection_utils.OPNsenseIntrospectionError) as error:
+            module.fail_json(msg=str(error))
+
+        username = config.get("remote_system_username")
+        password = config.get("remote_system_password")
+
+        with hasync_utils.HASyncClient(
+            url=hasync_utils.peer_url(synchronize_to.text),
+            auth=(
+                username.text if username is not None else None,
+                password.text if password is not None else None,
+            ),
+            timeout=module.params["timeout"],
+            validate_certs=module.params["validate_certs"],
+        ) as client:
+            result["peer"] = client.url
+
+            try:
+                result.update(
+                    hasync_utils.synchronize(
+                        config=config._config_xml_tree,  # pylint: disable=W0212
+                        sections=sections,
+                        client=client,
+                        state=hasync_utils.HASyncState(module.params["state_file"]),
+                        options=hasync_utils.SyncOptions(
+                            force=module.params["force"],
+                            check_mode=module.check_mode,
+                            reconfigure=(
+                                hasync_utils.RECONFIGURE_METHOD
+                                if module.params["reconfigure_peer"]
+                                else None
+                            ),
+                        ),
+                    )
+                )
+            except (hasync_utils.OPNsenseHASyncError, OSError) as error:
+                module.fail_json(msg=str(error), **result)
+
+        result["changed"] = bool(result["synchronized_sections"])
+
+        module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
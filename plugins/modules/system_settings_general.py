@@ -79,6 +79,54 @@ opnsense_configure_output:
         stdout: Writing trust files...done.
         stdout_lines:
           - Writing trust files...done.
+fingerprint_match:
+    description:
+      - Set if the run was skipped, because the same run found nothing to change before
+        and config.xml did not change since.
+      - Only used if the environment variable C(OPNSENSE_FINGERPRINTS) is set.
+    returned: when the run was skipped
+    type: bool
+    sample: true
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 2.114
+      phases:
+        parse:
+          wall: 0.012
+          cpu: 0.011
+          calls: 1
+        write:
+          wall: 0.004
+          cpu: 0.003
+          calls: 1
+        "apply:system_hostname_configure":
+          wall: 0.512
+          cpu: 0.398
+          calls: 1
+        "apply:filter_configure":
+          wall: 1.204
+          cpu: 0.913
+          calls: 1
+        php:
+          wall: 1.716
+          cpu: 1.311
+          calls: 2
+      php_invocations:
+        - name: system_hostname_configure
+          rc: 0
+          wall: 0.512
+          cpu: 0.398
+        - name: filter_configure
+          rc: 0
+          wall: 1.204
+          cpu: 0.913
 '''
 # fmt: on
 
@@ -86,8 +134,13 @@ import os
 import re
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    Fingerprint,
+    FingerprintStore,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
-    OPNsenseModuleConfig,
+    SectionedModuleConfig,
 )
 
 
@@ -155,6 +208,7 @@ def main():
             ["domain", "hostname", "timezone"],
         ],
     )
+    timing_utils.instrument(module, "system_settings_general")
 
     # https://docs.ansible.com/ansible/latest/reference_appendices/common_return_values.html
     # https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html#return-block
@@ -164,11 +218,19 @@ def main():
         "diff": None,
     }
 
+    fingerprints: FingerprintStore = FingerprintStore()
+    fingerprint: Fingerprint = fingerprints.fingerprint(
+        "system_settings_general", {}, module.params
+    )
+    if fingerprints.matches(fingerprint):
+        result["fingerprint_match"] = True
+        module.exit_json(**result)
+
     hostname_param = module.params.get("hostname")
     domain_param = module.params.get("domain")
     timezone_param = module.params.get("timezone")
 
-    with OPNsenseModuleConfig(
+    with SectionedModuleConfig(
         module_name="system_settings_general",
         config_context_names=["system_settings_general"],
         check_mode=module.check_mode,
@@ -197,8 +259,10 @@ def main():
         if config.changed:
             result["diff"] = config.diff
             result["changed"] = True
+        elif not module.check_mode:
+            fingerprints.record(fingerprint, config.config_digest)
 
-        if config.changed and not module.check_mode:
+        if result["changed"] and not module.check_mode:
             config.save()
             result["opnsense_configure_output"] = config.apply_settings()
             for cmd_result in result["opnsense_configure_output"]:
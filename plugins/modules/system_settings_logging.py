@@ -62,12 +62,57 @@ opnsense_configure_output:
         stdout: 'Configuring system logging...done.'
         stdout_lines:
           - 'Configuring system logging...done.'
+fingerprint_match:
+    description:
+      - Set if the run was skipped, because the same run found nothing to change before
+        and config.xml did not change since.
+      - Only used if the environment variable C(OPNSENSE_FINGERPRINTS) is set.
+    returned: when the run was skipped
+    type: bool
+    sample: true
+timings:
+    description:
+      - Wall and CPU time in seconds and number of calls of the phases of the run, and the
+        single PHP invocations.
+      - Only returned if the environment variable C(OPNSENSE_TIMINGS) is set. If
+        C(OPNSENSE_TIMINGS_FILE) is set as well, the timings are also appended to that file.
+    returned: when the environment variable C(OPNSENSE_TIMINGS) is set
+    type: dict
+    sample:
+      total: 0.397
+      phases:
+        parse:
+          wall: 0.008
+          cpu: 0.007
+          calls: 1
+        write:
+          wall: 0.003
+          cpu: 0.002
+          calls: 1
+        "apply:system_syslog_start":
+          wall: 0.351
+          cpu: 0.262
+          calls: 1
+        php:
+          wall: 0.351
+          cpu: 0.262
+          calls: 1
+      php_invocations:
+        - name: system_syslog_start
+          rc: 0
+          wall: 0.351
+          cpu: 0.262
 '''
 # fmt: on
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.puzzle.opnsense.plugins.module_utils import timing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    Fingerprint,
+    FingerprintStore,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
-    OPNsenseModuleConfig,
+    SectionedModuleConfig,
     ModuleMisconfigurationError,
     UnsupportedModuleSettingError,
 )
@@ -100,6 +145,7 @@ def main():
         argument_spec=module_args,
         supports_check_mode=True,
     )
+    timing_utils.instrument(module, "system_settings_logging")
 
     # https://docs.ansible.com/ansible/latest/reference_appendices/common_return_values.html
     # https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_documenting.html#return-block
@@ -109,10 +155,18 @@ def main():
         "diff": None,
     }
 
+    fingerprints: FingerprintStore = FingerprintStore()
+    fingerprint: Fingerprint = fingerprints.fingerprint(
+        "system_settings_logging", {}, module.params
+    )
+    if fingerprints.matches(fingerprint):
+        result["fingerprint_match"] = True
+        module.exit_json(**result)
+
     preserve_logs_param = module.params.get("preserve_logs")
     max_log_file_size_mb_param = module.params.get("max_log_file_size_mb")
 
-    with OPNsenseModuleConfig(
+    with SectionedModuleConfig(
         module_name="system_settings_logging",
         config_context_names=["system_settings_logging"],
         check_mode=module.check_mode,
@@ -161,7 +215,10 @@ def main():
         if config.changed:
             result["diff"] = config.diff
             result["changed"] = True
-        if config.changed and not module.check_mode:
+        elif not module.check_mode:
+            fingerprints.record(fingerprint, config.config_digest)
+
+        if result["changed"] and not module.check_mode:
             config.save()
             result["opnsense_configure_output"] = config.apply_settings()
             for cmd_result in result["opnsense_configure_output"]:
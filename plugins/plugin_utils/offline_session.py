@@ -0,0 +1,365 @@
+# Copyright: (c) 2024, Puzzle ITC
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Controller side of the offline sessions of the offline_session module.
+
+A session keeps the config.xml fetched from a host in a directory on the controller,
+together with the OPNsense version and the introspection of the host. While a session
+is active, the modules of OFFLINE_MODULES run as a local process on the controller
+against that copy: the module_utils are redirected to the session by environment
+variables, configure functions are deferred to the pending file of the session and PHP
+is not run. The session is flushed by pushing the config and applying the pending
+functions on the host in a single task.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+
+from ansible.plugins.action import ActionBase
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import file_utils
+
+SESSION_DIR_ENV: str = "OPNSENSE_OFFLINE_SESSION_DIR"
+
+# modules which can run on the fetched config, their arguments which need the host
+OFFLINE_MODULES: Dict[str, tuple] = {
+    "firewall_rules": (),
+    "firewall_alias": ("materialize_table",),
+    "system_access_users": (),
+    "interfaces_assignments": (),
+}
+
+CONFIG_FILE: str = "config.xml"
+STATE_FILE: str = "session.json"
+INTROSPECTION_FILE: str = "introspection.json"
+PENDING_FILE: str = "pending.json"
+
+_MODULES_DIR: str = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "modules"
+)
+
+
+class OfflineSessionError(Exception):
+    """
+    Exception raised when an offline session can not be used.
+    """
+
+
+def collections_path() -> str:
+    """
+    Returns the directory containing the ansible_collections package of this collection.
+    """
+
+    path: str = os.path.abspath(__file__)
+    while os.path.basename(path) != "ansible_collections":
+        parent: str = os.path.dirname(path)
+        if parent == path:
+            raise OfflineSessionError(
+                "the collection is not installed in an ansible_collections directory"
+            )
+        path = parent
+
+    return os.path.dirname(path)
+
+
+class OfflineSession:
+    """
+    The offline session of a host on the controller.
+
+    Attributes:
+        host (str): The inventory hostname of the session.
+        base_dir (str): The directory of the sessions of all hosts, a directory of the
+                        current user in the temporary directory by default.
+        directory (str): The directory of the session files.
+    """
+
+    def __init__(self, host: str, base_dir: Optional[str] = None):
+        self.host = host
+        self.base_dir = base_dir or os.environ.get(SESSION_DIR_ENV)
+        if not self.base_dir:
+            self.base_dir = os.path.join(
+                tempfile.gettempdir(), f"ansible-opnsense-offline-{os.geteuid()}"
+            )
+        self.directory = os.path.join(self.base_dir, re.sub(r"[^\w.-]", "_", host))
+
+    def _protected(self) -> bool:
+        """
+        Returns True if the base directory is owned by the current user and nobody else
+        can write to it.
+        """
+
+        try:
+            directory_stat: os.stat_result = os.lstat(self.base_dir)
+        except OSError:
+            return False
+
+        return (
+            stat.S_ISDIR(directory_stat.st_mode)
+            and directory_stat.st_uid == os.geteuid()
+            and not directory_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+        )
+
+    def path(self, name: str) -> str:
+        """Returns the path of a file of the session."""
+        return os.path.join(self.directory, name)
+
+    def load_state(self) -> Optional[dict]:
+        """
+        Returns the state of the session, None if there is no session of this run.
+
+        Sessions are bound to the ansible-playbook process which started them, the parent
+        of the worker processes running the tasks. Sessions in a base directory which
+        others can write to are ignored.
+        """
+
+        if not self._protected():
+            return None
+
+        try:
+            with open(self.path(STATE_FILE), "r", encoding="utf-8") as state_file:
+                state: dict = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+
+        if state.get("controller_pid") != os.getppid():
+            return None
+
+        return state
+
+    @property
+    def active(self) -> bool:
+        """True if the host has a session started by this run."""
+        return self.load_state() is not None
+
+    def start(
+        self,
+        content: bytes,
+        digest: str,
+        opnsense_version: str,
+        introspection: Optional[dict],
+    ) -> None:
+        """
+        Starts the session on the fetched config, replacing a previous session.
+
+        Raises:
+            OfflineSessionError: If the base directory is not owned by the current user
+                                 or others can write to it.
+        """
+
+        os.makedirs(self.base_dir, mode=0o700, exist_ok=True)
+        if not self._protected():
+            raise OfflineSessionError(
+                f"{self.base_dir} must be a directory owned by the current user "
+                "which nobody else can write to"
+            )
+
+        self.discard()
+        os.makedirs(self.directory, mode=0o700)
+
+        with open(self.path(CONFIG_FILE), "wb") as config_file:
+            config_file.write(content)
+        if introspection is not None:
+            with open(
+                self.path(INTROSPECTION_FILE), "w", encoding="utf-8"
+            ) as introspection_file:
+                json.dump(introspection, introspection_file)
+
+        with open(self.path(STATE_FILE), "w", encoding="utf-8") as state_file:
+            json.dump(
+                {
+                    "host": self.host,
+                    "digest": digest,
+                    "opnsense_version": opnsense_version,
+                    "controller_pid": os.getppid(),
+                    "started": time.time(),
+                },
+                state_file,
+            )
+
+    def config_digest(self) -> Optional[str]:
+        """
+        Returns the SHA-256 digest of the session config, None if there is none.
+        """
+
+        try:
+            with open(self.path(CONFIG_FILE), "rb") as config_file:
+                return file_utils.digest(config_file.read())
+        except OSError:
+            return None
+
+    def discard(self) -> None:
+        """
+        Removes the session and its offline changes.
+        """
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def load_pending(self) -> Dict[str, list]:
+        """
+        Returns the configure functions recorded in the session and their requirements.
+        """
+
+        try:
+            with open(self.path(PENDING_FILE), "r", encoding="utf-8") as pending_file:
+                pending: dict = json.load(pending_file)
+        except (OSError, ValueError):
+            pending = {}
+
+        return {
+            "php_requirements": list(pending.get("php_requirements", [])),
+            "functions": list(pending.get("functions", [])),
+        }
+
+    def environment(self, state: dict) -> Dict[str, str]:
+        """
+        Returns the environment redirecting the module_utils to the session.
+        """
+
+        environment: Dict[str, str] = {
+            "OPNSENSE_CONFIG_PATH": self.path(CONFIG_FILE),
+            "OPNSENSE_VERSION": state["opnsense_version"],
+            "OPNSENSE_PENDING_APPLY_FILE": self.path(PENDING_FILE),
+            "OPNSENSE_DEFER_APPLY": "1",
+            "OPNSENSE_OFFLINE": "1",
+        }
+        if os.path.exists(self.path(INTROSPECTION_FILE)):
+            environment["OPNSENSE_INTROSPECTION_FILE"] = self.path(INTROSPECTION_FILE)
+
+        return environment
+
+    def run_module(
+        self, module_name: str, module_args: dict, check_mode: bool, diff: bool
+    ) -> dict:
+        """
+        Runs a module of this collection on the controller against the session config.
+
+        Args:
+            module_name (str): The short name of the module, one of OFFLINE_MODULES.
+            module_args (dict): The arguments of the module.
+            check_mode (bool): Whether to run in check mode.
+            diff (bool): Whether to return a diff.
+
+        Returns:
+            dict: The result of the module.
+
+        Raises:
+            OfflineSessionError: If there is no session of this run for the host.
+        """
+
+        state: Optional[dict] = self.load_state()
+        if state is None:
+            raise OfflineSessionError(f"there is no offline session for {self.host}")
+
+        args_path: str = self.path(f"{module_name}.args.json")
+        with open(args_path, "w", encoding="utf-8") as args_file:
+            json.dump(
+                {
+                    "ANSIBLE_MODULE_ARGS": {
+                        **module_args,
+                        "_ansible_check_mode": check_mode,
+                        "_ansible_diff": diff,
+                    }
+                },
+                args_file,
+            )
+
+        environment: Dict[str, str] = dict(os.environ)
+        environment.update(self.environment(state))
+        environment["PYTHONPATH"] = os.pathsep.join(
+            [collections_path()]
+            + [path for path in [environment.get("PYTHONPATH")] if path]
+        )
+
+        try:
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.join(_MODULES_DIR, f"{module_name}.py"),
+                    args_path,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=environment,
+                check=False,
+            )
+        finally:
+            os.unlink(args_path)
+
+        stdout: str = process.stdout.decode("utf-8", errors="replace")
+        try:
+            return json.loads(stdout[stdout.index("{") :])
+        except ValueError:
+            return {
+                "failed": True,
+                "msg": "MODULE FAILURE",
+                "rc": process.returncode,
+                "module_stdout": stdout,
+                "module_stderr": process.stderr.decode("utf-8", errors="replace"),
+            }
+
+
+class OfflineActionBase(ActionBase):
+    """
+    Action plugin of a module which runs on the config of the offline session of the host,
+    if there is one, and on the host otherwise.
+    """
+
+    TRANSFERS_FILES = False
+    _supports_check_mode = True
+    _supports_async = True
+    MODULE_NAME: str = ""
+
+    def run(self, tmp=None, task_vars=None):
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        task_vars = task_vars or {}
+        session = OfflineSession(task_vars.get("inventory_hostname", ""))
+        if not session.active:
+            # like the normal action plugin
+            wrap_async = self._task.async_val and not self._connection.has_native_async
+            result.update(
+                self._execute_module(task_vars=task_vars, wrap_async=wrap_async)
+            )
+            if not wrap_async:
+                self._remove_tmp_path(
+                    self._connection._shell.tmpdir  # pylint: disable=protected-access
+                )
+            return result
+
+        unsupported = [
+            argument
+            for argument in OFFLINE_MODULES[self.MODULE_NAME]
+            if self._task.args.get(argument)
+        ]
+        if unsupported:
+            result.update(
+                failed=True,
+                msg=f"{', '.join(unsupported)} is not supported in an offline session",
+            )
+            return result
+
+        result.update(
+            session.run_module(
+                self.MODULE_NAME,
+                self._task.args,
+                check_mode=self._play_context.check_mode,
+                diff=self._play_context.diff,
+            )
+        )
+        result["offline"] = True
+
+        return result
@@ -0,0 +1,262 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Generator of synthetic OPNsense config.xml files of arbitrary size.
+
+The generated configurations follow the structure of a real OPNsense 24.7 config.xml and
+contain the given number of firewall rules, aliases, users and interfaces. The content
+is derived from a seeded random generator, so that the same arguments always produce
+the same file.
+"""
+
+import argparse
+import random
+import uuid
+from typing import Optional
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element, SubElement
+
+# bcrypt hash of the password "password", as stored by OPNsense
+PASSWORD_HASH: str = "$2y$11$pSYTZcD0o23JSfksEekwKOnWM8o2NXCAOvJmMkJOOL0GmmGdX.OIy"
+
+RULE_ACTIONS = ("pass", "block", "reject")
+RULE_PROTOCOLS = ("tcp", "udp", "tcp/udp", "icmp")
+ALIAS_TYPES = ("host", "network", "port")
+FIRST_UID: int = 2000
+FIRST_GID: int = 2000
+
+
+def _text_element(parent: Element, tag: str, text: Optional[str] = None) -> Element:
+    element: Element = SubElement(parent, tag)
+    element.text = text
+    return element
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def interface_name(index: int) -> str:
+    """
+    Returns the identifier of the interface with the given index: wan, lan, opt1, opt2...
+    """
+
+    if index == 0:
+        return "wan"
+    if index == 1:
+        return "lan"
+    return f"opt{index - 1}"
+
+
+def rule_description(index: int) -> str:
+    """Returns the description of the generated rule with the given index."""
+    return f"Generated rule {index}"
+
+
+def alias_name(index: int) -> str:
+    """Returns the name of the generated alias with the given index."""
+    return f"generated_alias_{index}"
+
+
+def user_name(index: int) -> str:
+    """Returns the name of the generated user with the given index."""
+    return f"generated_user_{index}"
+
+
+def _add_system(root: Element, users: int, aliases: int) -> None:
+    system: Element = SubElement(root, "system")
+    _text_element(system, "hostname", "OPNsense")
+    _text_element(system, "domain", "localdomain")
+    _text_element(system, "timezone", "Etc/UTC")
+    # the default of 100000 table entries would limit the number of aliases
+    _text_element(system, "maximumtableentries", str(max(100000, 2 * aliases + 1000)))
+
+    group: Element = SubElement(system, "group")
+    _text_element(group, "name", "admins")
+    _text_element(group, "description", "System Administrators")
+    _text_element(group, "scope", "system")
+    _text_element(group, "gid", "1999")
+    _text_element(group, "member", "0")
+    _text_element(group, "priv", "page-all")
+
+    users_group: Element = SubElement(system, "group")
+    _text_element(users_group, "name", "generated_users")
+    _text_element(users_group, "description", "Generated users")
+    _text_element(users_group, "scope", "user")
+    _text_element(users_group, "gid", str(FIRST_GID))
+
+    root_user: Element = SubElement(system, "user")
+    _text_element(root_user, "name", "root")
+    _text_element(root_user, "descr", "System Administrator")
+    _text_element(root_user, "scope", "system")
+    _text_element(root_user, "groupname", "admins")
+    _text_element(root_user, "password", PASSWORD_HASH)
+    _text_element(root_user, "uid", "0")
+
+    for index in range(users):
+        uid: str = str(FIRST_UID + index)
+        user: Element = SubElement(system, "user")
+        _text_element(user, "name", user_name(index))
+        _text_element(user, "password", PASSWORD_HASH)
+        _text_element(user, "scope", "user")
+        _text_element(user, "descr", f"Generated user {index}")
+        _text_element(user, "expires")
+        _text_element(user, "authorizedkeys")
+        _text_element(user, "ipsecpsk")
+        _text_element(user, "otp_seed")
+        _text_element(user, "shell", "/bin/sh")
+        _text_element(user, "uid", uid)
+        if index % 10 == 0:
+            _text_element(users_group, "member", uid)
+
+    _text_element(system, "nextuid", str(FIRST_UID + users))
+    _text_element(system, "nextgid", str(FIRST_GID + 1))
+
+
+def _add_interfaces(root: Element, interfaces: int) -> None:
+    interfaces_element: Element = SubElement(root, "interfaces")
+
+    for index in range(interfaces):
+        interface: Element = SubElement(interfaces_element, interface_name(index))
+        _text_element(interface, "if", f"vtnet{index}")
+        _text_element(interface, "descr", interface_name(index).upper())
+        _text_element(interface, "enable", "1")
+        if index == 0:
+            _text_element(interface, "ipaddr", "dhcp")
+        else:
+            _text_element(interface, "ipaddr", f"10.{index // 256}.{index % 256}.1")
+            _text_element(interface, "subnet", "24")
+
+
+def _add_rules(root: Element, rules: int, interfaces: int, rng: random.Random) -> None:
+    filter_element: Element = SubElement(root, "filter")
+
+    for index in range(rules):
+        rule: Element = SubElement(filter_element, "rule", {"uuid": _uuid(rng)})
+        protocol: str = rng.choice(RULE_PROTOCOLS)
+        _text_element(rule, "type", rng.choice(RULE_ACTIONS))
+        _text_element(rule, "interface", interface_name(rng.randrange(interfaces)))
+        _text_element(rule, "ipprotocol", "inet")
+        _text_element(rule, "statetype", "keep state")
+        _text_element(rule, "descr", rule_description(index))
+        _text_element(rule, "protocol", protocol)
+
+        source: Element = SubElement(rule, "source")
+        SubElement(source, "any")
+
+        destination: Element = SubElement(rule, "destination")
+        _text_element(
+            destination,
+            "address",
+            f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+        )
+        if protocol in ("tcp", "udp", "tcp/udp"):
+            _text_element(destination, "port", str(rng.randrange(1, 65536)))
+
+
+def _alias_content(alias_type: str, rng: random.Random) -> str:
+    if alias_type == "host":
+        return f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+    if alias_type == "network":
+        return f"172.{rng.randrange(16, 32)}.{rng.randrange(256)}.0/24"
+    return str(rng.randrange(1, 65536))
+
+
+def _add_aliases(root: Element, aliases: int, rng: random.Random) -> None:
+    opnsense: Element = SubElement(root, "OPNsense")
+    firewall: Element = SubElement(opnsense, "Firewall")
+    alias_element: Element = SubElement(firewall, "Alias", {"version": "1.0.1"})
+    SubElement(alias_element, "geoip")
+    aliases_element: Element = SubElement(alias_element, "aliases")
+
+    for index in range(aliases):
+        alias_type: str = ALIAS_TYPES[index % len(ALIAS_TYPES)]
+        alias: Element = SubElement(aliases_element, "alias", {"uuid": _uuid(rng)})
+        _text_element(alias, "enabled", "1")
+        _text_element(alias, "name", alias_name(index))
+        _text_element(alias, "type", alias_type)
+        _text_element(alias, "proto")
+        _text_element(alias, "interface")
+        _text_element(alias, "counters", "0")
+        _text_element(alias, "updatefreq")
+        _text_element(alias, "content", _alias_content(alias_type, rng))
+        _text_element(alias, "description", f"Generated alias {index}")
+
+
+def generate_config(
+    rules: int = 0,
+    aliases: int = 0,
+    users: int = 0,
+    interfaces: int = 2,
+    seed: int = 0,
+) -> Element:
+    """
+    Generates a synthetic OPNsense configuration.
+
+    Args:
+        rules (int): Number of firewall rules.
+        aliases (int): Number of firewall aliases.
+        users (int): Number of users, in addition to root.
+        interfaces (int): Number of assigned interfaces, at least wan and lan.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        Element: The root element of the generated config.xml.
+    """
+
+    rng: random.Random = random.Random(seed)
+    interfaces = max(2, interfaces)
+
+    root: Element = Element("opnsense")
+    _text_element(root, "version", "1")
+    _add_system(root, users, aliases)
+    _add_interfaces(root, interfaces)
+    _add_rules(root, rules, interfaces, rng)
+    _add_aliases(root, aliases, rng)
+
+    return root
+
+
+def write_config(path: str, **kwargs) -> None:
+    """
+    Generates a synthetic OPNsense configuration and writes it to the given path.
+
+    Args:
+        path (str): Path of the config.xml to write.
+        **kwargs: The arguments of generate_config.
+    """
+
+    tree: ElementTree.ElementTree = ElementTree.ElementTree(generate_config(**kwargs))
+    if hasattr(ElementTree, "indent"):
+        # indent the file like OPNsense does, available since Python 3.9
+        ElementTree.indent(tree)
+    tree.write(path, encoding="utf-8", xml_declaration=True)
+
+
+def main() -> None:
+    """
+    Writes a generated config.xml to the path given on the command line.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="path of the config.xml to write")
+    parser.add_argument("--rules", type=int, default=0)
+    parser.add_argument("--aliases", type=int, default=0)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--interfaces", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_config(
+        args.path,
+        rules=args.rules,
+        aliases=args.aliases,
+        users=args.users,
+        interfaces=args.interfaces,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
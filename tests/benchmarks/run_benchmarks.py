@@ -0,0 +1,591 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Benchmarks of the config handling of the collection on large configurations.
+
+For every size, a synthetic config.xml with that many firewall rules, aliases and users
+is generated. The load, find, add_or_update, changed, diff and save operations of
+OPNsenseModuleConfig, FirewallRuleSet, FirewallAliasSet and UserSet are then timed on
+a fresh copy of it. The OPNsense version lookup and all PHP invocations are stubbed, so
+that the benchmarks measure the Python side only and run on any machine. The XMLBackend
+benchmark compares parsing and serializing the whole config with every available XML
+backend (lxml and etree). The XMLConversion benchmark times converting every alias and
+user of the config to a dict with xml_utils.etree_to_dict and back with
+xml_utils.dict_to_etree, the conversions of their from_xml and to_etree. The Import
+benchmark measures the cold start of every module: each module is imported in a fresh
+interpreter, like on every task, and the startup time of the interpreter, the import
+time of the module and the import time of the collection's own modules are recorded
+(size 0, they do not depend on the config).
+
+PHP commands are answered by a stand-in for the PHP interpreter, or with --replay from
+fixtures recorded on a firewall with OPNSENSE_EXECUTOR=record, see executor_utils.
+
+The results are written as JSON, to compare them between releases:
+
+    PYTHONPATH=../../.. python tests/benchmarks/run_benchmarks.py --output results.json
+"""
+
+import argparse
+import base64
+import datetime
+import json
+import operator
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    executor_utils,
+    version_utils,
+    xml_utils,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
+    OPNsenseModuleConfig,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_alias_utils import (
+    FirewallAlias,
+    FirewallAliasSet,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_rules_utils import (
+    FirewallRule,
+    FirewallRuleSet,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils import (
+    SecretHasher,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils import (
+    User,
+    UserSet,
+)
+from ansible_collections.puzzle.opnsense.tests.benchmarks import config_generator
+
+BENCHMARK_OPNSENSE_VERSION: str = "24.7"
+DEFAULT_SIZES: Tuple[int, ...] = (1000, 10000, 100000)
+OPERATIONS: Tuple[str, ...] = (
+    "load",
+    "find",
+    "add_or_update",
+    "changed",
+    "diff",
+    "save",
+)
+XML_BACKEND_BENCHMARK: str = "XMLBackend"
+XML_BACKEND_OPERATIONS: Tuple[str, ...] = ("parse", "serialize")
+XML_CONVERSION_BENCHMARK: str = "XMLConversion"
+XML_CONVERSION_OPERATIONS: Tuple[str, ...] = ("etree_to_dict", "dict_to_etree")
+# the converted subtrees of the generated config
+XML_CONVERSION_SUBTREES: Dict[str, str] = {
+    "aliases": "OPNsense/Firewall/Alias/aliases/alias",
+    "users": "system/user",
+}
+IMPORT_BENCHMARK: str = "Import"
+IMPORT_OPERATIONS: Tuple[str, ...] = ("startup", "import", "collection_import")
+COLLECTION_PACKAGE: str = "ansible_collections.puzzle.opnsense"
+MODULES_DIR: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "plugins", "modules"
+)
+# a line of python -X importtime: self and cumulative microseconds and the module
+IMPORT_TIME_RE: re.Pattern = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \|\s*(\S+)$")
+GALAXY_FILE: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "galaxy.yml"
+)
+
+
+# pylint: disable=too-few-public-methods
+class FakePHPExecutor(executor_utils.Executor):
+    """
+    Stands in for the PHP interpreter of OPNsense.
+
+    Password verifications succeed, password batches return a bcrypt hash per value and
+    every other command (e.g. configure functions) succeeds without output.
+    """
+
+    def run(self, args: List[str]) -> subprocess.CompletedProcess:
+        """
+        Answers a PHP command like the PHP interpreter of OPNsense would.
+
+        Args:
+            args (List[str]): The command, the PHP code is the last argument.
+
+        Returns:
+            subprocess.CompletedProcess: The successful result of the command.
+        """
+        php_cmd: str = args[-1]
+        stdout: str = ""
+        if "password_verify" in php_cmd:
+            stdout = "bool(true)"
+        else:
+            batch_values: Optional[re.Match] = re.search(
+                r"base64_decode\('([^']*)'\)", php_cmd
+            )
+            if batch_values:
+                values: list = json.loads(base64.b64decode(batch_values.group(1)))
+                stdout = json.dumps([config_generator.PASSWORD_HASH] * len(values))
+
+        return subprocess.CompletedProcess(args, 0, stdout.encode("utf-8"), b"")
+
+
+def _config_operations(path: str, size: int) -> Dict[str, Callable]:
+    del size
+
+    def load() -> OPNsenseModuleConfig:
+        return OPNsenseModuleConfig(
+            module_name="system_settings_general",
+            config_context_names=["system_settings_general"],
+            path=path,
+        )
+
+    return {
+        "load": load,
+        "find": operator.methodcaller("get", "hostname"),
+        "add_or_update": operator.methodcaller("set", "benchmark", "hostname"),
+        "changed": operator.attrgetter("changed"),
+        "diff": operator.attrgetter("diff"),
+        "save": OPNsenseModuleConfig.save,
+    }
+
+
+def _firewall_rules_operations(path: str, size: int) -> Dict[str, Callable]:
+    return {
+        "load": lambda: FirewallRuleSet(path),
+        # the last rule is the worst case of a linear search
+        "find": operator.methodcaller(
+            "find", descr=config_generator.rule_description(size - 1)
+        ),
+        "add_or_update": operator.methodcaller(
+            "add_or_update", FirewallRule(interface="lan", descr="Benchmark rule")
+        ),
+        "changed": operator.attrgetter("changed"),
+        "diff": operator.attrgetter("diff"),
+        "save": FirewallRuleSet.save,
+    }
+
+
+def _firewall_alias_operations(path: str, size: int) -> Dict[str, Callable]:
+    return {
+        "load": lambda: FirewallAliasSet(path),
+        "find": operator.methodcaller(
+            "find", name=config_generator.alias_name(size - 1)
+        ),
+        "add_or_update": operator.methodcaller(
+            "add_or_update",
+            FirewallAlias(name="benchmark_alias", type="host", content=["10.0.0.1"]),
+        ),
+        "changed": operator.attrgetter("changed"),
+        "diff": operator.attrgetter("diff"),
+        "save": FirewallAliasSet.save,
+    }
+
+
+def _users_operations(path: str, size: int) -> Dict[str, Callable]:
+    def load() -> UserSet:
+        user_set: UserSet = UserSet(path)
+        # hash in the stubbed PHP instead of an in-process bcrypt, which would dominate
+        user_set._hasher = SecretHasher(  # pylint: disable=protected-access
+            backend="php"
+        )
+        return user_set
+
+    return {
+        "load": load,
+        "find": operator.methodcaller(
+            "find", name=config_generator.user_name(size - 1)
+        ),
+        "add_or_update": operator.methodcaller(
+            "add_or_update",
+            User(name="benchmark_user", password="benchmark", descr="Benchmark user"),
+        ),
+        "changed": operator.attrgetter("changed"),
+        "diff": operator.attrgetter("diff"),
+        "save": UserSet.save,
+    }
+
+
+BENCHMARKS: Dict[str, Callable[[str, int], Dict[str, Callable]]] = {
+    "OPNsenseModuleConfig": _config_operations,
+    "FirewallRuleSet": _firewall_rules_operations,
+    "FirewallAliasSet": _firewall_alias_operations,
+    "UserSet": _users_operations,
+}
+
+
+def _summarize(
+    name: str, size: int, repeat: int, timings: Dict[str, List[float]]
+) -> List[dict]:
+    return [
+        {
+            "benchmark": name,
+            "size": size,
+            "operation": operation,
+            "repeat": repeat,
+            "min": min(durations),
+            "median": statistics.median(durations),
+            "mean": statistics.mean(durations),
+        }
+        for operation, durations in timings.items()
+    ]
+
+
+def run_xml_backend_benchmark(template_path: str, size: int, repeat: int) -> List[dict]:
+    """
+    Times parsing and serializing the generated config with every available XML backend.
+
+    Args:
+        template_path (str): The generated config.xml.
+        size (int): The number of rules, aliases and users in the config.
+        repeat (int): How many times the operations are timed.
+
+    Returns:
+        List[dict]: The timings of every backend and operation in seconds, the benchmark
+        is named after the backend, e.g. XMLBackend:lxml.
+    """
+
+    with open(template_path, "rb") as config_file:
+        data: bytes = config_file.read()
+
+    backends: List[str] = ["lxml", "etree"] if xml_utils.lxml_available() else ["etree"]
+    results: List[dict] = []
+    for backend in backends:
+        timings: Dict[str, List[float]] = {
+            operation: [] for operation in XML_BACKEND_OPERATIONS
+        }
+        with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+            for _ in range(repeat):
+                start: float = time.perf_counter()
+                root = xml_utils.parse_xml(data)
+                timings["parse"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                xml_utils.serialize_xml(root, xml_declaration=True)
+                timings["serialize"].append(time.perf_counter() - start)
+
+        for result in _summarize(
+            f"{XML_BACKEND_BENCHMARK}:{backend}", size, repeat, timings
+        ):
+            result["config_bytes"] = len(data)
+            results.append(result)
+
+    return results
+
+
+def run_xml_conversion_benchmark(
+    template_path: str, size: int, repeat: int
+) -> List[dict]:
+    """
+    Times converting the aliases and users of the generated config to dicts and back.
+
+    Args:
+        template_path (str): The generated config.xml.
+        size (int): The number of rules, aliases and users in the config.
+        repeat (int): How many times the operations are timed.
+
+    Returns:
+        List[dict]: The timings of every subtree and operation in seconds, the benchmark
+        is named after the subtree, e.g. XMLConversion:aliases.
+    """
+
+    with open(template_path, "rb") as config_file:
+        root = xml_utils.parse_xml(config_file.read())
+
+    results: List[dict] = []
+    for subtree, xpath in XML_CONVERSION_SUBTREES.items():
+        elements: list = root.findall(xpath)
+        timings: Dict[str, List[float]] = {
+            operation: [] for operation in XML_CONVERSION_OPERATIONS
+        }
+        for _ in range(repeat):
+            start: float = time.perf_counter()
+            dicts: List[dict] = [
+                xml_utils.etree_to_dict(element) for element in elements
+            ]
+            timings["etree_to_dict"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for element_dict in dicts:
+                for tag, value in element_dict.items():
+                    xml_utils.dict_to_etree(tag, value)
+            timings["dict_to_etree"].append(time.perf_counter() - start)
+
+        results.extend(
+            _summarize(f"{XML_CONVERSION_BENCHMARK}:{subtree}", size, repeat, timings)
+        )
+
+    return results
+
+
+def _import_timings(module_name: str) -> Tuple[float, float, float]:
+    """
+    Imports a module in a fresh interpreter with python -X importtime.
+
+    Returns:
+        Tuple[float, float, float]: The wall time of the interpreter, the cumulative import
+        time of the module and the summed own import time of all modules of the
+        collection, in seconds.
+    """
+
+    env: Dict[str, str] = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(path for path in sys.path if path)
+
+    start: float = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    startup: float = time.perf_counter() - start
+
+    module_import: float = 0.0
+    collection_import: float = 0.0
+    for line in process.stderr.splitlines():
+        match: Optional[re.Match] = IMPORT_TIME_RE.match(line)
+        if match is None:
+            continue
+        if match.group(3).startswith(COLLECTION_PACKAGE):
+            collection_import += int(match.group(1)) / 1e6
+        if match.group(3) == module_name:
+            module_import = int(match.group(2)) / 1e6
+
+    return startup, module_import, collection_import
+
+
+def run_import_benchmark(repeat: int) -> List[dict]:
+    """
+    Times the cold start of every module of the collection.
+
+    Args:
+        repeat (int): How many times every module is imported.
+
+    Returns:
+        List[dict]: The timings of every module in seconds, the benchmark is named after
+        the module, e.g. Import:firewall_rules.
+    """
+
+    results: List[dict] = []
+    for file_name in sorted(os.listdir(MODULES_DIR)):
+        if not file_name.endswith(".py") or file_name == "__init__.py":
+            continue
+
+        name: str = file_name[: -len(".py")]
+        timings: Dict[str, List[float]] = {
+            operation: [] for operation in IMPORT_OPERATIONS
+        }
+        for _ in range(repeat):
+            for operation, duration in zip(
+                IMPORT_OPERATIONS,
+                _import_timings(f"{COLLECTION_PACKAGE}.plugins.modules.{name}"),
+            ):
+                timings[operation].append(duration)
+
+        results.extend(_summarize(f"{IMPORT_BENCHMARK}:{name}", 0, repeat, timings))
+
+    return results
+
+
+def _report(report: dict, results: List[dict]) -> None:
+    for result in results:
+        report["results"].append(result)
+        print(
+            f"{result['benchmark']:<22} {result['size']:>8} "
+            f"{result['operation']:<14} {result['median']:.6f}s",
+            file=sys.stderr,
+        )
+
+
+def run_benchmark(
+    name: str, template_path: str, size: int, repeat: int, work_dir: str
+) -> List[dict]:
+    """
+    Times the operations of a benchmark, each on a fresh copy of the generated config.
+
+    Args:
+        name (str): The name of the benchmark in BENCHMARKS.
+        template_path (str): The generated config.xml.
+        size (int): The number of rules, aliases and users in the config.
+        repeat (int): How many times the operations are timed.
+        work_dir (str): Directory for the copies of the config.
+
+    Returns:
+        List[dict]: The timings of every operation in seconds.
+    """
+
+    timings: Dict[str, List[float]] = {operation: [] for operation in OPERATIONS}
+
+    for _ in range(repeat):
+        path: str = os.path.join(work_dir, "config.xml")
+        shutil.copyfile(template_path, path)
+
+        # load returns the config, which every other operation is called with
+        operations: Dict[str, Callable] = BENCHMARKS[name](path, size)
+        start: float = time.perf_counter()
+        config = operations["load"]()
+        timings["load"].append(time.perf_counter() - start)
+        for operation in OPERATIONS[1:]:
+            start = time.perf_counter()
+            operations[operation](config)
+            timings[operation].append(time.perf_counter() - start)
+
+    return _summarize(name, size, repeat, timings)
+
+
+def collection_version() -> Optional[str]:
+    """Returns the version of the collection from galaxy.yml."""
+    try:
+        with open(GALAXY_FILE, "r", encoding="utf-8") as galaxy_file:
+            match: Optional[re.Match] = re.search(
+                r"^version:\s*(\S+)", galaxy_file.read(), re.MULTILINE
+            )
+    except OSError:
+        return None
+
+    return match.group(1) if match else None
+
+
+def run_benchmarks(
+    sizes: List[int],
+    benchmarks: List[str],
+    repeat: int,
+    seed: int = 0,
+    replay: Optional[str] = None,
+) -> dict:
+    """
+    Runs the benchmarks on generated configurations of the given sizes.
+
+    The PHP commands are answered by FakePHPExecutor, or from the fixtures recorded with
+    OPNSENSE_EXECUTOR=record if replay is set, see executor_utils. The commands which
+    were not recorded are still answered by FakePHPExecutor.
+
+    Returns:
+        dict: The metadata of the run and the results of every benchmark.
+    """
+
+    report: dict = {
+        "metadata": {
+            "collection_version": collection_version(),
+            "python_version": platform.python_version(),
+            "python_implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "opnsense_version": BENCHMARK_OPNSENSE_VERSION,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "repeat": repeat,
+            "seed": seed,
+            "xml_backend": xml_utils.xml_backend(),
+            "replay": replay,
+        },
+        "results": [],
+    }
+
+    executor: executor_utils.Executor = FakePHPExecutor()
+    if replay:
+        executor = executor_utils.ReplayingExecutor(replay, fallback=executor)
+    previous_executor: Optional[executor_utils.Executor] = executor_utils.set_executor(
+        executor
+    )
+
+    try:
+        with patch.object(
+            version_utils,
+            "get_opnsense_version",
+            return_value=BENCHMARK_OPNSENSE_VERSION,
+        ), tempfile.TemporaryDirectory() as work_dir:
+            if IMPORT_BENCHMARK in benchmarks:
+                _report(report, run_import_benchmark(repeat))
+
+            for size in sizes:
+                template_path: str = os.path.join(work_dir, f"config-{size}.xml")
+                config_generator.write_config(
+                    template_path,
+                    rules=size,
+                    aliases=size,
+                    users=size,
+                    interfaces=max(2, size // 100),
+                    seed=seed,
+                )
+
+                for name in benchmarks:
+                    if name == IMPORT_BENCHMARK:
+                        continue
+                    if name == XML_BACKEND_BENCHMARK:
+                        results: List[dict] = run_xml_backend_benchmark(
+                            template_path, size, repeat
+                        )
+                    elif name == XML_CONVERSION_BENCHMARK:
+                        results = run_xml_conversion_benchmark(
+                            template_path, size, repeat
+                        )
+                    else:
+                        results = run_benchmark(
+                            name, template_path, size, repeat, work_dir
+                        )
+                    _report(report, results)
+
+                os.unlink(template_path)
+    finally:
+        executor_utils.set_executor(previous_executor)
+
+    return report
+
+
+def main() -> None:
+    """
+    Runs the benchmarks selected on the command line and writes the results.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda sizes: [int(size) for size in sizes.split(",")],
+        default=list(DEFAULT_SIZES),
+        help="comma separated numbers of rules, aliases and users",
+    )
+    extra_benchmarks: List[str] = [
+        XML_BACKEND_BENCHMARK,
+        XML_CONVERSION_BENCHMARK,
+        IMPORT_BENCHMARK,
+    ]
+    parser.add_argument(
+        "--benchmarks",
+        type=lambda names: names.split(","),
+        default=list(BENCHMARKS) + extra_benchmarks,
+        help="comma separated benchmarks, out of "
+        f"{', '.join(list(BENCHMARKS) + extra_benchmarks)}",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--replay",
+        help="fixtures recorded with OPNSENSE_EXECUTOR=record to answer PHP commands",
+    )
+    parser.add_argument(
+        "--output", default="benchmark-results.json", help="path of the JSON results"
+    )
+    args = parser.parse_args()
+
+    unknown: List[str] = [
+        name
+        for name in args.benchmarks
+        if name not in BENCHMARKS and name not in extra_benchmarks
+    ]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    report: dict = run_benchmarks(
+        args.sizes, args.benchmarks, args.repeat, args.seed, args.replay
+    )
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
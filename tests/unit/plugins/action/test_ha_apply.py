@@ -0,0 +1,76 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import pytest
+from ansible.errors import AnsibleActionFail
+
+from ansible_collections.puzzle.opnsense.plugins.action.ha_apply import (
+    finish_node,
+    marker_dir,
+    previous_node,
+    remove_markers,
+    wait_for_node,
+    write_marker,
+)
+
+
+@pytest.fixture(autouse=True)
+def temp_dir(tmp_path, monkeypatch):
+    """
+    Keeps the markers written by the tests out of the temporary directory of the system.
+    """
+
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    return tmp_path
+
+
+def test_previous_node():
+    nodes = ["secondary", "primary"]
+    assert previous_node(nodes, "secondary") is None
+    assert previous_node(nodes, "primary") == "secondary"
+    assert previous_node(nodes, "other") is None
+
+
+def test_wait_for_node_staggers_apply():
+    run_id = str(uuid.uuid4())
+
+    def apply_previous_node():
+        time.sleep(0.2)
+        write_marker(run_id, "secondary", "done")
+
+    thread = threading.Thread(target=apply_previous_node)
+    thread.start()
+
+    start = time.monotonic()
+    assert wait_for_node(run_id, "secondary", timeout=5, interval=0.05) == "done"
+    assert time.monotonic() - start >= 0.2
+    thread.join()
+
+
+def test_wait_for_node_reports_failure_and_timeout():
+    run_id = str(uuid.uuid4())
+    write_marker(run_id, "secondary", "failed")
+    assert wait_for_node(run_id, "secondary", timeout=1) == "failed"
+
+    with pytest.raises(AnsibleActionFail):
+        wait_for_node(run_id, "primary", timeout=0.1, interval=0.05)
+
+
+def test_markers_are_removed_by_the_last_node(temp_dir):
+    run_id = str(uuid.uuid4())
+    nodes = ["secondary", "primary"]
+
+    finish_node(run_id, "secondary", nodes, "done")
+    assert os.path.isdir(marker_dir(run_id))
+    assert marker_dir(run_id).startswith(str(temp_dir))
+
+    finish_node(run_id, "primary", nodes, "failed")
+    assert not os.path.exists(marker_dir(run_id))
+
+    assert remove_markers(run_id, nodes) is False
@@ -0,0 +1,108 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import os
+from unittest.mock import patch
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import apply_utils
+
+
+@pytest.fixture
+def pending_path(tmp_path):
+    return str(tmp_path / "pending_apply.json")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("", False), ("0", False), ("false", False), ("1", True), ("yes", True)],
+)
+def test_apply_deferred(value, expected):
+    with patch.dict(os.environ, {apply_utils.DEFER_APPLY_ENV: value}):
+        assert apply_utils.apply_deferred() is expected
+
+
+def test_defer_functions_deduplicates(pending_path):
+    output = apply_utils.defer_functions(
+        ["req_1"],
+        [{"name": "filter_configure", "configure_params": []}],
+        path=pending_path,
+    )
+    apply_utils.defer_functions(
+        ["req_1", "req_2"],
+        [
+            {"name": "filter_configure", "configure_params": []},
+            {"name": "system_cron_configure", "configure_params": ["true"]},
+        ],
+        path=pending_path,
+    )
+
+    assert output == [
+        {"function": "filter_configure", "params": [], "deferred": True, "rc": 0}
+    ]
+    assert apply_utils.load_pending(pending_path) == {
+        "php_requirements": ["req_1", "req_2"],
+        "functions": [
+            {"name": "filter_configure", "configure_params": []},
+            {"name": "system_cron_configure", "configure_params": ["true"]},
+        ],
+    }
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.apply_utils.opnsense_utils.run_function",
+    return_value={"stdout": "", "stderr": "", "rc": 0},
+)
+def test_apply_pending(mock_run_function, pending_path):
+    apply_utils.defer_functions(
+        ["req_1"],
+        [{"name": "filter_configure", "configure_params": []}],
+        path=pending_path,
+    )
+
+    output = apply_utils.apply_pending(pending_path)
+
+    assert output == [
+        {
+            "function": "filter_configure",
+            "params": [],
+            "stdout": "",
+            "stderr": "",
+            "rc": 0,
+        }
+    ]
+    mock_run_function.assert_called_once_with(
+        php_requirements=["req_1"],
+        configure_function="filter_configure",
+        configure_params=[],
+    )
+    assert not os.path.exists(pending_path)
+    assert apply_utils.apply_pending(pending_path) == []
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.apply_utils.opnsense_utils.run_function",
+    return_value={"stdout": "", "stderr": "error", "rc": 1},
+)
+def test_apply_pending_keeps_failed_functions(mock_run_function, pending_path):
+    apply_utils.defer_functions(
+        [], [{"name": "filter_configure", "configure_params": []}], path=pending_path
+    )
+
+    assert apply_utils.apply_pending(pending_path)[0]["rc"] == 1
+    assert apply_utils.load_pending(pending_path)["functions"] == [
+        {"name": "filter_configure", "configure_params": []}
+    ]
+
+
+def test_pending_apply_file_from_environment(pending_path):
+    with patch.dict(os.environ, {apply_utils.PENDING_APPLY_FILE_ENV: pending_path}):
+        apply_utils.defer_functions(
+            [], [{"name": "filter_configure", "configure_params": []}]
+        )
+
+        assert apply_utils.pending_apply_file() == pending_path
+        assert apply_utils.load_pending()["functions"] == [
+            {"name": "filter_configure", "configure_params": []}
+        ]
@@ -9,6 +9,7 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__val = type
 
+import fcntl
 import os
 from tempfile import NamedTemporaryFile
 from typing import List, Dict
@@ -16,8 +17,14 @@ from unittest.mock import patch, MagicMock
 from xml.etree.ElementTree import Element
 
 import pytest
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    apply_utils,
+    opnsense_utils,
+    xml_utils,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.config_utils import (
     OPNsenseModuleConfig,
+    SectionedModuleConfig,
     UnsupportedOPNsenseVersion,
     UnsupportedModuleSettingError,
     ModuleMisconfigurationError,
@@ -396,6 +403,30 @@ def test_get_configure_functions(sample_config_path):
         )
 
 
+def test_config_maps_per_instance(sample_config_path):
+    """
+    Test case to verify that removing a config map from one instance keeps it in others.
+
+    Args:
+    - sample_config_path (str): The path to the temporary test configuration file.
+    """
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=True,
+    ) as first_config:
+        first_config._config_maps.pop("test_module")
+
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=True,
+    ) as second_config:
+        assert "test_module" in second_config._config_maps
+
+
 def test_changed(sample_config_path):
     """
     Test case to verify that the `changed` property correctly identifies changes
@@ -415,6 +446,7 @@ def test_changed(sample_config_path):
         new_config.save()
 
 
+@patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: "etree"})
 def test_get_setting(sample_config_path):
     """
     Test case to verify the correct retrieval of a specific setting from the OPNsense configuration.
@@ -576,3 +608,235 @@ def test_success_set_on_empty_leaf_node(sample_config_path):
         new_config.set("test", "remote_system_username")
         assert new_config.get("remote_system_username").text == "test"
         new_config.save()
+
+
+@patch.object(opnsense_utils, "run_function")
+def test_apply_settings_deferred(mock_run_function, sample_config_path, tmp_path):
+    """
+    Test case to verify that configure functions are only recorded as pending
+    if OPNSENSE_DEFER_APPLY is set.
+    """
+    pending_path = str(tmp_path / "pending_apply.json")
+
+    with patch.dict(os.environ, {apply_utils.DEFER_APPLY_ENV: "1"}), patch.object(
+        apply_utils, "PENDING_APPLY_FILE", pending_path
+    ):
+        with OPNsenseModuleConfig(
+            module_name="test_module",
+            config_context_names=["test_module"],
+            path=sample_config_path,
+            check_mode=False,
+        ) as new_config:
+            output = new_config.apply_settings()
+
+    mock_run_function.assert_not_called()
+    assert output == [
+        {
+            "function": "test_configure_function",
+            "params": ["param_1"],
+            "deferred": True,
+            "rc": 0,
+        }
+    ]
+    assert apply_utils.load_pending(pending_path) == {
+        "php_requirements": ["req_1", "req_2"],
+        "functions": [
+            {"name": "test_configure_function", "configure_params": ["param_1"]}
+        ],
+    }
+
+
+@patch.object(opnsense_utils, "run_function")
+def test_lock_released_before_apply_settings(mock_run_function, sample_config_path):
+    """
+    Test case to verify that the lock is released once the config is saved, so that
+    configure functions can lock and write the config file themselves.
+    """
+
+    def configure_function(**_kwargs):
+        # like write_config in another process, which locks the config file exclusively
+        file_descriptor = os.open(sample_config_path, os.O_RDONLY)
+        try:
+            fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        finally:
+            os.close(file_descriptor)
+        return {"stdout": "", "stderr": "", "rc": 0}
+
+    mock_run_function.side_effect = configure_function
+
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=False,
+    ) as new_config:
+        new_config.set(value="testtest", setting="hostname")
+        new_config.save()
+
+        assert not new_config._state.lock.acquired
+        assert [output["rc"] for output in new_config.apply_settings()] == [0]
+
+
+def test_save_does_not_parse_written_config(sample_config_path):
+    """
+    Test case to verify that a save replaces the config atomically and uses the written
+    content as the baseline of changed instead of parsing the file again.
+    """
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=False,
+    ) as new_config:
+        new_config.set(value="testtest", setting="hostname")
+
+        with patch.object(
+            OPNsenseModuleConfig,
+            "_load_config",
+            autospec=True,
+            side_effect=OPNsenseModuleConfig._load_config,
+        ) as mock_load_config, patch(
+            "ansible_collections.puzzle.opnsense.plugins.module_utils.file_utils.os.fsync"
+        ) as mock_fsync:
+            assert new_config.save()
+            assert not new_config.changed
+
+        # the file is not read again, changed compares against the in-memory baseline
+        mock_load_config.assert_not_called()
+        mock_fsync.assert_called()
+
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=False,
+    ) as saved_config:
+        assert saved_config.get("hostname").text == "testtest"
+
+
+def test_save_skips_identical_content(sample_config_path):
+    """
+    Test case to verify that the config file is not rewritten if its content did not change.
+    """
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=False,
+    ) as new_config:
+        new_config.set(value="testtest", setting="hostname")
+        new_config.save()
+        modified_time = os.stat(sample_config_path).st_mtime_ns
+
+        with patch(
+            "ansible_collections.puzzle.opnsense.plugins.module_utils.file_utils.atomic_write"
+        ) as mock_atomic_write:
+            assert new_config.save(override_changed=True)
+
+        mock_atomic_write.assert_not_called()
+        assert os.stat(sample_config_path).st_mtime_ns == modified_time
+
+
+def test_check_mode_uses_in_memory_baseline(sample_config_path):
+    """
+    Test case to verify that changed and diff in check mode compare against the config
+    as loaded, without reading the config file again.
+    """
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=True,
+    ) as new_config:
+        assert not new_config.changed
+        new_config.set(value="testtest", setting="hostname")
+
+        with patch("builtins.open", side_effect=AssertionError("config file read")):
+            assert new_config.changed
+            assert new_config.diff == {
+                "before": {"system/hostname": "test_name"},
+                "after": {"system/hostname": "testtest"},
+            }
+
+        assert new_config.check_mode
+        assert not new_config.approximations
+
+
+def test_sectioned_config_keeps_other_sections(sample_config_path):
+    """
+    Test case to verify that a sectioned config only parses the sections addressed by
+    its config maps and writes all other sections back unchanged.
+    """
+    with SectionedModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module"],
+        path=sample_config_path,
+        check_mode=False,
+    ) as new_config:
+        assert [section.tag for section in new_config._config_xml_tree] == ["system"]
+        assert not new_config.changed
+
+        new_config.set(value="testtest", setting="hostname")
+        assert new_config.changed
+        assert new_config.diff == {
+            "before": {"system/hostname": "test_name"},
+            "after": {"system/hostname": "testtest"},
+        }
+        assert new_config.save()
+        assert not new_config.changed
+
+    with open(sample_config_path, "rb") as config_file:
+        data: bytes = config_file.read()
+
+    assert data == TEST_XML.encode().replace(b"test_name", b"testtest")
+
+
+def test_settings_are_indexed(sample_config_path):
+    """
+    Test case to verify that the elements of the settings are resolved once at load and
+    kept current when settings are created and removed.
+    """
+    with OPNsenseModuleConfig(
+        module_name="test_module",
+        config_context_names=["test_module", "test_module_3"],
+        path=sample_config_path,
+        check_mode=False,
+    ) as new_config:
+        with patch.object(new_config, "_config_xml_tree") as mock_tree:
+            hostname = new_config.get("hostname")
+            new_config.set(value="testtest", setting="hostname")
+        mock_tree.find.assert_not_called()
+        assert new_config.get("hostname") is hostname
+        assert hostname.text == "testtest"
+
+        assert new_config.get("preserve_logs") is None
+        new_config.set(value="10", setting="preserve_logs")
+        assert new_config.get("preserve_logs") is new_config._config_xml_tree.find(
+            "syslog/preservelogs"
+        )
+
+        new_config.remove("preserve_logs")
+        assert new_config.get("preserve_logs") is None
+        assert new_config._config_xml_tree.find("syslog/preservelogs") is None
+        new_config.remove("preserve_logs")
+
+        with pytest.raises(ModuleMisconfigurationError):
+            new_config.remove("timezone")
+        new_config.save()
+
+
+def test_conflicting_settings_raise_error(sample_config_path):
+    """
+    Test case to verify that a setting mapped to different XPaths by two config contexts
+    raises a ModuleMisconfigurationError.
+    """
+    with patch.dict(
+        TEST_VERSION_MAP["OPNsense Test"],
+        {"conflicting_module": {"hostname": "system/timezone"}},
+    ), pytest.raises(ModuleMisconfigurationError, match="hostname"):
+        OPNsenseModuleConfig(
+            module_name="test_module",
+            config_context_names=["test_module", "conflicting_module"],
+            path=sample_config_path,
+            check_mode=False,
+        )
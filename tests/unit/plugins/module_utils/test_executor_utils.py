@@ -0,0 +1,177 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import json
+import os
+import stat
+import subprocess
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    executor_utils,
+    opnsense_utils,
+    version_utils,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.executor_utils import (
+    EXECUTOR_ENV,
+    EXECUTOR_FIXTURES_ENV,
+    ExecutorUsageError,
+    PooledExecutor,
+    RecordingExecutor,
+    ReplayingExecutor,
+    SubprocessExecutor,
+)
+
+# echoes the script it reads from stdin, like a PHP interpreter running echo
+FAKE_PHP: str = f"""#!{sys.executable}
+import sys
+sys.stdout.write(sys.stdin.read())
+"""
+
+
+@pytest.fixture
+def fixtures_path(tmp_path):
+    """The fixtures of a command run twice with different output and of a PHP command."""
+    fixtures_path = str(tmp_path / "fixtures.jsonl")
+    recorder = RecordingExecutor(fixtures_path)
+    script = "import sys, os; print(len(os.listdir(sys.argv[1]))); sys.exit(3)"
+    for _ in range(2):
+        recorder.run([sys.executable, "-c", script, str(tmp_path)])
+
+    with patch.object(
+        SubprocessExecutor,
+        "run",
+        lambda self, args: subprocess.CompletedProcess(args, 0, b"done", b""),
+    ):
+        recorder.run(
+            [
+                "php",
+                "-r",
+                "require '/usr/local/etc/inc/filter.inc'; filter_configure();",
+            ]
+        )
+
+    return fixtures_path
+
+
+def test_recorded_commands_are_replayed(fixtures_path, tmp_path):
+    assert stat.S_IMODE(os.stat(fixtures_path).st_mode) == 0o600
+    with open(fixtures_path, "r", encoding="utf-8") as fixtures_file:
+        assert len(fixtures_file.readlines()) == 3
+
+    replayer = ReplayingExecutor(fixtures_path)
+    args = [
+        sys.executable,
+        "-c",
+        "import sys, os; print(len(os.listdir(sys.argv[1]))); sys.exit(3)",
+        str(tmp_path),
+    ]
+    # the first run did not see the fixtures file yet
+    assert replayer.run(args).stdout == b"0\n"
+    assert replayer.run(args).stdout == b"1\n"
+    assert replayer.run(args).returncode == 3
+    result = replayer.run(
+        ["php", "-r", "require '/usr/local/etc/inc/filter.inc'; filter_configure();"]
+    )
+    assert (result.returncode, result.stdout, result.stderr) == (0, b"done", b"")
+
+    with pytest.raises(ExecutorUsageError, match="was not recorded"):
+        replayer.run(["php", "-r", "system_cron_configure();"])
+    with pytest.raises(subprocess.CalledProcessError):
+        replayer.check_output(args)
+
+
+def test_replay_falls_back_for_unrecorded_commands(fixtures_path):
+    replayer = ReplayingExecutor(fixtures_path, fallback=SubprocessExecutor())
+
+    assert replayer.check_output([sys.executable, "-c", "print('live')"]) == "live\n"
+
+
+def test_modules_run_commands_with_selected_executor(fixtures_path, tmp_path):
+    with open(fixtures_path, "a", encoding="utf-8") as fixtures_file:
+        fixtures_file.write(
+            json.dumps(
+                {
+                    "args": ["opnsense-version", "-O"],
+                    "rc": 0,
+                    "stdout": '{"product_series": "24.7"}\n',
+                    "stderr": "",
+                }
+            )
+            + "\n"
+        )
+
+    with patch.dict(
+        os.environ, {EXECUTOR_ENV: "replay", EXECUTOR_FIXTURES_ENV: fixtures_path}
+    ):
+        assert version_utils.get_opnsense_version() == "24.7"
+        assert (
+            opnsense_utils.run_function(
+                php_requirements=["/usr/local/etc/inc/filter.inc"],
+                configure_function="filter_configure",
+            )["stdout"]
+            == "done"
+        )
+
+        # the executor is selected again if the environment changes
+        with patch.dict(os.environ, {EXECUTOR_FIXTURES_ENV: str(tmp_path / "new")}):
+            with pytest.raises(FileNotFoundError):
+                version_utils.get_opnsense_version()
+
+
+def test_set_executor_overrides_environment(fixtures_path):
+    replayer = ReplayingExecutor(fixtures_path)
+    with patch.dict(os.environ, {EXECUTOR_ENV: "unknown"}):
+        previous = executor_utils.set_executor(replayer)
+        try:
+            assert executor_utils.get_executor() is replayer
+        finally:
+            assert executor_utils.set_executor(previous) is replayer
+
+        with pytest.raises(ExecutorUsageError, match="Unknown executor"):
+            executor_utils.get_executor()
+
+    with patch.dict(os.environ, {EXECUTOR_ENV: "record", EXECUTOR_FIXTURES_ENV: ""}):
+        with pytest.raises(ExecutorUsageError, match="requires the fixtures file"):
+            executor_utils.get_executor()
+
+
+def test_executors_must_implement_run():
+    with pytest.raises(TypeError):
+        executor_utils.Executor()
+
+    class EchoExecutor(executor_utils.Executor):
+        def run(self, args):
+            return subprocess.CompletedProcess(args, 0, " ".join(args).encode(), b"")
+
+    assert EchoExecutor().check_output(["opnsense-version", "-v"]) == (
+        "opnsense-version -v"
+    )
+
+
+def test_pooled_executor_starts_next_php_ahead(tmp_path):
+    php_path = tmp_path / "php"
+    php_path.write_text(FAKE_PHP)
+    php_path.chmod(0o700)
+
+    executor = PooledExecutor()
+    with patch.dict(
+        os.environ, {"PATH": f"{tmp_path}{os.pathsep}{os.environ['PATH']}"}
+    ):
+        result = executor.run(["php", "-r", "echo 'pooled';"])
+        assert (result.returncode, result.stdout) == (0, b"<?php echo 'pooled';")
+        (worker,) = executor._workers
+        assert worker.poll() is None
+
+        assert executor.run(["php", "-r", "echo 'next';"]).stdout.endswith(b"next';")
+        assert executor._workers[0] is not worker
+        assert worker.returncode == 0
+
+        # other commands are run like by SubprocessExecutor
+        assert executor.check_output([sys.executable, "-c", "print(1)"]) == "1\n"
+
+        executor.close()
+    assert not executor._workers
@@ -0,0 +1,77 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Tests for the ansible_collections.puzzle.opnsense.plugins.module_utils.file_utils module.
+"""
+
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+from ansible_collections.puzzle.opnsense.plugins.module_utils import file_utils
+
+
+def test_atomic_write_creates_file(tmp_path):
+    """
+    Test that atomic_write creates a missing file with the default mode and
+    leaves no temporary file behind.
+    """
+    path = tmp_path / "config.xml"
+
+    file_utils.atomic_write(str(path), b"<opnsense/>")
+
+    assert path.read_bytes() == b"<opnsense/>"
+    assert stat.S_IMODE(os.stat(path).st_mode) == file_utils.DEFAULT_FILE_MODE
+    assert os.listdir(tmp_path) == ["config.xml"]
+
+
+def test_atomic_write_keeps_mode(tmp_path):
+    """
+    Test that atomic_write keeps the mode of the replaced file.
+    """
+    path = tmp_path / "config.xml"
+    path.write_bytes(b"<opnsense/>")
+    os.chmod(path, 0o640)
+
+    file_utils.atomic_write(str(path), b"<opnsense><system/></opnsense>")
+
+    assert path.read_bytes() == b"<opnsense><system/></opnsense>"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+
+
+def test_atomic_write_with_mode(tmp_path):
+    """
+    Test that atomic_write creates the file with the given mode.
+    """
+    path = tmp_path / "state.json"
+
+    file_utils.atomic_write(str(path), b"{}", mode=0o600)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_atomic_write_failure_keeps_file(tmp_path):
+    """
+    Test that a failed write keeps the original file and removes the
+    temporary file.
+    """
+    path = tmp_path / "config.xml"
+    path.write_bytes(b"<opnsense/>")
+
+    with patch.object(file_utils.os, "fsync", side_effect=OSError("disk full")):
+        with pytest.raises(OSError, match="disk full"):
+            file_utils.atomic_write(str(path), b"<opnsense><system/></opnsense>")
+
+    assert path.read_bytes() == b"<opnsense/>"
+    assert os.listdir(tmp_path) == ["config.xml"]
+
+
+def test_digest():
+    """
+    Test that digest is the same for the same content and differs for
+    different content.
+    """
+    assert file_utils.digest(b"<opnsense/>") == file_utils.digest(b"<opnsense/>")
+    assert file_utils.digest(b"<opnsense/>") != file_utils.digest(b"<opnsense />")
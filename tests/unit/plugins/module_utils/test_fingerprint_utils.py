@@ -0,0 +1,131 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import json
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    file_utils,
+    snapshot_utils,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.fingerprint_utils import (
+    FINGERPRINTS_ENV,
+    FingerprintStore,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils import (
+    OPNSENSE_VERSION_ENV,
+)
+
+CONFIG: bytes = b"<opnsense><system><hostname>fw</hostname></system></opnsense>"
+PARAMS: dict = {"name": "host_1", "content": ["10.0.0.1"], "password": "secret"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A store next to a config file, with fingerprints enabled."""
+    config_path = tmp_path / "config.xml"
+    config_path.write_bytes(CONFIG)
+    with patch.dict(os.environ, {FINGERPRINTS_ENV: "1", OPNSENSE_VERSION_ENV: "24.7"}):
+        yield FingerprintStore(config_path=str(config_path))
+
+
+def test_recorded_run_matches(store):
+    fingerprint = store.fingerprint("firewall_alias", {"name": "host_1"}, PARAMS)
+    assert not store.matches(fingerprint)
+
+    store.record(fingerprint, file_utils.digest(CONFIG))
+
+    assert store.matches(
+        store.fingerprint("firewall_alias", {"name": "host_1"}, dict(PARAMS))
+    )
+    assert stat.S_IMODE(os.stat(store.path).st_mode) == 0o600
+    # the parameters are not stored in plain text
+    with open(store.path, "r", encoding="utf-8") as store_file:
+        assert "secret" not in store_file.read()
+
+
+def test_changed_params_do_not_match(store):
+    store.record(
+        store.fingerprint("firewall_alias", {"name": "host_1"}, PARAMS),
+        file_utils.digest(CONFIG),
+    )
+
+    assert not store.matches(
+        store.fingerprint(
+            "firewall_alias", {"name": "host_1"}, {**PARAMS, "content": ["10.0.0.2"]}
+        )
+    )
+    assert not store.matches(
+        store.fingerprint("firewall_alias", {"name": "host_2"}, PARAMS)
+    )
+
+
+def test_config_edited_outside_ansible_invalidates(store):
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+    store.record(fingerprint, file_utils.digest(CONFIG))
+
+    with open(store.config_path, "wb") as config_file:
+        config_file.write(CONFIG.replace(b"fw", b"gui-edit"))
+
+    assert not store.matches(fingerprint)
+
+
+def test_run_on_other_config_does_not_match(store):
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+    store.record(fingerprint, file_utils.digest(b"<opnsense/>"))
+
+    assert not store.matches(fingerprint)
+
+
+def test_opnsense_update_invalidates(store):
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+    store.record(fingerprint, file_utils.digest(CONFIG))
+
+    with patch.dict(os.environ, {OPNSENSE_VERSION_ENV: "25.1"}):
+        assert not FingerprintStore(config_path=store.config_path).matches(fingerprint)
+    assert FingerprintStore(config_path=store.config_path).matches(fingerprint)
+
+
+def test_collection_update_invalidates(store):
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+    store.record(fingerprint, file_utils.digest(CONFIG))
+
+    with patch.object(snapshot_utils, "collection_code_digest", return_value="updated"):
+        assert not FingerprintStore(config_path=store.config_path).matches(fingerprint)
+
+
+def test_unknown_version_records_nothing(store):
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+
+    with patch.dict(os.environ, {OPNSENSE_VERSION_ENV: "", "PATH": ""}):
+        store.record(fingerprint, file_utils.digest(CONFIG))
+
+    assert not os.path.exists(store.path)
+
+
+def test_disabled(store):
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+    store.record(fingerprint, file_utils.digest(CONFIG))
+
+    with patch.dict(os.environ, {FINGERPRINTS_ENV: "0"}):
+        assert not store.matches(fingerprint)
+        store.clear()
+        store.record(fingerprint, file_utils.digest(CONFIG))
+
+    assert not os.path.exists(store.path)
+
+
+def test_corrupt_store_is_ignored(store):
+    with open(store.path, "w", encoding="utf-8") as store_file:
+        store_file.write("{not json")
+    fingerprint = store.fingerprint("system_settings_general", {}, PARAMS)
+
+    assert not store.matches(fingerprint)
+    store.record(fingerprint, file_utils.digest(CONFIG))
+    assert store.matches(fingerprint)
+    with open(store.path, "r", encoding="utf-8") as store_file:
+        assert len(json.load(store_file)["entries"]) == 1
@@ -0,0 +1,250 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Tests for the plugins.module_utils.firewall_alias_table_utils module."""
+
+# This is probably intentional and required for the fixture
+# pylint: disable=redefined-outer-name,unused-argument,protected-access
+
+import functools
+import http.server
+import os
+import subprocess
+import threading
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import executor_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_alias_table_utils import (
+    AliasTableCache,
+    OPNsenseAliasTableNameError,
+    OPNsenseAliasTableSourceError,
+    load_table_source,
+    normalize_table_entries,
+)
+
+TEST_SOURCE: str = """; Spamhaus DROP List
+# comment
+1.10.16.0/20 ; SBL256894
+1.10.16.0/24
+10.0.0.1
+10.0.0.0/31
+192.168.1.7/24
+not-an-address
+2001:db8::/33
+2001:db8:8000::/33
+2001:db8::1/128
+"""
+
+
+@pytest.fixture
+def table_cache(tmp_path) -> AliasTableCache:
+    """Returns an AliasTableCache operating in a temporary directory."""
+    geoip_dir = tmp_path / "geoip"
+    geoip_dir.mkdir()
+    (geoip_dir / "CH-IPv4").write_text("5.1.48.0/21\n5.1.56.0/21\n")
+    (geoip_dir / "CH-IPv6").write_text("2001:620::/29\n")
+    return AliasTableCache(
+        table_dir=str(tmp_path / "aliastables"), geoip_dir=str(geoip_dir)
+    )
+
+
+def test_normalize_table_entries():
+    """
+    Comments and invalid entries are dropped, host bits are cleared and networks
+    contained in or adjacent to others are merged.
+    """
+    assert normalize_table_entries(TEST_SOURCE.splitlines()) == [
+        "1.10.16.0/20",
+        "10.0.0.0/31",
+        "192.168.1.0/24",
+        "2001:db8::/32",
+    ]
+
+
+def test_load_table_source_skips_unmodified_file(tmp_path):
+    """
+    A file source which was not modified since the given mtime is not read again.
+    """
+    source = tmp_path / "source.txt"
+    source.write_text(TEST_SOURCE)
+
+    first = load_table_source(str(source))
+    assert not first.not_modified
+    assert first.content == TEST_SOURCE.encode()
+
+    second = load_table_source(f"file://{source}", mtime=first.mtime)
+    assert second.not_modified
+    assert second.content is None
+
+
+def test_load_table_source_missing_file(tmp_path):
+    """
+    A missing file source raises OPNsenseAliasTableSourceError.
+    """
+    with pytest.raises(OPNsenseAliasTableSourceError):
+        load_table_source(str(tmp_path / "missing.txt"))
+
+
+def test_materialize_urltable(tmp_path, table_cache: AliasTableCache):
+    """
+    The table file is written from the source and only rewritten if its entries
+    change.
+    """
+    source = tmp_path / "source.txt"
+    source.write_text(TEST_SOURCE)
+
+    result = table_cache.materialize_urltable("spamhaus", str(source))
+    assert result["changed"]
+    assert result["entries"] == 4
+    with open(table_cache.table_path("spamhaus"), "r", encoding="utf-8") as table:
+        assert table.read().splitlines()[0] == "1.10.16.0/20"
+
+    # unchanged source, state is loaded from disk
+    result = AliasTableCache(table_cache.table_dir).materialize_urltable(
+        "spamhaus", str(source)
+    )
+    assert not result["changed"]
+    assert result["skipped"] == "source not modified"
+
+    # touched but equivalent source does not rewrite the table file
+    source.write_text(TEST_SOURCE + "# trailing comment\n")
+    os.utime(source, (1, 1))
+    result = table_cache.materialize_urltable("spamhaus", str(source))
+    assert not result["changed"]
+    assert "skipped" not in result
+
+
+def test_materialize_geoip(table_cache: AliasTableCache):
+    """
+    The table file of a GeoIP alias is written from the country files of the
+    selected address families, of both if none are selected.
+    """
+    result = table_cache.materialize_geoip("geo_ch", ["CH"], ["IPv4"])
+    assert result["changed"]
+    with open(table_cache.table_path("geo_ch"), "r", encoding="utf-8") as table:
+        assert table.read() == "5.1.48.0/20\n"
+
+    result = table_cache.materialize_geoip("geo_ch", ["CH"], ["IPv4"])
+    assert result["skipped"] == "source not modified"
+
+    result = table_cache.materialize_geoip("geo_ch", ["CH"], [])
+    assert result["changed"]
+    assert result["entries"] == 2
+
+
+def test_materialize_geoip_without_data(table_cache: AliasTableCache):
+    """
+    A country without GeoIP data raises OPNsenseAliasTableSourceError.
+    """
+    with pytest.raises(OPNsenseAliasTableSourceError):
+        table_cache.materialize_geoip("geo_xx", ["XX"], ["IPv4"])
+
+
+@pytest.fixture
+def http_source(tmp_path):
+    """Serves the test source over HTTP, with Last-Modified and If-Modified-Since."""
+    source = tmp_path / "drop.txt"
+    source.write_text(TEST_SOURCE)
+    os.utime(source, (1700000000, 1700000000))
+
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler, directory=str(tmp_path)
+    )
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/drop.txt"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_load_table_source_remembers_last_modified(http_source):
+    """
+    The Last-Modified header of an HTTP source is remembered, so that the next load sends
+    If-Modified-Since and an unchanged source is not downloaded again.
+    """
+    first = load_table_source(http_source)
+    assert first.content == TEST_SOURCE.encode()
+    assert first.mtime == 1700000000
+
+    second = load_table_source(http_source, mtime=first.mtime)
+    assert second.not_modified
+    assert second.content is None
+
+
+def test_invalid_alias_name_is_rejected(tmp_path, table_cache: AliasTableCache):
+    """
+    Alias names which are not valid OPNsense alias names never end up in a file path.
+    """
+    source = tmp_path / "source.txt"
+    source.write_text(TEST_SOURCE)
+
+    for alias_name in ("../../etc/passwd", "drop list", "a" * 33, ""):
+        with pytest.raises(OPNsenseAliasTableNameError):
+            table_cache.materialize_urltable(alias_name, str(source))
+    with pytest.raises(OPNsenseAliasTableNameError):
+        table_cache.materialize_geoip("../geo_ch", ["CH"], ["IPv4"])
+
+    assert not os.path.exists(table_cache.table_dir)
+
+
+def test_check_mode_writes_nothing(tmp_path, table_cache: AliasTableCache):
+    """
+    In check mode, the table is compared with the source, but nothing is written.
+    """
+    source = tmp_path / "source.txt"
+    source.write_text(TEST_SOURCE)
+    check_cache = AliasTableCache(
+        table_dir=table_cache.table_dir,
+        geoip_dir=table_cache.geoip_dir,
+        check_mode=True,
+    )
+
+    result = check_cache.materialize_urltable("spamhaus", str(source))
+    assert result["changed"]
+    assert result["entries"] == 4
+    assert check_cache.materialize_geoip("geo_ch", ["CH"], ["IPv4"])["changed"]
+    assert not os.path.exists(table_cache.table_dir)
+
+    table_cache.materialize_urltable("spamhaus", str(source))
+    check_cache = AliasTableCache(table_dir=table_cache.table_dir, check_mode=True)
+    assert not check_cache.materialize_urltable("spamhaus", str(source))["changed"]
+
+
+def test_load_table_replaces_pf_table(table_cache: AliasTableCache):
+    """
+    A materialized table is loaded into the pf table of the alias with pfctl.
+    """
+    commands = []
+
+    # pylint: disable=too-few-public-methods
+    class PfctlExecutor(executor_utils.Executor):
+        """Records the commands and answers them like pfctl."""
+
+        def run(self, args):
+            """Records the command and returns the output of pfctl."""
+            commands.append(args)
+            return subprocess.CompletedProcess(args, 0, b"", b"4 addresses added.\n")
+
+    previous = executor_utils.set_executor(PfctlExecutor())
+    try:
+        result = table_cache.load_table("spamhaus")
+    finally:
+        executor_utils.set_executor(previous)
+
+    assert commands == [
+        [
+            "pfctl",
+            "-t",
+            "spamhaus",
+            "-T",
+            "replace",
+            "-f",
+            table_cache.table_path("spamhaus"),
+        ]
+    ]
+    assert result["rc"] == 0
+    assert result["stderr"] == "4 addresses added.\n"
@@ -7,6 +7,8 @@ Test suite for the firewall_alias module.
 
 # pylint: skip-file
 import os
+import subprocess
+import sys
 from tempfile import NamedTemporaryFile
 from unittest.mock import patch, MagicMock
 from xml.etree import ElementTree
@@ -1649,3 +1651,33 @@ def test_firewall_alias_set_load_simple_rules(
         assert len(alias_set._aliases) == 15
 
         alias_set.save()
+
+
+def test_firewall_alias_module_imports_on_demand():
+    """
+    Importing the firewall_alias module does not import the modules needed only by some
+    aliases, e.g. to materialize tables or to verify API key secrets.
+    """
+    modules = [
+        "lxml",
+        "crypt",
+        "urllib.request",
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils",
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils",
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_alias_table_utils",
+    ]
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; "
+            "import ansible_collections.puzzle.opnsense.plugins.modules.firewall_alias; "
+            f"print([module for module in {modules!r} if module in sys.modules])",
+        ],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert process.stdout.strip() == "[]"
@@ -0,0 +1,159 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Tests for the plugins.module_utils.hashing_utils module."""
+
+# pylint: disable=redefined-outer-name,unused-argument,protected-access
+
+import base64
+import json
+import re
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import hashing_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils import (
+    OPNsensePasswordHashReturnError,
+    SecretHasher,
+)
+
+HASH_EXPRESSION: str = "password_hash($value,PASSWORD_BCRYPT,[ 'cost' => 11 ])"
+
+
+def fake_php_batch(php_requirements, command, name="command"):
+    """Emulates a batched PHP command by prefixing every value."""
+    values = json.loads(
+        base64.b64decode(re.search(r"base64_decode\('([^']*)'\)", command).group(1))
+    )
+    prefix = "$6$$" if "crypt" in command else "$2y$11$"
+    results = [f"{prefix}{value}".ljust(90, "x") for value in values]
+    return {"stdout": json.dumps(results), "stderr": "", "rc": 0}
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+def test_hash_passwords_php_chunks(mock_run_command: MagicMock):
+    """
+    Test that the PHP backend hashes the passwords in one PHP invocation per chunk.
+    """
+
+    hasher = SecretHasher(backend="php", workers=3)
+    passwords = [f"password_{index}" for index in range(7)]
+
+    hashed = hasher.hash_passwords(
+        passwords,
+        php_requirements=["/usr/local/etc/inc/auth.inc"],
+        hash_expression=HASH_EXPRESSION,
+    )
+
+    assert hashed == [f"$2y$11${password}".ljust(90, "x") for password in passwords]
+    assert mock_run_command.call_count == 3
+    assert [stats["size"] for stats in hasher.stats] == [3, 3, 1]
+    assert {stats["method"] for stats in hasher.stats} == {"php"}
+    assert HASH_EXPRESSION in mock_run_command.call_args.kwargs["command"]
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+def test_hash_secrets_php(mock_run_command: MagicMock):
+    """
+    Test that the PHP backend hashes API key secrets with the OPNsense crypt expression.
+    """
+
+    hasher = SecretHasher(backend="php", workers=1)
+
+    assert hasher.hash_secrets(["secret_1", "secret_2"]) == [
+        "$6$$secret_1".ljust(90, "x"),
+        "$6$$secret_2".ljust(90, "x"),
+    ]
+    assert mock_run_command.call_count == 1
+
+
+@pytest.mark.skipif(hashing_utils._crypt() is None, reason="crypt module not available")
+def test_hash_secrets_native():
+    """
+    Test that API key secrets are hashed in-process with crypt in a single chunk.
+    """
+
+    hasher = SecretHasher(backend="native", workers=2)
+
+    hashed = hasher.hash_secrets(["password123", "password123"])
+
+    assert hashed[0] == hashed[1]
+    assert hashed[0].startswith("$6$$")
+    # crypt holds the GIL, the secrets are hashed in a single chunk
+    assert [stats["size"] for stats in hasher.stats] == [2]
+
+
+def test_workers_are_bounded():
+    """
+    Test that the number of workers is bounded by MAX_WORKERS.
+    """
+
+    with patch.object(hashing_utils.os, "cpu_count", return_value=64):
+        assert SecretHasher().workers == hashing_utils.MAX_WORKERS
+    assert SecretHasher(workers=100).workers == hashing_utils.MAX_WORKERS
+    assert SecretHasher(workers=2).workers == 2
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    return_value={"stdout": "", "stderr": "PHP Fatal error", "rc": 255},
+)
+def test_verify_passwords_php_error(mock_run_command: MagicMock):
+    """
+    Test that a failing PHP invocation raises OPNsensePasswordHashReturnError.
+    """
+
+    hasher = SecretHasher(backend="php")
+
+    with pytest.raises(OPNsensePasswordHashReturnError):
+        hasher.verify_passwords([("$2y$11$hash", "password")])
+
+
+@patch.object(hashing_utils, "bcrypt", None)
+def test_native_backend_without_module():
+    """
+    Test that the native backend fails if bcrypt is not available.
+    """
+
+    hasher = SecretHasher(backend="native")
+
+    with pytest.raises(OPNsensePasswordHashReturnError):
+        hasher.hash_passwords(
+            ["password"], php_requirements=[], hash_expression=HASH_EXPRESSION
+        )
+
+
+def test_unsupported_backend():
+    """
+    Test that an unknown backend is rejected.
+    """
+
+    with pytest.raises(ValueError):
+        SecretHasher(backend="unknown")
+
+
+@pytest.mark.skipif(hashing_utils._crypt() is None, reason="crypt module not available")
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command"
+)
+def test_verify_secrets_native(mock_run_command: MagicMock):
+    """
+    Test that SHA-512 crypt secrets are verified in-process without PHP.
+    """
+
+    hasher = SecretHasher(backend="auto")
+    hashed = hasher.hash_secrets(["secret"])[0]
+
+    assert hasher.verifies_natively([hashed])
+    assert hasher.verify_passwords([(hashed, "secret"), (hashed, "other")]) == [
+        True,
+        False,
+    ]
+    mock_run_command.assert_not_called()
+    assert not SecretHasher(backend="php").verifies_natively([hashed])
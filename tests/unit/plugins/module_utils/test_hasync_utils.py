@@ -0,0 +1,268 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import json
+import os
+import threading
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+from xml.etree import ElementTree
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils.hasync_utils import (
+    element_to_xmlrpc,
+    get_sync_services,
+    HASyncClient,
+    HASyncState,
+    OPNsenseHASyncError,
+    SyncOptions,
+    peer_url,
+    plan_sync,
+    section_digest,
+    synchronize,
+)
+
+TEST_XML: str = """<?xml version="1.0"?>
+<opnsense>
+    <hasync>
+        <synchronizetoip>192.168.1.3</synchronizetoip>
+        <synchronizealiases>on</synchronizealiases>
+        <synchronizerules>on</synchronizerules>
+    </hasync>
+    <aliases>
+        <alias><name>a</name><address>10.0.0.1</address></alias>
+        <alias><name>b</name><address/></alias>
+    </aliases>
+    <filter>
+        <rule><descr>allow</descr></rule>
+    </filter>
+    <OPNsense>
+        <Firewall><Alias><aliases/></Alias></Firewall>
+    </OPNsense>
+</opnsense>
+"""
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/xmlrpc.php",)
+
+    def setup(self):
+        super().setup()
+        self.server.client_ports.add(self.client_address[1])
+
+
+@pytest.fixture
+def xmlrpc_peer():
+    """
+    Local stand-in for the XMLRPC endpoint of an OPNsense HA peer.
+    """
+
+    server = SimpleXMLRPCServer(
+        ("127.0.0.1", 0),
+        requestHandler=KeepAliveRequestHandler,
+        logRequests=False,
+        allow_none=True,
+    )
+    server.client_ports = set()
+    server.restored_sections = []
+
+    def restore_config_section(sections):
+        server.restored_sections.append(sections)
+        return True
+
+    def filter_configure():
+        return True
+
+    server.register_function(restore_config_section, "opnsense.restore_config_section")
+    server.register_function(filter_configure, "opnsense.filter_configure")
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_peer_url():
+    assert peer_url("192.168.1.3") == "https://192.168.1.3/xmlrpc.php"
+    assert peer_url("http://peer:8080") == "http://peer:8080/xmlrpc.php"
+    assert peer_url("https://peer/custom.php") == "https://peer/custom.php"
+
+
+def test_get_sync_services():
+    config = ElementTree.fromstring(TEST_XML)
+    assert get_sync_services(config.find("hasync")) == ["aliases", "rules"]
+
+    hasync_247 = ElementTree.fromstring(
+        "<hasync><syncitems>aliases,ssh</syncitems></hasync>"
+    )
+    assert get_sync_services(hasync_247) == ["aliases", "ssh"]
+
+
+def test_element_to_xmlrpc():
+    config = ElementTree.fromstring(TEST_XML)
+    assert element_to_xmlrpc(config.find("aliases")) == {
+        "alias": [
+            {"name": "a", "address": "10.0.0.1"},
+            {"name": "b", "address": ""},
+        ]
+    }
+
+
+def test_element_to_xmlrpc_keeps_attributes():
+    """
+    The uuids of MVC items are sent as @attributes, so that the peer restores them.
+    """
+    section = ElementTree.fromstring(
+        '<Alias version="1.0.1"><aliases>'
+        '<alias uuid="0b7e9b4d"><name>a</name><content/></alias>'
+        '<alias uuid="5c1f3a2e"><name>b</name><content>10.0.0.1</content></alias>'
+        '</aliases><geoip><url/></geoip><empty flag="on"/></Alias>'
+    )
+    assert element_to_xmlrpc(section) == {
+        "@attributes": {"version": "1.0.1"},
+        "aliases": {
+            "alias": [
+                {"@attributes": {"uuid": "0b7e9b4d"}, "name": "a", "content": ""},
+                {
+                    "@attributes": {"uuid": "5c1f3a2e"},
+                    "name": "b",
+                    "content": "10.0.0.1",
+                },
+            ]
+        },
+        "geoip": {"url": ""},
+        "empty": {"@attributes": {"flag": "on"}},
+    }
+
+
+def test_section_digest_ignores_formatting():
+    compact = ElementTree.fromstring("<aliases><alias><name>a</name></alias></aliases>")
+    indented = ElementTree.fromstring(
+        "<aliases>\n  <alias>\n    <name>a</name>\n  </alias>\n</aliases>"
+    )
+    assert section_digest(compact) == section_digest(indented)
+    assert section_digest(None) is None
+
+
+def test_plan_sync():
+    config = ElementTree.fromstring(TEST_XML)
+    changed, unchanged = plan_sync(
+        config,
+        ["aliases", "filter", "OPNsense.Firewall.Alias", "missing"],
+        {"filter": section_digest(config.find("filter"))},
+    )
+    assert list(changed) == ["aliases", "OPNsense.Firewall.Alias"]
+    assert unchanged == ["filter"]
+
+
+def test_synchronize_pushes_changed_sections_only(xmlrpc_peer, tmp_path):
+    config = ElementTree.fromstring(TEST_XML)
+    state_path = str(tmp_path / "hasync_state.json")
+    url = f"http://127.0.0.1:{xmlrpc_peer.server_address[1]}/xmlrpc.php"
+
+    with HASyncClient(url, auth=("root", "p@ss:word")) as client:
+        result = synchronize(
+            config, ["aliases", "filter"], client, HASyncState(state_path)
+        )
+
+        assert [section["section"] for section in result["synchronized_sections"]] == [
+            "aliases",
+            "filter",
+        ]
+        assert all(section["bytes"] > 0 for section in result["synchronized_sections"])
+        assert result["reconfigure_output"]["method"] == "opnsense.filter_configure"
+        # all requests share one keep-alive connection
+        assert client.connections == 1
+
+    assert len(xmlrpc_peer.client_ports) == 1
+    assert xmlrpc_peer.restored_sections[1] == {"filter": {"rule": {"descr": "allow"}}}
+    with open(state_path, encoding="utf-8") as state_file:
+        assert set(json.load(state_file)[url]) == {"aliases", "filter"}
+
+    config.find("filter/rule/descr").text = "block"
+
+    with HASyncClient(url) as client:
+        result = synchronize(
+            config, ["aliases", "filter"], client, HASyncState(state_path)
+        )
+
+    assert [section["section"] for section in result["synchronized_sections"]] == [
+        "filter"
+    ]
+    assert result["unchanged_sections"] == ["aliases"]
+    assert len(xmlrpc_peer.restored_sections) == 3
+
+
+def test_synchronize_check_mode(xmlrpc_peer, tmp_path):
+    config = ElementTree.fromstring(TEST_XML)
+    state_path = str(tmp_path / "hasync_state.json")
+    url = f"http://127.0.0.1:{xmlrpc_peer.server_address[1]}/xmlrpc.php"
+
+    with HASyncClient(url) as client:
+        result = synchronize(
+            config,
+            ["aliases"],
+            client,
+            HASyncState(state_path),
+            SyncOptions(check_mode=True),
+        )
+
+    assert result["synchronized_sections"] == [{"section": "aliases"}]
+    assert xmlrpc_peer.restored_sections == []
+    assert not os.path.exists(state_path)
+
+
+def test_synchronize_failure(xmlrpc_peer, tmp_path):
+    config = ElementTree.fromstring(TEST_XML)
+    url = f"http://127.0.0.1:{xmlrpc_peer.server_address[1]}/unknown.php"
+
+    with HASyncClient(url, timeout=5) as client:
+        with pytest.raises(OPNsenseHASyncError):
+            synchronize(
+                config,
+                ["aliases"],
+                client,
+                HASyncState(str(tmp_path / "hasync_state.json")),
+            )
+
+
+def test_failed_reconfigure_is_retried(xmlrpc_peer, tmp_path):
+    """
+    The pushed sections are only recorded once the peer was reconfigured, so that a
+    failed reconfigure is retried by the next run.
+    """
+    config = ElementTree.fromstring(TEST_XML)
+    state_path = str(tmp_path / "hasync_state.json")
+    url = f"http://127.0.0.1:{xmlrpc_peer.server_address[1]}/xmlrpc.php"
+
+    with HASyncClient(url) as client:
+        with pytest.raises(OPNsenseHASyncError, match="opnsense.unknown"):
+            synchronize(
+                config,
+                ["aliases"],
+                client,
+                HASyncState(state_path),
+                SyncOptions(reconfigure="opnsense.unknown"),
+            )
+    assert not os.path.exists(state_path)
+
+    with HASyncClient(url) as client:
+        result = synchronize(config, ["aliases"], client, HASyncState(state_path))
+
+    assert [section["section"] for section in result["synchronized_sections"]] == [
+        "aliases"
+    ]
+    assert "reconfigure_output" in result
+    assert len(xmlrpc_peer.restored_sections) == 2
+
+    with HASyncClient(url) as client:
+        result = synchronize(
+            config,
+            ["aliases"],
+            client,
+            HASyncState(state_path),
+            SyncOptions(reconfigure=None),
+        )
+    assert result == {"synchronized_sections": [], "unchanged_sections": ["aliases"]}
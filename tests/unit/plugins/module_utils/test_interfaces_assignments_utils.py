@@ -10,8 +10,13 @@ from xml.etree.ElementTree import Element
 
 import pytest
 
-from ansible_collections.puzzle.opnsense.plugins.module_utils import xml_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    interfaces_assignments_utils,
+    introspection_utils,
+    xml_utils,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils import (
+    get_configured_virtual_devices,
     InterfaceAssignment,
     InterfacesSet,
     OPNSenseDeviceNotFoundError,
@@ -1103,6 +1108,16 @@ TEST_XML: str = """<?xml version="1.0"?>
     """  # noqa: E501
 
 
+@pytest.fixture(autouse=True)
+def reset_introspection():
+    """
+    Discards the memoized PHP introspection between the tests.
+    """
+    introspection_utils.reset_introspection()
+    yield
+    introspection_utils.reset_introspection()
+
+
 @pytest.fixture(scope="function")
 def sample_config_path(request):
     """
@@ -1475,8 +1490,8 @@ def test_interface_assignment_from_ansible_module_params_with_duplicate_device(
     return_value="OPNsense Test",
 )
 @patch(
-    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.opnsense_utils.run_command",
-    return_value={"stdout": "em0,em1,em2", "stderr": None},
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    return_value={"stdout": '{"devices": ["em0", "em1", "em2"]}', "stderr": None},
 )
 @patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
 def test_get_interfaces_success(
@@ -1495,8 +1510,8 @@ def test_get_interfaces_success(
     return_value="OPNsense Test",
 )
 @patch(
-    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.opnsense_utils.run_command",
-    return_value={"stdout": "", "stderr": None},
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    return_value={"stdout": '{"devices": []}', "stderr": None},
 )
 @patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
 def test_get_interfaces_success(
@@ -1518,7 +1533,7 @@ def test_get_interfaces_success(
     return_value="OPNsense Test",
 )
 @patch(
-    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.opnsense_utils.run_command",
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
     return_value={"stdout": "", "stderr": "there was an error"},
 )
 @patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
@@ -1531,3 +1546,175 @@ def test_get_interfaces_success(
         with pytest.raises(OPNSenseGetInterfacesError) as excinfo:
             result = interfaces_set.get_interfaces()
         assert "error encounterd while getting interfaces" in str(excinfo.value)
+
+
+def test_get_configured_virtual_devices():
+    config: Element = ElementTree.fromstring(
+        """<opnsense>
+            <vlans><vlan><if>em1</if><tag>100</tag><vlanif>vlan0.100</vlanif></vlan></vlans>
+            <laggs><lagg><laggif>lagg0</laggif></lagg></laggs>
+            <bridges><bridged><bridgeif>bridge0</bridgeif></bridged></bridges>
+            <openvpn><openvpn-server><vpnid>1</vpnid></openvpn-server></openvpn>
+            <OPNsense>
+                <OpenVPN><Instances><Instance><vpnid>2</vpnid><role>client</role></Instance></Instances></OpenVPN>
+                <wireguard><server><servers><server><instance>0</instance></server></servers></server></wireguard>
+            </OPNsense>
+        </opnsense>"""
+    )
+
+    assert get_configured_virtual_devices(config) == [
+        "vlan0.100",
+        "lagg0",
+        "bridge0",
+        "ovpns1",
+        "wg0",
+        "ovpnc2",
+    ]
+
+
+@pytest.mark.parametrize("device_enumeration", ["native", "verify"])
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.socket.if_nameindex",
+    return_value=[(1, "em0"), (2, "em1"), (3, "lo0"), (4, "pflog0"), (5, "em2")],
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    return_value={
+        "stdout": '{"devices": ["em0", "em1", "em2", "em3"]}',
+        "stderr": None,
+    },
+)
+def test_get_interfaces_device_enumeration(
+    mock_run_command, mock_if_nameindex, device_enumeration, sample_config_path
+):
+    interfaces_assignments_utils.get_kernel_interfaces.cache_clear()
+
+    with InterfacesSet(
+        sample_config_path, device_enumeration=device_enumeration
+    ) as interfaces_set:
+        result = interfaces_set.get_interfaces()
+        # the enumeration is cached for the lifetime of the set
+        interfaces_set.get_interfaces()
+
+    interfaces_assignments_utils.get_kernel_interfaces.cache_clear()
+
+    if device_enumeration == "native":
+        assert result == ["em0", "em1", "em2"]
+        mock_run_command.assert_not_called()
+        assert interfaces_set.device_enumeration_mismatch is None
+    else:
+        assert result == ["em0", "em1", "em2", "em3"]
+        mock_run_command.assert_called_once()
+        assert interfaces_set.device_enumeration_mismatch == {
+            "missing_in_native": ["em3"],
+            "missing_in_php": [],
+        }
+    mock_if_nameindex.assert_called_once()
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.socket.if_nameindex",
+    return_value=[(1, "em0"), (2, "em1"), (3, "lo0")],
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command"
+)
+def test_get_interfaces_check_mode(
+    mock_run_command, mock_if_nameindex, sample_config_path
+):
+    interfaces_assignments_utils.get_kernel_interfaces.cache_clear()
+
+    with InterfacesSet(
+        sample_config_path, device_enumeration="verify", check_mode=True
+    ) as interfaces_set:
+        result = interfaces_set.get_interfaces()
+
+    interfaces_assignments_utils.get_kernel_interfaces.cache_clear()
+
+    assert result == ["em0", "em1"]
+    mock_run_command.assert_not_called()
+    assert interfaces_set.approximations == [
+        "assignable devices enumerated natively instead of with PHP"
+    ]
+
+
+def test_interfaces_set_invalid_device_enumeration(sample_config_path):
+    with pytest.raises(ValueError):
+        InterfacesSet(sample_config_path, device_enumeration="sysctl")
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.InterfacesSet.get_interfaces",
+    return_value=["em0", "em1", "em2", "em3", "em4"],
+)
+def test_reconcile_swaps_devices_and_creates_assignments(
+    mock_get_interfaces, sample_config_path
+):
+    with InterfacesSet(sample_config_path) as interfaces_set:
+        interfaces_set.reconcile(
+            [
+                InterfaceAssignment(identifier="lan", device="em3", descr="LAN"),
+                InterfaceAssignment(identifier="opt1", device="em1"),
+                InterfaceAssignment(identifier="opt3", device="em4", descr="NEW"),
+            ]
+        )
+        assert interfaces_set.changed
+        interfaces_set.save()
+
+    mock_get_interfaces.assert_called_once()
+
+    with InterfacesSet(sample_config_path) as interfaces_set:
+        assert interfaces_set.find(identifier="lan").device == "em3"
+        assert interfaces_set.find(identifier="lan").descr == "LAN"
+        assert interfaces_set.find(identifier="opt1").device == "em1"
+        assert interfaces_set.find(identifier="opt3").device == "em4"
+        # not listed identifiers are unchanged
+        assert interfaces_set.find(identifier="wan").device == "em2"
+        assert interfaces_set.find(identifier="opt2").device == "em0"
+
+
+@pytest.mark.parametrize(
+    "assignments, error, message",
+    [
+        (
+            [InterfaceAssignment(identifier="lan", device="em9")],
+            OPNSenseDeviceNotFoundError,
+            "Device was not found on OPNsense Instance: em9",
+        ),
+        (
+            [InterfaceAssignment(identifier="lan", device="em0")],
+            OPNSenseDeviceAlreadyAssignedError,
+            "Device em0 is already assigned to opt2",
+        ),
+        (
+            [
+                InterfaceAssignment(identifier="lan", device="em4"),
+                InterfaceAssignment(identifier="opt1", device="em4"),
+            ],
+            OPNSenseDeviceAlreadyAssignedError,
+            "Device em4 is assigned to lan and opt1",
+        ),
+        (
+            [
+                InterfaceAssignment(identifier="lan", device="em1"),
+                InterfaceAssignment(identifier="lan", device="em4"),
+            ],
+            OPNSenseDeviceAlreadyAssignedError,
+            "Identifier lan is listed more than once",
+        ),
+    ],
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.interfaces_assignments_utils.InterfacesSet.get_interfaces",
+    return_value=["em0", "em1", "em2", "em3", "em4"],
+)
+def test_reconcile_conflicts(
+    mock_get_interfaces, assignments, error, message, sample_config_path
+):
+    with InterfacesSet(sample_config_path) as interfaces_set:
+        with pytest.raises(error) as excinfo:
+            interfaces_set.reconcile(assignments)
+
+        assert message in str(excinfo.value)
+        # conflicts are detected before anything is modified
+        assert not interfaces_set.changed
@@ -0,0 +1,198 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Tests for the ansible_collections.puzzle.opnsense.plugins.module_utils.lock_utils module.
+"""
+
+# pylint: disable=redefined-outer-name,protected-access
+
+import fcntl
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    file_utils,
+    lock_utils,
+    timing_utils,
+)
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    """A config file to lock."""
+    path = tmp_path / "config.xml"
+    path.write_bytes(b"<opnsense/>")
+    return str(path)
+
+
+def can_lock(path: str, operation: int) -> bool:
+    """Returns True if another open file of the path can be locked with the operation."""
+    file_descriptor = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(file_descriptor, operation | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(file_descriptor)
+
+
+def test_exclusive_lock(config_path):
+    """
+    Test that an exclusive lock blocks other shared locks until it is released.
+    """
+    with lock_utils.ConfigLock(config_path) as lock:
+        assert lock.acquired
+        assert not lock.contended
+        assert not can_lock(config_path, fcntl.LOCK_SH)
+
+    assert not lock.acquired
+    assert can_lock(config_path, fcntl.LOCK_EX)
+    assert not lock_utils._held_locks
+
+
+def test_shared_lock(config_path):
+    """
+    Test that a shared lock allows other shared locks but no exclusive lock.
+    """
+    with lock_utils.ConfigLock(config_path, exclusive=False):
+        assert can_lock(config_path, fcntl.LOCK_SH)
+        assert not can_lock(config_path, fcntl.LOCK_EX)
+
+
+def test_lock_is_reentrant(config_path):
+    """
+    Test that a nested exclusive lock upgrades the lock of the process and is
+    downgraded to the outer shared lock when it is released.
+    """
+    outer = lock_utils.ConfigLock(config_path, exclusive=False, timeout=0.2).acquire()
+    inner = lock_utils.ConfigLock(config_path, timeout=0.2).acquire()
+
+    assert not can_lock(config_path, fcntl.LOCK_SH)
+
+    inner.release()
+    # downgraded to the shared lock of the outer lock
+    assert can_lock(config_path, fcntl.LOCK_SH)
+    assert not can_lock(config_path, fcntl.LOCK_EX)
+
+    outer.release()
+    assert can_lock(config_path, fcntl.LOCK_EX)
+
+
+def test_lock_timeout(config_path):
+    """
+    Test that ConfigLockTimeoutError is raised if the file can not be locked
+    within the timeout.
+    """
+    file_descriptor = os.open(config_path, os.O_RDONLY)
+    fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+
+    try:
+        with pytest.raises(lock_utils.ConfigLockTimeoutError, match="within 0.1"):
+            lock_utils.ConfigLock(config_path, timeout=0.1).acquire()
+    finally:
+        os.close(file_descriptor)
+
+    assert not lock_utils._held_locks
+
+
+def test_lock_timeout_from_environment():
+    """
+    Test that the timeout is read from OPNSENSE_CONFIG_LOCK_TIMEOUT, and that
+    the default is used if it is invalid.
+    """
+    with patch.dict(os.environ, {lock_utils.CONFIG_LOCK_TIMEOUT_ENV: "2.5"}):
+        assert lock_utils.ConfigLock("/conf/config.xml").timeout == 2.5
+
+    with patch.dict(os.environ, {lock_utils.CONFIG_LOCK_TIMEOUT_ENV: "invalid"}):
+        assert lock_utils.lock_timeout() == lock_utils.DEFAULT_LOCK_TIMEOUT
+
+
+def test_lock_follows_replaced_file(config_path):
+    """
+    Test that a waiting lock locks the new file if the config file is replaced
+    while it waits.
+    """
+    file_descriptor = os.open(config_path, os.O_RDONLY)
+    fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+    lock = lock_utils.ConfigLock(config_path, timeout=5)
+
+    waiter = threading.Thread(target=lock.acquire)
+    waiter.start()
+    time.sleep(0.2)
+
+    # another process replaces the config file and releases its lock
+    file_utils.atomic_write(config_path, b"<opnsense><system/></opnsense>")
+    os.close(file_descriptor)
+    waiter.join()
+
+    try:
+        assert lock.acquired
+        assert lock.contended
+        assert lock.wait >= 0.2
+        held_file = os.fstat(lock_utils._held_locks[lock.path].file_descriptor)
+        assert held_file.st_ino == os.stat(config_path).st_ino
+    finally:
+        lock.release()
+
+
+def test_relock_moves_lock_to_replaced_file(config_path):
+    """
+    Test that relock moves the lock from the replaced config file to the new one.
+    """
+    with lock_utils.ConfigLock(config_path, exclusive=False) as outer:
+        with lock_utils.ConfigLock(config_path) as lock:
+            replaced_file = os.open(config_path, os.O_RDONLY)
+            file_utils.atomic_write(config_path, b"<opnsense><system/></opnsense>")
+            lock.relock()
+
+            # the new config file is locked exclusively, the replaced one not at all
+            held_file = os.fstat(lock_utils._held_locks[lock.path].file_descriptor)
+            assert held_file.st_ino == os.stat(config_path).st_ino
+            assert not can_lock(config_path, fcntl.LOCK_SH)
+            fcntl.flock(replaced_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.close(replaced_file)
+
+        # the outer lock still holds the new file
+        assert outer.acquired
+        assert not can_lock(config_path, fcntl.LOCK_EX)
+
+    assert can_lock(config_path, fcntl.LOCK_EX)
+    assert not lock_utils._held_locks
+
+
+def test_lock_wait_is_recorded(config_path):
+    """
+    Test that the wait for the lock is recorded in the timings.
+    """
+    timing_utils.reset_timings()
+
+    with patch.dict(os.environ, {timing_utils.TIMINGS_ENV: "1"}):
+        with lock_utils.ConfigLock(config_path, exclusive=False):
+            pass
+
+    timings = timing_utils.get_timings()
+
+    assert timings["phases"]["config_lock_wait"]["calls"] == 1
+    assert timings["config_locks"] == [
+        {
+            "path": os.path.realpath(config_path),
+            "mode": "shared",
+            "wait": timings["config_locks"][0]["wait"],
+            "attempts": 1,
+        }
+    ]
+
+
+def test_unreferenced_lock_is_released(config_path):
+    """
+    Test that a lock which is no longer referenced is released.
+    """
+    lock_utils.ConfigLock(config_path).acquire()
+
+    assert can_lock(config_path, fcntl.LOCK_EX)
+    assert not lock_utils._held_locks
@@ -0,0 +1,132 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils.module_index import (
+    SERIES,
+    VERSION_MAP,
+    Series,
+    resolve_version_map,
+    validate_version_map,
+)
+
+BASE_CONTEXT: dict = {
+    "hostname": "system/hostname",
+    "domain": "system/domain",
+    "php_requirements": ["/usr/local/etc/inc/config.inc"],
+    "configure_functions": {
+        "system_hostname_configure": {
+            "name": "system_hostname_configure",
+            "configure_params": ["true"],
+        },
+    },
+}
+FROZEN_BASE_CONTEXT: dict = {
+    "hostname": "system/hostname",
+    "domain": "system/domain",
+    "php_requirements": ("/usr/local/etc/inc/config.inc",),
+    "configure_functions": {
+        "system_hostname_configure": {
+            "name": "system_hostname_configure",
+            "configure_params": ("true",),
+        },
+    },
+}
+
+
+def test_version_map_is_valid():
+    assert list(VERSION_MAP) == list(SERIES)
+    assert validate_version_map(VERSION_MAP) == []
+
+
+def test_series_inherit_from_previous_series():
+    assert (
+        VERSION_MAP["24.7"]["firewall_alias"] is VERSION_MAP["22.7"]["firewall_alias"]
+    )
+    assert "max_log_file_size_mb" not in VERSION_MAP["23.7"]["system_settings_logging"]
+    assert (
+        VERSION_MAP["24.1"]["system_settings_logging"]["max_log_file_size_mb"]
+        == "syslog/maxfilesize"
+    )
+    assert (
+        VERSION_MAP["24.7"]["system_settings_logging"]["preserve_logs"]
+        == ".//Syslog/general/maxpreserve"
+    )
+
+
+def test_resolve_overrides_and_removals():
+    version_map = resolve_version_map(
+        {
+            "1.0": Series(
+                inherits=None,
+                contexts={"general": BASE_CONTEXT, "legacy": BASE_CONTEXT},
+            ),
+            "2.0": Series(
+                inherits="1.0",
+                contexts={
+                    "general": {"hostname": "system/name", "domain": None},
+                    "legacy": None,
+                },
+            ),
+        }
+    )
+
+    assert version_map["1.0"]["general"] == FROZEN_BASE_CONTEXT
+    assert dict(version_map["2.0"]["general"]) == {
+        "hostname": "system/name",
+        "php_requirements": FROZEN_BASE_CONTEXT["php_requirements"],
+        "configure_functions": FROZEN_BASE_CONTEXT["configure_functions"],
+    }
+    assert list(version_map["2.0"]) == ["general"]
+
+    general = version_map["2.0"]["general"]
+    with pytest.raises(TypeError):
+        general["hostname"] = "system/hostname"
+    with pytest.raises(TypeError):
+        version_map["2.0"]["legacy"] = BASE_CONTEXT
+    with pytest.raises(AttributeError):
+        general["php_requirements"].append("/usr/local/etc/inc/filter.inc")
+    with pytest.raises(TypeError):
+        general["configure_functions"]["system_hostname_configure"]["name"] = "other"
+    with pytest.raises(AttributeError):
+        general["configure_functions"]["system_hostname_configure"][
+            "configure_params"
+        ].append("false")
+
+
+def test_resolve_undeclared_parent():
+    with pytest.raises(ValueError, match="'2.0' inherits from '1.0'"):
+        resolve_version_map({"2.0": Series(inherits="1.0", contexts={})})
+
+
+def test_validate_reports_invalid_entries():
+    version_map = resolve_version_map(
+        {
+            "1.0": Series(
+                inherits=None,
+                contexts={
+                    "general": {
+                        **BASE_CONTEXT,
+                        "timezone": "",
+                        "php_requirements": ["config.inc"],
+                        "configure_functions": {
+                            "unnamed": {"configure_params": []},
+                            "no_params": {"name": "filter_configure"},
+                        },
+                    },
+                    "users": {"php_requirements": "/usr/local/etc/inc/auth.inc"},
+                },
+            ),
+        }
+    )
+
+    assert validate_version_map(version_map) == [
+        "1.0/general: setting 'timezone' has no XPath",
+        "1.0/general: PHP requirement 'config.inc' is not an absolute path",
+        "1.0/general: configure function 'unnamed' has no name",
+        "1.0/general: configure_params of configure function 'no_params' are not a "
+        "list of strings",
+        "1.0/users: php_requirements is not a list",
+        "1.0/users: configure_functions is not a dict",
+    ]
@@ -6,6 +6,7 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
+import os
 import subprocess
 from unittest.mock import patch, MagicMock
 from ansible_collections.puzzle.opnsense.plugins.module_utils import opnsense_utils
@@ -76,3 +77,18 @@ def test_run_function(mock_subprocess_run: MagicMock):
     mock_subprocess_run.assert_called_with(
         expected_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
     )
+
+
+@patch("subprocess.run")
+def test_run_function_offline(mock_subprocess_run: MagicMock):
+    """
+    Test that PHP is not run offline and a failed result is returned instead.
+    """
+    with patch.dict(os.environ, {opnsense_utils.OFFLINE_ENV: "1"}):
+        result = opnsense_utils.run_function(
+            php_requirements=[], configure_function="filter_configure"
+        )
+
+    mock_subprocess_run.assert_not_called()
+    assert result["rc"] == 1
+    assert "offline" in result["stderr"]
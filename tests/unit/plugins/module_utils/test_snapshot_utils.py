@@ -0,0 +1,187 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import os
+import stat
+import sys
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import snapshot_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_alias_utils import (
+    FirewallAliasSet,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.firewall_rules_utils import (
+    FirewallRuleSet,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.snapshot_utils import (
+    SNAPSHOT_DIR_NAME,
+    SNAPSHOTS_ENV,
+    SnapshotCache,
+    code_digest,
+    collection_code_digest,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils import (
+    UserSet,
+)
+from ansible_collections.puzzle.opnsense.tests.benchmarks import config_generator
+
+MODULES: list = [snapshot_utils.__name__]
+OBJECTS: dict = {"rules": [{"descr": "Allow SSH"}], "count": 1}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """A snapshot cache next to a config file, with snapshots enabled."""
+    with patch.dict(os.environ, {SNAPSHOTS_ENV: "1"}):
+        yield SnapshotCache(config_path=str(tmp_path / "config.xml"))
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    """A generated 24.7 config file, with snapshots enabled."""
+    config_path = tmp_path / "config.xml"
+    config_path.write_bytes(
+        ElementTree.tostring(
+            config_generator.generate_config(rules=5, aliases=5, users=3, interfaces=2),
+            encoding="utf-8",
+            xml_declaration=True,
+        )
+    )
+    with patch(
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",  # pylint: disable=line-too-long
+        return_value="24.7",
+    ), patch.dict(os.environ, {SNAPSHOTS_ENV: "1"}):
+        yield str(config_path)
+
+
+def convert_once(objects):
+    calls = []
+
+    def convert():
+        calls.append(None)
+        return objects
+
+    return convert, calls
+
+
+def test_snapshot_is_stored_and_loaded(cache):
+    convert, calls = convert_once(OBJECTS)
+    code = code_digest(MODULES)
+
+    assert cache.snapshot("rules", "digest", MODULES, convert) == OBJECTS
+    assert cache.snapshot("rules", "digest", MODULES, convert) == OBJECTS
+    assert len(calls) == 1
+
+    assert stat.S_IMODE(os.stat(cache.path).st_mode) == 0o700
+    for entry in os.scandir(cache.path):
+        assert stat.S_IMODE(entry.stat().st_mode) == 0o600
+    assert cache.load("rules", "other digest", code) is None
+    assert cache.load("aliases", "digest", code) is None
+    assert cache.load("rules", "digest", "other code") is None
+
+
+def test_disabled_or_check_mode_stores_nothing(cache):
+    convert, calls = convert_once(OBJECTS)
+
+    with patch.dict(os.environ, {SNAPSHOTS_ENV: "0"}):
+        cache.snapshot("rules", "digest", MODULES, convert)
+    cache.read_only = True
+    cache.snapshot("rules", "digest", MODULES, convert)
+    cache.snapshot("rules", None, MODULES, convert)
+
+    assert len(calls) == 3
+    assert not os.listdir(os.path.dirname(cache.path))
+
+
+def test_tampered_or_unprotected_snapshot_is_ignored(cache):
+    code = code_digest(MODULES)
+    cache.store("rules", "digest", code, OBJECTS)
+    (snapshot_path,) = [
+        entry.path for entry in os.scandir(cache.path) if entry.name.endswith(".pickle")
+    ]
+
+    os.chmod(cache.path, 0o777)
+    assert cache.load("rules", "digest", code) is None
+    os.chmod(cache.path, 0o700)
+    assert cache.load("rules", "digest", code) == OBJECTS
+
+    with open(snapshot_path, "r+b") as snapshot_file:
+        snapshot_file.seek(-1, os.SEEK_END)
+        snapshot_file.write(b"\0")
+    assert cache.load("rules", "digest", code) is None
+
+
+def test_least_recently_used_snapshots_are_evicted(cache):
+    cache.max_snapshots = 2
+    code = code_digest(MODULES)
+
+    cache.store("first", "digest", code, OBJECTS)
+    cache.store("second", "digest", code, OBJECTS)
+    # sets the modification times apart, as if first was used after second
+    for name, mtime in (("second", 1), ("first", 2)):
+        os.utime(cache._snapshot_path(name, "digest", code), (mtime, mtime))
+    cache.store("third", "digest", code, OBJECTS)
+
+    assert cache.load("first", "digest", code) == OBJECTS
+    assert cache.load("second", "digest", code) is None
+    assert cache.load("third", "digest", code) == OBJECTS
+
+
+def test_collection_code_digest_covers_fixed_modules():
+    digest = collection_code_digest("firewall_rules")
+    assert digest is not None
+    assert digest != collection_code_digest("firewall_alias")
+
+    # lazily imported module_utils do not change the digest
+    lazy_module = (
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.hasync_utils"
+    )
+    with patch.dict(sys.modules):
+        sys.modules.pop(lazy_module, None)
+        assert collection_code_digest("firewall_rules") == digest
+
+    with patch.object(snapshot_utils, "_source_digest", return_value=None) as source:
+        assert collection_code_digest("firewall_rules") is None
+    module_names = [module_name for module_name, _loader in source.call_args.args[0]]
+    assert (
+        module_names[0]
+        == "ansible_collections.puzzle.opnsense.plugins.modules.firewall_rules"
+    )
+    assert module_names[1:] == sorted(module_names[1:])
+    assert snapshot_utils.__name__ in module_names
+    assert lazy_module in module_names
+    assert (
+        "ansible_collections.puzzle.opnsense.plugins.module_utils" not in module_names
+    )
+
+    assert collection_code_digest("no_such_module") is None
+
+
+@pytest.mark.parametrize(
+    "set_class, attributes",
+    [
+        (FirewallRuleSet, ["_rules"]),
+        (FirewallAliasSet, ["_aliases"]),
+        (UserSet, ["_users", "_groups"]),
+    ],
+)
+def test_sets_load_snapshots(config_path, set_class, attributes):
+    # e.g. _rules is converted by _load_rules
+    load_methods = {f"_load{attribute}": pytest.fail for attribute in attributes}
+
+    with set_class(path=config_path, check_mode=True) as config_set:
+        objects = [getattr(config_set, method)() for method in load_methods]
+    assert not os.path.exists(
+        os.path.join(os.path.dirname(config_path), SNAPSHOT_DIR_NAME)
+    )
+
+    with set_class(path=config_path):
+        pass
+
+    with patch.multiple(set_class, **load_methods):
+        config_set = set_class(path=config_path, check_mode=True)
+    with config_set:
+        assert [getattr(config_set, attribute) for attribute in attributes] == objects
@@ -11,13 +11,21 @@ from xml.etree.ElementTree import Element
 import pytest
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import xml_utils
+from ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils import (
+    OFFLINE_ENV,
+)
+from ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils import (
+    OPNsensePasswordHashReturnError,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils import (
     User,
     UserSet,
     Group,
+    IdAllocator,
     OPNsenseCryptReturnError,
     OPNsenseGroupNotFoundError,
     OPNsenseHashVerifyReturnError,
+    CHECK_MODE_PASSWORD_HASH,
     hash_verify,
 )
 from ansible_collections.puzzle.opnsense.plugins.module_utils.module_index import (
@@ -1043,3 +1051,462 @@ def test_new_user_from_ansible_module_params_with_empty_parameters(
 
     assert not hasattr(new_test_user, "shell")
     assert not hasattr(new_test_user, "email")
+
+
+RECONCILE_VERSION_MAP = {
+    "OPNsense Test": {
+        **TEST_VERSION_MAP["OPNsense Test"],
+        "password": {
+            "php_requirements": [
+                "/usr/local/etc/inc/auth.inc",
+            ],
+            "configure_functions": {
+                "password": {
+                    "name": "echo password_hash",
+                    "configure_params": [
+                        "'password'",
+                        "PASSWORD_BCRYPT",
+                        "[ 'cost' => 11 ]",
+                    ],
+                },
+            },
+        },
+    }
+}
+
+
+@pytest.fixture(scope="function")
+def reconcile_config_path():
+    """
+    Fixture that creates a temporary file with the test XML configuration including
+    the nextuid and nextgid elements.
+    """
+    with NamedTemporaryFile(delete=False) as temp_file:
+        temp_file.write(
+            TEST_XML.replace(
+                "<test>test_name_2</test>",
+                "<test>test_name_2</test><nextuid>2022</nextuid><nextgid>2001</nextgid>",
+            ).encode()
+        )
+        temp_file.flush()
+        yield temp_file.name
+
+    os.unlink(temp_file.name)
+
+
+def fake_php_batch(php_requirements, command, name="command"):
+    """Emulates the batched password_verify and password_hash PHP commands."""
+    import base64
+    import json
+    import re
+
+    values = json.loads(
+        base64.b64decode(re.search(r"base64_decode\('([^']*)'\)", command).group(1))
+    )
+    if "password_verify" in command:
+        # the test hashes are "$2y$11$" followed by the plain password padded to 60 chars
+        results = [value[0] == f"$2y$11${value[1]}".ljust(60, "x") for value in values]
+    else:
+        assert "password_hash($value,PASSWORD_BCRYPT,[ 'cost' => 11 ])" in command
+        results = [f"$2y$11${value}".ljust(60, "x") for value in values]
+    return {"stdout": json.dumps(results), "stderr": "", "rc": 0}
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+def test_user_set_reconcile(
+    mock_run_command: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    with UserSet(reconcile_config_path) as user_set:
+        user_set._hasher.workers = 1
+        removed_users = user_set.reconcile(
+            [
+                User.from_ansible_module_params(
+                    {"username": "vagrant", "password": "vagrant", "groups": ["admins"]}
+                ),
+                User.from_ansible_module_params(
+                    {"username": "new_user_1", "password": "secret_1"}
+                ),
+                User.from_ansible_module_params(
+                    {
+                        "username": "new_user_2",
+                        "password": "secret_2",
+                        "groups": ["test_group"],
+                    }
+                ),
+            ],
+            absent_users=[User(name="test_user_1")],
+        )
+
+        # one batch to verify and one batch to hash the passwords
+        assert mock_run_command.call_count == 2
+        assert [stats["operation"] for stats in user_set.hashing_stats] == [
+            "password_verify",
+            "password_hash",
+        ]
+        assert removed_users == ["test_user_1"]
+        assert user_set.changed
+        user_set.save()
+
+    with UserSet(reconcile_config_path) as user_set:
+        assert user_set.find(name="test_user_1") is None
+        assert user_set.find(name="test_user_23") is not None
+        assert user_set.find(name="vagrant").password == "$2y$11$vagrant".ljust(60, "x")
+        assert user_set.find(name="new_user_1").password == "$2y$11$secret_1".ljust(
+            60, "x"
+        )
+        assert user_set.find(name="new_user_1").uid == "2022"
+        new_user_2 = user_set.find(name="new_user_2")
+        assert new_user_2.uid == "2023"
+        assert user_set.get("uid").text == "2024"
+        assert new_user_2.groupname == ["test_group"]
+        assert "admins" in user_set.find(name="vagrant").groupname
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+def test_user_set_reconcile_purge(
+    mock_run_command: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    with UserSet(reconcile_config_path) as user_set:
+        removed_users = user_set.reconcile(
+            [
+                User.from_ansible_module_params(
+                    {"username": "vagrant", "password": "vagrant"}
+                ),
+            ],
+            purge=True,
+        )
+        # test_user_23 has scope "User", which is treated like "user"
+        assert removed_users == ["test_user_1", "test_user_23"]
+        user_set.save()
+
+    with UserSet(reconcile_config_path) as user_set:
+        assert [user.name for user in user_set._users] == ["vagrant"]
+
+
+def test_group_member_index():
+    test_group = Group(name="test_group", description="test", member=["1000"])
+    user = User(name="test", uid="1001")
+
+    assert not test_group.check_if_user_in_group(user)
+    test_group.add_user(user)
+    test_group.add_user(user)
+    assert test_group.member == ["1000", "1001"]
+    assert test_group.check_if_user_in_group(user)
+
+    test_group.remove_user(user)
+    assert test_group.member == ["1000"]
+    assert not test_group.check_if_user_in_group(user)
+
+    # replacing the member list invalidates the index
+    test_group.member = ["1001"]
+    assert test_group.check_if_user_in_group(user)
+
+    # the index is not part of the group
+    assert test_group == Group(name="test_group", description="test", member=["1001"])
+    assert "_members" not in repr(test_group)
+    assert test_group.to_etree().find("_members") is None
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.system_access_users_utils.hash_verify",
+    return_value=True,
+)
+@patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
+def test_user_set_changed_is_incremental(
+    mock_password_verify: MagicMock, mock_get_version: MagicMock, sample_config_path
+):
+    with UserSet(sample_config_path) as user_set:
+        with patch.object(UserSet, "_load_users") as mock_load_users, patch.object(
+            UserSet, "_load_groups"
+        ) as mock_load_groups:
+            # unchanged user
+            user_set.add_or_update(
+                User.from_ansible_module_params(
+                    {
+                        "username": "test_user_23",
+                        "password": "test_password_23",
+                        "scope": "User",
+                        "shell": "/bin/sh",
+                        "uid": "2021",
+                        "full_name": "[ ANSIBLE ]",
+                        "groups": ["test_group"],
+                    }
+                )
+            )
+            assert not user_set.changed
+
+            # group membership change only
+            user_set.add_or_update(
+                User.from_ansible_module_params(
+                    {
+                        "username": "test_user_23",
+                        "password": "test_password_23",
+                        "scope": "User",
+                        "shell": "/bin/sh",
+                        "uid": "2021",
+                        "full_name": "[ ANSIBLE ]",
+                        "groups": ["test_group", "admins"],
+                    }
+                )
+            )
+            assert user_set.changed
+            assert user_set._group_index.by_uid["2021"] == {"test_group", "admins"}
+
+            mock_load_users.assert_not_called()
+            mock_load_groups.assert_not_called()
+
+        user_set.save()
+        assert not user_set.changed
+
+    with UserSet(sample_config_path) as user_set:
+        assert "2021" in user_set._group_index.by_name["admins"].member
+
+
+def test_id_allocator_monotonic():
+    allocator = IdAllocator(used_ids=["2000", "2001", "2005", None], next_id=2002)
+
+    assert allocator.allocate(4) == [2002, 2003, 2004, 2006]
+    assert allocator.next_id == 2007
+    assert allocator.dirty
+
+    allocator.release(2001)
+    assert allocator.allocate() == [2007]
+
+
+def test_id_allocator_reuse():
+    allocator = IdAllocator(
+        used_ids=["2000", "2002", "2004"], next_id=2005, policy="reuse"
+    )
+    allocator.release("2000")
+
+    assert allocator.allocate(4) == [2000, 2001, 2003, 2005]
+    assert allocator.next_id == 2006
+
+    allocator.reserve("2006")
+    assert allocator.allocate() == [2007]
+
+
+def test_id_allocator_release_below_minimum():
+    allocator = IdAllocator(used_ids=["1001", "2000"], next_id=2001, policy="reuse")
+    allocator.release("1001")
+
+    assert allocator.allocate() == [2001]
+
+
+def test_id_allocator_without_next_id():
+    assert IdAllocator(used_ids=[]).allocate() == [2000]
+    assert IdAllocator(used_ids=["2010"]).allocate() == [2011]
+    assert not IdAllocator(used_ids=["2010"]).dirty
+
+    with pytest.raises(ValueError):
+        IdAllocator(used_ids=[], policy="unknown")
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+def test_user_set_reconcile_reuses_uids(
+    mock_run_command: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    with UserSet(reconcile_config_path, id_policy="reuse") as user_set:
+        user_set.reconcile(
+            [
+                User.from_ansible_module_params(
+                    {"username": f"bulk_user_{index}", "password": "secret"}
+                )
+                for index in range(3)
+            ],
+            absent_users=[User(name="test_user_23")],
+        )
+        # the gaps below the counter are filled, so the counter is not increased
+        assert [user_set.find(name=f"bulk_user_{index}").uid for index in range(3)] == [
+            "2000",
+            "2001",
+            "2002",
+        ]
+        user_set.save()
+
+    with UserSet(reconcile_config_path) as user_set:
+        assert user_set.get("uid").text == "2022"
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+def test_user_set_diff_does_not_write_id_counters(
+    mock_run_command: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    with UserSet(reconcile_config_path) as user_set:
+        user_set.add_or_update(
+            User.from_ansible_module_params(
+                {"username": "new_user", "password": "secret"}
+            )
+        )
+
+        assert user_set.diff["after"]["system/nextuid"] == "2023"
+        assert user_set.get("uid").text == "2022"
+        user_set.save()
+
+    with UserSet(reconcile_config_path) as user_set:
+        assert user_set.get("uid").text == "2023"
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+def test_user_set_reuse_skips_group_member_uids(
+    mock_run_command: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    with UserSet(reconcile_config_path, id_policy="reuse") as user_set:
+        user_set.delete(User(name="test_user_1"))
+        user_set.delete(User(name="test_user_23"))
+        user_set.reconcile(
+            [
+                User.from_ansible_module_params(
+                    {"username": f"n{index}", "password": "secret"}
+                )
+                for index in range(6)
+            ],
+        )
+
+        # 1001 is below the minimum, 2004 to 2006 are still admins members and 2021 was
+        # removed from test_group with test_user_23
+        assert [user_set.find(name=f"n{index}").uid for index in range(6)] == [
+            "2000",
+            "2001",
+            "2002",
+            "2003",
+            "2007",
+            "2008",
+        ]
+        assert user_set._group_index.by_name["test_group"].member == ["2004"]
+        assert not any(
+            user_set._group_index.by_name["admins"].check_if_user_in_group(
+                user_set.find(name=f"n{index}")
+            )
+            for index in range(6)
+        )
+        user_set.save()
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    side_effect=fake_php_batch,
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils.bcrypt",
+    None,
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+def test_user_set_reconcile_check_mode(
+    mock_run_command: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    with UserSet(reconcile_config_path, check_mode=True) as user_set:
+        user_set.reconcile(
+            [
+                User.from_ansible_module_params(
+                    {"username": "vagrant", "password": "vagrant", "groups": ["admins"]}
+                ),
+                User.from_ansible_module_params(
+                    {"username": "new_user_1", "password": "secret_1"}
+                ),
+            ],
+        )
+
+        # neither verified nor hashed by PHP
+        mock_run_command.assert_not_called()
+        assert user_set.changed
+        assert user_set.approximations == [
+            "password of user 'vagrant' not verified, assumed unchanged"
+        ]
+        assert user_set.find(name="vagrant").password != "vagrant"
+        assert user_set.find(name="new_user_1").password == CHECK_MODE_PASSWORD_HASH
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="OPNsense Test",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.executor_utils.get_executor",
+)
+@patch.dict(in_dict=VERSION_MAP, values=RECONCILE_VERSION_MAP, clear=True)
+@patch.dict(os.environ, {OFFLINE_ENV: "1"})
+def test_user_set_add_or_update_offline_verifies_in_process(
+    mock_get_executor: MagicMock, mock_get_version: MagicMock, reconcile_config_path
+):
+    fake_bcrypt = MagicMock()
+    fake_bcrypt.checkpw.return_value = True
+
+    with patch(
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils.bcrypt",
+        fake_bcrypt,
+    ):
+        with UserSet(reconcile_config_path) as user_set:
+            password_hash = user_set.find(name="vagrant").password
+            user_set.add_or_update(
+                User.from_ansible_module_params(
+                    {"username": "vagrant", "password": "vagrant", "groups": ["admins"]}
+                )
+            )
+
+            assert fake_bcrypt.checkpw.called
+            assert user_set.find(name="vagrant").password == password_hash
+            user_set.save()
+
+    # without bcrypt, the password can not be verified offline, PHP is not run
+    with patch(
+        "ansible_collections.puzzle.opnsense.plugins.module_utils.hashing_utils.bcrypt",
+        None,
+    ):
+        with UserSet(reconcile_config_path) as user_set:
+            with pytest.raises(OPNsensePasswordHashReturnError, match="offline"):
+                user_set.add_or_update(
+                    User.from_ansible_module_params(
+                        {"username": "vagrant", "password": "vagrant"}
+                    )
+                )
+
+    mock_get_executor.assert_not_called()
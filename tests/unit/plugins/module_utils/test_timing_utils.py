@@ -0,0 +1,181 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Tests for the ansible_collections.puzzle.opnsense.plugins.module_utils.timing_utils module.
+"""
+
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    opnsense_utils,
+    timing_utils,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_timings():
+    """Starts every test without recorded timings."""
+    timing_utils.reset_timings()
+    yield
+    timing_utils.reset_timings()
+
+
+@pytest.fixture(name="timings_enabled")
+def fixture_timings_enabled():
+    """Enables the timings for the test."""
+    with patch.dict(os.environ, {timing_utils.TIMINGS_ENV: "1"}):
+        yield
+
+
+def test_phase_disabled_records_nothing():
+    """
+    Test that nothing is recorded if the timings are not enabled.
+    """
+    with patch.dict(os.environ, {timing_utils.TIMINGS_ENV: ""}):
+        with timing_utils.phase("parse"):
+            pass
+
+    assert timing_utils.get_timings() == {"phases": {}, "php_invocations": []}
+
+
+@pytest.mark.usefixtures("timings_enabled")
+def test_phase_accumulates_calls():
+    """
+    Test that phases with the same name are accumulated.
+    """
+    for _ in range(3):
+        with timing_utils.phase("parse"):
+            pass
+
+    phases = timing_utils.get_timings()["phases"]
+
+    assert list(phases) == ["parse"]
+    assert phases["parse"]["calls"] == 3
+    assert phases["parse"]["wall"] >= 0
+    assert phases["parse"]["cpu"] >= 0
+
+
+@pytest.mark.usefixtures("timings_enabled")
+def test_phase_records_failing_block():
+    """
+    Test that a phase is recorded even if its block raises.
+    """
+    with pytest.raises(ValueError):
+        with timing_utils.phase("write"):
+            raise ValueError("write failed")
+
+    assert timing_utils.get_timings()["phases"]["write"]["calls"] == 1
+
+
+@patch("subprocess.run")
+@pytest.mark.usefixtures("timings_enabled")
+def test_php_invocations_are_recorded(mock_run):
+    """
+    Test that PHP invocations are recorded by their name, never by their command.
+    """
+    mock_run.return_value = subprocess.CompletedProcess(
+        args=[], returncode=0, stdout=b"done", stderr=b""
+    )
+
+    opnsense_utils.run_function(
+        php_requirements=["/usr/local/etc/inc/filter.inc"],
+        configure_function="filter_configure",
+    )
+    opnsense_utils.run_command(
+        php_requirements=[],
+        command="var_dump(password_verify('secret','hash'));",
+        name="password_verify",
+    )
+
+    timings = timing_utils.get_timings()
+
+    assert timings["phases"]["php"]["calls"] == 2
+    assert [invocation["name"] for invocation in timings["php_invocations"]] == [
+        "filter_configure",
+        "password_verify",
+    ]
+    assert all(invocation["rc"] == 0 for invocation in timings["php_invocations"])
+    assert "secret" not in json.dumps(timings)
+
+
+@pytest.mark.usefixtures("timings_enabled")
+def test_phases_recorded_from_threads():
+    """
+    Test that phases recorded from worker threads are not lost.
+    """
+
+    def record_phases():
+        for _ in range(1000):
+            with timing_utils.phase("password_hash"):
+                pass
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for _ in range(4):
+            executor.submit(record_phases)
+
+    assert timing_utils.get_timings()["phases"]["password_hash"]["calls"] == 4000
+
+
+def test_write_timings_appends_json_lines(tmp_path):
+    """
+    Test that the timings of every run are appended as a JSON line.
+    """
+    timings_file = tmp_path / "timings.jsonl"
+
+    timing_utils.write_timings("firewall_rules", {"total": 1.5}, str(timings_file))
+    timing_utils.write_timings("firewall_alias", {"total": 0.5}, str(timings_file))
+
+    lines = [json.loads(line) for line in timings_file.read_text().splitlines()]
+
+    assert [line["module"] for line in lines] == ["firewall_rules", "firewall_alias"]
+    assert lines[0]["total"] == 1.5
+
+
+def test_write_timings_without_file():
+    """
+    Test that no timings are written if no timings file is set.
+    """
+    with patch.dict(os.environ, {timing_utils.TIMINGS_FILE_ENV: ""}):
+        timing_utils.write_timings("firewall_rules", {"total": 1.5})
+
+
+@pytest.mark.usefixtures("timings_enabled")
+def test_instrument_adds_timings_to_result(tmp_path):
+    """
+    Test that an instrumented module returns and writes its timings.
+    """
+    timings_file = tmp_path / "timings.jsonl"
+    module = MagicMock()
+    exit_json = module.exit_json
+
+    with patch.dict(os.environ, {timing_utils.TIMINGS_FILE_ENV: str(timings_file)}):
+        timing_utils.instrument(module, "firewall_rules")
+        with timing_utils.phase("parse"):
+            pass
+        module.exit_json(changed=False)
+
+    result = exit_json.call_args.kwargs
+
+    assert result["changed"] is False
+    assert result["timings"]["phases"]["parse"]["calls"] == 1
+    assert result["timings"]["total"] >= 0
+    assert json.loads(timings_file.read_text())["module"] == "firewall_rules"
+
+
+def test_instrument_disabled_keeps_module():
+    """
+    Test that the module is left untouched if the timings are not enabled.
+    """
+    module = MagicMock()
+    exit_json = module.exit_json
+
+    with patch.dict(os.environ, {timing_utils.TIMINGS_ENV: ""}):
+        timing_utils.instrument(module, "firewall_rules")
+
+    assert module.exit_json is exit_json
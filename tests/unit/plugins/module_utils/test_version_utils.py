@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
+import os
 from unittest.mock import patch, MagicMock
 
 from ansible_collections.puzzle.opnsense.plugins.module_utils import version_utils
@@ -61,3 +62,14 @@ def test_version_utils(mock_object: MagicMock):
     """
 
     assert version_utils.get_opnsense_version() == "23.1"
+
+
+@patch("subprocess.check_output")
+def test_version_utils_override(mock_object: MagicMock):
+    """
+    Test that OPNSENSE_VERSION overrides the version of the instance.
+    """
+    with patch.dict(os.environ, {version_utils.OPNSENSE_VERSION_ENV: "24.7"}):
+        assert version_utils.get_opnsense_version() == "24.7"
+
+    mock_object.assert_not_called()
@@ -10,13 +10,38 @@ from __future__ import absolute_import, division, print_function
 
 __metaclass__ = type
 
+import os
+import subprocess
+import sys
 import xml.etree.ElementTree as ET
 from typing import Union, Optional, List
+from unittest.mock import patch
 from xml.etree.ElementTree import Element
 
 import pytest
 from ansible_collections.puzzle.opnsense.plugins.module_utils import xml_utils
 
+# the lxml backend is only tested if lxml is installed
+XML_BACKENDS = [
+    "etree",
+    pytest.param(
+        "lxml",
+        marks=pytest.mark.skipif(
+            not xml_utils.lxml_available(), reason="lxml is not installed"
+        ),
+    ),
+]
+
+
+@pytest.fixture(autouse=True)
+def etree_backend():
+    """
+    Runs the tests on the ElementTree backend, whose elements keep the assigned text
+    values as they are, unless a test selects another backend.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: "etree"}):
+        yield
+
 
 ###############################
 # --- Dict to ElementTree --- #
@@ -226,6 +251,51 @@ def test_dict_to_etree__nested_lists() -> None:
     assert children[3].text == 4
 
 
+def test_dict_to_etree__list_values_before_merged_dicts() -> None:
+    """
+    Test that the values of a list are converted before the single element
+    which merges the items of all of its dicts, in their order.
+
+    Example:
+    - Input: tag: test, list: [{"a": "1"}, "x", [{"b": "2"}, "y"]]
+    - Expected Output:
+        <test>x</test>
+        <test>y</test>
+        <test><a>1</a><b>2</b></test>
+    """
+    output_etree: List[Element] = xml_utils.dict_to_etree(
+        "test", [{"a": "1"}, "x", [{"b": "2"}, "y"]]
+    )
+
+    assert [element.text for element in output_etree] == ["x", "y", None]
+    assert [(child.tag, child.text) for child in output_etree[2]] == [
+        ("a", "1"),
+        ("b", "2"),
+    ]
+
+
+def test_conversions_of_trees_deeper_than_recursion_limit() -> None:
+    """
+    Test that dict_to_etree and etree_to_dict convert trees of any depth.
+    """
+    depth: int = sys.getrecursionlimit() + 100
+    input_dict: dict = {"leaf": "1"}
+    for _ in range(depth):
+        input_dict = {"node": input_dict}
+
+    output_etree: Element = xml_utils.dict_to_etree("root", input_dict)[0]
+    element: Element = output_etree
+    # from the root through the nodes to the leaf
+    for _ in range(depth + 1):
+        (element,) = list(element)
+    assert (element.tag, element.text) == ("leaf", "1")
+
+    output_dict: dict = xml_utils.etree_to_dict(output_etree)["root"]
+    for _ in range(depth):
+        output_dict = output_dict["node"]
+    assert output_dict == {"leaf": "1"}
+
+
 ###############################
 # --- ElementTree to Dict --- #
 ###############################
@@ -487,3 +557,258 @@ def test_elements_not_equal_with_children():
     e2.extend([e2c1, e2c2])
 
     assert not xml_utils.elements_equal(e1, e2)
+
+
+###############################
+# ------- XML backends ------- #
+###############################
+
+SAMPLE_XML: bytes = b"""<?xml version="1.0"?>
+<opnsense>
+  <!-- comments are not part of the tree -->
+  <system>
+    <hostname>fw</hostname>
+    <user uid="1" name="root"><descr>System &amp; Administrator</descr></user>
+    <user uid="2" name="ansible"><descr/></user>
+  </system>
+</opnsense>
+"""
+
+
+def test_xml_backend_selection():
+    """
+    Test that OPNSENSE_XML_BACKEND selects etree, and that etree is used
+    if lxml is requested but not installed.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: "etree"}):
+        assert xml_utils.xml_backend() == "etree"
+
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: "lxml"}), patch.object(
+        xml_utils, "_lxml_etree", return_value=None
+    ):
+        assert xml_utils.xml_backend() == "etree"
+
+
+@pytest.mark.skipif(not xml_utils.lxml_available(), reason="lxml is not installed")
+@pytest.mark.parametrize("requested", ["auto", "lxml", "LXML"])
+def test_xml_backend_prefers_lxml(requested: str):
+    """
+    Test that lxml is used if it is installed and requested or auto.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: requested}):
+        assert xml_utils.xml_backend() == "lxml"
+
+
+@pytest.mark.parametrize("backend", XML_BACKENDS)
+def test_parse_xml_element_api(backend: str):
+    """
+    Both backends provide the same find, findall, attrib and text API.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+        root: Element = xml_utils.parse_xml(SAMPLE_XML)
+
+    assert root.tag == "opnsense"
+    assert [child.tag for child in root] == ["system"]
+    assert root.find("system/hostname").text == "fw"
+    assert root.find("system/missing") is None
+    assert [user.attrib for user in root.findall("system/user")] == [
+        {"uid": "1", "name": "root"},
+        {"uid": "2", "name": "ansible"},
+    ]
+    assert root.find("system/user[@name='ansible']").get("uid") == "2"
+    assert root.find("system/user/descr").text == "System & Administrator"
+    assert root.find("system/user[@uid='2']/descr").text is None
+
+
+@pytest.mark.parametrize("backend", XML_BACKENDS)
+def test_parse_xml_same_dict_on_all_backends(backend: str):
+    """
+    Test that a config parsed by either backend converts to the same dict.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+        root: Element = xml_utils.parse_xml(SAMPLE_XML)
+
+    assert xml_utils.etree_to_dict(root) == xml_utils.etree_to_dict(
+        ET.fromstring(SAMPLE_XML)
+    )
+
+
+@pytest.mark.parametrize("backend", XML_BACKENDS)
+def test_new_elements_can_be_added_to_parsed_tree(backend: str):
+    """
+    Test that elements created by new_element, sub_element and dict_to_etree
+    can be added to a config parsed by either backend.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+        root: Element = xml_utils.parse_xml(b"<opnsense><system/></opnsense>")
+        system: Element = root.find("system")
+
+        xml_utils.sub_element(system, "hostname", {"kind": "short"}).text = "fw"
+        system.extend(xml_utils.dict_to_etree("timezone", "Etc/UTC"))
+        element: Element = xml_utils.new_element("optional")
+        element.text = "1"
+        system.append(element)
+
+    assert xml_utils.serialize_xml(root) == xml_utils.serialize_xml(
+        ET.fromstring(
+            "<opnsense><system><hostname kind='short'>fw</hostname>"
+            "<timezone>Etc/UTC</timezone><optional>1</optional></system></opnsense>"
+        )
+    )
+
+
+@pytest.mark.parametrize("backend", XML_BACKENDS)
+def test_serialize_xml_round_trip(backend: str):
+    """
+    Test that serialize_xml writes the XML declaration and the same
+    document as ElementTree.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+        root: Element = xml_utils.parse_xml(SAMPLE_XML)
+
+    data: bytes = xml_utils.serialize_xml(root, xml_declaration=True)
+
+    assert data.startswith(xml_utils.XML_DECLARATION + b"<opnsense>")
+    assert b"System &amp; Administrator" in data
+    assert ET.canonicalize(data.decode("utf-8")) == ET.canonicalize(
+        ET.tostring(ET.fromstring(SAMPLE_XML), encoding="unicode")
+    )
+
+
+###############################
+# ---- Sectioned parsing ----- #
+###############################
+
+SECTIONED_XML: bytes = b"""<?xml version="1.0"?>
+<opnsense>
+  <system>
+    <hostname>fw</hostname>
+    <user><name>root</name></user>
+  </system>
+  <filter>
+    <rule uuid="1"><descr>Allow &amp; log</descr></rule>
+    <rule uuid="2"/>
+  </filter>
+  <OPNsense>
+    <Firewall><Alias><aliases/></Alias></Firewall>
+    <Syslog><general><maxpreserve>31</maxpreserve></general></Syslog>
+  </OPNsense>
+  <hasync/>
+</opnsense>
+"""
+
+
+@pytest.mark.parametrize("backend", XML_BACKENDS)
+def test_sectioned_xml_round_trip(backend: str):
+    """
+    Test that an unchanged sectioned document is serialized byte by byte
+    and only the addressed sections are parsed.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+        document = xml_utils.SectionedXML.parse(SECTIONED_XML, ["system/hostname"])
+
+    assert [section.tag for section in document.root] == ["system"]
+    assert document.root.find("system/hostname").text == "fw"
+    assert document.serialize() == SECTIONED_XML
+
+
+@pytest.mark.parametrize(
+    "xpaths, sections",
+    [
+        (["filter/rule", "system"], ["system", "filter"]),
+        ([".//Syslog/general/maxpreserve"], ["OPNsense"]),
+        (["./hasync"], ["hasync"]),
+        (["interfaces"], []),
+    ],
+)
+def test_sectioned_xml_parses_addressed_sections(xpaths: List[str], sections: list):
+    """
+    Test that the sections which the XPaths can match are parsed, and that
+    the XPaths find the same elements as in the fully parsed document.
+    """
+    document = xml_utils.SectionedXML.parse(SECTIONED_XML, xpaths)
+
+    assert [section.tag for section in document.root] == sections
+    full: Element = xml_utils.parse_xml(SECTIONED_XML)
+    for xpath in xpaths:
+        assert [
+            ET.canonicalize(ET.tostring(element, encoding="unicode"), strip_text=True)
+            for element in document.root.findall(xpath)
+        ] == [
+            ET.canonicalize(ET.tostring(element, encoding="unicode"), strip_text=True)
+            for element in full.findall(xpath)
+        ]
+
+
+@pytest.mark.parametrize(
+    "data, xpaths",
+    [
+        (SECTIONED_XML, ["/opnsense/system"]),
+        (SECTIONED_XML, ["*"]),
+        (SECTIONED_XML.replace(b"<hasync/>", b"<!-- <hasync> -->"), ["system"]),
+        (b"<!DOCTYPE opnsense []><opnsense><system/></opnsense>", ["system"]),
+        (b'<?xml version="1.0" encoding="latin-1"?><opnsense/>', ["system"]),
+        (b"<opnsense>text<system/></opnsense>", ["system"]),
+        (b"<opnsense><system></opnsense>", ["system"]),
+    ],
+)
+def test_sectioned_xml_falls_back(data: bytes, xpaths: List[str]):
+    """
+    Test that documents and XPaths which can not be split into sections
+    are not parsed.
+    """
+    assert xml_utils.SectionedXML.parse(data, xpaths) is None
+
+
+@pytest.mark.parametrize("backend", XML_BACKENDS)
+def test_sectioned_xml_serializes_changes(backend: str):
+    """
+    Test that changed and appended sections are serialized like the fully
+    parsed document, and the other sections as they were parsed.
+    """
+    with patch.dict(os.environ, {xml_utils.XML_BACKEND_ENV: backend}):
+        document = xml_utils.SectionedXML.parse(SECTIONED_XML, ["filter", "dnsmasq"])
+        full: Element = xml_utils.parse_xml(SECTIONED_XML)
+
+        for root in (document.root, full):
+            filter_element: Element = root.find("filter")
+            filter_element.remove(filter_element.find("rule"))
+            xml_utils.sub_element(filter_element, "rule", {"uuid": "3"})
+            xml_utils.sub_element(root, "dnsmasq").text = "1"
+
+    data: bytes = document.serialize()
+
+    # the untouched sections are written back byte by byte
+    assert data.startswith(SECTIONED_XML[: SECTIONED_XML.index(b"<filter>")])
+    assert SECTIONED_XML[SECTIONED_XML.index(b"</filter>") + 9 : -13] in data
+    assert ET.canonicalize(data.decode("utf-8"), strip_text=True) == ET.canonicalize(
+        xml_utils.serialize_xml(full).decode("utf-8"), strip_text=True
+    )
+
+
+@pytest.mark.skipif(not xml_utils.lxml_available(), reason="lxml is not installed")
+def test_lxml_is_imported_on_first_use():
+    """
+    Test that xml_utils does not import lxml until a document is parsed.
+    """
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; "
+            "from ansible_collections.puzzle.opnsense.plugins.module_utils import xml_utils; "
+            "print('lxml' in sys.modules); "
+            "xml_utils.parse_xml(b'<opnsense/>'); "
+            "print('lxml' in sys.modules)",
+        ],
+        env={
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(path for path in sys.path if path),
+            xml_utils.XML_BACKEND_ENV: "auto",
+        },
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert process.stdout.split() == ["False", "True"]
@@ -8,6 +8,7 @@ __metaclass__ = type
 
 from tempfile import NamedTemporaryFile
 from unittest.mock import patch, MagicMock
+import json
 import os
 
 from ansible_collections.puzzle.opnsense.plugins.modules.system_high_availability_settings import (
@@ -24,6 +25,9 @@ from ansible_collections.puzzle.opnsense.plugins.modules.system_high_availabilit
     sync_compatibility,
 )
 
+from ansible_collections.puzzle.opnsense.plugins.module_utils import (
+    introspection_utils,
+)
 from ansible_collections.puzzle.opnsense.plugins.module_utils.module_index import (
     VERSION_MAP,
 )
@@ -120,6 +124,16 @@ XML_CONFIG_247: str = """<?xml version="1.0"?>
     """
 
 
+@pytest.fixture(autouse=True)
+def reset_introspection():
+    """
+    Discards the memoized PHP introspection between the tests.
+    """
+    introspection_utils.reset_introspection()
+    yield
+    introspection_utils.reset_introspection()
+
+
 @pytest.fixture(scope="function")
 def sample_config(request):
     """
@@ -154,8 +168,11 @@ def sample_config(request):
     return_value="24.1",
 )
 @patch(
-    "ansible_collections.puzzle.opnsense.plugins.modules.system_high_availability_settings.opnsense_utils.run_command",  # pylint: disable=line-too-long
-    return_value={"stdout": "opt2:vagrant,lan:LAN", "stderr": None},
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    return_value={
+        "stdout": '{"interfaces": {"opt2": "vagrant", "lan": "LAN"}}',
+        "stderr": None,
+    },
 )
 @patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
 @pytest.mark.parametrize("sample_config", [XML_CONFIG_EMPTY], indirect=True)
@@ -267,7 +284,10 @@ def test_disconnect_dialup_interfaces_247(
 )
 @patch(
     "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
-    return_value={"stdout": "opt2:vagrant,lan:LAN", "stderr": None},
+    return_value={
+        "stdout": '{"interfaces": {"opt2": "vagrant", "lan": "LAN"}}',
+        "stderr": None,
+    },
 )
 @patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
 @pytest.mark.parametrize("sample_config", [XML_CONFIG_241], indirect=True)
@@ -292,7 +312,7 @@ def test_synchronize_interface(
 )
 @patch(
     "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
-    return_value={"stdout": "", "stderr": None},
+    return_value={"stdout": '{"interfaces": []}', "stderr": None},
 )
 @patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
 @pytest.mark.parametrize("sample_config", [XML_CONFIG_241], indirect=True)
@@ -417,13 +437,17 @@ def test_remote_system_synchronization(mocked_version_utils: MagicMock, sample_c
 @patch(
     "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
     return_value={
-        "stdout_lines": [
-            "aliases,Aliases",
-            "authservers,Auth Servers",
-            "captiveportal,Captive Portal",
-            "certs,Certificates",
-            "ssh,OpenSSH",
-        ],
+        "stdout": json.dumps(
+            {
+                "xmlrpc_sync": {
+                    "aliases": "Aliases",
+                    "authservers": "Auth Servers",
+                    "captiveportal": "Captive Portal",
+                    "certs": "Certificates",
+                    "ssh": "OpenSSH",
+                }
+            }
+        ),
         "stderr": "",
     },
 )
@@ -459,13 +483,17 @@ def test_services_to_synchronize_241(
 @patch(
     "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
     return_value={
-        "stdout_lines": [
-            "aliases,Aliases",
-            "authservers,Auth Servers",
-            "captiveportal,Captive Portal",
-            "certs,Certificates",
-            "ssh,OpenSSH",
-        ],
+        "stdout": json.dumps(
+            {
+                "xmlrpc_sync": {
+                    "aliases": "Aliases",
+                    "authservers": "Auth Servers",
+                    "captiveportal": "Captive Portal",
+                    "certs": "Certificates",
+                    "ssh": "OpenSSH",
+                }
+            }
+        ),
         "stderr": "",
     },
 )
@@ -503,7 +531,7 @@ def test_services_to_synchronize_247(
 @patch(
     "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
     return_value={
-        "stdout_lines": [],
+        "stdout": "",
         "stderr": "there was an error",
     },
 )
@@ -545,3 +573,35 @@ def test_sync_compatibility_unsupported_version(
         str(excinfo.value)
         == "Setting sync_compatibility is only supported for opnsense versions 24.7 and above"
     )
+
+
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.version_utils.get_opnsense_version",
+    return_value="24.7",
+)
+@patch(
+    "ansible_collections.puzzle.opnsense.plugins.module_utils.opnsense_utils.run_command",
+    return_value={
+        "stdout": json.dumps(
+            {
+                "interfaces": {"lan": "LAN", "opt2": "vagrant"},
+                "xmlrpc_sync": {"aliases": "Aliases", "ssh": "OpenSSH"},
+                "devices": ["em0", "em1"],
+            }
+        ),
+        "stderr": "",
+    },
+)
+@patch.dict(in_dict=VERSION_MAP, values=TEST_VERSION_MAP, clear=True)
+@pytest.mark.parametrize("sample_config", [XML_CONFIG_247], indirect=True)
+def test_introspection_is_shared(
+    mocked_version_utils: MagicMock, mocked_command_out: MagicMock, sample_config
+):
+    synchronize_interface(sample_config, "vagrant")
+    services_to_synchronize(sample_config, ["Aliases", "ssh"])
+    synchronize_interface(sample_config, "LAN")
+
+    assert sample_config.get("synchronize_interface").text == "lan"
+    assert sample_config.get("sync_services").text == "aliases,ssh"
+    assert introspection_utils.get_introspection()["devices"] == ["em0", "em1"]
+    mocked_command_out.assert_called_once()
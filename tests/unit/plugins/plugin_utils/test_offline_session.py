@@ -0,0 +1,156 @@
+#  Copyright: (c) 2024, Puzzle ITC
+#  GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+# pylint: skip-file
+import os
+import stat
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+import pytest
+
+from ansible_collections.puzzle.opnsense.plugins.module_utils import file_utils
+from ansible_collections.puzzle.opnsense.plugins.plugin_utils.offline_session import (
+    OfflineSession,
+    OfflineSessionError,
+)
+from ansible_collections.puzzle.opnsense.tests.benchmarks import config_generator
+
+INTROSPECTION = {
+    "interfaces": {},
+    "xmlrpc_sync": {},
+    "xmlrpc_sync_sections": {},
+    "devices": ["em0", "em1", "em2"],
+}
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A started session on a generated config."""
+    config = ElementTree.tostring(
+        config_generator.generate_config(rules=3, aliases=3, users=1, interfaces=2),
+        encoding="utf-8",
+        xml_declaration=True,
+    )
+    session = OfflineSession("fw/1", base_dir=str(tmp_path))
+    session.start(config, file_utils.digest(config), "24.7", INTROSPECTION)
+    return session
+
+
+def test_start_and_discard(session, tmp_path):
+    assert session.directory == str(tmp_path / "fw_1")
+    assert session.active
+    assert session.load_state()["opnsense_version"] == "24.7"
+    assert session.config_digest() == session.load_state()["digest"]
+
+    session.discard()
+
+    assert not session.active
+    assert not os.path.exists(session.directory)
+
+
+def test_default_base_dir_is_per_user(tmp_path):
+    with patch("tempfile.gettempdir", return_value=str(tmp_path)):
+        session = OfflineSession("fw")
+    assert session.base_dir == str(
+        tmp_path / f"ansible-opnsense-offline-{os.geteuid()}"
+    )
+
+    session.start(b"<opnsense/>", file_utils.digest(b"<opnsense/>"), "24.7", None)
+    assert stat.S_IMODE(os.stat(session.base_dir).st_mode) == 0o700
+    assert session.active
+
+
+def test_unprotected_base_dir_is_refused(session, tmp_path):
+    os.chmod(tmp_path, 0o777)
+    try:
+        assert not session.active
+
+        with pytest.raises(OfflineSessionError, match="nobody else can write"):
+            session.start(
+                b"<opnsense/>", file_utils.digest(b"<opnsense/>"), "24.7", None
+            )
+    finally:
+        os.chmod(tmp_path, 0o700)
+
+    assert session.active
+
+
+def test_session_of_other_run_is_ignored(session):
+    with patch("os.getppid", return_value=os.getppid() + 1):
+        assert not session.active
+
+        with pytest.raises(OfflineSessionError):
+            session.run_module("firewall_rules", {}, check_mode=False, diff=False)
+
+
+def test_run_module_edits_session_config(session):
+    base_digest = session.config_digest()
+
+    result = session.run_module(
+        "firewall_rules",
+        {"interface": "lan", "description": "Offline rule"},
+        check_mode=False,
+        diff=False,
+    )
+
+    assert result["changed"], result
+    assert session.config_digest() != base_digest
+    with open(session.path("config.xml"), "rb") as config_file:
+        assert b"Offline rule" in config_file.read()
+
+    # the configure functions are recorded for the flush instead of being applied
+    assert result["opnsense_configure_output"][0]["deferred"]
+    assert {"name": "filter_configure", "configure_params": []} in (
+        session.load_pending()["functions"]
+    )
+
+
+def test_run_module_uses_fetched_devices(session):
+    result = session.run_module(
+        "interfaces_assignments",
+        {"identifier": "opt1", "device": "em2", "description": "Offline"},
+        check_mode=False,
+        diff=False,
+    )
+    assert result["changed"], result
+
+    result = session.run_module(
+        "interfaces_assignments",
+        {"identifier": "opt1", "device": "em9"},
+        check_mode=False,
+        diff=False,
+    )
+    assert result["failed"]
+
+
+def test_run_module_skips_unchanged_run_by_fingerprint(session):
+    params = {"interface": "lan", "description": "Fingerprinted rule"}
+    with patch.dict(os.environ, {"OPNSENSE_FINGERPRINTS": "1"}):
+        assert session.run_module("firewall_rules", params, False, False)["changed"]
+        # the unchanged run verifies the config and records the fingerprint
+        result = session.run_module("firewall_rules", params, False, False)
+        assert not result["changed"] and "fingerprint_match" not in result
+        assert session.run_module("firewall_rules", params, False, False)[
+            "fingerprint_match"
+        ]
+
+        with open(session.path("config.xml"), "ab") as config_file:
+            config_file.write(b"\n")
+        result = session.run_module("firewall_rules", params, False, False)
+        assert not result["changed"] and "fingerprint_match" not in result
+
+
+def test_run_module_check_mode_has_no_side_effects(session):
+    base_digest = session.config_digest()
+
+    result = session.run_module(
+        "firewall_rules",
+        {"interface": "lan", "description": "Checked rule"},
+        check_mode=True,
+        diff=True,
+    )
+
+    assert result["changed"], result
+    assert "opnsense_configure_output" not in result
+    assert session.config_digest() == base_digest
+    assert session.load_pending()["functions"] == []